@@ -1,11 +1,17 @@
 # docbook/__init__.py
 
 from .docbook_core import Book, Extra, ExtraContentType, Division, ContentPiece, Author, Dynasty, Title, DivisionType, DecoderError, Indent2SectionHelper
-from .docbook_file import BookFileType, BookFile
+from .docbook_file import BookFileType, BookFile, ZipFileCache
+from .docbook_index import BookIndex
+from .docbook_field import BookFieldIndex
+from .docbook_cache import ChapterCache
 from .docbook_archive import BookArchive
+from .docbook_context import SearchContext
 from .docbook_query import BookQuery
+from .docbook_query_pool import BookQueryPool
 from . import docbook_label as BookLabel
 from . import docbook_author_type as AuthorType
+from . import docbook_validate as BookValidate
 
 __all__ = [
   'Book',
@@ -21,8 +27,15 @@ __all__ = [
   'Indent2SectionHelper',
   'BookFileType',
   'BookFile',
+  'ZipFileCache',
+  'BookIndex',
+  'BookFieldIndex',
+  'ChapterCache',
   'BookArchive',
+  'SearchContext',
   'BookQuery',
+  'BookQueryPool',
   'BookLabel',
   'AuthorType',
+  'BookValidate',
 ]
@@ -4,19 +4,51 @@ docbook_archive.py
 docbook_archive操作包含docbook文件的目录。
 """
 
+import gc
+import os
+import time
 import uuid
-import json
+import pickle
+import hashlib
 import logging
+import multiprocessing
+import concurrent.futures
 
-from typing import Union, List, Dict, Tuple
+from typing import Union, List, Dict, Tuple, Callable, Iterable, Any
 from enum import Enum
 
 import pathlib
 import utils
-from docbook import BookFile, Book, Division
+from docbook import BookFile, Book, Division, DivisionType, Title
+from .docbook_index import BookIndex
+from .docbook_field import BookFieldIndex
+from .docbook_cache import ChapterCache
+from .docbook_span import get_chapter_signature
+from query import query_normalize
 
 logger = logging.getLogger('docbook.archive')
 
+def _load_bookfile(path: str, dynamic_load: bool, rebuild_chapters_order: bool, trusted: bool = False, chapter_cache: Union[ChapterCache, None] = None, build_signatures: bool = False) -> Tuple[Union[BookFile, None], float, Union[str, None]]:
+  """
+  载入一本书籍，在并行载入时由载入进程调用（不使用章节缓存）。载入失败时不抛出异常，返回失败的原因。
+
+  :return: (BookFile, 载入的秒数, 失败的原因)。
+  """
+  start = time.perf_counter()
+  try:
+    dbfile = BookFile(path, dynamic_load, chapter_cache, trusted)
+    if dbfile.book is None:
+      return None, time.perf_counter() - start, "Not a docbook file"
+    if rebuild_chapters_order:
+      dbfile.book.rebuild_chapters_order()
+    if build_signatures and (not dynamic_load):
+      # 在载入时（载入进程中）建立章节的字符签名
+      for chapter in dbfile.book.chapters:
+        get_chapter_signature(chapter)
+    return dbfile, time.perf_counter() - start, None
+  except Exception as e:
+    return None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
 class BookArchive(object):
   #  DocBookArchive
   #  - path
@@ -29,17 +61,94 @@ class BookArchive(object):
   docbook文献库对象。
   """  
   ROOT_FILE_NAME = "archive.json"
-
-  def __init__(self, path: str, dynamic_load: bool = True):
+  INDEX_FILE_NAME = "archive.index"
+  SNAPSHOT_FILE_NAME = "archive.snapshot"
+
+  # 快照的格式版本，docbook对象的结构变化后需要增加，旧的快照被忽略
+  SNAPSHOT_VERSION = 7
+
+  # 保存archive.json时json的缩进，为None时输出紧凑的json
+  JSON_INDENT: Union[int, None] = 4
+
+  # 书籍、章节标题的排序函数，输入标题，输出可以用json保存的排序键（例如拼音）
+  # 文献库载入时预先计算所有标题的排序键，并保存在archive.json中，之后的排序只需要比较排序键
+  COLLATION_KEY_FUNC: Union[Callable[[str], Any], None] = None
+
+  # 载入文献库时解析书籍文件的进程数量，为None或者1时在本进程中依次载入
+  # 同时读取的书籍文件不超过进程数量的两倍，解析完成的书籍（包括已经载入的章节）再传回本进程
+  LOAD_PROCESS_NUM: Union[int, None] = None
+
+  # 载入书籍后是否按照章节在书籍中出现的顺序重新设置章节的order
+  REBUILD_CHAPTERS_ORDER: bool = False
+
+  # 是否为自己发布、已经校验过的文献库，为True时书籍和章节直接建立对象，不经过属性的校验（见BookFile的trusted）
+  # 发布前用docbook_validate检查整个文献库
+  TRUSTED_LOAD: bool = False
+
+  # 是否使用文献库的快照（archive.snapshot）：载入后保存所有书籍解析完成的对象，下次载入时直接恢复，
+  # 只重新解析磁盘文件被修改过的书籍（路径、大小、修改时间不一致，并且内容的hash也不一致）
+  # 快照为一个目录，每一本书籍用pickle保存为一个文件，只写入变化的书籍；只读取文献库自己写入的快照
+  USE_SNAPSHOT: bool = False
+
+  # 一次性载入时是否在载入书籍时建立章节的字符签名（见docbook_signature），为False时在章节第一次被搜索时建立
+  # 建立签名的时间比解析书籍文件长，一般与LOAD_PROCESS_NUM、USE_SNAPSHOT一起使用
+  BUILD_SIGNATURES: bool = False
+
+  def __init__(self, path: str, dynamic_load: bool = True, chapter_cache: Union[ChapterCache, None] = None, mp_context = None, previous: Union['BookArchive', None] = None):
+    """
+    :param path: 文献库目录或者archive.json的路径。
+    :param dynamic_load: 是否在需要时才载入章节内容。
+    :param chapter_cache: 文献库中所有书籍共用的章节缓存，动态载入的章节内容超出缓存的上限时被卸载。
+    :param mp_context: 并行载入时使用的multiprocessing上下文，为None时使用默认的上下文。
+    :param previous: 同一个文献库之前载入的对象，其中磁盘文件没有变化的书籍直接沿用，不重新载入。
+    """
     self._path = None
     self._archive = None
     self._dbfiles: List[BookFile] = []
-    self.load(path, dynamic_load)
+    self._chapter_cache: Union[ChapterCache, None] = chapter_cache
+    self._collation_keys: Dict[str, Any] = {}
+    self._dynamic_load: bool = dynamic_load
+    self._mp_context = mp_context
+    # 每一本书籍的载入结果：{'ref', 'path', 'seconds', 'error', 'reused'}，载入失败的书籍不加入文献库
+    self._load_report: List[Dict[str, Any]] = []
+    # 每一本载入成功的书籍的来源：{ref: {'path', 'signature', 'hash', 'dbfile'}}，用于刷新文献库和保存快照
+    self._sources: Dict[str, Dict[str, Any]] = {}
+    # 使用快照时，快照的载入选项（快照中的书籍与这些选项一致）
+    self._snapshot_options: Union[List[Any], None] = None
+
+    # id索引：book id到BookFile，卷章id到BookFile（再由书籍的索引找到卷章的路径）
+    # 以及建立索引时每一本书籍的对象和修订号，书籍被重新载入或者卷章结构变化后，重新建立该书籍的索引
+    self._dbfile_ids: Dict[uuid.UUID, BookFile] = {}
+    self._division_dbfiles: Dict[uuid.UUID, BookFile] = {}
+    self._indexed_books: Dict[int, Tuple[Book, int]] = {}
+
+    # 缓存的文献库章节列表和章节路径列表，以及生成时所有书籍的对象和修订号
+    self._chapters: Union[List[Division], None] = None
+    self._chapters_directorys: Union[List[List[Union[Division, Book]]], None] = None
+    self._field_index: Union[BookFieldIndex, None] = None
+    self._chapters_revision: Union[List[Tuple[int, int]], None] = None
+
+    self.load(path, dynamic_load, previous)
 
   @property
   def dbfiles(self):
     return self._dbfiles
 
+  @property
+  def chapter_cache(self) -> Union[ChapterCache, None]:
+    return self._chapter_cache
+
+  @property
+  def load_report(self) -> List[Dict[str, Any]]:
+    """
+    最近一次载入时每一本书籍的载入秒数和失败的原因，顺序与archive.json中的书籍一致。
+    """
+    return self._load_report
+
+  @property
+  def load_errors(self) -> List[Dict[str, Any]]:
+    return [item for item in self._load_report if item['error'] is not None]
+
   @property
   def dbooks(self):
     return [dbfile.book for dbfile in self._dbfiles]
@@ -48,72 +157,230 @@ class BookArchive(object):
   def book_count(self):
     return len(self._dbfiles)
 
+  def __get_chapters_revision(self) -> List[Tuple[int, int]]:
+    return [(id(dbfile.book), dbfile.book.revision) for dbfile in self._dbfiles]
+
+  def __check_chapters_cache(self):
+    """
+    书籍被加入、重新载入或者卷章结构变化后，缓存的章节列表失效。
+    """
+    revision = self.__get_chapters_revision()
+    if revision != self._chapters_revision:
+      self._chapters = None
+      self._chapters_directorys = None
+      self._field_index = None
+      self._chapters_revision = revision
+
   @property
   def chapters(self):
-    chapters = []
-    for dbfile in self._dbfiles:
-      chapters.extend(dbfile.book.chapters)
-    return chapters
+    """
+    文献库中所有的章节。列表被缓存，调用者不要修改。
+    """
+    self.__check_chapters_cache()
+    if self._chapters is None:
+      chapters = []
+      for dbfile in self._dbfiles:
+        chapters.extend(dbfile.book.chapters)
+      self._chapters = chapters
+    return self._chapters
 
   def get_chapters_directorys(self) -> List[List[Union['Division', 'Book']]]:
-    directorys = []
+    """
+    文献库中所有章节的路径。列表被缓存，调用者不要修改。
+    """
+    self.__check_chapters_cache()
+    if self._chapters_directorys is None:
+      directorys = []
+      for dbfile in self._dbfiles:
+        directorys.extend(dbfile.book.get_chapters_directorys())
+      self._chapters_directorys = directorys
+    return self._chapters_directorys
+
+  def get_field_index(self) -> BookFieldIndex:
+    """
+    文献库中书籍、卷章字段的索引，用于查询语句中的字段条件。索引被缓存，书籍变化后重新建立。
+    """
+    self.__check_chapters_cache()
+    if self._field_index is None:
+      self._field_index = BookFieldIndex.build(self.dbooks)
+    return self._field_index
+
+  def get_collation_key(self, obj: Union[Book, Division, str, None]) -> Any:
+    """
+    输出书籍、章节或者标题的排序键。没有设置COLLATION_KEY_FUNC时，排序键为标题本身。
+    """
+    if isinstance(obj, (Book, Division)):
+      obj = obj.title
+    if isinstance(obj, Title):
+      obj = obj.title
+    title = '' if obj is None else obj
+
+    key = self._collation_keys.get(title)
+    if key is None:
+      if BookArchive.COLLATION_KEY_FUNC is None:
+        return title
+      key = BookArchive.COLLATION_KEY_FUNC(title)
+      self._collation_keys[title] = key
+    return key
+
+  def __get_collation_name(self) -> Union[str, None]:
+    func = BookArchive.COLLATION_KEY_FUNC
+    return None if func is None else f"{func.__module__}.{func.__qualname__}"
+
+  def __update_collation_keys(self) -> bool:
+    """
+    计算所有书籍、章节标题的排序键。archive.json中已经保存的排序键直接使用，已经不在文献库中的标题的排序键被去掉；
+    只有排序键有变化（新计算或者去掉）时才保存到archive.json中。
+    """
+    name = self.__get_collation_name()
+    if name is None:
+      return False
+
+    collation = self._archive.get('collation')
+    if isinstance(collation, dict) and (collation.get('name') == name) and isinstance(collation.get('keys'), dict):
+      saved_keys = collation['keys']
+      changed = False
+    else:
+      # 没有保存过，或者保存的是另一个排序函数的排序键
+      saved_keys = {}
+      changed = collation is not None
+
+    # 只保留当前书籍、章节标题的排序键
+    self._collation_keys = {}
+    computed = 0
     for dbfile in self._dbfiles:
-      directorys.extend(dbfile.book.get_chapters_directorys())
-    return directorys
+      for obj in [dbfile.book, *dbfile.book.chapters]:
+        title = '' if obj.title is None else obj.title.title
+        if title in self._collation_keys:
+          continue
+        if title in saved_keys:
+          self._collation_keys[title] = saved_keys[title]
+        else:
+          self._collation_keys[title] = BookArchive.COLLATION_KEY_FUNC(title)
+          computed += 1
+
+    removed = len(saved_keys.keys() - self._collation_keys.keys())
+    if (computed == 0) and (removed == 0) and (changed == False):
+      return False
 
-  def get_chapter_directory_byid(self, id: Union[uuid.UUID, str]) -> List[List[Union['Division', 'Book']]]:
-    if id is None:
-      return None
+    logger.info(f"Compute {computed} collation keys, remove {removed} collation keys of archive '{self._path}'.")
+    self._archive['collation'] = {'name': name, 'keys': dict(self._collation_keys)}
+    try:
+      BookArchive.__save_to_file(self._path, self._archive)
+    except OSError as e:
+      logger.warning(f"Save collation keys to '{self._path}' failed: {e}.")
+    return True
+
+  def __index_bookfile(self, dbfile: BookFile):
+    book = dbfile.book
+    if book is None:
+      return
+    self._dbfile_ids.setdefault(book.id, dbfile)
+    for division_id in book.get_division_ids():
+      self._division_dbfiles.setdefault(division_id, dbfile)
+    self._indexed_books[id(dbfile)] = (book, book.revision)
+
+  def __is_indexed(self, dbfile: BookFile) -> bool:
+    indexed = self._indexed_books.get(id(dbfile))
+    return (indexed is not None) and (dbfile.book is not None) and (indexed[0] is dbfile.book) and (indexed[1] == dbfile.book.revision)
+
+  def __update_id_indexes(self, rebuild: bool = False) -> bool:
+    """
+    重新建立被重新载入、或者卷章结构发生变化的书籍的索引。
+
+    :return: 索引是否有变化。
+    """
+    if rebuild or any(not self.__is_indexed(dbfile) for dbfile in self._dbfiles):
+      self._dbfile_ids = {}
+      self._division_dbfiles = {}
+      self._indexed_books = {}
+      for dbfile in self._dbfiles:
+        self.__index_bookfile(dbfile)
+      return True
+    return False
+
+  @staticmethod
+  def __to_uuid(id: Union[uuid.UUID, str, None]) -> Union[uuid.UUID, None]:
     if isinstance(id, str):
       try:
-        id = uuid.UUID(id)
+        return uuid.UUID(id)
       except ValueError:
-        logger.debug("Invalid UUID string: {id}")
+        logger.debug(f"Invalid UUID string: {id}")
         return None
+    return id
 
-    directory = None
-    for dbook in self.dbooks:
-      directory = dbook.get_chapter_directory_byid(id)
-      if directory is None:
-        continue
-      else:
-        break
-      
-    return  directory
-
-  def get_book_byid(self, id: Union[uuid.UUID, str]) -> Book:
+  def get_division_directory_byid(self, id: Union[uuid.UUID, str]) -> Union[List[Union['Division', 'Book']], None]:
+    """
+    通过id找到卷或者章在文献库中的路径：book, division, ... , division。
+    """
+    id = BookArchive.__to_uuid(id)
     if id is None:
       return None
-    if isinstance(id, str):
-      try:
-        id = uuid.UUID(id)
-      except ValueError:
-        logger.debug("Invalid UUID string: {id}")
-        return None
 
-    for dbfile in self._dbfiles:
-      if (dbfile.book.id == id):
-        return dbfile.book
+    dbfile = self._division_dbfiles.get(id)
+    if (dbfile is not None) and self.__is_indexed(dbfile):
+      return dbfile.book.get_division_directory_byid(id)
 
+    # 索引中没有，或者书籍已经变化，更新索引后再查找
+    if self.__update_id_indexes():
+      dbfile = self._division_dbfiles.get(id)
+      if dbfile is not None:
+        return dbfile.book.get_division_directory_byid(id)
     return None
 
+  def get_division_byid(self, id: Union[uuid.UUID, str]) -> Union[Division, None]:
+    directory = self.get_division_directory_byid(id)
+    return None if directory is None else directory[-1]
+
+  def get_chapter_byid(self, id: Union[uuid.UUID, str]) -> Union[Division, None]:
+    directory = self.get_chapter_directory_byid(id)
+    return None if directory is None else directory[-1]
+
+  def get_chapter_directory_byid(self, id: Union[uuid.UUID, str]) -> List[List[Union['Division', 'Book']]]:
+    directory = self.get_division_directory_byid(id)
+    return directory if (directory is not None) and (directory[-1].type == DivisionType.CHAPTER) else None
+
+  def get_book_byid(self, id: Union[uuid.UUID, str]) -> Book:
+    dbfile = self.get_bookfile_byid(id)
+    return None if dbfile is None else dbfile.book
+
   def get_bookfile_byid(self, id: Union[uuid.UUID, str]) -> BookFile:
+    id = BookArchive.__to_uuid(id)
     if id is None:
       return None
-    if isinstance(id, str):
-      try:
-        id = uuid.UUID(id)
-      except ValueError:
-        logger.debug("Invalid UUID string: {id}")
-        return None
 
-    for dbfile in self._dbfiles:
-      if (dbfile.book.id == id):
-        return dbfile
+    dbfile = self._dbfile_ids.get(id)
+    if (dbfile is not None) and (dbfile.book is not None) and (dbfile.book.id == id):
+      return dbfile
 
+    # 索引中没有，或者书籍已经被重新载入，更新索引后再查找
+    if self.__update_id_indexes():
+      return self._dbfile_ids.get(id)
     return None
 
-  def load(self, path: str, dynamic_load: bool = True) -> bool:
+  def add_bookfile(self, dbfile: BookFile):
+    """
+    向文献库中加入一本书籍，并建立索引。
+    """
+    if self._chapter_cache is not None:
+      dbfile.chapter_cache = self._chapter_cache
+    self._dbfiles.append(dbfile)
+    self.__index_bookfile(dbfile)
+
+  def load_chapter_directory(self, directory: List[Union[Division, Book]]) -> bool:
+    """
+    载入章节路径（book, division, ... , chapter）中章节的内容，经过文献库的章节缓存。
+    """
+    chapter = directory[-1]
+    if chapter.is_load() and (self._chapter_cache is None):
+      return True
+    dbfile = self.get_bookfile_byid(directory[0].id)
+    # 章节路径中的书籍不属于该文献库对象（例如文献库刷新前已经被修改或者删除的书籍）
+    if (dbfile is None) or (dbfile.book is not directory[0]):
+      return False
+    return dbfile.load_chapter(chapter)
+
+  def load(self, path: str, dynamic_load: bool = True, previous: Union['BookArchive', None] = None) -> bool:
     archive_file_path = pathlib.Path(path)
 
     # 如果给定的path没有BookArchive.ROOT_FILE_NAME，则自动创建一个
@@ -122,39 +389,299 @@ class BookArchive(object):
       if archive_file_path.is_file() == False:
         self.create_archive(archive_file_path.parent.as_posix())
     
-    if self.__load_from_file(archive_file_path.as_posix(), dynamic_load) == True:
+    if self.__load_from_file(archive_file_path.as_posix(), dynamic_load, previous) == True:
       self._path = archive_file_path.as_posix()
+      self.__update_id_indexes(True)
+      self.__update_collation_keys()
       return True
     else:
       return False
 
-  def __load_from_file(self, path: str, dynamic_load: bool = True) -> bool:
+  def __load_from_file(self, path: str, dynamic_load: bool = True, previous: Union['BookArchive', None] = None) -> bool:
     with open(path, "rb") as file:
-      self._archive = json.loads(file.read().decode('utf-8'))
+      self._archive = utils.json_loads(file.read())
       file.close()
 
     # 先转绝对路径
     path = pathlib.Path(path).resolve()
     path = path.parent
-    for item in self._archive['items']:
-      dbfile = BookFile(utils.convert_relativepath_to_abspath(item['ref'], path.as_posix()), dynamic_load)
+    refs = [item['ref'] for item in self._archive['items']]
+    paths = [utils.convert_relativepath_to_abspath(ref, path.as_posix()) for ref in refs]
+
+    start = time.perf_counter()
+    snapshot_path = path / BookArchive.SNAPSHOT_FILE_NAME
+    # 快照中的span表、字符签名是用当前的折叠表建立的，折叠表改变后快照失效；载入之后折叠表不能再修改
+    query_normalize.freeze_fold_table()
+    options = [dynamic_load, BookArchive.REBUILD_CHAPTERS_ORDER, BookArchive.BUILD_SIGNATURES, query_normalize.get_fold_table_hash()]
+    self._snapshot_options = options if BookArchive.USE_SNAPSHOT else None
+    # 刷新时之前载入的对象与快照一致，不再读取快照
+    snapshot = self.__load_snapshot(snapshot_path, options) if BookArchive.USE_SNAPSHOT and (previous is None) else {}
+    # 需要写入快照的书籍
+    changed_refs = set()
+
+    # 可以沿用的书籍：快照中的书籍，以及之前载入的文献库对象中的书籍（优先）
+    reusable = dict(snapshot)
+    if (previous is not None) and (previous._dynamic_load == dynamic_load):
+      reusable.update(previous._sources)
+
+    # 磁盘文件没有被修改过的书籍直接沿用，其他的书籍从磁盘文件载入
+    results: List[Union[Tuple[Union[BookFile, None], float, Union[str, None]], None]] = [None] * len(paths)
+    sources: List[Union[Dict[str, Any], None]] = [None] * len(paths)
+    for index, (ref, book_path) in enumerate(zip(refs, paths)):
+      entry = reusable.get(ref)
+      if entry is None or entry['path'] != book_path:
+        continue
+      dbfile = entry['dbfile']
+      signature = dbfile.get_signature()
+      if signature != entry['signature']:
+        # 只有修改时间变化、内容没有变化
+        if (entry['hash'] is None) or (dbfile.get_content_hash() != entry['hash']):
+          continue
+        changed_refs.add(ref)
+      results[index] = (dbfile, 0.0, None)
+      sources[index] = {'path': book_path, 'signature': signature, 'hash': entry['hash'], 'dbfile': dbfile}
+    load_indexes = [index for index, result in enumerate(results) if result is None]
+
+    process_num = min(BookArchive.LOAD_PROCESS_NUM or 1, len(load_indexes))
+    if process_num > 1:
+      loaded = self.__load_bookfiles_parallel([paths[index] for index in load_indexes], dynamic_load, process_num)
+    else:
+      loaded = [_load_bookfile(paths[index], dynamic_load, BookArchive.REBUILD_CHAPTERS_ORDER, BookArchive.TRUSTED_LOAD, self._chapter_cache, BookArchive.BUILD_SIGNATURES) for index in load_indexes]
+    for index, result in zip(load_indexes, loaded):
+      results[index] = result
+
+    self._load_report = []
+    self._sources = {}
+    for index, (ref, book_path, (dbfile, seconds, error)) in enumerate(zip(refs, paths, results)):
+      self._load_report.append({'ref': ref, 'path': book_path, 'seconds': seconds, 'error': error, 'reused': sources[index] is not None})
+      if error is not None:
+        # 一本书籍载入失败时跳过该书籍，不影响其他书籍
+        logger.error(f"Load dbook '{book_path}' failed: {error}.")
+        continue
+      if sources[index] is None:
+        changed_refs.add(ref)
+        sources[index] = {'path': book_path, 'signature': dbfile.get_signature(), 'hash': dbfile.get_content_hash() if BookArchive.USE_SNAPSHOT else None, 'dbfile': dbfile}
+      self._sources[ref] = sources[index]
+      # 并行载入时，全部载入的章节不计入章节缓存
+      dbfile.chapter_cache = self._chapter_cache
       self._dbfiles.append(dbfile)
+
+    logger.info(f"Load {len(self._dbfiles)} dbooks ({len(paths) - len(load_indexes)} reused, {len(self.load_errors)} failed) of archive '{path.as_posix()}' with {max(process_num, 1)} processes in {time.perf_counter() - start:.2f}s.")
+
+    # 有书籍重新载入、修改时间变化或者书籍被删除时，更新快照中变化的书籍
+    if BookArchive.USE_SNAPSHOT:
+      for ref, source in self._sources.items():
+        if source['hash'] is None:
+          source['hash'] = source['dbfile'].get_content_hash()
+          changed_refs.add(ref)
+      known_refs = snapshot.keys() if previous is None else previous._sources.keys()
+      if (len(changed_refs) > 0) or (self._sources.keys() != known_refs):
+        self.__save_snapshot(snapshot_path, options, {ref: self._sources[ref] for ref in changed_refs}, self._sources.keys())
     return True
 
+  def refresh(self) -> 'BookArchive':
+    """
+    重新扫描文献库目录，更新archive.json，并返回新的文献库对象。
+    磁盘文件没有变化的书籍直接沿用，只载入新增和修改过的书籍，已经删除的书籍被去掉。
+    当前的文献库对象不会被修改，正在使用它的调用者可以继续使用，直到用新的对象整体替换它。
+    """
+    root = pathlib.Path(self._path).resolve().parent
+    refs = [item['ref'] for item in self._archive['items']]
+
+    # archive.json中的书籍按照磁盘文件判断是否还存在，PARTS_FILE的ref可以是目录，也可以是book.json
+    def get_file_path(ref: str) -> pathlib.Path:
+      file_path = pathlib.Path(utils.convert_relativepath_to_abspath(ref, root.as_posix()))
+      return file_path / BookFile.PARTS_FILE_NAME if file_path.is_dir() else file_path
+    file_paths = {get_file_path(ref): ref for ref in refs}
+
+    found = BookArchive.__find_bookfiles(root)
+    found_paths = set(found)
+    new_refs = [ref for file_path, ref in file_paths.items() if file_path in found_paths]
+    new_refs.extend([str(file_path.relative_to(root)) for file_path in found if file_path not in file_paths])
+
+    if new_refs != refs:
+      archive = dict(self._archive)
+      archive['items'] = [{'ref': ref} for ref in new_refs]
+      BookArchive.__save_to_file(self._path, archive)
+      logger.info(f"Refresh archive '{self._path}': {len(set(new_refs) - set(refs))} added, {len(set(refs) - set(new_refs))} removed.")
+
+    return BookArchive(self._path, self._dynamic_load, self._chapter_cache, self._mp_context, self)
+
+  def get_snapshot_entries(self) -> Dict[BookFile, Dict[str, Any]]:
+    """
+    每一本书籍在快照中的条目：{BookFile: {'path': 条目的文件路径, 'book_path': 书籍文件路径, 'options': 载入选项, 'signature': 书籍文件的签名}}。
+    没有使用快照，或者动态载入（快照中的书籍没有章节内容）时为空。
+    搜索进程（见docbook_query_pool）用load_snapshot_entry恢复书籍，不再重新解析书籍文件。
+    """
+    if (self._snapshot_options is None) or self._dynamic_load:
+      return {}
+    snapshot_path = pathlib.Path(self._path).resolve().parent / BookArchive.SNAPSHOT_FILE_NAME
+    return {source['dbfile']: {'path': (snapshot_path / BookArchive.__get_snapshot_entry_name(ref)).as_posix(), 'book_path': source['path'], 'options': self._snapshot_options, 'signature': source['signature']} for ref, source in self._sources.items()}
+
   @staticmethod
-  def create_archive(path):
-    path = pathlib.Path(path).resolve()
+  def load_snapshot_entry(entry: Dict[str, Any]) -> Union[BookFile, None]:
+    """
+    从快照中恢复get_snapshot_entries中的一本书籍。
+    条目不存在，或者版本、载入选项、书籍文件的签名与entry不一致（快照已经被之后的载入更新）时返回None。
+    """
+    try:
+      with open(entry['path'], "rb") as file:
+        snapshot_entry = pickle.load(file)
+    except Exception as e:
+      logger.warning(f"Load snapshot '{entry['path']}' failed: {e}.")
+      return None
+    if (not isinstance(snapshot_entry, dict)) or (snapshot_entry.get('version') != BookArchive.SNAPSHOT_VERSION) or (snapshot_entry.get('options') != entry['options']):
+      return None
+    book = snapshot_entry['book']
+    if (book['path'] != entry['book_path']) or (book['signature'] != entry['signature']):
+      return None
+    return book['dbfile']
+
+  @staticmethod
+  def __get_snapshot_entry_name(ref: str) -> str:
+    return f"{hashlib.sha1(ref.encode('utf-8')).hexdigest()}.pickle"
+
+  @staticmethod
+  def __load_snapshot(path: pathlib.Path, options: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    读取文献库的快照，快照不存在时返回空的快照，版本或者载入选项不一致的书籍被忽略。
+
+    :return: {ref: {'path', 'signature', 'hash', 'dbfile'}}。
+    """
+    if path.is_dir() == False:
+      return {}
+    books = {}
+    outdated = 0
+    # 恢复大量的对象时暂停垃圾回收，避免反复扫描刚刚创建的对象
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+      for entry_path in path.glob("*.pickle"):
+        try:
+          with open(entry_path, "rb") as file:
+            entry = pickle.load(file)
+        except Exception as e:
+          logger.warning(f"Load snapshot '{entry_path.as_posix()}' failed: {e}.")
+          continue
+        if (not isinstance(entry, dict)) or (entry.get('version') != BookArchive.SNAPSHOT_VERSION) or (entry.get('options') != options):
+          outdated += 1
+          continue
+        books[entry['ref']] = entry['book']
+    finally:
+      if gc_enabled:
+        gc.enable()
+    if outdated > 0:
+      logger.info(f"Snapshot '{path.as_posix()}': {outdated} dbooks are out of date.")
+    return books
+
+  @staticmethod
+  def __save_snapshot(path: pathlib.Path, options: List[Any], books: Dict[str, Dict[str, Any]], refs: Iterable[str]):
+    """
+    写入快照中变化的书籍books，并删除不在refs中的书籍。
+    """
+    temp_path = None
+    try:
+      # 旧格式的快照为一个文件
+      if path.is_file():
+        path.unlink()
+      path.mkdir(parents = True, exist_ok = True)
+      for ref, book in books.items():
+        # 先写入临时文件再替换，保存失败时不影响已有的快照
+        entry_path = path / BookArchive.__get_snapshot_entry_name(ref)
+        temp_path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as file:
+          pickle.dump({'version': BookArchive.SNAPSHOT_VERSION, 'options': options, 'ref': ref, 'book': book}, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+      names = {BookArchive.__get_snapshot_entry_name(ref) for ref in refs}
+      removed = [entry_path for entry_path in path.glob("*.pickle") if entry_path.name not in names]
+      for entry_path in removed:
+        entry_path.unlink()
+      logger.info(f"Save snapshot '{path.as_posix()}': {len(books)} dbooks updated, {len(removed)} removed.")
+    except Exception as e:
+      logger.warning(f"Save snapshot '{path.as_posix()}' failed: {e}.")
+      if temp_path is not None:
+        temp_path.unlink(missing_ok = True)
+
+  def __load_bookfiles_parallel(self, paths: List[str], dynamic_load: bool, process_num: int) -> List[Tuple[Union[BookFile, None], float, Union[str, None]]]:
+    """
+    在进程池中并行载入书籍，同时提交的书籍不超过进程数量的两倍，结果按照paths的顺序返回。
+    """
+    results: List[Union[Tuple[Union[BookFile, None], float, Union[str, None]], None]] = [None] * len(paths)
+    context = self._mp_context or multiprocessing.get_context()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = process_num, mp_context = context, initializer = query_normalize.sync_fold_table, initargs = (query_normalize.EXTRA_VARIANTS, query_normalize.get_fold_table_hash())) as executor:
+      pending = {}
+      next_index = 0
+      while (next_index < len(paths)) or (len(pending) > 0):
+        while (next_index < len(paths)) and (len(pending) < process_num * 2):
+          future = executor.submit(_load_bookfile, paths[next_index], dynamic_load, BookArchive.REBUILD_CHAPTERS_ORDER, BookArchive.TRUSTED_LOAD, None, BookArchive.BUILD_SIGNATURES)
+          pending[future] = next_index
+          next_index += 1
+
+        done, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          index = pending.pop(future)
+          try:
+            results[index] = future.result()
+          except Exception as e:
+            # 载入进程异常退出，或者书籍无法传回本进程
+            results[index] = (None, 0.0, f"{type(e).__name__}: {e}")
+    return results
+
+  @staticmethod
+  def __find_bookfiles(path: pathlib.Path) -> List[pathlib.Path]:
     dbook_files = list(path.rglob(BookFile.PARTS_FILE_NAME))
     dbook_files.extend(list(path.rglob(f"*{BookFile.SINGLE_FILE_SUFFIX}")))
+    dbook_files.extend(list(path.rglob(f"*{BookFile.PACKED_FILE_SUFFIX}")))
+    dbook_files.extend(list(path.rglob(f"*{BookFile.SINGLE_PARTS_FILE_SUFFIX}")))
+    return dbook_files
+
+  @staticmethod
+  def create_archive(path):
+    path = pathlib.Path(path).resolve()
+    dbook_files = BookArchive.__find_bookfiles(path)
 
     archive: dict = {}
     archive['items'] = [{'ref': str(dbfile.relative_to(path))} for dbfile in dbook_files]
 
     archive_path = path / BookArchive.ROOT_FILE_NAME
     archive_path.parent.mkdir(parents = True, exist_ok = True)
-    with open(archive_path, 'wb') as file:
-      file.write(json.dumps(archive, ensure_ascii = False, indent = 4).encode('utf-8'))
+    BookArchive.__save_to_file(archive_path.as_posix(), archive)
+
+  @staticmethod
+  def __save_to_file(path: str, archive: dict):
+    # 先写入临时文件再替换，其他进程不会读到写了一半的archive.json
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+      file.write(utils.json_dumps_bytes(archive, indent = BookArchive.JSON_INDENT))
       file.close()
+    os.replace(temp_path, path)
+
+  def load_index(self, rebuild: bool = False) -> BookIndex:
+    """
+    载入文献库的倒排索引。如果索引文件不存在，或者和文献库中的书籍文件不一致，则重新建立索引并保存。
+    索引文件与书籍文件不一致时，没有变化的书籍沿用原来索引中的posting，只为新增和修改过的书籍建立索引（见BookIndex.build）。
+
+    :param rebuild: 是否为所有书籍重新建立索引。
+    """
+    index_path = pathlib.Path(self._path).parent / BookArchive.INDEX_FILE_NAME
+    previous = None
+    if (rebuild == False) and index_path.is_file():
+      try:
+        index = BookIndex.load(index_path.as_posix())
+        if index.is_up_to_date(self):
+          return index
+        previous = index
+        logger.info(f"Index '{index_path}' is out of date, update it.")
+      except (OSError, ValueError) as e:
+        logger.warning(f"Load index '{index_path}' failed: {e}, rebuild it.")
+
+    try:
+      index = BookIndex.build(self, previous)
+    finally:
+      if previous is not None:
+        previous.close()
+    index.save(index_path.as_posix())
+    return index
 
   def load_all_books(self) -> bool:
     for dbfile in self._dbfiles:
@@ -165,6 +692,13 @@ class BookArchive(object):
     self._path = None
     self._archive = None
     self._dbfiles = None
+    self._dbfile_ids = {}
+    self._division_dbfiles = {}
+    self._indexed_books = {}
+    self._chapters = None
+    self._chapters_directorys = None
+    self._field_index = None
+    self._chapters_revision = None
 
   #  - path
   #  - archive
@@ -0,0 +1,165 @@
+"""
+docbook_cache.py
+
+docbook_cache管理动态载入的章节内容（ChapterCache）。
+章节内容按照最近使用的顺序（LRU）保存，超出数量或者字节数的上限时，用Division.unload()卸载最久没有使用的章节，
+使文献库可以在固定的内存预算内动态载入章节。
+正在使用的章节（比如正在输出的章节）可以在载入时固定（pin），固定的章节在unpin之前不被卸载。
+"""
+
+import uuid
+import logging
+import threading
+import collections
+
+from typing import Union, List, Dict, Tuple
+
+from .docbook_core import Division
+
+logger = logging.getLogger('docbook.cache')
+
+class ChapterCache(object):
+  """
+  章节内容的LRU缓存，可以被文献库中所有的BookFile共用。
+  只管理有外部引用（ref）的章节，SINGLE_FILE书籍的章节内容不能卸载，不在缓存中。
+  """
+
+  def __init__(self, max_count: Union[int, None] = None, max_bytes: Union[int, None] = None):
+    """
+    :param max_count: 最多保存的章节数量，为None时不限制。
+    :param max_bytes: 最多保存的章节文件字节数，为None时不限制。
+    """
+    self._max_count: Union[int, None] = max_count
+    self._max_bytes: Union[int, None] = max_bytes
+
+    # chapter id -> (chapter, 章节文件字节数)，按照最近使用的顺序排列，最久没有使用的在最前面
+    self._chapters: collections.OrderedDict = collections.OrderedDict()
+    self._bytes: int = 0
+    # chapter id -> 固定的次数
+    self._pins: Dict[uuid.UUID, int] = {}
+    self._lock = threading.Lock()
+
+    self._hits: int = 0
+    self._misses: int = 0
+    self._evictions: int = 0
+
+  @property
+  def max_count(self) -> Union[int, None]:
+    return self._max_count
+
+  @property
+  def max_bytes(self) -> Union[int, None]:
+    return self._max_bytes
+
+  @property
+  def count(self) -> int:
+    return len(self._chapters)
+
+  @property
+  def bytes(self) -> int:
+    return self._bytes
+
+  @property
+  def hits(self) -> int:
+    return self._hits
+
+  @property
+  def misses(self) -> int:
+    return self._misses
+
+  @property
+  def evictions(self) -> int:
+    return self._evictions
+
+  def get_stats(self) -> Dict[str, int]:
+    return {
+      "count": self.count,
+      "bytes": self._bytes,
+      "hits": self._hits,
+      "misses": self._misses,
+      "evictions": self._evictions,
+      "pinned": len(self._pins),
+    }
+
+  def load_chapter(self, dbfile: 'BookFile', chapter: Division, pin: bool = False) -> bool:
+    """
+    载入章节内容。已经在缓存中的章节只更新使用顺序，没有载入的章节由dbfile载入后加入缓存，并卸载超出上限的章节。
+
+    :param pin: 载入成功时固定章节，使用完之后需要调用unpin。
+    """
+    if chapter.ref is None:
+      return dbfile._load_chapter(chapter)
+
+    # 载入之后、加入缓存之前，章节可能被其他线程卸载（比如同一个章节原来的缓存项被卸载），重新载入
+    for _ in range(3):
+      with self._lock:
+        item = self._chapters.get(chapter.id)
+        if (item is not None) and (item[0] is chapter) and chapter.is_load():
+          self._chapters.move_to_end(chapter.id)
+          self._hits += 1
+          if pin:
+            self.__pin(chapter)
+          return True
+        self._misses += 1
+
+      # 在锁之外读取文件，不阻塞其他章节的载入
+      if dbfile._load_chapter(chapter) == False:
+        return False
+      size = dbfile.get_chapter_size(chapter)
+
+      with self._lock:
+        item = self._chapters.pop(chapter.id, None)
+        if item is not None:
+          self._bytes -= item[1]
+        self._chapters[chapter.id] = (chapter, size)
+        self._bytes += size
+        loaded = chapter.is_load()
+        if loaded and pin:
+          self.__pin(chapter)
+        self.__evict()
+      if loaded:
+        return True
+    return False
+
+  def unpin(self, chapter: Division):
+    """
+    取消一次固定，章节不再被固定时，可以被卸载。
+    """
+    with self._lock:
+      count = self._pins.get(chapter.id)
+      if count is None:
+        return
+      if count > 1:
+        self._pins[chapter.id] = count - 1
+      else:
+        del self._pins[chapter.id]
+        self.__evict()
+
+  def __pin(self, chapter: Division):
+    self._pins[chapter.id] = self._pins.get(chapter.id, 0) + 1
+
+  def __is_full(self) -> bool:
+    return ((self._max_count is not None) and (len(self._chapters) > self._max_count)) or ((self._max_bytes is not None) and (self._bytes > self._max_bytes))
+
+  def __evict(self):
+    # 刚刚载入的章节和固定的章节不卸载
+    last = next(reversed(self._chapters), None)
+    while self.__is_full():
+      chapter_id = next((chapter_id for chapter_id in self._chapters if (chapter_id != last) and (chapter_id not in self._pins)), None)
+      if chapter_id is None:
+        break
+      chapter, size = self._chapters.pop(chapter_id)
+      self._bytes -= size
+      chapter.unload()
+      self._evictions += 1
+      logger.debug(f"Evict chapter: '{chapter.title.title}', ref: '{chapter.ref}'.")
+
+  def clear(self):
+    """
+    卸载缓存中所有的章节。
+    """
+    with self._lock:
+      for chapter, _ in self._chapters.values():
+        chapter.unload()
+      self._chapters.clear()
+      self._bytes = 0
@@ -0,0 +1,103 @@
+"""
+docbook_context.py
+
+docbook_context定义一次搜索的上下文（SearchContext），保存该次搜索的结果计数、中止标志、截止时间，以及载入章节内容的函数。
+每一次搜索使用自己的上下文，多个搜索可以在同一个进程中并发执行，互不影响。
+"""
+
+import time
+import logging
+import threading
+
+from typing import Union, List, Callable
+
+logger = logging.getLogger('docbook.context')
+
+class SearchContext(object):
+  """
+  一次搜索的上下文。
+  """
+
+  def __init__(self, limit: Union[int, None] = None, timeout: Union[float, None] = None, chapter_load_func: Union[Callable[[List], bool], None] = None):
+    """
+    :param limit: 最多输出的命中结果数量，为None时不限制。
+    :param timeout: 搜索的最长时间（秒），超时后中止搜索，为None时不限制。
+    :param chapter_load_func: 这次搜索载入章节内容的函数（一般为搜索的文献库对象的load_chapter_directory），为None时使用BookQuery.CHAPTER_LOAD_FUNC。
+    """
+    self._limit: Union[int, None] = limit
+    self._chapter_load_func: Union[Callable[[List], bool], None] = chapter_load_func
+    self._deadline: Union[float, None] = None if timeout is None else time.monotonic() + timeout
+    self._count: int = 0
+    self._lock = threading.Lock()
+    self._stop_event = threading.Event()
+
+  @property
+  def limit(self) -> Union[int, None]:
+    return self._limit
+
+  @property
+  def count(self) -> int:
+    """
+    已经输出的命中结果数量。
+    """
+    return self._count
+
+  @property
+  def chapter_load_func(self) -> Union[Callable[[List], bool], None]:
+    return self._chapter_load_func
+
+  @property
+  def deadline(self) -> Union[float, None]:
+    """
+    截止时间，time.monotonic()的值。
+    """
+    return self._deadline
+
+  @property
+  def remaining_time(self) -> Union[float, None]:
+    """
+    距离截止时间剩余的秒数，没有截止时间时为None。
+    """
+    return None if self._deadline is None else max(0.0, self._deadline - time.monotonic())
+
+  @property
+  def is_timeout(self) -> bool:
+    return (self._deadline is not None) and (time.monotonic() >= self._deadline)
+
+  @property
+  def is_full(self) -> bool:
+    """
+    命中结果的数量是否已经达到limit。
+    """
+    return (self._limit is not None) and (self._count >= self._limit)
+
+  def cancel(self):
+    """
+    中止搜索。
+    """
+    self._stop_event.set()
+
+  def is_stopped(self) -> bool:
+    """
+    搜索是否应该中止：被cancel、结果数量达到limit或者超时。
+    """
+    if self._stop_event.is_set():
+      return True
+    if self.is_timeout:
+      logger.debug(f"Search timeout, hits: {self._count}.")
+      self._stop_event.set()
+      return True
+    return False
+
+  def take(self, count: int) -> int:
+    """
+    申请输出count个命中结果，返回实际可以输出的数量。结果数量达到limit时中止搜索。
+    """
+    with self._lock:
+      if self._stop_event.is_set():
+        return 0
+      if (self._limit is not None) and (self._count + count >= self._limit):
+        count = max(0, self._limit - self._count)
+        self._stop_event.set()
+      self._count += count
+      return count
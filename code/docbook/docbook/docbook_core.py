@@ -6,16 +6,17 @@ docbook是为了能结构化古代文献重新定义的一种书籍格式，格
 这样可以方面表达和分析工具更好的格式化或者分析文献内容。
 """
 
+import sys
 import uuid
-import json
 import logging
 from datetime import datetime, timezone
 
-from typing import Union, List, Dict, Tuple
+from typing import Union, List, Dict, Tuple, Iterator, Any
 from enum import Enum
 
 from . import docbook_author_type as AuthorType
-from utils import remove_html_tags, remove_useless_value, is_valid_url
+from utils import remove_html_tags, is_valid_url, json_loads, json_dumps, json_dumps_bytes
+from .docbook_writer import dumps_json, dump_json
 
 logger = logging.getLogger('docbook.core')
 
@@ -26,58 +27,80 @@ class DecoderError(Exception):
     self.message = message
     super().__init__(self.message)
 
+def intern_label(label: Union[str, None]) -> Union[str, None]:
+  """
+  驻留注释者、著作者身份、朝代等重复出现的标签字符串，相同的标签在内存中只保存一份。
+  """
+  return sys.intern(label) if isinstance(label, str) else label
+
 
 # The `BaseObject` class provides support for attributes manipulation similar to a dictionary for all
 # subclasses in a docbook system.
 class BaseObject:
+  # docbook树中的节点数量很多（特别是ContentPiece），所有的子类都用__slots__保存属性，不分配__dict__
+  __slots__ = ('_attributes',)
+
   def __init__(self, attrs: Union[Dict, None] = None):
     """
-    This Python function initializes an object with attributes provided in a dictionary or an empty
-    dictionary if none is provided.
+    This Python function initializes an object with attributes provided in a dictionary. The
+    `_attributes` dictionary is allocated lazily, it stays None until the first attribute is set.
     @param {Union[Dict, None]} attrs - The `attrs` parameter in the `__init__` method is a dictionary or
-    None. If a dictionary is provided, it will be copied to the `_attributes` attribute of the class
-    instance. If None is provided, an empty dictionary will be assigned to the `_attributes` attribute.
+    None. If a non-empty dictionary is provided, it will be copied to the `_attributes` attribute of
+    the class instance. Otherwise None will be assigned to the `_attributes` attribute.
     """
-    if attrs is not None:
+    if attrs:
       self._attributes = attrs.copy()
     else:
-      self._attributes = {}
+      self._attributes = None
 
   def __getitem__(self, key):
+    if self._attributes is None:
+      raise KeyError(key)
     return self._attributes[key]
 
   def __setitem__(self, key, value):
+    if self._attributes is None:
+      self._attributes = {}
     self._attributes[key] = value
 
   def __delitem__(self, key):
+    if self._attributes is None:
+      raise KeyError(key)
     del self._attributes[key]
 
   def get(self, key, default=None):
+    if self._attributes is None:
+      return default
     return self._attributes.get(key, default)
 
   def update_attrs(self, *args, **kwargs):
+    if self._attributes is None:
+      self._attributes = {}
     self._attributes.update(*args, **kwargs)
 
   def clear_attrs(self):
-    self._attributes.clear()
+    self._attributes = None
 
   @property
   def attrs(self):
+    # 调用者可能直接修改返回的dict，所以在这里分配
+    if self._attributes is None:
+      self._attributes = {}
     return self._attributes
 
   @attrs.setter
   def attrs(self, attrs: Union[Dict, None]):
     """
-    The function `attrs` sets the attributes of an object based on a dictionary input or initializes an
-    empty list if no input is provided.
+    The function `attrs` sets the attributes of an object based on a dictionary input, or clears them
+    if no input is provided.
     @param {Union[Dict, None]} attrs - The `attrs` parameter in the `attrs` method is expected to be a
-    dictionary or `None`. If it is `None`, the method will set `self._attrs` to an empty list. If it is
-    a dictionary, the method will set `self._attrs` to the provided dictionary
+    dictionary or `None`. If it is `None`, the method will set `self._attributes` to None. If it is
+    a dictionary, the method will set `self._attributes` to the provided dictionary
     """
     if attrs is None:
-      self._attrs = []
+      self._attributes = None
     elif isinstance(attrs, Dict):
-      self._attrs = attrs
+      self._attributes = attrs
     else:
       raise ValueError("Invalid Attributes Value")
 
@@ -88,7 +111,7 @@ class BaseObject:
     object. This representation could be a string that provides information about the object's
     attributes in a readable format.
     """
-    return repr(self._attributes)
+    return repr({} if self._attributes is None else self._attributes)
 
   def __str__(self) -> str:
     """
@@ -98,8 +121,23 @@ class BaseObject:
     """
     return self.dump_json()
 
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    """
+    按照输出的顺序，输出对象的json字段：(键, 值)。值可以是BaseObject、BaseObject的列表，或者可以直接输出为json的值。
+    没有任何字段时，对象输出为{}。to_dict和JsonWriter都由这里生成输出。
+    """
+    return iter(())
+
   def to_dict(self) -> Dict:
-    pass
+    return {key: BaseObject.__to_dict_value(value) for key, value in self.iter_json_fields()}
+
+  @staticmethod
+  def __to_dict_value(value: Any) -> Any:
+    if isinstance(value, BaseObject):
+      return value.to_dict()
+    elif isinstance(value, list):
+      return [item.to_dict() if isinstance(item, BaseObject) else item for item in value]
+    return value
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> 'BaseObject':
@@ -117,14 +155,40 @@ class BaseObject:
     return self(params)
 
   def dump_json(self, ensure_ascii: bool = False, indent: Union[int, None] = None, remove_useless: bool = False) -> str:
-    d = self.to_dict()
     if remove_useless:
-      d = remove_useless_value(d)
-    return json.dumps(d, ensure_ascii = ensure_ascii, indent = indent)
+      # 一次遍历直接输出，不生成中间的dict
+      return dumps_json(self, ensure_ascii = ensure_ascii, indent = indent)
+    return json_dumps(self.to_dict(), ensure_ascii = ensure_ascii, indent = indent)
+
+  def dump_json_bytes(self, indent: Union[int, None] = None, remove_useless: bool = False) -> bytes:
+    """
+    输出UTF-8编码的json。
+    """
+    if remove_useless:
+      return dumps_json(self, indent = indent).encode('utf-8')
+    return json_dumps_bytes(self.to_dict(), indent = indent)
+
+  def write_json(self, file, indent: Union[int, None] = None):
+    """
+    把去掉没有用的值的json分块写入以二进制方式打开的文件，不在内存中生成完整的json。
+    """
+    dump_json(self, file, indent = indent)
+
+  @classmethod
+  def from_trusted_dict(self, params: Union[Dict, None]) -> 'BaseObject':
+    """
+    从自己生成、已经校验过的数据（例如发布的文献库）直接建立对象，不经过属性的校验。
+    结果与from_dict一致，数据不合法时结果不确定，不合法的数据用docbook_validate检查。
+    """
+    return self.from_dict(params)
 
   @classmethod
-  def from_json(self, params: str) -> 'BaseObject':
-    return self.from_dict(json.loads(s=params))
+  def from_json(self, params: Union[str, bytes], trusted: bool = False) -> 'BaseObject':
+    """
+    :param trusted: 是否为已经校验过的数据，为True时使用from_trusted_dict。
+    """
+    params = json_loads(params)
+    return self.from_trusted_dict(params) if trusted else self.from_dict(params)
 
 
 # This Python class defines a Title object with properties for title, prefix, and subtitle, along with
@@ -137,6 +201,7 @@ class Title(BaseObject):
     - prefix: str 可选项。标题前缀。
     - subtitle: str 可选项。标题副标题。
   """
+  __slots__ = ('_title', '_prefix', '_subtitle')
 
   def __init__(
       self,
@@ -170,7 +235,7 @@ class Title(BaseObject):
       self.title = title
     
     # 标题前缀。
-    self._prefix: Union[str, None] = prefix
+    self._prefix: Union[str, None] = intern_label(prefix)
 
     # 副标题。
     self._subtitle: Union[str, None] = subtitle
@@ -209,7 +274,7 @@ class Title(BaseObject):
 
   @prefix.setter
   def prefix(self, prefix: str):
-    self._prefix = prefix
+    self._prefix = intern_label(prefix)
 
   @property
   def subtitle(self) -> Union[str, None]:
@@ -225,16 +290,12 @@ class Title(BaseObject):
             f"{'None' if self._subtitle is None else repr(self._subtitle)}),"
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    if (len(self._title) == 0):
-      return {}
-    else:
-      return {
-          "title": self._title,
-          "prefix": self._prefix,
-          "subtitle": self._subtitle,
-          "attrs": self._attributes
-      }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    if (len(self._title) > 0):
+      yield "title", self._title
+      yield "prefix", self._prefix
+      yield "subtitle", self._subtitle
+      yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Title', None]:
@@ -251,6 +312,18 @@ class Title(BaseObject):
     else:
       raise ValueError("Invalid Title Dict")
 
+  @classmethod
+  def from_trusted_dict(self, params: Union[Dict, None]) -> Union['Title', None]:
+    if not params:
+      return None
+    title = self.__new__(self)
+    title._title = params['title']
+    title._prefix = intern_label(params.get('prefix'))
+    title._subtitle = params.get('subtitle')
+    # 刚刚解码的数据不会被其他对象使用，不需要复制
+    title._attributes = params.get('attrs') or None
+    return title
+
 
 class Dynasty(BaseObject):
   """
@@ -260,6 +333,7 @@ class Dynasty(BaseObject):
   Dynasty
    - value: str 必须项。朝代名称。
   """
+  __slots__ = ('_value',)
 
   def __init__(
       self,
@@ -282,7 +356,7 @@ class Dynasty(BaseObject):
   @value.setter
   def value(self, dynasty: str):
     if isinstance(dynasty, str) and (len(dynasty) > 0):
-      self._value = dynasty
+      self._value = intern_label(dynasty)
     else:
       raise ValueError("Invalid Dynasty.value Value")
 
@@ -290,14 +364,10 @@ class Dynasty(BaseObject):
     return (f"Dynasty({'None' if self._value is None else repr(self._value)}, "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    if (len(self._value) == 0):
-      return {}
-    else:
-      return {
-          "value": self._value,
-          "attrs": self._attributes
-      }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    if (len(self._value) > 0):
+      yield "value", self._value
+      yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Dynasty', None]:
@@ -322,6 +392,7 @@ class Author(BaseObject):
    - dynasty: Dynasty 可选项。著作者生活的朝代，有不少著作者是跨朝代的，一般以著作者死亡朝代为朝代。
    - officialPosition: str 可选项。著作者的官职或者荣誉，多个以 '|' 区分开。
   """
+  __slots__ = ('_name', '_type', '_dynasty', '_officialPosition')
 
   def __init__(
       self,
@@ -341,7 +412,7 @@ class Author(BaseObject):
       self.name = name
 
     # 工作类型。一般有：著、编、撰、传、译等。
-    self._type: AuthorType = type
+    self._type: AuthorType = intern_label(type)
     if (type != AuthorType.AUTHOR):
       self.type = type
 
@@ -389,7 +460,7 @@ class Author(BaseObject):
   @type.setter
   def type(self, type: str):
     # TODO: 过滤工作类型
-    self._type = type
+    self._type = intern_label(type)
 
   @property
   def dynasty(self) -> Union[Dynasty, None]:
@@ -420,17 +491,13 @@ class Author(BaseObject):
             f"{'None' if self._officialPosition is None else repr(self._officialPosition)}, "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    if (len(self._name) == 0):
-      return {}
-    else:
-      return {
-          "name": self._name,
-          "type": self._type,
-          "dynasty": None if self._dynasty is None else self._dynasty.to_dict(),
-          "officialPosition": self._officialPosition,
-          "attrs": self._attributes
-      }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    if (len(self._name) > 0):
+      yield "name", self._name
+      yield "type", self._type
+      yield "dynasty", self._dynasty
+      yield "officialPosition", self._officialPosition
+      yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Author', None]:
@@ -487,6 +554,7 @@ class Division(BaseObject):
       如果(ref is None) and (divisions is not None)表示该Division已经load，这种情况下不允许unload。
       如果(ref is not None) and (divisions is None)表示该Division没有load。
   """
+  __slots__ = ('_parent', '_chapters', '_chapters_directorys', '_spans', '_signature', '_id', '_order', '_title', '_authors', '_type', '_ref', '_divisions')
 
   def __init__(
       self,
@@ -503,6 +571,18 @@ class Division(BaseObject):
     初始化卷章对象。
     """
 
+    # 上一级卷章或者书籍，卷章结构变化时，通知上一级更新索引
+    self._parent: Union[Division, Book, None] = None
+
+    # 缓存的章节列表和章节路径列表，卷章结构变化时失效
+    self._chapters: Union[List[Division], None] = None
+    self._chapters_directorys: Union[List[List[Division]], None] = None
+
+    # 章节的span表，由docbook_span在第一次搜索时建立，章节内容变化时失效
+    self._spans = None
+    # 章节的字符签名，与span表一起建立，章节内容卸载后仍然保留，用于搜索前排除不可能命中的章节
+    self._signature = None
+
     self._id: uuid.UUID = uuid.uuid4()
     if id is not None:
       self.id = id
@@ -547,6 +627,14 @@ class Division(BaseObject):
       self._id = id
     else:
       raise ValueError("Invalid Division.id value")
+    self._invalidate()
+
+  @property
+  def parent(self) -> Union['Division', 'Book', None]:
+    """
+    上一级卷章或者书籍。
+    """
+    return self._parent
 
   @property
   def order(self) -> Union[int, None]:
@@ -599,6 +687,7 @@ class Division(BaseObject):
   def type(self, type: DivisionType):
     if isinstance(type, DivisionType) and ((type == DivisionType.VOLUME) or (type == DivisionType.CHAPTER)):
       self._type = type
+      self._invalidate()
     else:
       raise ValueError("Invalid Division.type Value")
 
@@ -621,14 +710,19 @@ class Division(BaseObject):
 
   @property
   def chapters(self) -> List['Division']:
-    chapters = []
-    if self._type == DivisionType.CHAPTER:
-      chapters.append(self)
-    elif self._type == DivisionType.VOLUME:
-      for division in self._divisions:
-        if isinstance(division, Division):
-          chapters.extend(division.chapters)
-    return chapters
+    """
+    本卷章下所有的章节。列表被缓存，调用者不要修改。
+    """
+    if self._chapters is None:
+      chapters = []
+      if self._type == DivisionType.CHAPTER:
+        chapters.append(self)
+      elif self._type == DivisionType.VOLUME:
+        for division in self._divisions:
+          if isinstance(division, Division):
+            chapters.extend(division.chapters)
+      self._chapters = chapters
+    return self._chapters
 
   @property
   def divisions(self) -> List['Division']:
@@ -650,6 +744,35 @@ class Division(BaseObject):
       self._divisions = divisions
     else:
       raise ValueError("Invalid Division.divisions Objects")
+    self._spans = None
+    # 卸载内容时保留字符签名，载入新的内容时签名失效
+    if len(self._divisions) > 0:
+      self._signature = None
+
+    # 章节的内容（ContentPiece）不属于卷章结构，载入、卸载章节内容时不需要更新索引
+    if self._type == DivisionType.VOLUME:
+      for division in self._divisions:
+        if isinstance(division, Division):
+          division._parent = self
+      self._invalidate()
+
+  def _invalidate(self):
+    """
+    卷章结构发生变化，清除缓存的章节列表，并通知上一级直到书籍，更新书籍的索引。
+    """
+    self._chapters = None
+    self._chapters_directorys = None
+    if self._parent is not None:
+      self._parent._invalidate()
+
+  def get_book(self) -> Union['Book', None]:
+    """
+    本卷章所属的书籍。
+    """
+    parent = self._parent
+    while isinstance(parent, Division):
+      parent = parent._parent
+    return parent
 
   def is_lost(self) -> bool:
     """
@@ -675,17 +798,23 @@ class Division(BaseObject):
       return False
 
   def get_chapters_directorys(self, use_object: bool = True) -> Union[List[Union[Tuple[uuid.UUID, str], 'Division']], None]:
+    """
+    本卷章下所有章节的路径。use_object为True时，列表被缓存，调用者不要修改。
+    """
+    if use_object and (self._chapters_directorys is not None):
+      return self._chapters_directorys
+
     directorys = []
     if self._type == DivisionType.CHAPTER:
-      return [[self]]
+      directorys = [[self]]
     elif self._type == DivisionType.VOLUME:
+      head = self if use_object else (self._id, self._title.title)
       for division in self._divisions:
         if isinstance(division, Division):
-          sub_directorys = division.get_chapters_directorys(use_object = use_object)
-          for directory in sub_directorys:
-            directory.insert(0, self) if use_object else directory.insert(0, (self._id, self._title.title))
-        directorys.extend(sub_directorys)
+          directorys.extend([head] + directory for directory in division.get_chapters_directorys(use_object = use_object))
 
+    if use_object:
+      self._chapters_directorys = directorys
     return directorys
 
   def get_chapter_directory_byid(self, id: Union[uuid.UUID, str], use_object: bool = True) -> Union[List[Union[Tuple[uuid.UUID, str], 'Division']], None]:
@@ -704,6 +833,15 @@ class Division(BaseObject):
         logger.debug("Invalid UUID string: {id}")
         return None
 
+    # 属于某本书籍时，使用书籍的索引
+    book = self.get_book()
+    if book is not None:
+      directory = book.get_chapter_directory_byid(id)
+      if (directory is None) or (self not in directory):
+        return None
+      directory = directory[directory.index(self):]
+      return directory if use_object else [(division.id, division.title.title) for division in directory]
+
     directory = None
     if self._type == DivisionType.CHAPTER:
       if self._id == id:
@@ -733,7 +871,7 @@ class Division(BaseObject):
         "type": str(self._type),
         "ref": self._ref,
         "divisions": None if ((self._divisions is None) or (self.type == DivisionType.CHAPTER)) else [division.get_catalogue() for division in self._divisions],
-        "attrs": self._attributes
+        "attrs": {} if self._attributes is None else self._attributes
     }
 
   def add_division(self, division: Union['Division', 'ContentPiece']):
@@ -750,6 +888,8 @@ class Division(BaseObject):
 
     if isinstance(division, Division):
       self._divisions.append(division)
+      division._parent = self
+      self._invalidate()
     else:
       raise ValueError("Invalid Division Object")
 
@@ -759,6 +899,8 @@ class Division(BaseObject):
 
     if isinstance(content_piece, ContentPiece):
       self._divisions.append(content_piece)
+      self._spans = None
+      self._signature = None
     else:
       raise ValueError("Invalid ContentPiece Object")
 
@@ -770,21 +912,16 @@ class Division(BaseObject):
             f"{repr(self._divisions)}, "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    title = self._title.to_dict()
-    if (len(title) == 0):
-      return {}
-    else:
-      return {
-          "id": str(self._id),
-          "order": self._order,
-          "title": title,
-          "authors": None if self._authors is None else [author.to_dict() for author in self._authors],
-          "type": str(self._type),
-          "ref": self._ref,
-          "divisions": None if self._divisions is None else [division.to_dict() for division in self._divisions],
-          "attrs": self._attributes
-    }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    if (len(self._title.title) > 0):
+      yield "id", str(self._id)
+      yield "order", self._order
+      yield "title", self._title
+      yield "authors", self._authors
+      yield "type", str(self._type)
+      yield "ref", self._ref
+      yield "divisions", self._divisions
+      yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Division', None]:
@@ -808,6 +945,35 @@ class Division(BaseObject):
     else:
       raise ValueError("Invalid Division Dict")
 
+  @classmethod
+  def from_trusted_dict(self, params: Union[Dict, None]) -> Union['Division', None]:
+    if not params:
+      return None
+    division = self.__new__(self)
+    division._parent = None
+    division._chapters = None
+    division._chapters_directorys = None
+    division._spans = None
+    division._signature = None
+    division._id = uuid.UUID(params['id'])
+    division._order = params.get('order')
+    division._title = Title.from_trusted_dict(params['title'])
+    authors = params.get('authors')
+    division._authors = [Author.from_dict(author) for author in authors] if authors else None
+    division._type = type = DivisionType[params['type'].upper()]
+    division._ref = params.get('ref')
+    divisions = params.get('divisions')
+    if not divisions:
+      division._divisions = []
+    elif type == DivisionType.VOLUME:
+      division._divisions = [Division.from_trusted_dict(sub_division) for sub_division in divisions]
+      for sub_division in division._divisions:
+        sub_division._parent = division
+    else:
+      division._divisions = [ContentPiece.from_trusted_dict(content_piece) for content_piece in divisions]
+    division._attributes = params.get('attrs') or None
+    return division
+
 
 class ContentPiece(BaseObject):
   """
@@ -823,6 +989,7 @@ class ContentPiece(BaseObject):
     - position: int 可选项。只有段内注释，这个项目才生效。
     - content_pieces: List[ContentPiece] 可选项。 
   """
+  __slots__ = ('_type', '_content', '_content_pieces', '_annotator', '_authorship', '_position')
 
   def __init__(
       self,
@@ -849,8 +1016,8 @@ class ContentPiece(BaseObject):
     self._content_pieces: List['ContentPiece'] = content_pieces if content_pieces is not None else []
 
     # 初始化其他属性
-    self._annotator: Union[str, None] = annotator
-    self._authorship: Union[str, None] = authorship
+    self._annotator: Union[str, None] = intern_label(annotator)
+    self._authorship: Union[str, None] = intern_label(authorship)
     self._position: Union[int, None] = position
 
     super().__init__(attrs)
@@ -861,7 +1028,7 @@ class ContentPiece(BaseObject):
 
   @annotator.setter
   def annotator(self, annotator: str):
-    self._annotator = annotator
+    self._annotator = intern_label(annotator)
 
   @property
   def authorship(self) -> Union[str, None]:
@@ -869,7 +1036,7 @@ class ContentPiece(BaseObject):
 
   @authorship.setter
   def authorship(self, authorship: str):
-    self._authorship = authorship
+    self._authorship = intern_label(authorship)
 
   @property
   def position(self) -> Union[int, None]:
@@ -942,16 +1109,14 @@ class ContentPiece(BaseObject):
             f"{'None' if self._content_pieces is None else repr(self._content_pieces)}), "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    return {
-        "type": str(self._type),
-        "content": self._content,
-        "annotator": self._annotator,
-        "authorship": self._authorship,
-        "position": self._position,
-        "content_pieces": None if self._content_pieces is None else [content_piece.to_dict() for content_piece in self._content_pieces],
-        "attrs": self._attributes
-    }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    yield "type", str(self._type)
+    yield "content", self._content
+    yield "annotator", self._annotator
+    yield "authorship", self._authorship
+    yield "position", self._position
+    yield "content_pieces", self._content_pieces
+    yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['ContentPiece', None]:
@@ -972,6 +1137,22 @@ class ContentPiece(BaseObject):
     else:
       raise ValueError("Invalid ContentPiece Dict")
 
+  @classmethod
+  def from_trusted_dict(self, params: Union[Dict, None]) -> Union['ContentPiece', None]:
+    if not params:
+      return None
+    content_piece = self.__new__(self)
+    content_piece._type = DivisionType[params['type'].upper()]
+    content_piece._content = params.get('content', "")
+    content_pieces = params.get('content_pieces')
+    content_piece._content_pieces = [ContentPiece.from_trusted_dict(sub_content_piece) for sub_content_piece in content_pieces] if content_pieces is not None else []
+    content_piece._annotator = intern_label(params.get('annotator'))
+    # 与from_dict一致
+    content_piece._authorship = intern_label(params.get('source'))
+    content_piece._position = params.get('position')
+    content_piece._attributes = params.get('attrs') or None
+    return content_piece
+
 
 class Indent2SectionHelper(object):
   """
@@ -1067,6 +1248,7 @@ class Extra(BaseObject):
     - ref: URL 可选项。ref主要是指该附加内容的存储位置。
     - content: bytes 可选项。附加内容的实际内容。content和ref必须要有一个。
   """
+  __slots__ = ('_name', '_type', '_ref', '_content')
 
   def __init__(
       self,
@@ -1146,13 +1328,11 @@ class Extra(BaseObject):
     return (f"Extra({repr(self._name)}, {repr(self._type)}, {repr(self._ref)}, "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self) -> Dict:
-    return {
-        "name": str(self._name),
-        "type": str(self._type),
-        "ref": self._ref,
-        "attrs": self._attributes
-    }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    yield "name", str(self._name)
+    yield "type", str(self._type)
+    yield "ref", self._ref
+    yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Extra', None]:
@@ -1185,6 +1365,7 @@ class Book(BaseObject):
     - divisions: List[Division] 可选项。书籍卷、章集合。
     - extras: List[Extra] 可选项。书籍附加内容集合。
   """
+  __slots__ = ('_revision', '_directory_ids', '_chapters', '_chapters_directorys', '_id', '_title', '_authors', '_dynasty', '_categories', '_source', '_description', '_utc_datetime', '_divisions', '_extras')
 
   def __init__(
       self,
@@ -1203,6 +1384,12 @@ class Book(BaseObject):
     """
     初始化一本文献书籍。
     """
+    # 卷章结构的修订号，以及id到卷章路径的索引、缓存的章节列表和章节路径列表，卷章结构变化时失效
+    self._revision: int = 0
+    self._directory_ids: Union[Dict[uuid.UUID, List[Union[Division, Book]]], None] = None
+    self._chapters: Union[List[Division], None] = None
+    self._chapters_directorys: Union[List[List[Union[Division, Book]]], None] = None
+
     self._id: uuid.UUID = uuid.uuid4()
     if id is not None:
       self.id = id
@@ -1236,7 +1423,9 @@ class Book(BaseObject):
     self.utc_datetime = date
 
     # 卷册章内容。书籍的卷册章内容内容。
-    self._divisions: Union[Division, None] = [] if divisions is None else divisions
+    self._divisions: Union[Division, None] = []
+    if divisions is not None:
+      self.divisions = divisions
 
     # 附加内容
     self.extras: Union[Extra, None] = [] if extras is None else extras
@@ -1258,6 +1447,69 @@ class Book(BaseObject):
       self._id = id
     else:
       raise ValueError("Invalid Book.id value")
+    self._invalidate()
+
+  @property
+  def revision(self) -> int:
+    """
+    卷章结构的修订号，卷章结构每次变化时递增。
+    """
+    return self._revision
+
+  def _invalidate(self):
+    """
+    卷章结构发生变化，索引和缓存的章节列表失效。
+    """
+    self._revision += 1
+    self._directory_ids = None
+    self._chapters = None
+    self._chapters_directorys = None
+
+  def __get_directory_ids(self) -> Dict[uuid.UUID, List[Union[Division, 'Book']]]:
+    """
+    id到卷章路径（self, division, ... , division）的索引，包含所有的卷和章。
+    """
+    if self._directory_ids is None:
+      directory_ids = {}
+      def add_directorys(division: Division, directory: List[Union[Division, Book]]):
+        directory = directory + [division]
+        # 与按顺序查找的结果一致，重复的id使用第一个
+        directory_ids.setdefault(division.id, directory)
+        if division.type == DivisionType.VOLUME:
+          for sub_division in division.divisions:
+            if isinstance(sub_division, Division):
+              add_directorys(sub_division, directory)
+
+      for division in (self._divisions or []):
+        add_directorys(division, [self])
+      self._directory_ids = directory_ids
+    return self._directory_ids
+
+  def get_division_ids(self) -> List[uuid.UUID]:
+    """
+    书籍中所有卷章的id。
+    """
+    return list(self.__get_directory_ids().keys())
+
+  def get_division_directory_byid(self, id: Union[uuid.UUID, str]) -> Union[List[Union[Division, 'Book']], None]:
+    """
+    通过id找到卷或者章在书籍中的路径：self, division, ... , division。
+    """
+    if id is None:
+      return None
+    if isinstance(id, str):
+      try:
+        id = uuid.UUID(id)
+      except ValueError:
+        logger.debug("Invalid UUID string: {id}")
+        return None
+
+    directory = self.__get_directory_ids().get(id)
+    return None if directory is None else list(directory)
+
+  def get_division_byid(self, id: Union[uuid.UUID, str]) -> Union[Division, None]:
+    directory = self.get_division_directory_byid(id)
+    return None if directory is None else directory[-1]
 
   @property
   def title(self) -> Union[Title, None]:
@@ -1350,7 +1602,12 @@ class Book(BaseObject):
 
   @property
   def chapters(self) -> List[Division]:
-    return [chapter for division in self._divisions for chapter in division.chapters]
+    """
+    书籍中所有的章节。列表被缓存，调用者不要修改。
+    """
+    if self._chapters is None:
+      self._chapters = [chapter for division in (self._divisions or []) for chapter in division.chapters]
+    return self._chapters
 
   @property
   def divisions(self) -> List[Division]:
@@ -1365,8 +1622,11 @@ class Book(BaseObject):
         if not isinstance(division, Division):
            raise ValueError("Invalid Book.divisions Objects")
       self._divisions = divisions
+      for division in divisions:
+        division._parent = self
     else:
       raise ValueError("Invalid Book.divisions Objects")
+    self._invalidate()
 
   @property
   def extras(self) -> Union[List[Extra], None]:
@@ -1385,14 +1645,20 @@ class Book(BaseObject):
       raise ValueError("Invalid Book.extras Object")
 
   def get_chapters_directorys(self, use_object: bool = True) -> Union[List[Union[Tuple[uuid.UUID, str], Union['Division', 'Book']]], None]:
+    """
+    书籍中所有章节的路径。use_object为True时，列表被缓存，调用者不要修改。
+    """
+    if use_object and (self._chapters_directorys is not None):
+      return self._chapters_directorys
+
     directorys = []
-    for division in self._divisions:
+    head = self if use_object else (self._id, self._title.title)
+    for division in (self._divisions or []):
       if isinstance(division, Division):
-        sub_directorys = division.get_chapters_directorys(use_object = use_object)
-        for directory in sub_directorys:
-          directory.insert(0, self) if use_object else directory.insert(0, (self._id, self._title.title))
-      directorys.extend(sub_directorys)
+        directorys.extend([head] + directory for directory in division.get_chapters_directorys(use_object = use_object))
 
+    if use_object:
+      self._chapters_directorys = directorys
     return directorys
 
   def get_chapter_directory_byid(self, id: Union[uuid.UUID, str], use_object: bool = True) -> Union[List[Union[Tuple[uuid.UUID, str], Union['Division', 'Book']]], None]:
@@ -1405,19 +1671,10 @@ class Book(BaseObject):
         logger.debug("Invalid UUID string: {id}")
         return None
 
-    directory = None
-    for division in self._divisions:
-      directory = division.get_chapter_directory_byid(id, use_object = use_object)
-      if directory is None:
-        continue
-      else:
-        if use_object:
-          directory.insert(0, self)
-        else:
-          directory.insert(0, (self._id, self._title.title))
-        break
-    
-    return  None if directory is None else directory
+    directory = self.get_division_directory_byid(id)
+    if (directory is None) or (directory[-1].type != DivisionType.CHAPTER):
+      return None
+    return directory if use_object else [(division.id, division.title.title) for division in directory]
 
   def get_chapter_byid(self, id) -> Union[Division, None]:
     if id is None:
@@ -1429,11 +1686,8 @@ class Book(BaseObject):
         logger.debug("Invalid UUID string: {id}")
         return None
 
-    for chapter in self.chapters:
-      if chapter.id == id:
-        return chapter
-
-    return None
+    division = self.get_division_byid(id)
+    return division if (division is not None) and (division.type == DivisionType.CHAPTER) else None
 
   def get_brief(self) -> Dict:
     return {
@@ -1445,7 +1699,7 @@ class Book(BaseObject):
         "source": self._source,
         "description": self._description,
         "date": None if self._utc_datetime is None else self._utc_datetime.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "attrs": self._attributes
+        "attrs": {} if self._attributes is None else self._attributes
     }
 
   def get_catalogue(self) -> Dict:
@@ -1459,12 +1713,14 @@ class Book(BaseObject):
         "description": self._description,
         "date": None if self._utc_datetime is None else self._utc_datetime.strftime("%Y-%m-%dT%H:%M:%SZ"),
         "divisions": None if self._divisions is None else [division.get_catalogue() for division in self._divisions],
-        "attrs": self._attributes
+        "attrs": {} if self._attributes is None else self._attributes
     }
 
   def add_division(self, division: Division):
     if isinstance(division, Division):
       self._divisions.append(division)
+      division._parent = self
+      self._invalidate()
     else:
       raise ValueError("Invalid Division Object")
 
@@ -1475,6 +1731,7 @@ class Book(BaseObject):
     """
     for index, chapter in enumerate(self.chapters):
       chapter.order = index
+    self._invalidate()
 
   def resort_chapters(self):
     """
@@ -1519,23 +1776,19 @@ class Book(BaseObject):
             f"{'None' if self._extras is None else repr(self._extras)}), "
             f"{'None' if self._attributes is None else repr(self._attributes)})")
 
-  def to_dict(self):
-    if (self._title is None) or (len(self._title.to_dict()) == 0):
-      return {}
-    else:
-      return {
-          "id": str(self._id),
-          "title": self._title.to_dict(),
-          "authors": None if self._authors is None else [author.to_dict() for author in self._authors],
-          "dynasty": None if self._dynasty is None else self._dynasty.to_dict(),
-          "categories": self._categories,
-          "source": self._source,
-          "description": self._description,
-          "date": None if self._utc_datetime is None else self._utc_datetime.strftime("%Y-%m-%dT%H:%M:%SZ"),
-          "divisions": None if self._divisions is None else [division.to_dict() for division in self._divisions],
-          "extras": None if self._extras is None else [extra.to_dict() for extra in self._extras],
-          "attrs": self._attributes
-      }
+  def iter_json_fields(self) -> Iterator[Tuple[str, Any]]:
+    if (self._title is not None) and (len(self._title.title) > 0):
+      yield "id", str(self._id)
+      yield "title", self._title
+      yield "authors", self._authors
+      yield "dynasty", self._dynasty
+      yield "categories", self._categories
+      yield "source", self._source
+      yield "description", self._description
+      yield "date", None if self._utc_datetime is None else self._utc_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")
+      yield "divisions", self._divisions
+      yield "extras", self._extras
+      yield "attrs", {} if self._attributes is None else self._attributes
 
   @classmethod
   def from_dict(self, params: Union[Dict, None]) -> Union['Book', None]:
@@ -1560,4 +1813,34 @@ class Book(BaseObject):
           params.get('attrs', None)
       )
     else:
-      raise ValueError("Invalid Book Dict")
\ No newline at end of file
+      raise ValueError("Invalid Book Dict")
+
+  @classmethod
+  def from_trusted_dict(self, params: Union[Dict, None]) -> Union['Book', None]:
+    if not params:
+      return None
+    # 书籍只有一个，其中不在热点上的部分（著作者、朝代、附加内容等）仍然经过校验
+    book = self.__new__(self)
+    book._revision = 0
+    book._directory_ids = None
+    book._chapters = None
+    book._chapters_directorys = None
+    id = params.get('id')
+    book._id = uuid.uuid4() if id is None else uuid.UUID(id)
+    book._title = Title.from_trusted_dict(params['title'])
+    book._authors = None
+    book.authors = None if params.get('authors') is None else [Author.from_dict(author) for author in params['authors']]
+    book._dynasty = Dynasty.from_dict(params.get('dynasty'))
+    book._categories = params.get('categories')
+    book._source = params.get('source')
+    book._description = params.get('description')
+    book._utc_datetime = None
+    book.utc_datetime = params.get('date')
+    divisions = params.get('divisions')
+    book._divisions = [] if divisions is None else [Division.from_trusted_dict(division) for division in divisions]
+    for division in book._divisions:
+      division._parent = book
+    extras = params.get('extras')
+    book.extras = [] if extras is None else [Extra.from_dict(extra) for extra in extras]
+    book._attributes = params.get('attrs') or None
+    return book
\ No newline at end of file
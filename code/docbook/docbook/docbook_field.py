@@ -0,0 +1,147 @@
+"""
+docbook_field.py
+
+docbook_field判断查询语句中的字段条件（Query.field_tree），比如：'title:周易 and 君子'、'type:annotation and annotator:王弼'。
+- 书籍、卷章的字段（title、author、dynasty、category）由BookFieldIndex判断：每一个字段的值到书籍、卷章id集合的映射。
+  搜索前先排除不符合条件的章节，这些章节不需要载入，也不需要扫描内容。
+- 段落的字段（annotator、type）在章节的span表上判断，只在符合条件的span中执行内容的查询条件。
+两类字段条件只能以AND组合，比如：'title:周易 and (annotator:王弼 or annotator:韓康伯)'。
+"""
+
+import uuid
+import logging
+
+from typing import Union, List, Dict, Tuple, Set, Callable, Iterable
+
+from query import Query, QueryNode, QueryField
+from .docbook_core import Book, Division, Author, DivisionType
+from .docbook_span import ChapterSpan, get_chapter_spans
+
+logger = logging.getLogger('docbook.field')
+
+# 书籍、卷章的字段
+BOOK_FIELDS = Query.BOOK_FIELDS
+# 段落的字段
+CONTENT_PIECE_FIELDS = Query.CONTENT_PIECE_FIELDS
+
+class BookFieldIndex(object):
+  """
+  书籍、卷章字段的索引：{字段名: {值: 书籍、卷章的id集合}}。
+  卷章上的著作者对它下面所有的章节有效；一个字段的不同取值很少，查询时逐个判断取值，不需要扫描每一本书。
+  """
+
+  def __init__(self):
+    self._values: Dict[str, Dict[str, Set[uuid.UUID]]] = {field: {} for field in BOOK_FIELDS}
+
+  def __add(self, field: str, value: Union[str, None], id: uuid.UUID):
+    if (value is None) or (len(value) == 0):
+      return
+    ids = self._values[field].get(value)
+    if ids is None:
+      ids = self._values[field][value] = set()
+    ids.add(id)
+
+  def __add_authors(self, authors: Union[List[Author], None], id: uuid.UUID):
+    for author in authors or []:
+      self.__add('author', author.name, id)
+      if author.dynasty is not None:
+        self.__add('dynasty', author.dynasty.value, id)
+
+  def __add_division(self, division: Division):
+    self.__add_authors(division.authors, division.id)
+    # 章节下面是段落，不再遍历
+    if division.type == DivisionType.VOLUME:
+      for sub_division in division.divisions:
+        if isinstance(sub_division, Division):
+          self.__add_division(sub_division)
+
+  def add_book(self, book: Book):
+    title = book.title
+    if title is not None:
+      for text in (title.prefix, title.title, title.subtitle):
+        self.__add('title', text, book.id)
+    self.__add_authors(book.authors, book.id)
+    if book.dynasty is not None:
+      self.__add('dynasty', book.dynasty.value, book.id)
+    for category in book.categories or []:
+      self.__add('category', category, book.id)
+    for division in book.divisions or []:
+      self.__add_division(division)
+
+  @classmethod
+  def build(self, dbooks: Iterable[Book]) -> 'BookFieldIndex':
+    index = self()
+    for book in dbooks:
+      index.add_book(book)
+    return index
+
+  def get_ids(self, node: QueryField) -> Set[uuid.UUID]:
+    """
+    输出字段值符合node的书籍、卷章的id集合。
+    """
+    ids = set()
+    for value, value_ids in self._values.get(node.field, {}).items():
+      if node.match(value):
+        ids |= value_ids
+    return ids
+
+  def compile_filter(self, tree: QueryNode) -> Callable[[List[Union[Division, Book]]], bool]:
+    """
+    将只包含书籍、卷章字段的条件编译为章节路径（[书籍, 卷, ..., 章节]）上的判断函数。
+    路径上的书籍、卷章中，任何一个的字段值符合条件，字段条件就成立。
+    """
+    node_ids = {node: self.get_ids(node) for node in tree.get_fields()}
+    all_ids = set().union(*node_ids.values())
+    # 大部分章节的结果只由书籍决定，按照路径上出现在索引中的id缓存结果
+    results: Dict[Tuple[uuid.UUID, ...], bool] = {}
+
+    def match(directory: List[Union[Division, Book]]) -> bool:
+      key = tuple(division.id for division in directory if division.id in all_ids)
+      result = results.get(key)
+      if result is None:
+        ids = set(key)
+        result = results[key] = tree.evaluate_fields(lambda node: not node_ids[node].isdisjoint(ids))
+      return result
+    return match
+
+  def filter_directorys(self, tree: QueryNode, directorys: List[List[Union[Division, Book]]]) -> List[List[Union[Division, Book]]]:
+    """
+    输出directorys中符合书籍、卷章字段条件的章节路径，保持原来的顺序。
+    """
+    match = self.compile_filter(tree)
+    return [directory for directory in directorys if match(directory)]
+
+  def filter_books(self, tree: QueryNode, dbooks: List[Book]) -> List[Book]:
+    """
+    输出dbooks中符合书籍字段条件的书籍，只判断书籍本身的字段，不包括卷章上的著作者。
+    """
+    match = self.compile_filter(tree)
+    return [book for book in dbooks if match([book])]
+
+
+def split_field_tree(q: Query) -> Tuple[Union[QueryNode, None], Union[QueryNode, None]]:
+  """
+  把查询语句的字段条件分为书籍、卷章的字段条件和段落的字段条件，两者以AND组合（Query在解码时已经检查）。
+
+  :return: (书籍、卷章的字段条件, 段落的字段条件)，没有的部分为None。
+  """
+  return Query.split_book_fields(q.field_tree)
+
+def match_span_field(node: QueryField, span: ChapterSpan) -> bool:
+  """
+  判断span是否符合段落的字段条件。type的值为段落的类型（不区分大小写），注释中的span的类型都是annotation。
+  """
+  if node.field == 'type':
+    return node.value.upper() == (DivisionType.ANNOTATION.name if span.in_annotation else span.type.name)
+  return node.match(span.content_piece.annotator)
+
+def get_field_spans(tree: QueryNode, chapter: Division, chapter_spans: Union[List[ChapterSpan], None] = None) -> Set[int]:
+  """
+  输出章节中符合段落字段条件的span序号集合。
+
+  :param chapter: 章节对象，必须是已经load的章节。
+  :param chapter_spans: 章节的span表，为None时使用get_chapter_spans(chapter)。
+  """
+  if chapter_spans is None:
+    chapter_spans = get_chapter_spans(chapter)
+  return {span.index for span in chapter_spans if tree.evaluate_fields(lambda node: match_span_field(node, span))}
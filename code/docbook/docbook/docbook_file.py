@@ -6,28 +6,91 @@ docbook文件以目录或者打包方式来进行管理。
 """
 
 import uuid
-import json
+import hashlib
 import logging
+import zipfile
+import threading
+import collections
 from datetime import datetime, timezone
 
-from typing import Union, List, Dict, Tuple
+from typing import Union, List, Dict, Tuple, Callable, Any
 from enum import Enum
 
 import pathlib
-from .docbook_core import Book, Division, DecoderError
+from .docbook_core import Book, Division, Extra, DecoderError
+from .docbook_pack import PackedBlock, PackedCompression, write_packed_file, read_packed_header, read_packed_block
 
 logger = logging.getLogger('docbook.file')
 
 class BookFileType(Enum):
   SINGLE_FILE       = 0
   PARTS_FILE        = 1
-  # TODO: unsupport
   SINGLE_PARTS_FILE = 2
+  PACKED_FILE       = 3
   AUTO_DETECTED     = 9
 
   def __str__(self):
     return self.name
 
+class ZipFileCache(object):
+  """
+  SINGLE_PARTS_FILE书籍打开的zip文件，所有的BookFile共用。
+  按照最近使用的顺序（LRU）最多保持max_count个zip文件打开，超出时关闭最久没有使用的文件，之后需要时再重新打开。
+  ZipFile不能在多个线程中同时读取，同一个zip文件的读取依次进行。
+  """
+
+  def __init__(self, max_count: int = 64):
+    self._max_count: int = max(1, max_count)
+    # key -> (打开的zip文件, 读取该文件的锁)，最久没有使用的在最前面
+    self._files: collections.OrderedDict = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  @property
+  def count(self) -> int:
+    return len(self._files)
+
+  def read(self, key: Any, path: str, func: Callable[[zipfile.ZipFile], Any]) -> Any:
+    """
+    用打开的zip文件执行func（比如：读取一个entry），文件没有打开时先打开。
+
+    :param key: zip文件的标识，磁盘文件被替换后应该使用不同的key。
+    :param path: zip文件的路径。
+    """
+    while True:
+      closed = []
+      with self._lock:
+        item = self._files.get(key)
+        if item is None:
+          item = self._files[key] = (zipfile.ZipFile(path, 'r'), threading.Lock())
+        else:
+          self._files.move_to_end(key)
+        while len(self._files) > self._max_count:
+          closed.append(self._files.popitem(last = False)[1])
+      for file, lock in closed:
+        with lock:
+          file.close()
+
+      file, lock = item
+      with lock:
+        # 在取得锁之前，文件可能已经被其他线程关闭，重新打开
+        if file.fp is not None:
+          return func(file)
+
+  def close(self, key: Any):
+    with self._lock:
+      item = self._files.pop(key, None)
+    if item is not None:
+      with item[1]:
+        item[0].close()
+
+  def clear(self):
+    with self._lock:
+      items = list(self._files.values())
+      self._files.clear()
+    for file, lock in items:
+      with lock:
+        file.close()
+
 class BookFile(object):
   """
   文献书籍文件定义。用于读取、存储文献书籍。
@@ -44,17 +107,53 @@ class BookFile(object):
           - img_001.gif       image file by order
           - img_002.jpg       image file by order
           - ...               image file by order
-    - SINGLE_PARTS_FILE 打包单文件结构。一个被zip压缩后的PARTS_FILE目录结构。
+    - SINGLE_PARTS_FILE 打包单文件结构。一个被zip压缩后的PARTS_FILE目录结构，文件后缀为'.dbzip'。
+      book.json可以在zip的根目录，也可以在zip中唯一的一级目录中。
+      打开书籍时只读取book.json，章节和附加内容在需要时通过zip的中央目录直接读取。
+      打开的zip文件由ZIP_FILE_CACHE管理，最近使用的zip文件保持打开，同时打开的文件数量有上限。
+    - PACKED_FILE 二进制打包文件结构，文件后缀为'.dbpack'。目录和章节偏移表在文件头部，章节内容在需要时单独读取、解码。
+      文件结构见docbook_pack，与PARTS_FILE可以无损互相转换。
   """
 
   SINGLE_FILE_SUFFIX = ".dbook"
   PARTS_FILE_NAME = "book.json"
+  PACKED_FILE_SUFFIX = ".dbpack"
+  SINGLE_PARTS_FILE_SUFFIX = ".dbzip"
+
+  # 保存书籍文件时json的缩进，为None时输出紧凑的json（生产环境使用，文件更小，读写更快）
+  JSON_INDENT: Union[int, None] = 4
+
+  # 所有SINGLE_PARTS_FILE书籍共用的打开的zip文件
+  ZIP_FILE_CACHE: ZipFileCache = ZipFileCache()
   
-  def __init__(self, path: str, dynamic_load: bool = True):
+  def __init__(self, path: Union[str, None], dynamic_load: bool = True, chapter_cache: Union['ChapterCache', None] = None, trusted: bool = False):
+    """
+    :param path: 书籍文件的路径，为None时不载入，之后由load或者open打开。
+    :param dynamic_load: 是否在需要时才载入章节内容。
+    :param chapter_cache: 管理动态载入的章节内容的缓存。
+    :param trusted: 是否为自己生成、已经校验过的书籍（例如发布的文献库），为True时直接建立对象，不经过属性的校验。
+    """
     self._path: str = path
     self._type: BookFileType = BookFileType.SINGLE_FILE
     self._book: Book = None
-    self.load(path, dynamic_load)
+    # 管理动态载入的章节内容的缓存，为None时章节载入后一直保留
+    self._chapter_cache: Union['ChapterCache', None] = chapter_cache
+    # PACKED_FILE的压缩方式和数据块偏移表
+    self._packed_compression: int = PackedCompression.NONE
+    self._packed_blocks: Dict[str, PackedBlock] = {}
+    # SINGLE_PARTS_FILE的zip文件在ZIP_FILE_CACHE中的key（路径、大小、修改时间），以及book.json在zip中的目录前缀
+    self._zip_key: Union[Tuple[str, int, int], None] = None
+    self._zip_prefix: str = ""
+    # 书籍和章节是否使用不校验的快速载入
+    self._trusted: bool = trusted
+    if path is not None:
+      self.load(path, dynamic_load, trusted = trusted)
+
+  def __getstate__(self):
+    # 在进程之间传递时（例如并行载入文献库），不传递章节缓存；zip文件在第一次读取时由ZIP_FILE_CACHE重新打开
+    state = self.__dict__.copy()
+    state['_chapter_cache'] = None
+    return state
 
   @property
   def path(self):
@@ -67,8 +166,19 @@ class BookFile(object):
   def book(self):
     return self._book
 
+  @property
+  def chapter_cache(self) -> Union['ChapterCache', None]:
+    return self._chapter_cache
+
+  @chapter_cache.setter
+  def chapter_cache(self, chapter_cache: Union['ChapterCache', None]):
+    self._chapter_cache = chapter_cache
+
   @staticmethod
-  def save_to_docbook(path: str, book: Book, type: BookFileType = BookFileType.SINGLE_FILE) -> bool:
+  def save_to_docbook(path: str, book: Book, type: BookFileType = BookFileType.SINGLE_FILE, compress: bool = True) -> bool:
+    """
+    :param compress: PACKED_FILE是否压缩目录和数据块。
+    """
     dbook_path = pathlib.Path(path)
     book.utc_datetime = datetime.now(timezone.utc)
 
@@ -77,7 +187,7 @@ class BookFile(object):
     if type == BookFileType.SINGLE_FILE:
       dbook_path.parent.mkdir(parents = True, exist_ok = True)
       with open(dbook_path, 'wb') as file:
-        file.write(book.dump_json(indent = 4, remove_useless = True).encode('utf-8'))
+        book.write_json(file, indent = BookFile.JSON_INDENT)
         file.close()
 
     # save as a directory include book.json and chapters/[chapter].json
@@ -87,11 +197,12 @@ class BookFile(object):
         chapter_path = dbook_path / ref
         chapter_path.parent.mkdir(parents = True, exist_ok = True)
         with open(chapter_path, 'wb') as file:
-          file.write(chapter.dump_json(indent = 4, remove_useless = True).encode('utf-8'))
+          chapter.write_json(file, indent = BookFile.JSON_INDENT)
           file.close()
         chapter.divisions = None
         chapter.ref = ref
 
+      BookFile.__assign_extra_refs(book)
       for extra in book.extras:
         if extra.content is not None:
           extra_path = dbook_path / extra.ref
@@ -103,9 +214,46 @@ class BookFile(object):
       chapter_path = dbook_path / BookFile.PARTS_FILE_NAME
       chapter_path.parent.mkdir(parents = True, exist_ok = True)
       with open(chapter_path, 'wb') as file:
-        file.write(book.dump_json(indent = 4, remove_useless = True).encode('utf-8'))
+        book.write_json(file, indent = BookFile.JSON_INDENT)
         file.close()
 
+    # save as a binary file include the toc, the block table and the chapter and extra blocks, and suffix is ".dbpack"
+    elif type == BookFileType.PACKED_FILE:
+      blocks = []
+      for index, chapter in enumerate(book.chapters):
+        ref = f"chapters/chapter_{index:03}.json"
+        blocks.append((ref, chapter.dump_json_bytes(indent = BookFile.JSON_INDENT, remove_useless = True)))
+        chapter.divisions = None
+        chapter.ref = ref
+
+      BookFile.__assign_extra_refs(book)
+      for extra in book.extras:
+        if extra.content is not None:
+          blocks.append((extra.ref, extra.content))
+
+      dbook_path.parent.mkdir(parents = True, exist_ok = True)
+      with open(dbook_path, 'wb') as file:
+        toc = book.dump_json_bytes(indent = BookFile.JSON_INDENT, remove_useless = True)
+        write_packed_file(file, toc, blocks, PackedCompression.ZLIB if compress else PackedCompression.NONE)
+        file.close()
+
+    # save as a zip file of the directory of PARTS_FILE, and suffix is ".dbzip"
+    elif type == BookFileType.SINGLE_PARTS_FILE:
+      dbook_path.parent.mkdir(parents = True, exist_ok = True)
+      with zipfile.ZipFile(dbook_path, 'w', compression = zipfile.ZIP_DEFLATED) as file:
+        for index, chapter in enumerate(book.chapters):
+          ref = f"chapters/chapter_{index:03}.json"
+          file.writestr(ref, chapter.dump_json_bytes(indent = BookFile.JSON_INDENT, remove_useless = True))
+          chapter.divisions = None
+          chapter.ref = ref
+
+        BookFile.__assign_extra_refs(book)
+        for extra in book.extras:
+          if extra.content is not None:
+            file.writestr(extra.ref, extra.content)
+
+        file.writestr(BookFile.PARTS_FILE_NAME, book.dump_json_bytes(indent = BookFile.JSON_INDENT, remove_useless = True))
+
     else:
       logger.info(f"Unsupported file type {type}.")
       return False
@@ -113,45 +261,90 @@ class BookFile(object):
     logger.info(f"Save book id: {book.id} as '{path}', file type {type}.")
     return True
 
-  def load(self, path: str, dynamic_load: bool = True, reload: bool = True) -> bool:
+  def load(self, path: str, dynamic_load: bool = True, reload: bool = True, trusted: bool = False) -> bool:
     if reload == False and self._book is not None:
       logger.info(f"BookFile already load a docbook.")
       return False
 
+    toc = self.open(path)
+    if toc is None:
+      return False
+    self._trusted = trusted
+    self._book = Book.from_json(toc, trusted)
+    
+    if dynamic_load == False:
+      self.load_all_chapter()
+
+    logger.info(f"Load dbook: '{path}', type: {'dynamic' if dynamic_load else 'all'}, success.")
+    return True
+
+  @staticmethod
+  def __assign_extra_refs(book: Book):
+    """
+    分成多个部分保存时，没有ref的附加内容（内容只在内存中）按照顺序生成ref，比如：extras/extra_001.gif。
+    """
+    refs = {extra.ref for extra in book.extras if extra.ref is not None}
+    for index, extra in enumerate(book.extras):
+      if (extra.content is None) or (extra.ref is not None):
+        continue
+      suffix = pathlib.PurePosixPath(extra.name).suffix
+      ref = f"extras/extra_{index:03}{suffix}"
+      count = 0
+      while ref in refs:
+        count += 1
+        ref = f"extras/extra_{index:03}_{count}{suffix}"
+      extra.ref = ref
+      refs.add(ref)
+      logger.debug(f"Assign ref '{ref}' to extra '{extra.name}'.")
+
+  def open(self, path: str) -> Union[bytes, None]:
+    """
+    打开书籍文件，输出书籍的json（SINGLE_FILE为整本书籍，其他格式为不包含章节内容的目录），不解码。
+    之后可以由read_part读取章节等其他部分。不是书籍文件时返回None。
+    """
     book_file_path = pathlib.Path(path)
     if book_file_path.is_file():
       if book_file_path.suffix.lower() == BookFile.SINGLE_FILE_SUFFIX:
         self._type = BookFileType.SINGLE_FILE
+      elif book_file_path.suffix.lower() == BookFile.PACKED_FILE_SUFFIX:
+        self._type = BookFileType.PACKED_FILE
+      elif book_file_path.suffix.lower() == BookFile.SINGLE_PARTS_FILE_SUFFIX:
+        self._type = BookFileType.SINGLE_PARTS_FILE
       elif book_file_path.name.lower() == BookFile.PARTS_FILE_NAME:
         self._type = BookFileType.PARTS_FILE
       else:
         logger.info(f"'{path}' isn't a correct BookFile path.")
-        return False
+        return None
     elif book_file_path.is_dir():
       self._type = BookFileType.PARTS_FILE
       book_file_path = pathlib.Path(book_file_path) / BookFile.PARTS_FILE_NAME
     else:
       raise DecoderError(f"{book_file_path} Does Not Exist")
 
-    # load '.dbook' or '/directory/book.json'
-    with open(book_file_path, "rb") as file:
-      self._book = Book.from_json(file.read().decode('utf-8'))
-      file.close()
+    self.__close_zipfile()
+    # load 'book.json' in '.dbzip', and keep the zip file open for the chapters
+    if self._type == BookFileType.SINGLE_PARTS_FILE:
+      self.__open_zipfile(book_file_path)
+      toc = self.__read_zip_entry(BookFile.PARTS_FILE_NAME)
+    else:
+      # load '.dbook' or '/directory/book.json'
+      # or the header of '.dbpack', the chapters are decoded when they are loaded
+      with open(book_file_path, "rb") as file:
+        if self._type == BookFileType.PACKED_FILE:
+          self._packed_compression, toc, self._packed_blocks = read_packed_header(file)
+        else:
+          # 直接解码文件内容，不需要先转换成str
+          toc = file.read()
+        file.close()
 
     if self._type == BookFileType.PARTS_FILE:
       self._path = book_file_path.parent.as_posix()
     else:
       self._path = book_file_path.as_posix()
-    
-    if dynamic_load == False:
-      self.load_all_chapter()
-
-    logger.info(f"Load dbook: '{path}', type: {'dynamic' if dynamic_load else 'all'}, success.")
-    return True
+    return toc
 
   def load_all_chapter(self) -> bool:
     # 如果是一整个没有分包的文件，已经完全载入了所有章节
-    # TODO：只考虑了json的整个文件，没有考虑zip后的有目录的分章节文件
     if (self._type == BookFileType.SINGLE_FILE):
       return True
 
@@ -167,26 +360,193 @@ class BookFile(object):
     
     return True
 
-  def load_chapter(self, chapter : Division) -> bool:
+  def load_chapter(self, chapter : Division, pin: bool = False) -> bool:
+    """
+    载入章节内容。有章节缓存时，pin为True表示载入成功后固定章节，在unpin_chapter之前不被卸载。
+    """
+    if self._chapter_cache is not None:
+      return self._chapter_cache.load_chapter(self, chapter, pin)
+    return self._load_chapter(chapter)
+
+  def unpin_chapter(self, chapter : Division):
+    if self._chapter_cache is not None:
+      self._chapter_cache.unpin(chapter)
+
+  def _load_chapter(self, chapter : Division) -> bool:
+    """
+    从文件中载入章节内容，不经过章节缓存。
+    """
     if (chapter.is_load()):
       return True
 
-    if self._type == BookFileType.PARTS_FILE:
-      book_file_path = pathlib.Path(self._path) / chapter.ref
-      with open(book_file_path, "rb") as file:
-        division = Division.from_json(file.read().decode('utf-8'))
-        chapter.divisions = division.divisions
-        file.close()
+    if self._type != BookFileType.SINGLE_FILE:
+      division = Division.from_json(self.read_part(chapter.ref), self._trusted)
+      chapter.divisions = division.divisions
 
     logger.info(f"Load chapter: '{chapter.title.title}', ref: '{chapter.ref}', success.")
     return True
 
-  def load_chapter_byid(self, id : Union[uuid.UUID, str]) -> Tuple[bool, Union[Division, None]]:
+  def read_part(self, ref: str) -> bytes:
+    """
+    读取PARTS_FILE、PACKED_FILE、SINGLE_PARTS_FILE中ref对应的部分（章节json等），不解码。
+    """
+    if self._type == BookFileType.PARTS_FILE:
+      with open(pathlib.Path(self._path) / ref, "rb") as file:
+        return file.read()
+    elif self._type == BookFileType.PACKED_FILE:
+      return self.__read_packed_block(ref)
+    elif self._type == BookFileType.SINGLE_PARTS_FILE:
+      return self.__read_zip_entry(ref)
+    raise DecoderError(f"{self._path} has no part {ref}")
+
+  def load_chapter_byid(self, id : Union[uuid.UUID, str], pin: bool = False) -> Tuple[bool, Union[Division, None]]:
     chapter = self.book.get_chapter_byid(id)
-    return (self.load_chapter(chapter), chapter) if chapter is not None else (False, None)
+    return (self.load_chapter(chapter, pin), chapter) if chapter is not None else (False, None)
+
+  def load_extra(self, extra: Extra) -> bool:
+    """
+    载入附加内容（图片等）的实际内容。
+    """
+    if extra.content is not None:
+      return True
+    content = self.get_extra_content(extra)
+    if content is None:
+      return False
+    extra.content = content
+    return True
+
+  def get_extra_content(self, extra: Extra) -> Union[bytes, None]:
+    """
+    附加内容（图片等）的实际内容，不保存在extra中。SINGLE_PARTS_FILE、PACKED_FILE直接从书籍文件中读取。
+    """
+    if extra.content is not None:
+      return extra.content
+    if extra.ref is None:
+      return None
+
+    if self._type == BookFileType.SINGLE_PARTS_FILE:
+      try:
+        return self.__read_zip_entry(extra.ref)
+      except DecoderError:
+        return None
+    elif self._type == BookFileType.PACKED_FILE:
+      return self.__read_packed_block(extra.ref) if extra.ref in self._packed_blocks else None
+    elif self._type == BookFileType.PARTS_FILE:
+      extra_path = pathlib.Path(self._path) / extra.ref
+      if extra_path.is_file():
+        with open(extra_path, "rb") as file:
+          return file.read()
+    return None
+
+  def load_all_extra(self) -> bool:
+    for extra in self._book.extras:
+      if self.load_extra(extra) == False:
+        return False
+    return True
+
+  def __open_zipfile(self, path: pathlib.Path):
+    stat = path.stat()
+    self._zip_key = (path.as_posix(), stat.st_size, stat.st_mtime_ns)
+    # book.json在根目录，或者在唯一的一级目录中
+    names = BookFile.ZIP_FILE_CACHE.read(self._zip_key, self._zip_key[0], lambda file: file.namelist())
+    self._zip_prefix = ""
+    if BookFile.PARTS_FILE_NAME not in names:
+      prefixes = [name[:-len(BookFile.PARTS_FILE_NAME)] for name in names if name.endswith(f"/{BookFile.PARTS_FILE_NAME}") and (name.count('/') == 1)]
+      if len(prefixes) != 1:
+        self.__close_zipfile()
+        raise DecoderError(f"{path} has no {BookFile.PARTS_FILE_NAME}")
+      self._zip_prefix = prefixes[0]
+
+  def __close_zipfile(self):
+    if self._zip_key is not None:
+      BookFile.ZIP_FILE_CACHE.close(self._zip_key)
+      self._zip_key = None
+
+  def __read_zip_entry(self, name: str) -> bytes:
+    try:
+      # 通过zip的中央目录定位
+      return BookFile.ZIP_FILE_CACHE.read(self._zip_key, self._zip_key[0], lambda file: file.read(self._zip_prefix + name))
+    except KeyError:
+      raise DecoderError(f"{self._path} has no entry {name}")
+
+  def __get_zip_entry_size(self, name: str) -> int:
+    try:
+      return BookFile.ZIP_FILE_CACHE.read(self._zip_key, self._zip_key[0], lambda file: file.getinfo(self._zip_prefix + name).file_size)
+    except KeyError:
+      return 0
+
+  def __read_packed_block(self, name: str) -> bytes:
+    block = self._packed_blocks.get(name)
+    if block is None:
+      raise DecoderError(f"{self._path} has no block {name}")
+    # 每次读取时打开文件，文献库中有很多书籍时，不长期占用文件句柄
+    with open(self._path, "rb") as file:
+      data = read_packed_block(file, block, self._packed_compression)
+      file.close()
+    return data
+
+  def get_chapter_size(self, chapter: Division) -> int:
+    """
+    章节文件的字节数，作为章节内容占用内存的估计值。
+    """
+    if (self._type == BookFileType.PARTS_FILE) and (chapter.ref is not None):
+      try:
+        return (pathlib.Path(self._path) / chapter.ref).stat().st_size
+      except OSError:
+        pass
+    elif (self._type == BookFileType.PACKED_FILE) and (chapter.ref in self._packed_blocks):
+      return self._packed_blocks[chapter.ref].raw_length
+    elif (self._type == BookFileType.SINGLE_PARTS_FILE) and (chapter.ref is not None):
+      return self.__get_zip_entry_size(chapter.ref)
+    return 0
+
+  def get_source_files(self) -> List[pathlib.Path]:
+    """
+    书籍对应的所有磁盘文件。
+    SINGLE_FILE为'.dbook'文件本身；PARTS_FILE为'book.json'以及所有章节文件。
+    """
+    if self._type == BookFileType.PARTS_FILE:
+      path = pathlib.Path(self._path)
+      files = [path / BookFile.PARTS_FILE_NAME]
+      files.extend([path / chapter.ref for chapter in self._book.chapters if chapter.ref is not None])
+      return files
+    else:
+      return [pathlib.Path(self._path)]
+
+  def get_signature(self) -> List[List[Union[str, int]]]:
+    """
+    书籍文件的签名，由每一个磁盘文件的路径、大小和修改时间组成，用于判断书籍文件是否被修改过。
+    """
+    signature = []
+    for file in self.get_source_files():
+      try:
+        stat = file.stat()
+        signature.append([file.as_posix(), stat.st_size, stat.st_mtime_ns])
+      except OSError:
+        signature.append([file.as_posix(), -1, -1])
+    return signature
+
+  def get_content_hash(self) -> Union[str, None]:
+    """
+    书籍所有磁盘文件内容的hash，修改时间变化但内容没有变化时，可以认为书籍文件没有被修改过。文件不存在时返回None。
+    """
+    digest = hashlib.blake2b(digest_size = 16)
+    try:
+      for file in self.get_source_files():
+        with open(file, "rb") as f:
+          while True:
+            data = f.read(1 << 20)
+            if len(data) == 0:
+              break
+            digest.update(data)
+    except OSError:
+      return None
+    return digest.hexdigest()
 
   def clear(self):
+    self.__close_zipfile()
     self._path = None
     self._book = None
     self._type = None
+    self._packed_blocks = {}
   
\ No newline at end of file
@@ -0,0 +1,451 @@
+"""
+docbook_index.py
+
+docbook_index为文献库建立基于字符n-gram（单字和双字）的位置倒排索引，并存储在磁盘上。
+古文没有分词边界，因此以单字和相邻两个字作为索引项，每一个索引项对应包含它的span（posting），以及它每一次出现的span和在span中的位置。
+搜索时，先将查询语句中的AND/OR/NOT映射为posting集合的交、并、差运算，得到候选span，只读取去重的posting；
+短语、NEAR/BEFORE才读取位置列表，合并两个关键字的位置，直接得到符合距离条件的span；再只对候选span执行查询语句进行确认。
+索引建立在span归一化的文本（ChapterSpan.search_text）上，与归一化的查询关键字一致；归一化的规则改变时需要升级索引版本。
+文献库中的书籍变化后，书籍文件没有变化的书籍沿用原来索引中的posting（重新编号span），只为新增和修改过的书籍建立索引，
+它们的span编号在沿用的书籍之后，所以chapters中章节的顺序不一定与文献库中的顺序一致。
+
+索引文件结构：
+  - MAGIC             8 bytes
+  - header length     uint64, little-endian
+  - header            json, utf-8
+    - version         索引版本
+    - books           [{'id': book id, 'signature': BookFile.get_signature()}]
+    - chapters        [[book id, chapter id, 第一个span的全局序号, span数量]]
+    - span_count      span总数
+    - posting_count   所有posting的长度之和
+    - entry_count     所有gram出现的次数之和
+    - grams           {gram: [posting的起始位置, posting的长度, 出现位置的起始位置, 出现的次数]}
+  - postings          uint32, little-endian，每一个gram对应一段升序的span全局序号，每一个span一项
+  - occurrences       uint32, little-endian，每一个gram对应一段span全局序号，每一次出现一项，按照span、位置升序排列
+  - positions         uint32, little-endian，与occurrences一一对应，gram在span中出现的位置
+"""
+
+import os
+import sys
+import uuid
+import json
+import mmap
+import struct
+import bisect
+import logging
+import pathlib
+import operator
+
+from array import array
+from typing import Union, List, Dict, Tuple, Set, Iterator
+
+from .docbook_core import Division, DivisionType
+from .docbook_span import get_chapter_spans
+from query import Query, normalize_text, get_fold_table_hash
+
+logger = logging.getLogger('docbook.index')
+
+# posting集合的值：(span集合, 是否为补集, 是否精确)
+# - 是否为补集为True时，表示的集合为：全体span - span集合。
+# - 是否精确为False时，表示的集合是实际命中集合的超集，这时不能对其求补集。
+# 普通文本的关键字在最后附加关键字本身：(span集合, False, 是否精确, 关键字)，NEAR/BEFORE用它读取位置列表。
+PostingValue = Tuple[Set[int], bool, bool]
+
+class BookIndex(object):
+  """
+  文献库的n-gram倒排索引。
+  """
+
+  MAGIC = b'DBIDX\x00\x00\x01'
+  VERSION = 4
+
+  def __init__(self):
+    self._books: List[Dict] = []
+    self._chapters: List[Tuple[uuid.UUID, uuid.UUID, int, int]] = []
+    self._chapter_bases: List[int] = []
+    self._span_count: int = 0
+    # 建立索引时折叠表的hash，折叠表改变后索引失效
+    self._fold: Union[str, None] = None
+    # 新建的索引，posting保存在内存中：{gram: (去重的span全局序号, 每一次出现的span全局序号, 位置)}
+    self._memory_postings: Union[Dict[str, Tuple[array, array, array]], None] = None
+    # 从磁盘载入的索引，posting通过mmap按需读取
+    self._grams: Union[Dict[str, Tuple[int, int, int, int]], None] = None
+    self._mmap: Union[mmap.mmap, None] = None
+    self._postings_offset: int = 0
+    self._occurrences_offset: int = 0
+    self._positions_offset: int = 0
+
+  @property
+  def span_count(self) -> int:
+    return self._span_count
+
+  @property
+  def chapter_count(self) -> int:
+    return len(self._chapters)
+
+  @property
+  def gram_count(self) -> int:
+    return len(self._memory_postings) if self._memory_postings is not None else len(self._grams)
+
+  @staticmethod
+  def get_grams(text: str) -> Set[str]:
+    """
+    输出文本中所有的单字和双字。
+    """
+    grams = set(text)
+    grams.update(text[i : i + 2] for i in range(len(text) - 1))
+    return grams
+
+  @classmethod
+  def build(self, dbarchive: 'BookArchive', previous: Union['BookIndex', None] = None) -> 'BookIndex':
+    """
+    为文献库建立索引。对于没有载入的章节，建立索引时会临时载入，建立完成后再卸载。
+
+    :param previous: 同一个文献库原来的索引，书籍文件没有变化的书籍沿用其中的posting，不再载入章节。
+    """
+    index = self()
+    postings: Dict[str, Tuple[array, array, array]] = {}
+    span_id = 0
+    if (previous is not None) and (previous._fold == get_fold_table_hash()):
+      span_id = index.__reuse_postings(previous, dbarchive, postings)
+    reused = {book['id'] for book in index._books}
+
+    for dbfile in dbarchive.dbfiles:
+      book = dbfile.book
+      if str(book.id) in reused:
+        continue
+      index._books.append({'id': str(book.id), 'signature': dbfile.get_signature()})
+      for chapter in book.chapters:
+        loaded = chapter.is_load()
+        if not loaded:
+          # 不经过章节缓存，避免挤掉缓存中的章节
+          dbfile._load_chapter(chapter)
+
+        base = span_id
+        for span in get_chapter_spans(chapter):
+          text = span.search_text
+          # 先单字后双字，每一个gram的位置在span中都是升序的
+          for grams in (text, map(operator.add, text, text[1:])):
+            for position, gram in enumerate(grams):
+              posting = postings.get(gram)
+              if posting is None:
+                posting = postings[gram] = (array('I'), array('I'), array('I'))
+              # 同一个span中的出现是连续加入的，只需要和最后一项比较
+              if (len(posting[0]) == 0) or (posting[0][-1] != span_id):
+                posting[0].append(span_id)
+              posting[1].append(span_id)
+              posting[2].append(position)
+          span_id += 1
+
+        if span_id > base:
+          index._chapters.append((book.id, chapter.id, base, span_id - base))
+
+        if not loaded:
+          chapter.unload()
+
+    index._span_count = span_id
+    index._fold = get_fold_table_hash()
+    index._chapter_bases = [chapter[2] for chapter in index._chapters]
+    index._memory_postings = postings
+    logger.info(f"Build index: {len(index._chapters)} chapters ({len(reused)} books reused), {span_id} spans, {len(postings)} grams.")
+    return index
+
+  def __reuse_postings(self, previous: 'BookIndex', dbarchive: 'BookArchive', postings: Dict[str, Tuple[array, array, array]]) -> int:
+    """
+    把previous中书籍文件没有变化的书籍的章节和posting复制到本索引，span按照原来的顺序重新连续编号。
+
+    :return: 沿用的span数量，即之后新建立索引的span的起始序号。
+    """
+    signatures = {str(dbfile.book.id): dbfile.get_signature() for dbfile in dbarchive.dbfiles}
+    kept = {book['id'] for book in previous._books if signatures.get(book['id']) == book['signature']}
+    self._books = [book for book in previous._books if book['id'] in kept]
+
+    # 原来的span全局序号到新的序号，去掉的span为-1
+    remap = array('q', [-1]) * previous._span_count
+    span_id = 0
+    for book_id, chapter_id, base, count in previous._chapters:
+      if str(book_id) in kept:
+        self._chapters.append((book_id, chapter_id, span_id, count))
+        remap[base : base + count] = array('q', range(span_id, span_id + count))
+        span_id += count
+    if span_id == 0:
+      return 0
+    # 没有去掉任何span时，编号不变，直接复制
+    unchanged = (span_id == previous._span_count)
+
+    for gram, (posting, occurrences, positions) in previous.__iter_postings():
+      if unchanged:
+        postings[gram] = (array('I', posting), array('I', occurrences), array('I', positions))
+        continue
+      posting = array('I', [remap[old_id] for old_id in posting if remap[old_id] >= 0])
+      if len(posting) == 0:
+        continue
+      kept_occurrences = array('I')
+      kept_positions = array('I')
+      for old_id, position in zip(occurrences, positions):
+        new_id = remap[old_id]
+        if new_id >= 0:
+          kept_occurrences.append(new_id)
+          kept_positions.append(position)
+      postings[gram] = (posting, kept_occurrences, kept_positions)
+    return span_id
+
+  def __iter_postings(self) -> Iterator[Tuple[str, Tuple[array, array, array]]]:
+    """
+    输出所有gram的(去重的span全局序号, 每一次出现的span全局序号, 位置)。
+    """
+    if self._memory_postings is not None:
+      yield from self._memory_postings.items()
+      return
+    for gram, item in self._grams.items():
+      yield gram, (self.__read_array(self._postings_offset, item[0], item[1]), self.__read_array(self._occurrences_offset, item[2], item[3]), self.__read_array(self._positions_offset, item[2], item[3]))
+
+  def save(self, path: str):
+    """
+    将内存中的索引写入磁盘。
+    """
+    if self._memory_postings is None:
+      raise ValueError("Only a built BookIndex can be saved.")
+
+    grams = {}
+    offset = 0
+    entry_offset = 0
+    for gram, (posting, occurrences, _) in self._memory_postings.items():
+      grams[gram] = [offset, len(posting), entry_offset, len(occurrences)]
+      offset += len(posting)
+      entry_offset += len(occurrences)
+
+    header = json.dumps({
+        'version': BookIndex.VERSION,
+        'fold': self._fold,
+        'books': self._books,
+        'chapters': [[str(book_id), str(chapter_id), base, count] for book_id, chapter_id, base, count in self._chapters],
+        'span_count': self._span_count,
+        'posting_count': offset,
+        'entry_count': entry_offset,
+        'grams': grams
+    }, ensure_ascii = False).encode('utf-8')
+
+    index_path = pathlib.Path(path)
+    index_path.parent.mkdir(parents = True, exist_ok = True)
+    # 先写入临时文件再替换，已经载入的索引通过mmap读取原来的文件，不受影响
+    temp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, 'wb') as file:
+      file.write(BookIndex.MAGIC)
+      file.write(struct.pack('<Q', len(header)))
+      file.write(header)
+      for column in range(3):
+        for posting in self._memory_postings.values():
+          posting = posting[column]
+          if sys.byteorder == 'big':
+            posting = array('I', posting)
+            posting.byteswap()
+          posting.tofile(file)
+      file.close()
+    os.replace(temp_path, index_path)
+
+    logger.info(f"Save index: '{path}'.")
+
+  @classmethod
+  def load(self, path: str) -> 'BookIndex':
+    """
+    从磁盘载入索引。posting部分不会读入内存，而是在查询时通过mmap按需读取。
+    """
+    index = self()
+    with open(path, 'rb') as file:
+      if file.read(len(BookIndex.MAGIC)) != BookIndex.MAGIC:
+        raise ValueError(f"'{path}' isn't a BookIndex file.")
+      header_length, = struct.unpack('<Q', file.read(8))
+      header = json.loads(file.read(header_length).decode('utf-8'))
+      if header.get('version') != BookIndex.VERSION:
+        raise ValueError(f"Unsupported BookIndex version {header.get('version')}.")
+      index._mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+      file.close()
+
+    index._postings_offset = len(BookIndex.MAGIC) + 8 + header_length
+    index._occurrences_offset = index._postings_offset + header['posting_count'] * 4
+    index._positions_offset = index._occurrences_offset + header['entry_count'] * 4
+    index._fold = header.get('fold')
+    index._books = header['books']
+    index._chapters = [(uuid.UUID(book_id), uuid.UUID(chapter_id), base, count) for book_id, chapter_id, base, count in header['chapters']]
+    index._chapter_bases = [chapter[2] for chapter in index._chapters]
+    index._span_count = header['span_count']
+    index._grams = header['grams']
+    logger.info(f"Load index: '{path}', {len(index._chapters)} chapters, {index._span_count} spans.")
+    return index
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+      self._mmap = None
+
+  def is_up_to_date(self, dbarchive: 'BookArchive') -> bool:
+    """
+    判断索引是否和文献库中的书籍文件、当前的折叠表一致，书籍的顺序不影响索引。
+    """
+    if self._fold != get_fold_table_hash():
+      return False
+    books = {str(dbfile.book.id): dbfile.get_signature() for dbfile in dbarchive.dbfiles}
+    return (len(books) == len(self._books)) and all(books.get(book['id']) == book['signature'] for book in self._books)
+
+  def __read_array(self, offset: int, start: int, length: int) -> array:
+    start = offset + start * 4
+    values = array('I')
+    values.frombytes(self._mmap[start : start + length * 4])
+    if sys.byteorder == 'big':
+      values.byteswap()
+    return values
+
+  def get_posting(self, gram: str) -> Set[int]:
+    """
+    输出包含gram的span全局序号集合，只读取去重的posting，不读取每一次出现的位置。
+    """
+    if self._memory_postings is not None:
+      posting = self._memory_postings.get(gram)
+      return set() if posting is None else set(posting[0])
+
+    item = self._grams.get(gram)
+    if item is None:
+      return set()
+    return set(self.__read_array(self._postings_offset, item[0], item[1]))
+
+  def get_gram_positions(self, gram: str) -> Tuple[array, array]:
+    """
+    输出gram每一次出现的位置：(span全局序号, 在span中的位置)，两个数组一一对应。
+    """
+    if self._memory_postings is not None:
+      posting = self._memory_postings.get(gram)
+      return (array('I'), array('I')) if posting is None else posting[1:]
+
+    item = self._grams.get(gram)
+    if item is None:
+      return array('I'), array('I')
+    return self.__read_array(self._occurrences_offset, item[2], item[3]), self.__read_array(self._positions_offset, item[2], item[3])
+
+  def get_word_positions(self, word: str, spans: Union[Set[int], None] = None) -> Dict[int, List[int]]:
+    """
+    输出普通文本关键字在span中出现的起始位置：{span全局序号: [升序的位置]}。
+    多个字的关键字由其中所有的双字按照相对位置对齐得到，结果是精确的。关键字先归一化，与索引中的文本一致。
+
+    :param spans: 只输出这些span中的位置，为None时输出全部。
+    """
+    word = normalize_text(word)
+    grams = [word] if len(word) == 1 else [word[i : i + 2] for i in range(len(word) - 1)]
+    starts = None
+    for offset, gram in enumerate(grams):
+      # 每一次出现编码为一个整数：span全局序号 << 32 | 关键字的起始位置
+      gram_starts = set()
+      for span_id, position in zip(*self.get_gram_positions(gram)):
+        if (position >= offset) and ((spans is None) or (span_id in spans)):
+          gram_starts.add((span_id << 32) | (position - offset))
+      starts = gram_starts if starts is None else (starts & gram_starts)
+      if len(starts) == 0:
+        break
+
+    positions: Dict[int, List[int]] = {}
+    for start in sorted(starts):
+      positions.setdefault(start >> 32, []).append(start & 0xFFFFFFFF)
+    return positions
+
+  def __term_value(self, word: str) -> PostingValue:
+    # 正则表达式无法通过索引缩小范围，认为全体span都是候选
+    if not Query.is_literal_key(word):
+      return (set(), True, False)
+
+    if len(word) == 1:
+      return (self.get_posting(word), False, True, word)
+
+    grams = {word[i : i + 2] for i in range(len(word) - 1)}
+    spans = None
+    for posting in sorted((self.get_posting(gram) for gram in grams), key = len):
+      spans = posting if spans is None else (spans & posting)
+      if len(spans) == 0:
+        break
+    return (spans, False, len(word) == 2, word)
+
+  def __near_value(self, a: PostingValue, b: PostingValue, distance: int, ordered: bool) -> PostingValue:
+    """
+    两个操作数都是普通文本关键字时，合并两者在共同span中的位置列表，得到精确的span集合；
+    否则按照AND计算（超集）。
+    """
+    if (len(a) < 4) or (len(b) < 4):
+      return BookIndex.__and_value(a, b)
+
+    spans = a[0] & b[0]
+    if len(spans) == 0:
+      return (spans, False, True)
+    a_word, b_word = a[3], b[3]
+    a_positions = self.get_word_positions(a_word, spans)
+    b_positions = self.get_word_positions(b_word, set(a_positions))
+
+    result = set()
+    for span_id, b_starts in b_positions.items():
+      for a_start in a_positions[span_id]:
+        a_end = a_start + len(a_word)
+        # 第二个关键字的起始位置范围，与QueryNear一致
+        low = a_end if ordered else a_start - distance - len(b_word)
+        index = bisect.bisect_left(b_starts, low)
+        if (index < len(b_starts)) and (b_starts[index] <= a_end + distance):
+          result.add(span_id)
+          break
+    return (result, False, True)
+
+  @staticmethod
+  def __not_value(value: PostingValue) -> PostingValue:
+    spans, negated, exact = value[:3]
+    if exact:
+      return (spans, not negated, True)
+    else:
+      return (set(), True, False)
+
+  @staticmethod
+  def __and_value(a: PostingValue, b: PostingValue) -> PostingValue:
+    exact = a[2] and b[2]
+    if not a[1] and not b[1]:
+      return (a[0] & b[0], False, exact)
+    elif not a[1]:
+      return (a[0] - b[0], False, exact)
+    elif not b[1]:
+      return (b[0] - a[0], False, exact)
+    else:
+      return (a[0] | b[0], True, exact)
+
+  @staticmethod
+  def __or_value(a: PostingValue, b: PostingValue) -> PostingValue:
+    exact = a[2] and b[2]
+    if not a[1] and not b[1]:
+      return (a[0] | b[0], False, exact)
+    elif not a[1]:
+      return (b[0] - a[0], True, exact)
+    elif not b[1]:
+      return (a[0] - b[0], True, exact)
+    else:
+      return (a[0] & b[0], True, exact)
+
+  def candidates(self, q: Union[Query, str]) -> Union[Dict[uuid.UUID, Set[int]], None]:
+    """
+    通过索引找出可能符合查询条件的span。
+
+    :param q: 查询对象。
+    :return:
+      dict，chapter id对应章节中候选span的序号集合，不在dict中的章节没有候选span。
+      如果索引无法缩小搜索范围（比如：查询条件为'not 君子'），返回None，需要搜索全部章节。
+    """
+    if isinstance(q, str):
+      q = Query(q)
+
+    value = q.reduce_query(self.__term_value, BookIndex.__not_value, BookIndex.__and_value, BookIndex.__or_value, near_func = self.__near_value)
+    if value is None:
+      return {}
+    spans, negated = value[0], value[1]
+    if negated:
+      return None
+
+    result: Dict[uuid.UUID, Set[int]] = {}
+    for span_id in spans:
+      _, chapter_id, base, _ = self._chapters[bisect.bisect_right(self._chapter_bases, span_id) - 1]
+      chapter_spans = result.get(chapter_id)
+      if chapter_spans is None:
+        chapter_spans = result[chapter_id] = set()
+      chapter_spans.add(span_id - base)
+    return result
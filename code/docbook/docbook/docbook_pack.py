@@ -0,0 +1,134 @@
+"""
+docbook_pack.py
+
+docbook_pack定义书籍的二进制打包文件（PACKED_FILE，后缀为'.dbpack'）。
+一本书籍的目录和所有章节保存在一个文件中，打开书籍时只解码目录，章节内容在需要时按照偏移表直接读取，单独解码。
+
+文件结构（整数都是little-endian）：
+  - header          文件头：magic 'DBPK'、版本号、压缩方式、目录字节数、数据块数量
+  - block table     数据块偏移表：每一个数据块的偏移、字节数、解压后的字节数和名称
+  - toc             书籍的目录json（章节不包含内容），与book.json一致
+  - blocks          数据块：章节json（与chapters/chapter_NNN.json一致），以及附加内容（图片等）的原始数据
+数据块的名称为章节或者附加内容的ref，与PARTS_FILE中的相对路径一致，两种格式可以无损互相转换。
+"""
+
+import zlib
+import struct
+import logging
+
+from typing import Union, List, Dict, Tuple, BinaryIO
+
+from .docbook_core import DecoderError
+
+logger = logging.getLogger('docbook.pack')
+
+PACKED_FILE_MAGIC = b'DBPK'
+PACKED_FILE_VERSION = 1
+
+class PackedCompression(object):
+  NONE = 0
+  ZLIB = 1
+
+# magic, version, compression, toc字节数, 数据块数量
+HEADER_STRUCT = struct.Struct('<4sHHII')
+# 偏移, 字节数, 解压后的字节数, 名称字节数
+BLOCK_STRUCT = struct.Struct('<QIIH')
+
+class PackedBlock(object):
+  """
+  数据块在文件中的位置。
+  """
+  __slots__ = ('name', 'offset', 'length', 'raw_length')
+
+  def __init__(self, name: str, offset: int = 0, length: int = 0, raw_length: int = 0):
+    self.name: str = name
+    self.offset: int = offset
+    self.length: int = length
+    self.raw_length: int = raw_length
+
+  def __repr__(self) -> str:
+    return f"PackedBlock({repr(self.name)}, {self.offset}, {self.length}, {self.raw_length})"
+
+
+def compress_block(data: bytes, compression: int) -> bytes:
+  return zlib.compress(data) if compression == PackedCompression.ZLIB else data
+
+def decompress_block(data: bytes, compression: int) -> bytes:
+  try:
+    return zlib.decompress(data) if compression == PackedCompression.ZLIB else data
+  except zlib.error as e:
+    raise DecoderError(f"Invalid packed block data: {e}") from e
+
+def read_exactly(file: BinaryIO, length: int, name: str) -> bytes:
+  """
+  读取指定长度的数据，文件被截断时抛出DecoderError。
+  """
+  data = file.read(length)
+  if len(data) < length:
+    raise DecoderError(f"Truncated packed file {name}")
+  return data
+
+def write_packed_file(file: BinaryIO, toc: bytes, blocks: List[Tuple[str, bytes]], compression: int = PackedCompression.ZLIB):
+  """
+  写入打包文件。数据块按照blocks的顺序压缩后直接写入，最后再回写偏移表，file必须可以seek。
+
+  :param toc: 书籍目录的json。
+  :param blocks: [(数据块名称, 数据块内容)]。
+  """
+  names = [name.encode('utf-8') for name, _ in blocks]
+  toc = compress_block(toc, compression)
+  table_length = sum(BLOCK_STRUCT.size + len(name) for name in names)
+
+  start = file.tell()
+  file.write(HEADER_STRUCT.pack(PACKED_FILE_MAGIC, PACKED_FILE_VERSION, compression, len(toc), len(blocks)))
+  table_offset = file.tell()
+  file.write(b'\0' * table_length)
+  file.write(toc)
+
+  table = []
+  for name, (_, content) in zip(names, blocks):
+    stored = compress_block(content, compression)
+    table.append(BLOCK_STRUCT.pack(file.tell() - start, len(stored), len(content), len(name)) + name)
+    file.write(stored)
+
+  end = file.tell()
+  file.seek(table_offset)
+  file.write(b''.join(table))
+  file.seek(end)
+
+def read_packed_header(file: BinaryIO) -> Tuple[int, bytes, Dict[str, PackedBlock]]:
+  """
+  读取打包文件的文件头、数据块偏移表和目录，不读取数据块。
+
+  :return: (压缩方式, 书籍目录的json, {数据块名称: 数据块})。
+  """
+  header = file.read(HEADER_STRUCT.size)
+  if len(header) < HEADER_STRUCT.size:
+    raise DecoderError("Invalid packed file header")
+  magic, version, compression, toc_length, block_count = HEADER_STRUCT.unpack(header)
+  if magic != PACKED_FILE_MAGIC:
+    raise DecoderError("Invalid packed file magic")
+  if version > PACKED_FILE_VERSION:
+    raise DecoderError(f"Unsupported packed file version {version}")
+
+  blocks: Dict[str, PackedBlock] = {}
+  for _ in range(block_count):
+    offset, length, raw_length, name_length = BLOCK_STRUCT.unpack(read_exactly(file, BLOCK_STRUCT.size, "block table"))
+    try:
+      name = read_exactly(file, name_length, "block table").decode('utf-8')
+    except UnicodeDecodeError as e:
+      raise DecoderError(f"Invalid packed block name: {e}") from e
+    blocks[name] = PackedBlock(name, offset, length, raw_length)
+
+  toc = decompress_block(read_exactly(file, toc_length, "toc"), compression)
+  return compression, toc, blocks
+
+def read_packed_block(file: BinaryIO, block: PackedBlock, compression: int) -> bytes:
+  """
+  读取并解压一个数据块。
+  """
+  file.seek(block.offset)
+  data = file.read(block.length)
+  if len(data) < block.length:
+    raise DecoderError(f"Truncated packed block {block.name}")
+  return decompress_block(data, compression)
@@ -6,17 +6,24 @@ docbook_query搜索docbook对象内容，并将搜索结果保存在QueryResult
 
 import re
 import json
+import uuid
+import fnmatch
 import logging
 
-from typing import Union, List, Dict, Tuple
+from typing import Union, List, Dict, Tuple, Set, Iterator, Callable
 from enum import Enum
 
 from concurrent.futures import ThreadPoolExecutor
 import threading
+import collections
 
-from query import Query, QueryResults, QueryResultPiece
+from query import Query, QueryResults, QueryResultPiece, KeywordMatcher, normalize_text
 from docbook import Book, Division, ContentPiece, DivisionType 
-from utils import remove_html_tags
+from .docbook_span import ChapterSpan, get_chapter_spans, get_loaded_chapter_spans, get_chapter_signature
+from .docbook_signature import ChapterSignature
+from .docbook_index import BookIndex
+from .docbook_field import BookFieldIndex, split_field_tree, get_field_spans
+from .docbook_context import SearchContext
 
 logger = logging.getLogger('docbook.query')
 
@@ -39,61 +46,96 @@ class BookQuery(object):
   QUERY_MAX_RESULT_NUM: int = 100
   QUERY_THREAD_NUM: int = 10
 
-  # Global variables for result tracking
-  global_result_count = 0
-  result_count_lock = threading.Lock()
-  stop_search_event = threading.Event()
+  # 载入章节内容的函数，输入章节路径，一般为BookArchive.load_chapter_directory
+  # 文献库动态载入章节时，搜索之前用它载入没有载入的章节；为None时只搜索已经载入的章节
+  # 搜索的上下文给出chapter_load_func时（比如：服务搜索的是某一代文献库），使用上下文的函数
+  CHAPTER_LOAD_FUNC: Union[Callable[[List[Union[Division, Book]]], bool], None] = None
+
+  # 搜索前用章节的字符签名排除不可能命中的章节
+  USE_SIGNATURE: bool = True
+
+  # 书籍范围中的一项：前缀（'+'、'-'），书籍id或者书名
+  BOOK_LIST_PATTERN = re.compile(r'([+\-]?)([^\s,，+]+)')
 
   @staticmethod
-  def highlights(text, format: int = PLAIN_TEXT, keys: List[str] = [], strong = False, color_map = None, surround = None):    
+  def highlights(text, format: int = PLAIN_TEXT, keys: List[str] = [], strong = False, color_map = None, surround = None, matcher: KeywordMatcher = None, matches: List[Tuple[int, int]] = None, span: Union[ChapterSpan, None] = None):
+    """
+    对text中的关键字进行高亮。
+    如果给出了matcher（一般为Query.matcher），高亮matcher.keys，matches为搜索时已经得到的匹配结果，不用再次扫描text；
+    否则高亮keys。关键字在归一化的text上匹配（比如：'于'也高亮'於'），高亮的是原文中的文字。
+    如果给出了text所在的span（见get_chapter_span），在span包含标签的原始内容上高亮，标签保留，
+    被标签分开的关键字分段高亮；surround仍然按照text的字数计算。
+    """
     if (format != BookQuery.HTML_TEXT) and (format != BookQuery.MARKDOWN_TEXT) and (format != BookQuery.MARK_TEXT):
       format = BookQuery.PLAIN_TEXT   
     if ((format == BookQuery.PLAIN_TEXT) and (surround is None)):
       return text
-    if (keys is None) or (len(keys) == 0):
+    if matcher is None:
+      if (keys is None) or (len(keys) == 0):
+        return text
+      matcher = KeywordMatcher([normalize_text(key) for key in keys])
+    if matches is None:
+      matches = matcher.search(normalize_text(text))
+
+    spans = matcher.highlight_spans(matches)
+    if len(spans) == 0:
       return text
     
     if color_map is None:
       color_map = BookQuery.COLOR_MAP
 
-    pattern = '|'.join(re.escape(key) for key in keys)
-    pattern = f'({pattern})'
-    matches = re.finditer(pattern, text)
-    
-    last_match = None
+    # 输出的内容，以及text中的位置在输出内容中的位置：关键字之前的内容到该位置为止，关键字之后的内容从该位置开始
+    if (span is not None) and (span.text == text) and (span._segments is not None):
+      source = span.get_content()
+      get_end = lambda position: len(source) if position >= len(text) else span.get_content_offset(position) - span.offset
+      get_start = lambda position: 0 if position <= 0 else span.get_content_offset(position - 1) - span.offset + 1
+      get_ranges = span.get_content_ranges
+    else:
+      source = text
+      get_end = get_start = lambda position: position
+      get_ranges = lambda start, end: [(start, end)]
+
+    last_end = None
     highlighted_text = ''
-    for match in matches:
-      keyword = match.group(0)
-      index = keys.index(keyword)
+    for match_start, match_end, index in spans:
       color = color_map[index % len(color_map)]
 
-      if format == BookQuery.HTML_TEXT or format == BookQuery.MARKDOWN_TEXT:
-        if strong:
-          keyword = f'<span style="color: {color}; font-weight: bold;">{keyword}</span>'
-        else:
-          keyword = f'<span style="color: {color};">{keyword}</span>'
-      elif format == BookQuery.MARK_TEXT:
-          keyword = f'<mark>{keyword}</mark>'
-
-      if last_match is None:
-        start = max(0, match.start() - surround) if surround else 0
-        before_text = text[start : match.start()]
+      # 关键字被标签分开时，标签不放在高亮的标记之内
+      keyword = ''
+      last_range_end = None
+      for range_start, range_end in get_ranges(match_start, match_end):
+        if last_range_end is not None:
+          keyword = keyword + source[last_range_end : range_start]
+        piece = source[range_start : range_end]
+        if format == BookQuery.HTML_TEXT or format == BookQuery.MARKDOWN_TEXT:
+          if strong:
+            piece = f'<span style="color: {color}; font-weight: bold;">{piece}</span>'
+          else:
+            piece = f'<span style="color: {color};">{piece}</span>'
+        elif format == BookQuery.MARK_TEXT:
+            piece = f'<mark>{piece}</mark>'
+        keyword = keyword + piece
+        last_range_end = range_end
+
+      if last_end is None:
+        start = max(0, match_start - surround) if surround else 0
+        before_text = source[get_start(start) : get_end(match_start)]
         if start > 0:
           before_text = '...' + before_text
         highlighted_text = highlighted_text + before_text + keyword
       else:
-        between = (match.start() - last_match.end())
+        between = (match_start - last_end)
         if surround is None or between < 2 * surround + 3:
-          highlighted_text = highlighted_text + text[last_match.end() : match.start()] + keyword
+          highlighted_text = highlighted_text + source[get_start(last_end) : get_end(match_start)] + keyword
         else:
-          after_text = text[last_match.end() : last_match.end() + surround]
+          after_text = source[get_start(last_end) : get_end(last_end + surround)]
           after_text = after_text + '...'
-          before_text = text[match.start() - surround : match.start()]
+          before_text = source[get_start(match_start - surround) : get_end(match_start)]
           highlighted_text = highlighted_text + after_text + before_text + keyword
-      last_match = match
+      last_end = match_end
 
-    end = min(len(text), last_match.end() + surround) if surround else len(text)
-    after_text = text[last_match.end() : end]
+    end = min(len(text), last_end + surround) if surround else len(text)
+    after_text = source[get_start(last_end) : get_end(end)]
     if end < len(text):
         after_text = after_text + '...'
     
@@ -142,64 +184,224 @@ class BookQuery(object):
     return output_string
 
   @staticmethod
-  def __search_in_chapter_section(q: Query, content_piece: ContentPiece, limit: int = None, annotation: bool = False) -> List[Tuple[str, float]]:
-    if (annotation == False) and (content_piece.type == DivisionType.ANNOTATION):
+  def search_hits_in_chapter(q: Query, chapter: Division, annotation: bool = False, spans: Union[Set[int], None] = None, context: Union[SearchContext, None] = None, chapter_spans: Union[List[ChapterSpan], None] = None) -> Union[List[Tuple[str, float, List[Tuple[int, int]], int]], None]:
+    """
+    在一个已经load的章节中搜索，输出命中的span：[(span文本, 相关度, 关键字匹配结果, span在章节中的序号)]。
+
+    :param q: 查询对象。
+    :param chapter: 章节对象。
+    :param annotation: 是否搜索注释。查询语句中有段落的字段条件时，由字段条件决定搜索的范围，包括注释。
+    :param spans: 只搜索章节中这些序号的span（一般为索引给出的候选span），为None时搜索全部span。
+    :param context: 搜索的上下文，上下文中止时中止搜索，返回None。
+    :param chapter_spans: 章节的span表，为None时使用get_chapter_spans(chapter)。
+    """
+    if (q.query_tree is None) and (q.field_tree is None):
       return []
+    if chapter_spans is None:
+      chapter_spans = get_chapter_spans(chapter)
+    spans, annotation = BookQuery.__apply_field_spans(q, chapter, annotation, spans, chapter_spans)
 
-    hits: List[{str, float}] = []
-
-    #logger.info(f"search string: {q.query_string}, content: {content_piece.content}")
-    # 检索范围定义为一个正文段落
+    hits: List[Tuple[str, float, List[Tuple[int, int]], int]] = []
+    # 检索范围定义为一个正文段落中以分行符号分隔的一段文本
     # TODO: 值得商榷，不同的范围定义，能搜索到的信息也是不一样的。
     #       关于语义的搜索，可以考虑采用LLM来进行搜索匹配
-    spans = content_piece.content.split('\n')
-    for span in spans:
-      span = remove_html_tags(span)
-      result = q.excute_query(span)
-      if (result == True):
-        hits.append((span, 1.0))
-
-    for index, content_piece in enumerate(content_piece.content_pieces):
-      hits += BookQuery.__search_in_chapter_section(q, content_piece, limit, annotation)
-    
+    # spans不为None时，只确认索引给出的候选span
+    for span in BookQuery.__iter_candidate_spans(chapter_spans, spans):
+      if (context is not None) and context.is_stopped():
+        return None
+      if (annotation == False) and span.in_annotation:
+        continue
+      # 在归一化的文本上匹配，命中的结果中保存原文和关键字的匹配结果，高亮时不用再次扫描
+      matches = q.match_query(span.search_text, normalized = True)
+      if matches is not None:
+        hits.append((span.text, 1.0, matches, span.index))
+
     return hits
 
   @staticmethod
-  def __search_in_chapter(q: Union[Query, str], directory: List[Union[Division, Book]], limit: int = None, annotation: bool = False) -> Union[QueryResultPiece, None]:
-    if (q is None) or (directory is None) or (len(directory) == 0) or BookQuery.stop_search_event.is_set():
+  def count_hits_in_chapter(q: Query, chapter: Division, annotation: bool = False, spans: Union[Set[int], None] = None, context: Union[SearchContext, None] = None, chapter_spans: Union[List[ChapterSpan], None] = None) -> Union[int, None]:
+    """
+    统计一个已经load的章节中命中的span数量，与search_hits_in_chapter命中的span一致，但只判断查询条件，不输出关键字的匹配结果。
+    参数与search_hits_in_chapter一致，上下文中止时返回None。
+    """
+    tree = q.query_tree
+    if (tree is None) and (q.field_tree is None):
+      return 0
+    if chapter_spans is None:
+      chapter_spans = get_chapter_spans(chapter)
+    spans, annotation = BookQuery.__apply_field_spans(q, chapter, annotation, spans, chapter_spans)
+
+    count = 0
+    for span in BookQuery.__iter_candidate_spans(chapter_spans, spans):
+      if (context is not None) and context.is_stopped():
+        return None
+      if (annotation == False) and span.in_annotation:
+        continue
+      # 只有字段条件时，符合字段条件的span都命中
+      if (tree is None) or tree.evaluate(span.search_text):
+        count += 1
+
+    return count
+
+  @staticmethod
+  def __apply_field_spans(q: Query, chapter: Division, annotation: bool, spans: Union[Set[int], None], chapter_spans: List[ChapterSpan]) -> Tuple[Union[Set[int], None], bool]:
+    """
+    用段落的字段条件缩小需要搜索的span，输出(需要搜索的span, 是否搜索注释)。
+    """
+    if q.field_tree is None:
+      return spans, annotation
+    _, content_piece_tree = split_field_tree(q)
+    if content_piece_tree is None:
+      return spans, annotation
+    field_spans = get_field_spans(content_piece_tree, chapter, chapter_spans)
+    return (field_spans if spans is None else (spans & field_spans)), True
+
+  @staticmethod
+  def parse_book_list(book_list: Union[str, None], dbooks: List[Book]) -> Union[Set[uuid.UUID], None]:
+    """
+    将书籍范围解码为书籍id的集合。书籍范围由逗号或者空格分隔的多项组成，每一项为书籍id或者书名（可以使用通配符*?[]），
+    以'+'开始（或者没有前缀）表示只搜索这些书籍，以'-'开始表示排除这些书籍。
+    URL中的'+'会被解码为空格，因为没有前缀的项也是'+'，所以结果不变。
+
+    示例:
+      >>> BookQuery.parse_book_list("+周易,+論語", dbooks)       # 只搜索周易、論語
+      >>> BookQuery.parse_book_list("-*注疏 -荀子", dbooks)      # 排除书名以注疏结尾的书籍和荀子
+
+    :return: 需要搜索的书籍id集合，没有给出范围时为None（搜索全部书籍）。
+    """
+    if book_list is None:
       return None
-    if isinstance(q, str):
-      q = Query(q)
+    includes = []
+    excludes = []
+    for match in BookQuery.BOOK_LIST_PATTERN.finditer(book_list):
+      (excludes if match.group(1) == '-' else includes).append(match.group(2))
+    if (len(includes) == 0) and (len(excludes) == 0):
+      return None
+
+    book_ids = {book.id: book for book in dbooks}
+    def select(items: List[str]) -> Set[uuid.UUID]:
+      selected = set()
+      for item in items:
+        try:
+          id = uuid.UUID(item)
+        except ValueError:
+          id = None
+        if id is not None:
+          if id in book_ids:
+            selected.add(id)
+          continue
+        selected.update(book.id for book in dbooks if (book.title is not None) and fnmatch.fnmatchcase(book.title.title, item))
+      return selected
+
+    result = select(includes) if len(includes) > 0 else set(book_ids)
+    return result - select(excludes)
+
+  @staticmethod
+  def filter_by_books(directorys: List[List[Union[Division, Book]]], books: Union[Set[uuid.UUID], None]) -> List[List[Union[Division, Book]]]:
+    """
+    只保留directorys中books（书籍id集合）中书籍的章节，保持原来的顺序；books为None时不缩小。
+    """
+    if books is None:
+      return directorys
+    return [directory for directory in directorys if directory[0].id in books]
+
+  @staticmethod
+  def filter_by_fields(q: Query, directorys: List[List[Union[Division, Book]]], fields: Union[BookFieldIndex, None] = None) -> List[List[Union[Division, Book]]]:
+    """
+    用书籍、卷章的字段条件排除directorys中不符合条件的章节，保持原来的顺序。
 
+    :param fields: 文献库的字段索引（BookArchive.get_field_index），为None时用directorys中的书籍临时建立。
+    """
+    if q.field_tree is None:
+      return directorys
+    book_tree, _ = split_field_tree(q)
+    if book_tree is None:
+      return directorys
+    if fields is None:
+      fields = BookFieldIndex.build({directory[0].id: directory[0] for directory in directorys}.values())
+    result = fields.filter_directorys(book_tree, directorys)
+    logger.debug(f"Field filter '{q.query_string}': {len(result)}/{len(directorys)} chapters.")
+    return result
+
+  @staticmethod
+  def __iter_candidate_spans(chapter_spans: List[ChapterSpan], spans: Union[Set[int], None] = None) -> Iterator[ChapterSpan]:
+    """
+    按照章节中的顺序，输出章节span表中需要确认的span。spans不为None时，直接按照序号取出候选span，不遍历整个章节。
+    """
+    if spans is None:
+      yield from chapter_spans
+    else:
+      for index in sorted(spans):
+        if index < len(chapter_spans):
+          yield chapter_spans[index]
+
+  @staticmethod
+  def filter_by_signature(q: Query, directorys: List[List[Union[Division, Book]]]) -> List[List[Union[Division, Book]]]:
+    """
+    用章节的字符签名排除directorys中不可能符合查询条件的章节，保持原来的顺序。
+    没有签名的章节（动态载入的文献库中还没有载入过的章节）不能排除，仍然需要搜索。
+    """
+    if not BookQuery.USE_SIGNATURE:
+      return directorys
+    match = ChapterSignature.compile_query(q)
+    if match is None:
+      return directorys
+
+    result = []
+    for directory in directorys:
+      chapter = directory[-1]
+      signature = get_chapter_signature(chapter) if isinstance(chapter, Division) else None
+      if (signature is None) or match(signature):
+        result.append(directory)
+    logger.debug(f"Signature filter '{q.query_string}': {len(result)}/{len(directorys)} chapters.")
+    return result
+
+  @staticmethod
+  def __get_chapter(directory: List[Union[Division, Book]], context: SearchContext) -> Tuple[Union[Division, None], List[ChapterSpan]]:
+    """
+    取得需要搜索的章节和它的span表。搜索只使用这里取得的span表，之后章节被章节缓存卸载也不影响这次搜索。
+    章节由context的chapter_load_func载入，没有时使用CHAPTER_LOAD_FUNC。
+    """
     chapter: Division = directory[-1]
     if (isinstance(chapter, Division) == False) or (chapter.type != DivisionType.CHAPTER):
       logger.debug(f"Invaild chapter {chapter}.")
+      return None, []
+    load_func = context.chapter_load_func or BookQuery.CHAPTER_LOAD_FUNC
+    if load_func is None:
+      return chapter, get_chapter_spans(chapter)
+
+    # 章节缓存很小时，刚载入的章节可能在取得span表之前被其他线程挤出缓存，再载入一次
+    for _ in range(3):
+      if load_func(directory) == False:
+        break
+      chapter_spans = get_loaded_chapter_spans(chapter)
+      if chapter_spans is not None:
+        return chapter, chapter_spans
+    logger.error(f"Load chapter '{chapter.title.title}' failed, ref: '{chapter.ref}'.")
+    return None, []
+
+  @staticmethod
+  def __search_in_chapter(q: Query, directory: List[Union[Division, Book]], context: SearchContext, annotation: bool = False, spans: Union[Set[int], None] = None) -> Union[List[Tuple[str, float, List[Tuple[int, int]], int]], None]:
+    if (directory is None) or (len(directory) == 0) or context.is_stopped():
       return None
 
-    hits: List[{str, float}] = []
-    for index, content_piece in enumerate(chapter.divisions):
-      if BookQuery.stop_search_event.is_set():
-        return None
-      if (isinstance(content_piece, ContentPiece) == False):
-        logger.error(f"a Invalid content_piece: {chapter}.")
-        break
-      
-      hits += BookQuery.__search_in_chapter_section(q, content_piece, limit, annotation)
-
-    if len(hits) > 0:
-      with BookQuery.result_count_lock:
-        if limit is not None and BookQuery.global_result_count + len(hits) > limit:
-          BookQuery.stop_search_event.set()
-          hits = hits[:limit - BookQuery.global_result_count]
-        BookQuery.global_result_count += len(hits)
-        #logger.info(f"BookQuery.global_result_count: {BookQuery.global_result_count}")
-        query_results_piece = QueryResultPiece(directory, hits = hits, order = chapter.order)
-      return query_results_piece
-    else:
+    chapter, chapter_spans = BookQuery.__get_chapter(directory, context)
+    if chapter is None:
       return None
+    return BookQuery.search_hits_in_chapter(q, chapter, annotation, spans, context, chapter_spans)
 
   @staticmethod
-  def search_in_chapter(q: Union[Query, str], directory: List[Union[Division, Book]], limit = QUERY_MAX_RESULT_NUM, annotation: bool = False) -> Union[QueryResults, None]:
+  def __count_in_chapter(q: Query, directory: List[Union[Division, Book]], context: SearchContext, annotation: bool = False, spans: Union[Set[int], None] = None) -> int:
+    if (directory is None) or (len(directory) == 0) or context.is_stopped():
+      return 0
+
+    chapter, chapter_spans = BookQuery.__get_chapter(directory, context)
+    if chapter is None:
+      return 0
+    return BookQuery.count_hits_in_chapter(q, chapter, annotation, spans, context, chapter_spans) or 0
+
+  @staticmethod
+  def search_in_chapter(q: Union[Query, str], directory: List[Union[Division, Book]], limit = QUERY_MAX_RESULT_NUM, annotation: bool = False, context: Union[SearchContext, None] = None) -> Union[QueryResults, None]:
     if (q is None) or (directory is None) or (len(directory) == 0):
       return None
     if isinstance(q, str):
@@ -207,19 +409,73 @@ class BookQuery(object):
 
     query_results: QueryResults = QueryResults(q)
 
-    BookQuery.global_result_count = 0
-    BookQuery.stop_search_event.clear()
+    if context is None:
+      context = SearchContext(limit)
 
-    query_results_piece = BookQuery.__search_in_chapter(q, directory, limit, annotation)
-    if query_results_piece is not None:
-      query_results.add_query_result_piece(query_results_piece)
+    hits = BookQuery.__search_in_chapter(q, directory, context, annotation)
+    if hits is not None:
+      hits = hits[:context.take(len(hits))]
+      if len(hits) > 0:
+        query_results.add_query_result_piece(QueryResultPiece(directory, hits = hits, order = directory[-1].order))
     
     # 不主动排序
     #query_results.sort_query_result_piece()
     return query_results
 
   @staticmethod
-  def search_in_chapters(q: Union[Query, str], directorys: List[List[Union[Division, Book]]], limit: int = QUERY_MAX_RESULT_NUM, annotation: bool = False) -> Union[QueryResults, None]:
+  def iter_search_in_chapters(q: Union[Query, str], directorys: List[List[Union[Division, Book]]], limit: Union[int, None] = QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Iterator[QueryResultPiece]:
+    """
+    搜索directorys中的章节，按照章节在directorys中的顺序，流式地输出QueryResultPiece。
+    多个线程预先搜索后面的章节，但最多只领先QUERY_THREAD_NUM * 2个章节，调用者不再取结果时，后面的章节不会被搜索。
+    结果按照输出的顺序计数，达到limit时截断并结束。参数与search_in_chapters一致。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return
+    if isinstance(q, str):
+      q = Query(q)
+
+    # 每一次搜索使用自己的上下文，limit由context计数
+    if context is None:
+      context = SearchContext(limit)
+
+    # 先按照书籍的范围缩小，之后的过滤和搜索都只涉及选中的书籍
+    directorys = BookQuery.filter_by_books(directorys, books)
+    # 通过索引找出候选span，没有候选span的章节不需要搜索
+    candidates = None if index is None else index.candidates(q)
+    if candidates is not None:
+      directorys = [directory for directory in directorys if directory[-1].id in candidates]
+    directorys = BookQuery.filter_by_fields(q, directorys, fields)
+    directorys = BookQuery.filter_by_signature(q, directorys)
+
+    # 使用 ThreadPoolExecutor 搜索章节，futures按照directorys的顺序排列
+    with ThreadPoolExecutor(max_workers = BookQuery.QUERY_THREAD_NUM, thread_name_prefix = 'chapter_searcher') as executor:
+      futures = collections.deque()
+      directory_iter = iter(directorys)
+      try:
+        while True:
+          for directory in directory_iter:
+            futures.append((directory, executor.submit(BookQuery.__search_in_chapter, q, directory, context, annotation, None if candidates is None else candidates[directory[-1].id])))
+            if len(futures) >= BookQuery.QUERY_THREAD_NUM * 2:
+              break
+          if len(futures) == 0:
+            break
+
+          directory, future = futures.popleft()
+          hits = future.result()
+          if (hits is not None) and (len(hits) > 0):
+            # 结果按照顺序计数，limit截断的位置是确定的
+            hits = hits[:context.take(len(hits))]
+            if len(hits) > 0:
+              yield QueryResultPiece(directory, hits = hits, order = directory[-1].order)
+          if context.is_stopped():
+            break
+      finally:
+        # 还没有开始的搜索不再执行
+        for _, future in futures:
+          future.cancel()
+
+  @staticmethod
+  def search_in_chapters(q: Union[Query, str], directorys: List[List[Union[Division, Book]]], limit: int = QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Union[QueryResults, None]:
     """
     The `search_in_chapters` function searches for a query string in chapters and returns the
     results.
@@ -232,6 +488,17 @@ class BookQuery(object):
     return. By default, it is set to `QUERY_MAX_RESULT_NUM`, which is a constant value defined
     elsewhere in the code. You can change the value of `limit` to control the number of search results
     returned
+    :param index: The `index` parameter is an optional `BookIndex` of the archive. If it is given, only
+    the candidate spans found by the index are checked by the query, and chapters without candidate
+    spans are skipped
+    :param context: The `context` parameter is an optional `SearchContext` of this search. It carries
+    the result counter, the cancellation and the deadline of the search, so concurrent searches don't
+    affect each other. If it is not given, a new context with `limit` is created
+    :param fields: The `fields` parameter is an optional `BookFieldIndex` of the archive. It is used
+    for the book fields of the query (title:, author:, dynasty:, category:). If it is not given, a
+    temporary one is built from the books of `directorys`
+    :param books: The `books` parameter is an optional set of book ids (see `parse_book_list`). If it
+    is given, only the chapters of these books are searched, before any other filter is applied
     :return: a QueryResults object.
     """
     if (q is None) or (directorys is None) or (len(directorys) == 0):
@@ -240,47 +507,109 @@ class BookQuery(object):
       q = Query(q)
 
     query_results = QueryResults(q)
+    for query_results_piece in BookQuery.iter_search_in_chapters(q, directorys, limit, annotation, index, context, fields, books):
+      query_results.add_query_result_piece(query_results_piece)
 
-    # Reset global variables
-    BookQuery.global_result_count = 0
-    BookQuery.stop_search_event.clear()
-    
-    # 创建一个锁对象
-    lock = threading.Lock()
+    #query_results.sort_query_result_piece()
+    return query_results
 
-    # 使用 ThreadPoolExecutor 对每个chapters的搜索启动一个线程进行处理
-    with ThreadPoolExecutor(max_workers = BookQuery.QUERY_THREAD_NUM, thread_name_prefix = 'chapter_searcher') as executor:
-      futures = [executor.submit(lambda p: BookQuery.__search_in_chapter(*p), (q, directory, limit, annotation)) for directory in directorys]
-
-      # 等待每个线程执行完毕
-      for future in futures:
-        query_results_piece = future.result()
-        #logger.info(f"query_results_piece.hits: {len(query_results_piece.hits) if query_results_piece is not None else None}")
-        # 避免线程冲突
-        with lock:
-          if query_results_piece is not None:
-            query_results.add_query_result_piece(query_results_piece)
-        if limit is not None:
-          if BookQuery.stop_search_event.is_set() and (query_results.query_result_count >= limit):
-            break
+  @staticmethod
+  def count_in_chapters(q: Union[Query, str], directorys: List[List[Union[Division, Book]]], annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> int:
+    """
+    统计directorys的章节中命中的结果数量，只判断查询条件，不生成命中结果。参数与search_in_chapters一致。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return 0
+    if isinstance(q, str):
+      q = Query(q)
+    if context is None:
+      context = SearchContext()
 
-    #query_results.sort_query_result_piece()
+    directorys = BookQuery.filter_by_books(directorys, books)
+    candidates = None if index is None else index.candidates(q)
+    if candidates is not None:
+      directorys = [directory for directory in directorys if directory[-1].id in candidates]
+    directorys = BookQuery.filter_by_fields(q, directorys, fields)
+    directorys = BookQuery.filter_by_signature(q, directorys)
+
+    with ThreadPoolExecutor(max_workers = BookQuery.QUERY_THREAD_NUM, thread_name_prefix = 'chapter_counter') as executor:
+      return sum(executor.map(lambda directory: BookQuery.__count_in_chapter(q, directory, context, annotation, None if candidates is None else candidates[directory[-1].id]), directorys))
+
+  @staticmethod
+  def search_page_in_chapters(q: Union[Query, str], directorys: List[List[Union[Division, Book]]], start: int = 0, count: Union[int, None] = QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, searcher = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Union[QueryResults, None]:
+    """
+    按照directorys的顺序搜索，只输出从第start个命中结果开始的count个结果。
+    directorys应该已经按照最终的顺序排好，搜索到start + count个结果后就不再生成命中结果，
+    剩下的章节只统计命中的数量，结果集的query_target_count为命中结果的总数。
+
+    :param start: 起始结果的序号。
+    :param count: 结果的数量，为None时输出start之后的全部结果。
+    :param searcher: 提供iter_search_in_chapters和count_in_chapters的搜索对象，例如BookQueryPool，缺省为BookQuery。
+    :return: 只包含该页结果的QueryResults。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return None
+    if isinstance(q, str):
+      q = Query(q)
+    if searcher is None:
+      searcher = BookQuery
+    if context is None:
+      context = SearchContext()
+    # 只缩小一次，分页搜索和统计数量都使用缩小后的章节
+    directorys = BookQuery.filter_by_books(directorys, books)
+
+    start = max(0, start)
+    end = None if count is None else start + max(0, count)
+    query_results = QueryResults(q)
+
+    # 章节在directorys中的位置，用于确定从哪里开始只统计数量
+    positions = {directory[-1].id: position for position, directory in enumerate(directorys)}
+    total = 0
+    next_position = len(directorys)
+    query_result_pieces = searcher.iter_search_in_chapters(q, directorys, None, annotation, index, context, fields)
+    try:
+      for query_result_piece in query_result_pieces:
+        hits = query_result_piece.hits
+        page_hits = hits[max(0, start - total) : (None if end is None else max(0, end - total))]
+        if len(page_hits) > 0:
+          query_results.add_query_result_piece(QueryResultPiece(query_result_piece.directory, hits = page_hits, order = query_result_piece.order))
+        total += len(hits)
+        if (end is not None) and (total >= end):
+          next_position = positions[query_result_piece.directory[-1].id] + 1
+          break
+    finally:
+      query_result_pieces.close()
+
+    if next_position < len(directorys):
+      total += searcher.count_in_chapters(q, directorys[next_position:], annotation, index, context, fields)
+    query_results.query_target_count = total
     return query_results
 
   @staticmethod
-  def search_book_bytitle(q: Union[Query, str], dbooks: List[Book], limit: int = QUERY_MAX_RESULT_NUM) -> Union[List[Book], None]:
+  def search_book_bytitle(q: Union[Query, str], dbooks: List[Book], limit: int = QUERY_MAX_RESULT_NUM, fields: Union[BookFieldIndex, None] = None) -> Union[List[Book], None]:
+    """
+    搜索书籍。查询语句中的关键字在书籍的标题（前缀、标题、副标题）中判断，书籍的字段条件按照书籍本身的字段判断，
+    比如：'易 and author:王弼 and category:經'；段落的字段条件对书籍没有意义，被忽略。
+
+    :param fields: dbooks的字段索引（BookArchive.get_field_index），为None时用dbooks临时建立。
+    """
     if (q is None) or (dbooks is None) or (len(dbooks) == 0):
       return None
     if isinstance(q, str):
       q = Query(q)
 
+    book_tree, _ = split_field_tree(q) if q.field_tree is not None else (None, None)
+    if book_tree is not None:
+      # 先用字段索引缩小范围，再判断标题
+      dbooks = (fields if fields is not None else BookFieldIndex.build(dbooks)).filter_books(book_tree, dbooks)
+    tree = q.query_tree
+    if tree is None:
+      return list(dbooks) if book_tree is not None else []
+
     result_dbooks = []
     for dbook in dbooks:
-      title = (f"{'' if dbook.title.prefix is None else dbook.title.prefix} . "
-              f"{'' if dbook.title is None else dbook.title} . "
-              f"{'' if dbook.title.subtitle is None else dbook.title.subtitle}")
-      result = q.excute_query(title)
-      if (result == True):
+      title = dbook.title
+      if (title is not None) and tree.evaluate(normalize_text(" . ".join(text for text in (title.prefix, title.title, title.subtitle) if text))):
         result_dbooks.append(dbook)
 
-    return result_dbooks
\ No newline at end of file
+    return result_dbooks
@@ -0,0 +1,486 @@
+"""
+docbook_query_pool.py
+
+docbook_query_pool用多个进程来搜索文献库，绕开GIL，使搜索能够利用多个CPU核。
+文献库中的书籍按照BookFile划分为多个分片，每一个搜索进程启动时自己载入一个分片的书籍，并一直保留在内存中：
+文献库使用快照时从快照中恢复书籍，否则按照BookArchive.TRUSTED_LOAD解析书籍文件。
+每次搜索时，搜索进程接收编译好的查询对象和需要搜索的章节，逐个章节搜索，并把命中的结果流式地发送回主进程。
+主进程按照章节在directorys中的顺序输出QueryResultPiece，顺序和BookQuery.search_in_chapters一致。
+搜索进程中的搜索失败（包括意外退出）时，主进程的搜索抛出RuntimeError，不返回不完整的结果。
+
+文献库刷新后（update），搜索进程不重新启动，而是建立新的一代（generation）：新的一代沿用没有变化的书籍，
+只载入新增、修改过的书籍。每一代是一个BookQueryPool对象，搜索消息带有它的代号，搜索进程在该代的书籍中搜索；
+旧的一代在关闭（close）之前保持不变，仍在使用旧的文献库对象的调用者得到的是旧的书籍的结果。
+所有的代都关闭后，搜索进程退出。
+
+多个线程可以同时搜索：每一次搜索有自己的search_id，搜索进程的结果都带有search_id。
+所有搜索共用一个结果队列，正在等待结果的线程轮流（持有锁）从结果队列中取出消息，转发给对应的搜索；
+锁只在发送任务和转发结果时持有，搜索结束（包括中途放弃的生成器被关闭）时注销该搜索，之后它的消息被丢弃。
+"""
+
+import os
+import uuid
+import queue
+import logging
+import threading
+import multiprocessing
+
+from typing import Union, List, Dict, Tuple, Set, Iterator, Any
+
+from query import Query, QueryResults, QueryResultPiece, query_normalize
+from .docbook_core import Book, Division
+from .docbook_file import BookFile
+from .docbook_index import BookIndex
+from .docbook_field import BookFieldIndex
+from .docbook_query import BookQuery
+from .docbook_context import SearchContext
+from .docbook_archive import BookArchive, _load_bookfile
+
+logger = logging.getLogger('docbook.query_pool')
+
+def _load_search_bookfile(path: str, snapshot_entry: Union[Dict[str, Any], None], trusted: bool) -> BookFile:
+  """
+  搜索进程载入一本书籍：有快照中的条目时从快照中恢复，条目失效时与文献库一样解析书籍文件（一次性载入）。
+  """
+  if snapshot_entry is not None:
+    dbfile = BookArchive.load_snapshot_entry(snapshot_entry)
+    if dbfile is not None:
+      return dbfile
+  dbfile, _, error = _load_bookfile(path, False, False, trusted)
+  if error is not None:
+    raise RuntimeError(error)
+  return dbfile
+
+def _search_process_main(shard: int, books: List[Tuple[str, Union[Dict[str, Any], None]]], request_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue, cancelled_search_ids, extra_variants: List[str], fold_hash: str, trusted: bool):
+  """
+  搜索进程的入口，books为第0代的书籍[(书籍文件路径, 快照中的条目)]，没有可用的快照时条目为None。
+  request_queue中的消息为：
+    - ('search', search_id, 代号, 查询对象, [(章节在directorys中的位置, chapter id, 候选span)], 是否搜索注释, 是否只统计数量)
+    - ('update', 原来的代号, 新的代号, 去掉的书籍文件路径, 载入的书籍[(书籍文件路径, 快照中的条目)])：由原来的一代建立新的一代，原来的一代不变
+    - ('release', 代号)：该代已经关闭，释放只属于该代的书籍
+    - None表示退出。
+  result_queue中的消息为：(search_id, shard, 章节在directorys中的位置, hits, None)，搜索完成时位置为None，
+  搜索失败时最后一项为失败的原因（载入失败的书籍的章节也作为搜索失败）；
+  只统计数量时，只在完成时输出一条消息，hits为命中结果的数量。
+  cancelled_search_ids为被中止的search_id，按照search_id % len(cancelled_search_ids)存放。
+  extra_variants、fold_hash为主进程的折叠表，查询对象中的关键字已经用它归一化，章节的span表也要用它建立。
+  trusted为主进程的BookArchive.TRUSTED_LOAD（spawn启动的进程中类属性是缺省值）。
+  """
+  query_normalize.sync_fold_table(extra_variants, fold_hash)
+  # 每一代的章节，以及书籍文件路径对应的章节id；没有变化的书籍在各代之间共用同一个对象
+  generations: Dict[int, Dict[uuid.UUID, Division]] = {0: {}}
+  generation_books: Dict[int, Dict[str, List[uuid.UUID]]] = {0: {}}
+
+  def load_books(chapters: Dict[uuid.UUID, Division], books: Dict[str, List[uuid.UUID]], new_books: List[Tuple[str, Union[Dict[str, Any], None]]]):
+    for path, snapshot_entry in new_books:
+      try:
+        dbfile = _load_search_bookfile(path, snapshot_entry, trusted)
+        chapters.update({chapter.id: chapter for chapter in dbfile.book.chapters})
+        books[path] = [chapter.id for chapter in dbfile.book.chapters]
+      except Exception as e:
+        logger.error(f"Search process {shard} load '{path}' failed: {e}.")
+
+  load_books(generations[0], generation_books[0], books)
+  while True:
+    message = request_queue.get()
+    if message is None:
+      break
+
+    if message[0] == 'update':
+      _, generation, new_generation, remove_paths, new_books = message
+      chapters = dict(generations.get(generation, {}))
+      books = dict(generation_books.get(generation, {}))
+      for path in remove_paths:
+        for chapter_id in books.pop(path, []):
+          chapters.pop(chapter_id, None)
+      load_books(chapters, books, new_books)
+      generations[new_generation] = chapters
+      generation_books[new_generation] = books
+      logger.info(f"Search process {shard} generation {new_generation}: {len(remove_paths)} removed, {len(new_books)} loaded.")
+      continue
+    elif message[0] == 'release':
+      generations.pop(message[1], None)
+      generation_books.pop(message[1], None)
+      continue
+
+    _, search_id, generation, q, items, annotation, count_only = message
+    chapters = generations.get(generation, {})
+    count = 0
+    error = None
+    try:
+      for position, chapter_id, spans in items:
+        if cancelled_search_ids[search_id % len(cancelled_search_ids)] == search_id:
+          break
+        chapter = chapters.get(chapter_id)
+        if chapter is None:
+          # 主进程只发送本分片的书籍的章节，找不到章节说明该书籍在本进程中载入失败
+          raise RuntimeError(f"chapter {chapter_id} isn't loaded")
+        if count_only:
+          count += BookQuery.count_hits_in_chapter(q, chapter, annotation, spans)
+          continue
+        hits = BookQuery.search_hits_in_chapter(q, chapter, annotation, spans)
+        if hits is not None and len(hits) > 0:
+          result_queue.put((search_id, shard, position, hits, None))
+    except Exception as e:
+      error = f"{type(e).__name__}: {e}"
+      logger.error(f"Search process {shard} search '{q.query_string}' failed: {error}.")
+    result_queue.put((search_id, shard, None, count if count_only else None, error))
+
+class _SearchProcesses(object):
+  """
+  各代BookQueryPool共用的搜索进程、结果队列和搜索的注册表。
+  """
+
+  def __init__(self, shard_books: List[List[Tuple[str, Union[Dict[str, Any], None]]]], mp_context = None):
+    context = mp_context if mp_context is not None else multiprocessing.get_context()
+    # 锁只在分配search_id、代号，发送任务和转发结果时持有
+    self.lock = threading.Lock()
+    self.search_id = 0
+    # 正在进行的搜索：{search_id: 转发给该搜索的消息}
+    self.searches: Dict[int, queue.Queue] = {}
+    # 还没有关闭的代
+    self.generations: Set[int] = {0}
+    self.last_generation = 0
+    self.cancelled_search_ids = context.Array('q', BookQueryPool.CANCEL_SLOT_NUM, lock = False)
+    self.result_queue = context.Queue()
+    self.request_queues = []
+    self.processes = []
+    for shard, books in enumerate(shard_books):
+      request_queue = context.Queue()
+      process = context.Process(
+          target = _search_process_main,
+          args = (shard, books, request_queue, self.result_queue, self.cancelled_search_ids, query_normalize.EXTRA_VARIANTS, query_normalize.get_fold_table_hash(), BookArchive.TRUSTED_LOAD),
+          name = f"chapter_searcher_{shard}",
+          daemon = True)
+      process.start()
+      self.request_queues.append(request_queue)
+      self.processes.append(process)
+
+  def new_generation(self, generation: int, remove_paths: List[List[str]], load_books: List[List[Tuple[str, Union[Dict[str, Any], None]]]]) -> int:
+    """
+    由generation建立新的一代，每一个搜索进程都建立新的一代（书籍没有变化的搜索进程只复制章节表）。
+    """
+    with self.lock:
+      if generation not in self.generations:
+        raise RuntimeError(f"Search processes generation {generation} is closed")
+      self.last_generation += 1
+      new_generation = self.last_generation
+      self.generations.add(new_generation)
+      for shard, request_queue in enumerate(self.request_queues):
+        request_queue.put(('update', generation, new_generation, remove_paths[shard], load_books[shard]))
+    return new_generation
+
+  def release_generation(self, generation: int):
+    """
+    关闭一代，所有的代都关闭后，通知搜索进程退出，并等待退出。
+    """
+    with self.lock:
+      if generation not in self.generations:
+        return
+      self.generations.discard(generation)
+      close = len(self.generations) == 0
+      for request_queue in self.request_queues:
+        request_queue.put(None if close else ('release', generation))
+    if close:
+      for process in self.processes:
+        process.join()
+
+  def start_search(self, generation: int, q: Query, shard_items: List[List[Tuple[int, uuid.UUID, Union[Set[int], None]]]], annotation: bool, count_only: bool) -> Tuple[int, queue.Queue]:
+    """
+    分配search_id，注册本次搜索，并把任务发送给搜索进程。
+
+    :return: (search_id, 转发给本次搜索的消息)
+    """
+    with self.lock:
+      self.search_id += 1
+      search_id = self.search_id
+      results = self.searches[search_id] = queue.Queue()
+      for shard, request_queue in enumerate(self.request_queues):
+        request_queue.put(('search', search_id, generation, q, shard_items[shard], annotation, count_only))
+    return search_id, results
+
+  def finish_search(self, search_id: int):
+    """
+    中止还在搜索的进程，并注销本次搜索，之后收到的本次搜索的消息被丢弃。
+    """
+    with self.lock:
+      self.cancelled_search_ids[search_id % len(self.cancelled_search_ids)] = search_id
+      self.searches.pop(search_id, None)
+
+  def get_result(self, search_id: int, results: queue.Queue, shard_done: List[bool], context: Union[SearchContext, None] = None) -> Union[Tuple[int, int, Union[int, None], Union[list, int, None], Union[str, None]], None]:
+    """
+    取出本次搜索的一条消息：先取其他线程已经转发过来的消息，没有时持有锁从result_queue中取出一条消息并转发。
+    如果有搜索进程意外退出，以该进程搜索失败的消息代替。给出context时，context中止后返回None。
+    搜索失败的消息抛出RuntimeError。
+    """
+    message = self.__get_message(search_id, results, shard_done, context)
+    if (message is not None) and (message[4] is not None):
+      raise RuntimeError(f"Search process {message[1]} failed: {message[4]}")
+    return message
+
+  def __get_message(self, search_id: int, results: queue.Queue, shard_done: List[bool], context: Union[SearchContext, None] = None) -> Union[Tuple[int, int, Union[int, None], Union[list, int, None], Union[str, None]], None]:
+    while True:
+      if (context is not None) and context.is_stopped():
+        return None
+      try:
+        return results.get_nowait()
+      except queue.Empty:
+        pass
+
+      timeout = 1.0 if (context is None) or (context.remaining_time is None) else min(1.0, max(0.01, context.remaining_time))
+      message = None
+      if self.lock.acquire(timeout = timeout):
+        try:
+          # 等待锁的期间，其他线程可能已经转发了本次搜索的消息
+          if results.empty():
+            message = self.result_queue.get(timeout = timeout)
+            if message[0] != search_id:
+              target = self.searches.get(message[0])
+              if target is not None:
+                target.put(message)
+              continue
+        except queue.Empty:
+          pass
+        finally:
+          self.lock.release()
+      if message is not None:
+        return message
+
+      for shard, process in enumerate(self.processes):
+        if (not shard_done[shard]) and (not process.is_alive()):
+          logger.error(f"Search process {shard} exited unexpectedly, exitcode: {process.exitcode}.")
+          return (search_id, shard, None, None, f"exited unexpectedly, exitcode: {process.exitcode}")
+
+class BookQueryPool(object):
+  """
+  多进程的文献库搜索对象，一个对象对应文献库的一代。
+  """
+
+  # 缺省的搜索进程数量为CPU核数
+  QUERY_PROCESS_NUM: Union[int, None] = None
+
+  # 记录被中止的search_id的槽位数量，同时进行的搜索超过该数量时，较早的搜索可能无法中止（只是继续搜索完，结果被丢弃）
+  CANCEL_SLOT_NUM: int = 64
+
+  def __init__(self, dbarchive: 'BookArchive', process_num: Union[int, None] = None, mp_context = None):
+    """
+    按照BookFile划分分片，并启动搜索进程，建立第0代。
+
+    :param dbarchive: 文献库对象。
+    :param process_num: 搜索进程数量，缺省为QUERY_PROCESS_NUM或者CPU核数。
+    :param mp_context: multiprocessing的上下文，缺省为multiprocessing的缺省上下文。
+    """
+    process_num = process_num or BookQueryPool.QUERY_PROCESS_NUM or os.cpu_count() or 1
+    dbfiles = dbarchive.dbfiles
+    process_num = max(1, min(process_num, len(dbfiles)))
+
+    # 书籍按照archive中的顺序，以章节数量为权重，连续地划分到各个分片中
+    shards: List[List[BookFile]] = [[] for _ in range(process_num)]
+    total = sum(len(dbfile.book.chapters) for dbfile in dbfiles)
+    count = 0
+    for dbfile in dbfiles:
+      shard = min(process_num - 1, (count * process_num) // total) if total > 0 else 0
+      shards[shard].append(dbfile)
+      count += len(dbfile.book.chapters)
+
+    snapshot_entries = dbarchive.get_snapshot_entries()
+    self.__init_generation(_SearchProcesses([[(dbfile.path, snapshot_entries.get(dbfile)) for dbfile in shard_dbfiles] for shard_dbfiles in shards], mp_context), 0, shards)
+    logger.info(f"Start {process_num} search processes, shards: {[len(shard_dbfiles) for shard_dbfiles in shards]}.")
+
+  def __init_generation(self, processes: _SearchProcesses, generation: int, shards: List[List[BookFile]]):
+    self._search_processes: _SearchProcesses = processes
+    self._generation: int = generation
+    self._shards: List[List[BookFile]] = shards
+    self._book_shards: Dict[uuid.UUID, int] = {dbfile.book.id: shard for shard, shard_dbfiles in enumerate(shards) for dbfile in shard_dbfiles}
+    self._closed: bool = False
+
+  @property
+  def process_num(self) -> int:
+    return len(self._search_processes.processes)
+
+  @property
+  def generation(self) -> int:
+    return self._generation
+
+  def update(self, dbarchive: 'BookArchive') -> 'BookQueryPool':
+    """
+    文献库刷新后，在同一组搜索进程中建立新的一代，不重新启动搜索进程。
+    没有变化的书籍（刷新时沿用的同一个BookFile对象）保留在原来的分片中，删除、修改过的书籍在新的一代中去掉，
+    新增、修改过的书籍分配到章节数量最少的分片。本对象（原来的一代）不变，在关闭之前仍然搜索原来的书籍。
+
+    :param dbarchive: 刷新后的文献库对象（BookArchive.refresh的结果）。
+    :return: 新的一代，不再使用时需要关闭。
+    """
+    current = set(dbarchive.dbfiles)
+    shards = [[dbfile for dbfile in shard_dbfiles if dbfile in current] for shard_dbfiles in self._shards]
+    remove_paths = [[dbfile.path for dbfile in shard_dbfiles if dbfile not in current] for shard_dbfiles in self._shards]
+    kept = {dbfile for shard_dbfiles in shards for dbfile in shard_dbfiles}
+    weights = [sum(len(dbfile.book.chapters) for dbfile in shard_dbfiles) for shard_dbfiles in shards]
+    snapshot_entries = dbarchive.get_snapshot_entries()
+    load_books = [[] for _ in shards]
+    for dbfile in dbarchive.dbfiles:
+      if dbfile in kept:
+        continue
+      shard = weights.index(min(weights))
+      shards[shard].append(dbfile)
+      load_books[shard].append((dbfile.path, snapshot_entries.get(dbfile)))
+      weights[shard] += len(dbfile.book.chapters)
+
+    generation = self._search_processes.new_generation(self._generation, remove_paths, load_books)
+    dbquery_pool = BookQueryPool.__new__(BookQueryPool)
+    dbquery_pool.__init_generation(self._search_processes, generation, shards)
+    logger.info(f"Update search processes to generation {generation}: {sum(len(paths) for paths in remove_paths)} removed, {sum(len(books) for books in load_books)} loaded, shards: {[len(shard_dbfiles) for shard_dbfiles in shards]}.")
+    return dbquery_pool
+
+  def __split_shard_items(self, directorys: List[List[Union[Division, Book]]], candidates: Union[Dict[uuid.UUID, Set[int]], None]) -> Tuple[List[List[Tuple[int, uuid.UUID, Union[Set[int], None]]]], List[Tuple[int, List[Union[Division, Book]]]]]:
+    """
+    把directorys中需要搜索的章节分配到各个分片。
+
+    :return: (每一个分片需要搜索的章节[(位置, chapter id, 候选span)], 每一个位置的(分片, directory))
+    """
+    shard_items: List[List[Tuple[int, uuid.UUID, Union[Set[int], None]]]] = [[] for _ in range(self.process_num)]
+    positions: List[Tuple[int, List[Union[Division, Book]]]] = []
+    for directory in directorys:
+      chapter = directory[-1]
+      shard = self._book_shards.get(directory[0].id)
+      if shard is None:
+        logger.debug(f"Book of chapter {chapter.id} isn't in the search processes.")
+        continue
+      spans = None
+      if candidates is not None:
+        spans = candidates.get(chapter.id)
+        if spans is None:
+          continue
+      shard_items[shard].append((len(positions), chapter.id, spans))
+      positions.append((shard, directory))
+    return shard_items, positions
+
+  def iter_search_in_chapters(self, q: Union[Query, str], directorys: List[List[Union[Division, Book]]], limit: Union[int, None] = BookQuery.QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Iterator[QueryResultPiece]:
+    """
+    在多个进程中搜索directorys中的章节，按照章节在directorys中的顺序，流式地输出QueryResultPiece。
+    输出的命中结果达到limit，或者context被中止、超时时，通知搜索进程中止搜索。
+    搜索进程中的搜索失败时抛出RuntimeError。
+
+    参数与BookQuery.search_in_chapters一致。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return
+    if isinstance(q, str):
+      q = Query(q)
+
+    if context is None:
+      context = SearchContext(limit)
+    directorys = BookQuery.filter_by_books(directorys, books)
+    candidates = None if index is None else index.candidates(q)
+    # 在主进程中用书籍、卷章的字段条件和章节的字符签名排除不可能命中的章节，不发送给搜索进程
+    directorys = BookQuery.filter_by_fields(q, directorys, fields)
+    directorys = BookQuery.filter_by_signature(q, directorys)
+
+    shard_items, positions = self.__split_shard_items(directorys, candidates)
+    search_id, results = self._search_processes.start_search(self._generation, q, shard_items, annotation, False)
+
+    # 每一个分片已经输出到的位置，位置小于该值且没有命中结果的章节，表示没有命中
+    shard_positions = [-1 for _ in range(self.process_num)]
+    shard_done = [False for _ in range(self.process_num)]
+    pending: Dict[int, list] = {}
+    next_position = 0
+    try:
+      while next_position < len(positions):
+        while next_position < len(positions):
+          shard, directory = positions[next_position]
+          hits = pending.pop(next_position, None)
+          if hits is not None:
+            # 结果按照顺序计数，limit截断的位置是确定的
+            hits = hits[:context.take(len(hits))]
+            if len(hits) > 0:
+              yield QueryResultPiece(directory, hits = hits, order = directory[-1].order)
+            if context.is_stopped():
+              return
+          elif not (shard_done[shard] or shard_positions[shard] > next_position):
+            break
+          next_position += 1
+
+        if next_position >= len(positions):
+          break
+
+        message = self._search_processes.get_result(search_id, results, shard_done, context)
+        if message is None:
+          return
+        _, shard, position, hits, _ = message
+        if position is None:
+          shard_done[shard] = True
+        else:
+          shard_positions[shard] = position
+          pending[position] = hits
+    finally:
+      # 生成器被关闭（包括中途放弃）时执行，不等待搜索进程
+      self._search_processes.finish_search(search_id)
+
+  def search_in_chapters(self, q: Union[Query, str], directorys: List[List[Union[Division, Book]]], limit: Union[int, None] = BookQuery.QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Union[QueryResults, None]:
+    """
+    在多个进程中搜索directorys中的章节，返回QueryResults。参数和返回结果与BookQuery.search_in_chapters一致。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return None
+    if isinstance(q, str):
+      q = Query(q)
+
+    query_results = QueryResults(q)
+    for query_result_piece in self.iter_search_in_chapters(q, directorys, limit, annotation, index, context, fields, books):
+      query_results.add_query_result_piece(query_result_piece)
+    return query_results
+
+  def count_in_chapters(self, q: Union[Query, str], directorys: List[List[Union[Division, Book]]], annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> int:
+    """
+    在多个进程中统计directorys的章节中命中的结果数量，参数和返回结果与BookQuery.count_in_chapters一致。
+    搜索进程中的搜索失败时抛出RuntimeError。
+    """
+    if (q is None) or (directorys is None) or (len(directorys) == 0):
+      return 0
+    if isinstance(q, str):
+      q = Query(q)
+
+    directorys = BookQuery.filter_by_books(directorys, books)
+    candidates = None if index is None else index.candidates(q)
+    # 在主进程中用书籍、卷章的字段条件和章节的字符签名排除不可能命中的章节，不发送给搜索进程
+    directorys = BookQuery.filter_by_fields(q, directorys, fields)
+    directorys = BookQuery.filter_by_signature(q, directorys)
+
+    shard_items, _ = self.__split_shard_items(directorys, candidates)
+    search_id, results = self._search_processes.start_search(self._generation, q, shard_items, annotation, True)
+
+    count = 0
+    shard_done = [False for _ in range(self.process_num)]
+    try:
+      while not all(shard_done):
+        message = self._search_processes.get_result(search_id, results, shard_done, context)
+        if message is None:
+          break
+        _, shard, position, shard_count, _ = message
+        if position is None:
+          shard_done[shard] = True
+          count += shard_count or 0
+    finally:
+      self._search_processes.finish_search(search_id)
+    return count
+
+  def search_page_in_chapters(self, q: Union[Query, str], directorys: List[List[Union[Division, Book]]], start: int = 0, count: Union[int, None] = BookQuery.QUERY_MAX_RESULT_NUM, annotation: bool = False, index: Union[BookIndex, None] = None, context: Union[SearchContext, None] = None, fields: Union[BookFieldIndex, None] = None, books: Union[Set[uuid.UUID], None] = None) -> Union[QueryResults, None]:
+    """
+    在多个进程中搜索一页结果，参数和返回结果与BookQuery.search_page_in_chapters一致。
+    """
+    return BookQuery.search_page_in_chapters(q, directorys, start, count, annotation, index, context, searcher = self, fields = fields, books = books)
+
+  def close(self):
+    """
+    关闭本代，搜索进程释放只属于本代的书籍。所有的代都关闭后，通知搜索进程退出，并等待退出。
+    """
+    if self._closed:
+      return
+    self._closed = True
+    self._search_processes.release_generation(self._generation)
+
+  def __enter__(self) -> 'BookQueryPool':
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
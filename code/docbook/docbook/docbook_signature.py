@@ -0,0 +1,133 @@
+"""
+docbook_signature.py
+
+docbook_signature为章节建立字符签名：章节所有span（归一化的文本）中的单字和双字组成的Bloom filter，用一个整数作为位图保存。
+搜索前先用签名判断查询条件，签名中不包含AND关键字的章节不可能命中，不需要载入和逐个span扫描。
+签名只会误判为可能包含（假阳性），不会漏掉真正包含关键字的章节。
+
+签名在章节的span表建立时一起建立（BookArchive.BUILD_SIGNATURES为True时在载入书籍时建立），章节内容卸载后仍然保留，
+因此动态载入的文献库中，搜索过的章节之后不用再载入就可以排除。
+"""
+
+import sys
+import logging
+
+from itertools import repeat
+from operator import mul, and_, rshift
+from typing import Union, List, Set, Callable, Iterable
+
+from query import Query
+
+logger = logging.getLogger('docbook.signature')
+
+MASK64 = (1 << 64) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+# 按照本机字节序编码为UTF-32，每4个字节为一个字的码位，每8个字节为相邻两个字组成的整数
+UTF32_ENCODING = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+class ChapterSignature(object):
+  """
+  章节的字符签名。位图的大小为2的幂，按照章节中单字和双字的数量确定，每一个单字或者双字在位图中置一位。
+  """
+  __slots__ = ('_bits', '_value')
+
+  # 每一个单字或者双字在位图中最少占用的位数，越大假阳性越低，占用的内存也越多
+  # 多个字的关键字需要同时判断其中所有的单字和双字，实际的假阳性比单个字低得多
+  BITS_PER_GRAM: int = 8
+  # 位图最少的位数（2的幂次）
+  MIN_BITS: int = 8
+
+  def __init__(self, bits: int, value: int):
+    # 位图的大小为2 ** bits
+    self._bits: int = bits
+    self._value: int = value
+
+  @property
+  def bits(self) -> int:
+    return self._bits
+
+  @staticmethod
+  def get_keys(text: str) -> Set[int]:
+    """
+    输出文本中所有的单字和双字对应的整数：单字为码位，双字为两个码位组成的64位整数。
+    文本编码为UTF-32后直接按照4个字节和8个字节（两种对齐）读取，不需要逐字循环。
+    """
+    data = text.encode(UTF32_ENCODING)
+    keys = set(memoryview(data).cast('I'))
+    keys.update(memoryview(data[: len(data) // 8 * 8]).cast('Q'))
+    keys.update(memoryview(data[4 : 4 + (len(data) - 4) // 8 * 8]).cast('Q'))
+    return keys
+
+  @staticmethod
+  def get_positions(keys: Iterable[int], bits: int) -> Set[int]:
+    """
+    单字或者双字在2 ** bits位的位图中的位置。使用确定的乘法散列（不使用hash()），签名可以在进程之间传递和保存。
+    """
+    return set(map(rshift, map(and_, map(mul, keys, repeat(HASH_MULTIPLIER)), repeat(MASK64)), repeat(64 - bits)))
+
+  @classmethod
+  def build(self, texts: Iterable[str]) -> 'ChapterSignature':
+    # 跨越两段文本的双字也会加入签名，只会增加假阳性
+    keys = ChapterSignature.get_keys('\n'.join(texts))
+    bits = max(ChapterSignature.MIN_BITS, (len(keys) * ChapterSignature.BITS_PER_GRAM - 1).bit_length())
+    bitmap = bytearray(1 << (bits - 3))
+    for position in ChapterSignature.get_positions(keys, bits):
+      bitmap[position >> 3] |= 1 << (position & 7)
+    return self(bits, int.from_bytes(bitmap, 'little'))
+
+  @staticmethod
+  def get_mask(keys: Iterable[int], bits: int) -> int:
+    mask = 0
+    for position in ChapterSignature.get_positions(keys, bits):
+      mask |= 1 << position
+    return mask
+
+  def may_contain(self, mask: int) -> bool:
+    """
+    判断签名是否可能包含mask（get_mask的输出）中的所有单字和双字。
+    """
+    return (self._value & mask) == mask
+
+  def __repr__(self) -> str:
+    return f"ChapterSignature({self._bits}, {bin(self._value).count('1')})"
+
+  @staticmethod
+  def compile_query(q: Query) -> Union[Callable[['ChapterSignature'], bool], None]:
+    """
+    将查询条件编译为签名上的判断函数，输出False的章节不可能命中。
+    签名无法判断NOT和正则表达式，它们被视为可能命中；无法排除任何章节时（比如：'not 君子'）返回None。
+
+    示例:
+      >>> match = ChapterSignature.compile_query(Query('君子 and (小人 or 大人)'))
+      >>> match(ChapterSignature.build(['君子不器', '小人長戚戚']))
+      True
+    """
+    # 无法通过签名判断的条件，视为所有的章节都可能命中（reduce_query中None表示还没有值，不能用None表示）
+    def unknown(signature: 'ChapterSignature') -> bool:
+      return True
+
+    def term_func(word: str) -> Callable[['ChapterSignature'], bool]:
+      if not Query.is_literal_key(word):
+        return unknown
+      keys = ChapterSignature.get_keys(word)
+      # 不同大小的签名使用不同的mask，在第一次用到时计算
+      masks = {}
+      def match(signature: 'ChapterSignature') -> bool:
+        mask = masks.get(signature._bits)
+        if mask is None:
+          mask = masks[signature._bits] = ChapterSignature.get_mask(keys, signature._bits)
+        return signature.may_contain(mask)
+      return match
+
+    def and_func(a, b):
+      if (a is unknown) or (b is unknown):
+        return b if a is unknown else a
+      return lambda signature: a(signature) and b(signature)
+
+    def or_func(a, b):
+      if (a is unknown) or (b is unknown):
+        return unknown
+      return lambda signature: a(signature) or b(signature)
+
+    match = q.reduce_query(term_func, lambda a: unknown, and_func, or_func)
+    return None if match is unknown else match
@@ -0,0 +1,228 @@
+"""
+docbook_span.py
+
+docbook_span定义搜索时使用的检索范围（span）。
+一个span为正文段落（ContentPiece）中以分行符号分隔的一段文本，并去掉了其中的标签。
+搜索、索引都以相同的顺序来遍历一个章节中的span，这样span在章节中的序号可以在两者之间通用。
+
+章节的span表在第一次使用时建立并缓存在章节上，之后的每一次搜索都直接使用，不再重复分行和去掉标签；
+章节内容被重新载入或者卸载时，span表失效。span表引用了章节的内容（content_piece），
+搜索一个章节时先取得它的span表（get_loaded_chapter_spans），之后章节被章节缓存卸载也不影响这次搜索。章节的字符签名（docbook_signature）由span表建立，卸载时保留。
+span表建立时同时把文本归一化（见query_normalize），搜索、签名和索引都使用归一化的文本，
+归一化的文本与原文位置一一对应，命中的位置可以直接在原文上高亮。
+span记录了去掉标签后的文本片段在原始内容中的位置，命中结果带有span的序号，高亮时可以把命中的位置映射回包含标签的原始内容。
+"""
+
+import bisect
+import logging
+
+from typing import Union, List, Dict, Tuple, Iterator
+
+from .docbook_core import Division, ContentPiece, DivisionType
+from .docbook_signature import ChapterSignature
+from query import normalize_text, freeze_fold_table
+from utils import HTML_TAG_PATTERN
+
+logger = logging.getLogger('docbook.span')
+
+class ChapterSpan(object):
+  """
+  章节中的一个span。
+  """
+  __slots__ = ('text', 'search_text', 'content_piece', 'index', 'in_annotation', 'type', 'offset', '_segments')
+
+  def __init__(self, text: str, content_piece: ContentPiece, index: int, in_annotation: bool, offset: int, segments: Union[List[Tuple[int, int]], None]):
+    # 去掉标签的span文本
+    self.text: str = text
+    # 归一化的span文本，与text长度相同，位置一一对应；归一化没有改变文本时就是text本身，不另外占用内存
+    search_text = normalize_text(text)
+    self.search_text: str = text if search_text == text else search_text
+    # span所在的content_piece
+    self.content_piece: ContentPiece = content_piece
+    # span在章节中的序号
+    self.index: int = index
+    # span是否在注释中（content_piece或者上级content_piece为注释）
+    self.in_annotation: bool = in_annotation
+    # content_piece的类型
+    self.type: DivisionType = content_piece.type
+    # span在content_piece.content中的起始位置
+    self.offset: int = offset
+    # 去掉标签后的文本片段：[(在text中的位置, 在content_piece.content中的位置)]，没有标签时为None
+    self._segments: Union[List[Tuple[int, int]], None] = segments
+
+  def get_content_offset(self, position: int) -> int:
+    """
+    把text（或者search_text）中的位置转换为content_piece.content（包含标签）中的位置，用于在原始内容上高亮。
+    """
+    if self._segments is None:
+      return self.offset + position
+    index = bisect.bisect_right(self._segments, (position, float('inf'))) - 1
+    if index < 0:
+      return self.offset + position
+    text_start, content_start = self._segments[index]
+    return content_start + (position - text_start)
+
+  def get_content(self) -> str:
+    """
+    span在content_piece.content中的原始内容（包含标签）。
+    """
+    content = self.content_piece.content
+    end = content.find('\n', self.offset)
+    return content[self.offset : len(content) if end < 0 else end]
+
+  def get_content_ranges(self, start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    把text中的[start, end)转换为原始内容（get_content()）中的位置，被标签分开的文本各为一段：[(起始位置, 结束位置)]。
+    """
+    if self._segments is None:
+      return [(start, end)]
+    ranges = []
+    for index, (text_start, content_start) in enumerate(self._segments):
+      text_end = self._segments[index + 1][0] if index + 1 < len(self._segments) else len(self.text)
+      range_start, range_end = max(start, text_start), min(end, text_end)
+      if range_start < range_end:
+        content_start -= self.offset
+        ranges.append((content_start + range_start - text_start, content_start + range_end - text_start))
+    return ranges
+
+  def __repr__(self) -> str:
+    return f"ChapterSpan({repr(self.text)}, {self.index}, {self.in_annotation}, {self.offset})"
+
+
+def strip_html_tags(text: str, offset: int = 0) -> Tuple[str, Union[List[Tuple[int, int]], None]]:
+  """
+  去掉text中的标签，同时记录去掉标签后每一个文本片段在原始文本中的位置。
+
+  :param offset: text在原始内容中的起始位置。
+  :return: (去掉标签的文本, [(在去掉标签的文本中的位置, 在原始内容中的位置)])，text中没有标签时片段为None。
+  """
+  if '<' not in text:
+    return text, None
+
+  pieces = []
+  segments = []
+  length = 0
+  last_end = 0
+  for match in HTML_TAG_PATTERN.finditer(text):
+    if match.start() > last_end:
+      pieces.append(text[last_end : match.start()])
+      segments.append((length, offset + last_end))
+      length += match.start() - last_end
+    last_end = match.end()
+  if last_end < len(text) or len(segments) == 0:
+    pieces.append(text[last_end:])
+    segments.append((length, offset + last_end))
+  return ''.join(pieces), segments
+
+def build_content_piece_spans(spans: List[ChapterSpan], content_piece: ContentPiece, in_annotation: bool = False):
+  """
+  按照先序遍历的顺序，把content_piece及其下级content_pieces中的所有span加入spans。
+  """
+  in_annotation = in_annotation or (content_piece.type == DivisionType.ANNOTATION)
+  offset = 0
+  for line in content_piece.content.split('\n'):
+    text, segments = strip_html_tags(line, offset)
+    spans.append(ChapterSpan(text, content_piece, len(spans), in_annotation, offset, segments))
+    offset += len(line) + 1
+
+  for sub_content_piece in content_piece.content_pieces:
+    build_content_piece_spans(spans, sub_content_piece, in_annotation)
+
+def build_chapter_spans(chapter: Division, divisions: Union[List[ContentPiece], None] = None) -> List[ChapterSpan]:
+  """
+  建立章节的span表，不缓存。
+
+  :param divisions: 章节的内容，为None时使用chapter.divisions。
+  """
+  # span表（以及由它建立的签名、索引）使用当前的折叠表，之后不能再修改
+  freeze_fold_table()
+  spans = []
+  for content_piece in (chapter.divisions if divisions is None else divisions):
+    if (isinstance(content_piece, ContentPiece) == False):
+      logger.error(f"a Invalid content_piece: {chapter}.")
+      break
+    build_content_piece_spans(spans, content_piece)
+  return spans
+
+def get_chapter_spans(chapter: Division) -> List[ChapterSpan]:
+  """
+  输出章节的span表，span在表中的序号，即为span在章节中的序号。
+  span表在第一次调用时建立，并缓存在章节上，同时建立章节的字符签名。
+
+  :param chapter: 章节对象，必须是已经load的章节。
+  """
+  spans = get_loaded_chapter_spans(chapter)
+  # 没有载入的章节不缓存，载入后重新建立
+  return spans if spans is not None else build_chapter_spans(chapter)
+
+def get_loaded_chapter_spans(chapter: Division) -> Union[List[ChapterSpan], None]:
+  """
+  输出已经载入的章节的span表，章节没有载入时返回None。
+  章节可能同时被其他线程卸载、重新载入：span表只从同一份章节内容建立，并且只在这份内容仍然是章节的内容时缓存。
+  """
+  spans = chapter._spans
+  if spans is not None:
+    return spans
+  divisions = chapter._divisions
+  if (chapter.ref is not None) and ((divisions is None) or (len(divisions) == 0)):
+    return None
+  spans = build_chapter_spans(chapter, divisions or [])
+  if chapter._divisions is divisions:
+    chapter._spans = spans
+    if chapter._signature is None:
+      chapter._signature = ChapterSignature.build(span.search_text for span in spans)
+  return spans
+
+def get_chapter_span(chapter: Division, index: int) -> Union[ChapterSpan, None]:
+  """
+  输出章节中序号为index的span（一般为命中结果中的span序号），用于在原始内容上高亮。
+  章节没有载入时返回None；没有缓存的span表时只建立到该span为止，不缓存。
+  """
+  spans = chapter._spans
+  if spans is None:
+    divisions = chapter._divisions
+    if (chapter.ref is not None) and ((divisions is None) or (len(divisions) == 0)):
+      return None
+    spans = []
+    for content_piece in divisions or []:
+      if len(spans) > index:
+        break
+      if (isinstance(content_piece, ContentPiece) == False):
+        break
+      build_content_piece_spans(spans, content_piece)
+  return spans[index] if 0 <= index < len(spans) else None
+
+def get_chapter_signature(chapter: Division, build: bool = True) -> Union[ChapterSignature, None]:
+  """
+  输出章节的字符签名。章节已经载入、还没有签名并且build为True时，建立签名（不缓存span表）；
+  从来没有载入过的章节没有签名，返回None。
+  """
+  signature = chapter._signature
+  if (signature is None) and build and chapter.is_load():
+    spans = chapter._spans if chapter._spans is not None else build_chapter_spans(chapter)
+    signature = chapter._signature = ChapterSignature.build(span.search_text for span in spans)
+  return signature
+
+def iter_content_piece_spans(content_piece: ContentPiece, in_annotation: bool = False) -> Iterator[Tuple[str, ContentPiece, bool]]:
+  """
+  按照先序遍历的顺序，输出content_piece及其下级content_pieces中的所有span。
+
+  :param content_piece: 节、正文段落、注释段落对象。
+  :param in_annotation: 上级content_piece是否为注释。
+  :return: (去掉标签的span文本, span所在的content_piece, span是否在注释中)。
+  """
+  spans = []
+  build_content_piece_spans(spans, content_piece, in_annotation)
+  for span in spans:
+    yield span.text, span.content_piece, span.in_annotation
+
+def iter_chapter_spans(chapter: Division) -> Iterator[Tuple[str, ContentPiece, bool]]:
+  """
+  按照搜索的顺序，输出章节中的所有span，包括注释中的span。
+  span在本函数输出中的序号，即为span在章节中的序号。
+
+  :param chapter: 章节对象，必须是已经load的章节。
+  :return: (去掉标签的span文本, span所在的content_piece, span是否在注释中)。
+  """
+  for span in get_chapter_spans(chapter):
+    yield span.text, span.content_piece, span.in_annotation
@@ -0,0 +1,286 @@
+"""
+docbook_validate.py
+
+docbook_validate离线检查书籍文件和文献库，输出所有不合法的地方，而不是像from_dict那样遇到第一个错误就停止。
+检查的规则与from_dict以及各个属性的校验一致。发布的文献库通过检查后，可以用BookArchive.TRUSTED_LOAD快速载入。
+"""
+
+import os
+import uuid
+import pathlib
+import logging
+import multiprocessing
+import concurrent.futures
+from datetime import datetime
+
+from typing import Union, List, Dict, Set, Any
+
+import utils
+from .docbook_core import DivisionType, ExtraContentType
+from .docbook_file import BookFileType, BookFile
+
+logger = logging.getLogger('docbook.validate')
+
+DIVISION_TYPES = {DivisionType.VOLUME.name, DivisionType.CHAPTER.name}
+CONTENT_PIECE_TYPES = {DivisionType.SECTION.name, DivisionType.PARAGRAPH.name, DivisionType.ANNOTATION.name}
+EXTRA_CONTENT_TYPES = {type.name for type in ExtraContentType}
+
+class BookValidator(object):
+  """
+  检查一本书籍的json数据，记录所有不合法的地方：'位置: 原因'。
+  """
+
+  def __init__(self):
+    self._violations: List[str] = []
+    self._ids: Set[str] = set()
+
+  @property
+  def violations(self) -> List[str]:
+    return self._violations
+
+  def __add(self, location: str, message: str):
+    self._violations.append(f"{location}: {message}")
+
+  def __is_dict(self, params: Any, location: str) -> bool:
+    if not isinstance(params, dict):
+      self.__add(location, f"should be an object, not {type(params).__name__}")
+      return False
+    return True
+
+  def __check_list(self, params: Dict, key: str, location: str) -> List[Any]:
+    value = params.get(key)
+    if value is None:
+      return []
+    if not isinstance(value, list):
+      self.__add(f"{location}.{key}", f"should be a list, not {type(value).__name__}")
+      return []
+    return value
+
+  def __check_str(self, params: Dict, key: str, location: str, required: bool = False):
+    value = params.get(key)
+    if value is None:
+      if required:
+        self.__add(f"{location}.{key}", "is missing")
+    elif not isinstance(value, str):
+      self.__add(f"{location}.{key}", f"should be a string, not {type(value).__name__}")
+    elif required and (len(value) == 0):
+      self.__add(f"{location}.{key}", "is empty")
+
+  def __check_attrs(self, params: Dict, location: str):
+    attrs = params.get('attrs')
+    if (attrs is not None) and (not isinstance(attrs, dict)):
+      self.__add(f"{location}.attrs", f"should be an object, not {type(attrs).__name__}")
+
+  def __check_id(self, params: Dict, location: str, required: bool):
+    id = params.get('id')
+    if id is None:
+      if required:
+        self.__add(f"{location}.id", "is missing")
+      return
+    try:
+      uuid.UUID(id)
+    except (ValueError, TypeError, AttributeError):
+      self.__add(f"{location}.id", f"invalid UUID {repr(id)}")
+      return
+    # 重复的id只能找到第一个卷章
+    if id in self._ids:
+      self.__add(f"{location}.id", f"duplicate id {id}")
+    self._ids.add(id)
+
+  def __check_ref(self, params: Dict, location: str):
+    ref = params.get('ref')
+    if ref is None:
+      return
+    if (not isinstance(ref, str)) or (len(ref) == 0):
+      self.__add(f"{location}.ref", f"invalid ref {repr(ref)}")
+    elif not utils.is_valid_url(ref):
+      self.__add(f"{location}.ref", f"invalid ref format {repr(ref)}")
+
+  def __check_type(self, params: Dict, location: str, types: Set[str]) -> Union[str, None]:
+    type = params.get('type')
+    if type is None:
+      self.__add(f"{location}.type", "is missing")
+      return None
+    if (not isinstance(type, str)) or (type.upper() not in types):
+      self.__add(f"{location}.type", f"should be one of {'/'.join(sorted(types))}, not {repr(type)}")
+      return None
+    return type.upper()
+
+  def check_title(self, params: Any, location: str, required: bool = True):
+    if (params is None) or (params == {}):
+      if required:
+        self.__add(location, "is missing")
+      return
+    if not self.__is_dict(params, location):
+      return
+    self.__check_str(params, 'title', location, True)
+    self.__check_str(params, 'prefix', location)
+    self.__check_str(params, 'subtitle', location)
+    self.__check_attrs(params, location)
+
+  def check_dynasty(self, params: Any, location: str):
+    if (params is None) or (params == {}):
+      return
+    if not self.__is_dict(params, location):
+      return
+    self.__check_str(params, 'value', location, True)
+    self.__check_attrs(params, location)
+
+  def check_author(self, params: Any, location: str):
+    if not self.__is_dict(params, location):
+      return
+    self.__check_str(params, 'name', location, True)
+    self.__check_str(params, 'type', location)
+    self.check_dynasty(params.get('dynasty'), f"{location}.dynasty")
+    self.__check_str(params, 'officialPosition', location)
+    self.__check_attrs(params, location)
+
+  def check_extra(self, params: Any, location: str, dbfile: Union[BookFile, None] = None):
+    if not self.__is_dict(params, location):
+      return
+    self.__check_str(params, 'name', location, True)
+    self.__check_type(params, location, EXTRA_CONTENT_TYPES)
+    self.__check_str(params, 'ref', location, True)
+    self.__check_ref(params, location)
+    self.__check_attrs(params, location)
+    if (dbfile is not None) and isinstance(params.get('ref'), str) and (len(params['ref']) > 0):
+      self.__read_part(params['ref'], location, dbfile)
+
+  def check_content_piece(self, params: Any, location: str):
+    if not self.__is_dict(params, location):
+      return
+    self.__check_type(params, location, CONTENT_PIECE_TYPES)
+    self.__check_str(params, 'content', location)
+    self.__check_str(params, 'annotator', location)
+    position = params.get('position')
+    if (position is not None) and ((not isinstance(position, int)) or isinstance(position, bool) or (position < 0)):
+      self.__add(f"{location}.position", f"invalid position {repr(position)}")
+    for index, content_piece in enumerate(self.__check_list(params, 'content_pieces', location)):
+      self.check_content_piece(content_piece, f"{location}.content_pieces[{index}]")
+    self.__check_attrs(params, location)
+
+  def check_division(self, params: Any, location: str, dbfile: Union[BookFile, None] = None):
+    """
+    检查卷章。dbfile不为None时，同时检查章节ref对应的章节文件（dbfile必须是分开保存章节的格式）。
+    """
+    if not self.__is_dict(params, location):
+      return
+    self.__check_id(params, location, True)
+    order = params.get('order')
+    if (order is not None) and ((not isinstance(order, int)) or isinstance(order, bool)):
+      self.__add(f"{location}.order", f"invalid order {repr(order)}")
+    self.check_title(params.get('title'), f"{location}.title")
+    for index, author in enumerate(self.__check_list(params, 'authors', location)):
+      self.check_author(author, f"{location}.authors[{index}]")
+    type = self.__check_type(params, location, DIVISION_TYPES)
+    self.__check_ref(params, location)
+    self.__check_attrs(params, location)
+
+    divisions = self.__check_list(params, 'divisions', location)
+    if type == DivisionType.VOLUME.name:
+      for index, division in enumerate(divisions):
+        self.check_division(division, f"{location}.divisions[{index}]", dbfile)
+    elif type == DivisionType.CHAPTER.name:
+      for index, content_piece in enumerate(divisions):
+        self.check_content_piece(content_piece, f"{location}.divisions[{index}]")
+      if (len(divisions) == 0) and (dbfile is not None) and isinstance(params.get('ref'), str) and (len(params['ref']) > 0):
+        self.__check_chapter_part(params, location, dbfile)
+
+  def __read_part(self, ref: str, location: str, dbfile: BookFile) -> Union[bytes, None]:
+    try:
+      return dbfile.read_part(ref)
+    except Exception as e:
+      self.__add(f"{location}.ref", f"can't read part {repr(ref)}: {type(e).__name__}: {e}")
+      return None
+
+  def __check_chapter_part(self, params: Dict, location: str, dbfile: BookFile):
+    ref = params['ref']
+    data = self.__read_part(ref, location, dbfile)
+    if data is None:
+      return
+    try:
+      chapter = utils.json_loads(data)
+    except Exception as e:
+      self.__add(f"{location}.ref", f"can't decode chapter {repr(ref)}: {type(e).__name__}: {e}")
+      return
+
+    location = f"{location}[{ref}]"
+    if not self.__is_dict(chapter, location):
+      return
+    for index, content_piece in enumerate(self.__check_list(chapter, 'divisions', location)):
+      self.check_content_piece(content_piece, f"{location}.divisions[{index}]")
+
+  def check_book(self, params: Any, location: str = "book", dbfile: Union[BookFile, None] = None):
+    if not self.__is_dict(params, location):
+      return
+    self.__check_id(params, location, False)
+    self.check_title(params.get('title'), f"{location}.title")
+    for index, author in enumerate(self.__check_list(params, 'authors', location)):
+      self.check_author(author, f"{location}.authors[{index}]")
+    self.check_dynasty(params.get('dynasty'), f"{location}.dynasty")
+    for index, category in enumerate(self.__check_list(params, 'categories', location)):
+      if not isinstance(category, str):
+        self.__add(f"{location}.categories[{index}]", f"should be a string, not {type(category).__name__}")
+    self.__check_str(params, 'source', location)
+    self.__check_str(params, 'description', location)
+    date = params.get('date')
+    if date is not None:
+      try:
+        datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+      except (ValueError, TypeError):
+        self.__add(f"{location}.date", f"invalid date {repr(date)}")
+    for index, division in enumerate(self.__check_list(params, 'divisions', location)):
+      self.check_division(division, f"{location}.divisions[{index}]", dbfile)
+    for index, extra in enumerate(self.__check_list(params, 'extras', location)):
+      self.check_extra(extra, f"{location}.extras[{index}]", dbfile)
+    self.__check_attrs(params, location)
+
+
+def validate_bookfile(path: str) -> List[str]:
+  """
+  检查一本书籍文件（包括所有的章节文件），输出所有不合法的地方，没有时为空列表。
+  """
+  validator = BookValidator()
+  dbfile = BookFile(None)
+  try:
+    toc = dbfile.open(path)
+    if toc is None:
+      return [f"'{path}' isn't a docbook file"]
+    # SINGLE_FILE包含所有的章节，其他格式需要检查每一个章节文件
+    validator.check_book(utils.json_loads(toc), dbfile = dbfile if dbfile.type != BookFileType.SINGLE_FILE else None)
+  except Exception as e:
+    validator.violations.append(f"can't read '{path}': {type(e).__name__}: {e}")
+  finally:
+    dbfile.clear()
+  return validator.violations
+
+def validate_archive(path: str, process_num: Union[int, None] = None, mp_context = None) -> Dict[str, List[str]]:
+  """
+  在多个进程中检查文献库中所有的书籍。
+
+  :param path: 文献库目录或者archive.json的路径。
+  :param process_num: 检查的进程数量，缺省为CPU核数。
+  :return: {书籍文件的路径: 不合法的地方}，只包含有问题的书籍。
+  """
+  archive_path = pathlib.Path(path)
+  if archive_path.is_dir():
+    archive_path = archive_path / "archive.json"
+  with open(archive_path, "rb") as file:
+    archive = utils.json_loads(file.read())
+  root = archive_path.resolve().parent.as_posix()
+  paths = [utils.convert_relativepath_to_abspath(item['ref'], root) for item in archive['items']]
+
+  process_num = max(1, min(process_num or os.cpu_count() or 1, len(paths)))
+  results: Dict[str, List[str]] = {}
+  if process_num == 1:
+    violations_list = [validate_bookfile(book_path) for book_path in paths]
+  else:
+    context = mp_context if mp_context is not None else multiprocessing.get_context()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = process_num, mp_context = context) as executor:
+      violations_list = list(executor.map(validate_bookfile, paths))
+
+  for book_path, violations in zip(paths, violations_list):
+    if len(violations) > 0:
+      results[book_path] = violations
+  logger.info(f"Validate archive '{archive_path.as_posix()}': {len(paths)} dbooks, {len(results)} invalid, {sum(len(violations) for violations in results.values())} violations.")
+  return results
@@ -0,0 +1,176 @@
+"""
+docbook_writer.py
+
+docbook_writer把docbook对象一次遍历直接输出为json，同时去掉没有用的值（None、空字符串、空列表、空字典），
+输出的结果与json.dumps(remove_useless_value(obj.to_dict()))一致，但不需要先生成完整的dict再复制两次。
+输出到文件时，已经确定的内容按块写入文件，大的章节也不需要在内存中保存完整的json。
+之前的输出经过json_utils，使用orjson、ujson编码时数字的格式、字符的转义与标准库json不同，
+这些情况下与之前的输出不是逐字节一致的，但解码后的内容相同；使用标准库json编码的情况下逐字节一致。
+"""
+
+import json
+import logging
+
+from typing import Union, List, Dict, Tuple, Callable, Any
+
+logger = logging.getLogger('docbook.writer')
+
+class JsonWriter(object):
+  """
+  去掉没有用的值的json输出。
+  可以输出docbook对象（有iter_json_fields方法的对象），以及由dict、list和基本类型组成的数据。
+
+  一个值是否有用，要在遍历完它的下级内容后才能确定：dict、list先输出前缀，如果最后没有输出任何下级内容，再把前缀撤销。
+  输出了任何一个基本类型的值之后，它所有的上级都是有用的，之前输出的内容都不会再被撤销，可以写入文件。
+  """
+
+  def __init__(self, write: Union[Callable[[bytes], Any], None] = None, indent: Union[int, None] = None, ensure_ascii: bool = False, default: Union[Callable[[Any], Any], None] = None, buffer_size: int = 4096):
+    """
+    :param write: 写入UTF-8编码内容的函数（比如file.write），为None时只在内存中输出，由getvalue()取得。
+    :param indent: 与json.dumps的indent一致，为None时输出紧凑的json。
+    :param ensure_ascii: 是否转义非ASCII字符。
+    :param default: 与json.dumps的default一致，把不能直接输出的值（比如UUID）转换为可以输出的值。
+    :param buffer_size: 缓存的片段数量超过该值时写入一次。
+    """
+    self._write = write
+    self._indent: Union[str, None] = None if indent is None else ' ' * indent
+    self._ensure_ascii: bool = ensure_ascii
+    self._default: Union[Callable[[Any], Any], None] = default
+    self._buffer_size: int = buffer_size
+    self._encode_str: Callable[[str], str] = json.encoder.encode_basestring_ascii if ensure_ascii else json.encoder.encode_basestring
+    self._item_separator: str = ','
+    self._key_separator: str = ':' if indent is None else ': '
+
+    # 还没有写入的片段，以及已经写入的片段数量。撤销的位置为片段的总序号
+    self._chunks: List[str] = []
+    self._flushed: int = 0
+
+  def dump(self, obj: Any) -> bool:
+    """
+    输出obj，obj没有任何有用的值时输出null（与json.dumps(None)一致）。
+    :return: 是否输出了有用的值。
+    """
+    written = self.__write_value(obj, 0)
+    if written == False:
+      self._chunks.append('null')
+    self.flush()
+    return written
+
+  def getvalue(self) -> str:
+    return ''.join(self._chunks)
+
+  def flush(self):
+    if (self._write is not None) and (len(self._chunks) > 0):
+      self._write(''.join(self._chunks).encode('utf-8'))
+      self._flushed += len(self._chunks)
+      self._chunks.clear()
+
+  def __mark(self) -> int:
+    return self._flushed + len(self._chunks)
+
+  def __rollback(self, mark: int):
+    del self._chunks[mark - self._flushed:]
+
+  def __commit(self, chunk: str):
+    """
+    输出一个基本类型的值，之前的内容都已经确定，缓存的片段足够多时写入。
+    """
+    self._chunks.append(chunk)
+    if (self._write is not None) and (len(self._chunks) >= self._buffer_size):
+      self.flush()
+
+  def __newline(self, depth: int) -> str:
+    return '' if self._indent is None else '\n' + self._indent * depth
+
+  def __write_value(self, value: Any, depth: int) -> bool:
+    if value is None:
+      return False
+    elif isinstance(value, str):
+      if len(value) == 0:
+        return False
+      self.__commit(self._encode_str(value))
+      return True
+    elif isinstance(value, dict):
+      return (len(value) > 0) and self.__write_items(value.items(), depth)
+    elif isinstance(value, list):
+      return (len(value) > 0) and self.__write_list(value, depth)
+    elif hasattr(value, 'iter_json_fields'):
+      return self.__write_items(value.iter_json_fields(), depth)
+    elif value is True:
+      self.__commit('true')
+    elif value is False:
+      self.__commit('false')
+    elif isinstance(value, int):
+      self.__commit(int.__repr__(value))
+    elif isinstance(value, float):
+      self.__commit(json.dumps(value))
+    else:
+      # 其他的值（比如tuple、UUID）与remove_useless_value一致，不去掉其中没有用的值
+      indent = None if self._indent is None else len(self._indent)
+      separators = (self._item_separator, self._key_separator)
+      self.__commit(json.dumps(value, ensure_ascii = self._ensure_ascii, indent = indent, separators = separators, default = self._default).replace('\n', self.__newline(depth)))
+    return True
+
+  def __write_items(self, items, depth: int) -> bool:
+    mark = self.__mark()
+    self._chunks.append('{')
+    empty = True
+    for key, value in items:
+      item_mark = self.__mark()
+      self._chunks.append(f"{'' if empty else self._item_separator}{self.__newline(depth + 1)}{self._encode_str(self.__key_to_str(key))}{self._key_separator}")
+      if self.__write_value(value, depth + 1):
+        empty = False
+      else:
+        self.__rollback(item_mark)
+
+    if empty:
+      self.__rollback(mark)
+      return False
+    self._chunks.append(f"{self.__newline(depth)}}}")
+    return True
+
+  def __write_list(self, values: List[Any], depth: int) -> bool:
+    mark = self.__mark()
+    self._chunks.append('[')
+    empty = True
+    for value in values:
+      item_mark = self.__mark()
+      self._chunks.append(f"{'' if empty else self._item_separator}{self.__newline(depth + 1)}")
+      if self.__write_value(value, depth + 1):
+        empty = False
+      else:
+        self.__rollback(item_mark)
+
+    if empty:
+      self.__rollback(mark)
+      return False
+    self._chunks.append(f"{self.__newline(depth)}]")
+    return True
+
+  @staticmethod
+  def __key_to_str(key: Any) -> str:
+    # 与json.dumps对非字符串键的转换一致
+    if isinstance(key, str):
+      return key
+    elif (key is True) or (key is False) or (key is None):
+      return json.dumps(key)
+    elif isinstance(key, int):
+      return int.__repr__(key)
+    elif isinstance(key, float):
+      return json.dumps(key)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {key.__class__.__name__}")
+
+
+def dumps_json(obj: Any, ensure_ascii: bool = False, indent: Union[int, None] = None, default: Union[Callable[[Any], Any], None] = None) -> str:
+  """
+  输出去掉没有用的值的json字符串。
+  """
+  writer = JsonWriter(indent = indent, ensure_ascii = ensure_ascii, default = default)
+  writer.dump(obj)
+  return writer.getvalue()
+
+def dump_json(obj: Any, file, ensure_ascii: bool = False, indent: Union[int, None] = None):
+  """
+  把去掉没有用的值的json写入以二进制方式打开的文件。
+  """
+  JsonWriter(file.write, indent = indent, ensure_ascii = ensure_ascii).dump(obj)
@@ -1,10 +1,28 @@
 # query/__init__.py
 
+from .query_tree import QueryPhrase, QueryNode, QueryTerm, QueryNot, QueryAnd, QueryOr, QueryNear, QueryField, split_query_tree
+from .query_matcher import KeywordMatcher
+from .query_normalize import normalize_text, add_variants, freeze_fold_table, get_fold_table_hash, sync_fold_table
 from .query_core import Query
 from .query_results import QueryResultPiece, QueryResults
 
 __all__ = [
   'Query',
+  'QueryPhrase',
+  'QueryNode',
+  'QueryTerm',
+  'QueryNot',
+  'QueryAnd',
+  'QueryOr',
+  'QueryNear',
+  'QueryField',
+  'split_query_tree',
+  'KeywordMatcher',
+  'normalize_text',
+  'add_variants',
+  'freeze_fold_table',
+  'get_fold_table_hash',
+  'sync_fold_table',
   'QueryResults',
   'QueryResultPiece'
 ]
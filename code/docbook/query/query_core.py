@@ -7,9 +7,13 @@ query_core.py
 import re
 import logging
 
-from typing import Union, List, Dict, Tuple
+from typing import Union, List, Dict, Tuple, Callable, Any
 from enum import Enum
 
+from .query_tree import QueryPhrase, QueryNode, QueryTerm, QueryNot, QueryAnd, QueryOr, QueryNear, QueryField, split_query_tree
+from .query_matcher import KeywordMatcher
+from .query_normalize import normalize_text, normalize_pattern
+
 logger = logging.getLogger('query.core')
 
 class Query(object):
@@ -17,14 +21,30 @@ class Query(object):
   查询条件对象，负责对给定的内容判断是否符合查询语句条件。
   """
 
+  # 普通文本关键字的数量达到这个值时，用KeywordMatcher扫描一遍代替对每一个关键字分别扫描
+  MATCHER_TERM_NUM: int = 16
+
+  # 查询语句中的词：引号中的短语（可以带有字段名），或者不包含空格的词
+  WORD_PATTERN = re.compile(r'([A-Za-z]+:)?"([^"]*)"|([^ "]+)')
+  # 邻近操作符：NEAR/n，BEFORE/n
+  PROXIMITY_PATTERN = re.compile(r'^(NEAR|BEFORE)/(\d+)$')
+  # 字段条件：字段名:值
+  FIELD_PATTERN = re.compile(r'^([A-Za-z]+):(.+)$', re.DOTALL)
+
+  # 书籍、卷章的字段名
+  BOOK_FIELDS: Tuple[str, ...] = ('title', 'author', 'dynasty', 'category')
+  # 段落的字段名
+  CONTENT_PIECE_FIELDS: Tuple[str, ...] = ('annotator', 'type')
+  # 查询语句中可以使用的字段名，其他的'xxx:'仍然作为普通的关键字
+  FIELDS: Tuple[str, ...] = BOOK_FIELDS + CONTENT_PIECE_FIELDS
+
   def __init__(self, query_string: str = None):
     """
     初始化QueryObject对象。
 
     :param query_string: 查询语句。
     """
-    self._query_string = None if query_string is None else query_string
-    self._query_list = None if query_string is None else self.parse_query(query_string)
+    self.query_string = query_string
 
   @property
   def query_string(self):
@@ -34,11 +54,39 @@ class Query(object):
   def query_string(self, query_string: str = None):
     self._query_string = None if query_string is None else query_string
     self._query_list = None if query_string is None else self.parse_query(query_string)
+    # 字段条件和内容的查询条件分开保存
+    self._field_tree, self._query_tree = Query.split_fields(None if query_string is None else self.compile_query(self._query_list))
+    self._matcher = None
 
   @property
   def query_list(self):
     return self._query_list
 
+  @property
+  def query_tree(self) -> Union[QueryNode, None]:
+    """
+    内容的查询条件，不包含字段条件。
+    """
+    return self._query_tree
+
+  @property
+  def field_tree(self) -> Union[QueryNode, None]:
+    """
+    字段条件（只包含QueryField），与query_tree以AND组合，没有字段条件时为None。
+    """
+    return self._field_tree
+
+  @property
+  def matcher(self) -> KeywordMatcher:
+    """
+    查询语句的多关键字匹配器，在第一次使用时创建。
+    需要高亮的关键字为get_query_keys()的输出，语法树中其他的普通文本关键字只用于查询条件判断。
+    """
+    if self._matcher is None:
+      terms = [] if self._query_tree is None else [term.word for term in self._query_tree.get_terms() if term.pattern is None]
+      self._matcher = KeywordMatcher(self.get_query_keys(), terms)
+    return self._matcher
+
   def __parse_nestedbrackets_to_list(self, s: str, i: int = 0, level: int = 0) -> Tuple[int, List[str], int]:
     """
     对带小括号的字符串解码为嵌套的list。
@@ -73,7 +121,13 @@ class Query(object):
     result = []
     content = ''
     while i < len(s):
-      if s[i] == '(':
+      if s[i] == '"':
+        # 引号中的短语原样保留，其中的括号不是嵌套
+        end = s.find('"', i + 1)
+        end = len(s) if end < 0 else end + 1
+        content += s[i : end]
+        i = end
+      elif s[i] == '(':
         if len(content):
           logger.debug(f"L{level}, {content}")
           result.append(content)
@@ -95,144 +149,221 @@ class Query(object):
       content = ''
     return i, result, level
 
-  def __judge_condition(self, conditiona: Union[bool, None], conditionb: Union[bool, None], operator: str) -> bool:
+  @staticmethod
+  def normalize_word(word: str) -> str:
     """
-    输出对两个条件进行操作符指定操作后的结果。
+    归一化查询语句中的词（见query_normalize）：普通文本、短语与内容一样归一化，正则表达式只归一化其中的非ASCII字符。
+    归一化后普通文本仍然是普通文本，正则表达式仍然是正则表达式。
+    """
+    if isinstance(word, QueryPhrase):
+      return QueryPhrase(normalize_text(word))
+    return normalize_text(word) if QueryTerm.is_literal(word) else normalize_pattern(word)
 
-    :param conditiona: 条件A
-    :param conditiona: 条件B
-    :param operator: 条件操作符号，AND, OR
-    :return: 输出条件执行后的结果。
+  @staticmethod
+  def split_words(query_string: str) -> List[str]:
     """
-    if conditiona is None and conditionb is not None:
-      return conditionb
-    if conditionb is None and conditiona is not None:
-      return conditiona
+    将不包含括号的查询语句按照空格分成词，引号中的短语作为一个词（QueryPhrase）。
+    每一个词都已经归一化（normalize_word），比如：'於'和'于'是同一个关键字。
 
-    # assert operator == 'AND' or operator == 'OR'
-    if operator == 'AND':
-      return conditiona and conditionb
-    elif operator == 'OR':
-      return conditiona or conditionb
-    else:
-      return conditiona and conditionb
-      # logger.error(f"Error in A: {conditiona}, B: {conditionb}, operator: {operator}.")
-
-  def __excute_single_query(self,
-      query: str,
-      content: str,
-      last_condition: Union[bool, None] = None,
-      operator: Union[str, None] = None,
-      not_operator: bool = False,
-      level: int = 0
-  ) -> Tuple[Union[bool, None], str, bool]:
-    """
-    对给定的content，执行query查询，并和last_condition进行条件操作。
-
-    :param query: 非嵌套的查询语句，有三种形式，如：
-      1. query type1 = condition + operator + [query type1]
-      2. query type2 = operator
-      3. query type3 = operator + condition + [query type2 | query type3]
-      其中,
-      query中的operator = AND | OR | NOT | AND + NOT | OR + NOT
-    :param last_condition: 上一个查询条件结果。
-    :param operator: 上一个查询条件和本次查询条件的条件操作符。
-    :param not_operator: 本次条件是否是包含not前缀操作符。
-    :return:
-      tuple: 包含三个元素的元组。
-      第一个元素，执行条件查询后的结果；
-      第二个元素，未执行完成的条件操作符；
-      第三个元素，未执行完成的条件操作符是否是包含not前缀操作符。
-    NOTE: 应该处理当条件已经变成FALSE后，就不应该在往下处理。
-    """
-    operator = operator
-    not_operator = not_operator
-    last_condition = last_condition
-    result = last_condition
-    condition = None
-    for index, word in enumerate(query):
-      if len(word) == 0:
+    示例:
+      >>> Query.split_words('"君子 小人" NEAR/5 大人')
+      ['君子 小人', 'NEAR/5', '大人']
+    """
+    words = []
+    for match in Query.WORD_PATTERN.finditer(query_string):
+      if match.group(3) is not None:
+        words.append(Query.normalize_word(match.group(3)))
         continue
-      upper_word = word.upper()
-      if upper_word == 'AND' or upper_word == 'OR':
-        operator = upper_word
-      elif upper_word == 'NOT':
-        not_operator = True
-      else:
-        match = [m.start() for m in re.finditer(word, content)]
-        condition = True if len(match) else False
-
-        if not_operator:
-          condition = not condition
-          not_operator = False
-        if last_condition is not None:
-          result = self.__judge_condition(last_condition, condition, operator)
-          operator = None
-          last_condition = result
-        else:
-          last_condition = condition
-          condition = None
-      logger.debug(
-          f"{'': <{level*2}}{index}: {word}, A: {last_condition}, B: {condition}, operator: {operator}, not: {not_operator}.")
-    return last_condition, operator, not_operator
-
-  def __excute_query(self,
-      querylist: List[str],
-      content: str,
-      last_condition: Union[bool, None] = None,
-      operator: Union[str, None] = None,
-      not_operator: bool = False,
-      level: int = 0
-  ) -> Tuple[Union[bool, None], str, bool, int]:
-    """
-    对给定的content，执行querylist嵌套查询，并和last_condition进行条件操作。
-
-    :param querylist: 嵌套查询对象。
-    :param last_condition: 上一个查询条件结果。
-    :param operator: 上一个查询条件和本次查询条件的条件操作符。
-    :param not_operator: 本次条件是否是包含not前缀操作符。
-    :return:
-      tuple: 包含三个元素的元组。
-      第一个元素，执行条件查询后的结果；
-      第二个元素，未执行完成的条件操作符；
-      第三个元素，未执行完成的条件操作符是否是包含not前缀操作符。
-    NOTE: 应该处理当条件已经变成FALSE后，就不应该在往下处理。
-    """
-    last_condition = last_condition
-    operator = operator
-    not_operator = not_operator
-    level = level
+      prefix, phrase = match.group(1), match.group(2)
+      if (prefix is not None) and (prefix[:-1].lower() in Query.FIELDS):
+        # 字段的值可以用引号括起来，其中可以有空格
+        if len(phrase) > 0:
+          words.append(Query.normalize_word(prefix + phrase))
+        continue
+      if prefix is not None:
+        words.append(prefix)
+      if len(phrase) > 0:
+        words.append(Query.normalize_word(QueryPhrase(phrase)))
+    return words
+
+  @staticmethod
+  def parse_operator(word: str) -> Union[str, Tuple[str, int], None]:
+    """
+    判断词是否为操作符：'AND'、'OR'、'NOT'，或者('NEAR', n)、('BEFORE', n)；不是操作符时返回None。
+    引号中的短语不是操作符。
+    """
+    if isinstance(word, QueryPhrase):
+      return None
+    upper_word = word.upper()
+    if upper_word in ('AND', 'OR', 'NOT'):
+      return upper_word
+    match = Query.PROXIMITY_PATTERN.match(upper_word)
+    if match is not None:
+      return match.group(1), int(match.group(2))
+    return None
+
+  @staticmethod
+  def parse_field(word: str) -> Union[Tuple[str, str], None]:
+    """
+    判断词是否为字段条件，比如：'title:周易'，输出(字段名, 值)；不是字段条件时返回None。
+    字段名不区分大小写，只有FIELDS中的字段名是字段条件，引号中的短语不是字段条件。
+    """
+    if isinstance(word, QueryPhrase):
+      return None
+    match = Query.FIELD_PATTERN.match(word)
+    if (match is None) or (match.group(1).lower() not in Query.FIELDS):
+      return None
+    return match.group(1).lower(), match.group(2)
+
+  @staticmethod
+  def __compile_term(word: str) -> QueryNode:
+    field = Query.parse_field(word)
+    return QueryTerm(word) if field is None else QueryField(*field)
+
+  @staticmethod
+  def split_fields(tree: Union[QueryNode, None]) -> Tuple[Union[QueryNode, None], Union[QueryNode, None]]:
+    """
+    把语法树分为字段条件和内容的查询条件，两者以AND组合。
+    字段条件只能以AND与内容的查询条件组合，比如：'title:周易 and (君子 or 小人)'，
+    书籍、卷章的字段条件也只能以AND与段落的字段条件组合，比如：'title:周易 and (annotator:王弼 or annotator:韓康伯)'，
+    否则（比如：'title:周易 or 君子'、'title:周易 or type:annotation'）抛出ValueError，在解码查询语句时就报告错误。
+
+    :return: (字段条件, 内容的查询条件)，没有的部分为None。
+    """
+    field_tree, query_tree = split_query_tree(tree, lambda node: len(node.get_terms()) == 0)
+    if (query_tree is not None) and (len(query_tree.get_fields()) > 0):
+      raise ValueError("Field terms must be combined with the other keywords by AND.")
+    _, content_piece_tree = Query.split_book_fields(field_tree)
+    if (content_piece_tree is not None) and any(field.field not in Query.CONTENT_PIECE_FIELDS for field in content_piece_tree.get_fields()):
+      raise ValueError("Book fields and content piece fields must be combined by AND.")
+    return field_tree, query_tree
+
+  @staticmethod
+  def split_book_fields(field_tree: Union[QueryNode, None]) -> Tuple[Union[QueryNode, None], Union[QueryNode, None]]:
+    """
+    把字段条件分为书籍、卷章的字段条件和段落的字段条件，两者以AND组合。
+
+    :return: (书籍、卷章的字段条件, 段落的字段条件)，没有的部分为None。
+    """
+    return split_query_tree(field_tree, lambda node: all(field.field in Query.BOOK_FIELDS for field in node.get_fields()))
+
+  @staticmethod
+  def __combine(last_value: Any, value: Any, operator: Union[str, Tuple[str, int], None], and_func: Callable[[Any, Any], Any], or_func: Callable[[Any, Any], Any], near_func: Union[Callable[[Any, Any, int, bool], Any], None]) -> Any:
+    if operator == 'OR':
+      return or_func(last_value, value)
+    elif isinstance(operator, tuple):
+      # 没有给出near_func时，NEAR/BEFORE按照AND计算（AND是它们的超集）
+      if near_func is None:
+        return and_func(last_value, value)
+      return near_func(last_value, value, operator[1], operator[0] == 'BEFORE')
+    return and_func(last_value, value)
+
+  def __reduce_query(self,
+      querylist: List[Union[str, list]],
+      term_func: Callable[[str], Any],
+      not_func: Callable[[Any], Any],
+      and_func: Callable[[Any, Any], Any],
+      or_func: Callable[[Any, Any], Any],
+      near_func: Union[Callable[[Any, Any, int, bool], Any], None] = None,
+      last_value: Any = None,
+      operator: Union[str, Tuple[str, int], None] = None,
+      not_operator: bool = False
+  ) -> Tuple[Any, Union[str, Tuple[str, int], None], bool]:
+    """
+    按照从左到右、无优先级、缺省操作符为AND的规则遍历querylist，
+    由term_func/not_func/and_func/or_func/near_func来计算每一步的值。
+    """
     for q in querylist:
       if isinstance(q, list):
-        logger.debug(f"{'': <{level*2}}L{level}, sub-query begin: {q}")
-        sub_last_condition, sub_operator, sub_not_operator, _ = self.__excute_query(
-            q, content, last_condition=None, operator=None, not_operator=False, level=level+1)
-
-        if not_operator:
-          sub_last_condition = not sub_last_condition
+        sub_value, sub_operator, sub_not_operator = self.__reduce_query(
+            q, term_func, not_func, and_func, or_func, near_func)
+        if not_operator and sub_value is not None:
+          sub_value = not_func(sub_value)
         not_operator = sub_not_operator
-        if last_condition is not None:
-          result = self.__judge_condition(
-              last_condition, sub_last_condition, operator)
+        if last_value is not None:
+          if sub_value is not None:
+            last_value = Query.__combine(last_value, sub_value, operator, and_func, or_func, near_func)
           operator = sub_operator
-          last_condition = result
         else:
-          last_condition = sub_last_condition
-        logger.debug(
-            f"{'': <{level*2}}L{level}, sub-query end: L: {last_condition}, operator: {operator}, not: {not_operator}.")
+          last_value = sub_value
       else:
-        result = q.split(" ")  # 以空格为分隔符分割字符串 "apple banana cherry"
-        logger.debug(f"{'': <{level*2}}L{level}, query begin: " +
-                     "/".join(result))  # 输出结果为 ['apple', 'banana', 'cherry']
-        last_condition, operator, not_operator = self.__excute_single_query(
-            result, content, last_condition=last_condition, operator=operator, not_operator=not_operator, level=level)
-        logger.debug(
-            f"{'': <{level*2}}L{level}, query end: L: {last_condition}, operator: {operator}, not: {not_operator}.")
-    return last_condition, operator, not_operator, level
+        for word in Query.split_words(q):
+          word_operator = Query.parse_operator(word)
+          if word_operator == 'NOT':
+            not_operator = True
+          elif word_operator is not None:
+            operator = word_operator
+          else:
+            value = term_func(word)
+            if not_operator:
+              value = not_func(value)
+              not_operator = False
+            if last_value is not None:
+              last_value = Query.__combine(last_value, value, operator, and_func, or_func, near_func)
+              operator = None
+            else:
+              last_value = value
+    return last_value, operator, not_operator
+
+  def reduce_query(self,
+      term_func: Callable[[str], Any],
+      not_func: Callable[[Any], Any],
+      and_func: Callable[[Any, Any], Any],
+      or_func: Callable[[Any, Any], Any],
+      query_list: Union[List[str], None] = None,
+      near_func: Union[Callable[[Any, Any, int, bool], Any], None] = None
+  ) -> Any:
+    """
+    用给定的函数对查询语句进行归约。
+    用于将查询语句映射到不同的求值方式上，比如：编译为语法树，或者倒排索引的posting集合的交、并、差运算。
+
+    :param term_func: 关键字的求值函数。引号中的短语以QueryPhrase传入，字段条件以'字段名:值'传入（见parse_field）。
+    :param not_func: NOT操作的求值函数。
+    :param and_func: AND操作的求值函数。
+    :param or_func: OR操作的求值函数。
+    :param query_list:
+      查询语句列表。
+      缺省为空，默认为QueryObject对象初始化时的查询语句解码后的查询语句列表。
+    :param near_func:
+      NEAR/n、BEFORE/n操作的求值函数：near_func(a, b, n, 是否为BEFORE)。
+      缺省为None，按照AND计算，得到的是实际结果的超集（比如：用于索引、签名缩小搜索范围）。
+    :return: 归约后的值，如果没有任何关键字，返回None。
+
+    示例:
+      >>> qo = Query('君子 and not 小人')
+      >>> qo.reduce_query(lambda w: w, lambda a: f"-{a}", lambda a, b: f"({a}*{b})", lambda a, b: f"({a}+{b})")
+      '(君子*-小人)'
+    """
+    query_list = self._query_list if query_list is None else query_list
+    if query_list is None:
+      return None
+    value, _, _ = self.__reduce_query(query_list, term_func, not_func, and_func, or_func, near_func)
+    return value
+
+  @staticmethod
+  def is_literal_key(key: str) -> bool:
+    """
+    判断关键字是否为普通文本（不包含正则表达式的特殊字符）。字段条件不是内容中的文本，不是普通文本。
+    """
+    return QueryTerm.is_literal(key) and (Query.parse_field(key) is None)
+
+  def compile_query(self, query_list: List[Union[str, list]]) -> Union[QueryNode, None]:
+    """
+    将解码后的查询语句列表编译为语法树，字段条件编译为QueryField（用split_fields分开）。
+
+    :param query_list: 查询语句列表。
+    :return: 语法树的根节点，如果查询语句中没有任何关键字，返回None。
+
+    示例:
+      >>> qo = Query()
+      >>> qo.compile_query(qo.parse_query("(大人 or 小人) and not 君子"))
+      QueryAnd(QueryOr(QueryTerm('大人'), QueryTerm('小人')), QueryNot(QueryTerm('君子')))
+    """
+    return self.reduce_query(Query.__compile_term, QueryNot, QueryAnd, QueryOr, query_list, QueryNear)
 
   def get_query_keys(self, query_string: Union[str, None] = None) -> List[str]:
     """
-    获取查询语句中的关键字。
+    获取查询语句中的关键字（已经归一化），不包括字段条件。
 
     :param query_string:
       查询语句字符串。
@@ -241,9 +372,9 @@ class Query(object):
       list，包含关键字的字符串数组。
 
     示例:
-      >>> qo = Query("大人 and 小人 not 君子")
+      >>> qo = Query('大人 and 小人 not 君子 or ("聖 人" NEAR/5 天)')
       >>> qo.get_query_keys()
-    ['大人', '小人', '君子']
+    ['大人', '小人', '君子', '圣 人', '天']
 
     原则上'君子'是不应该输出的。因为，君子在查询语句中是否定条件。
     """
@@ -251,12 +382,14 @@ class Query(object):
     if query_string is None:
       return []
 
-    operators = ['and', 'AND', 'or', 'OR', 'not', 'NOT', '(', ')']
-    for operator in operators:
-      query_string = query_string.replace(operator, '')
-
-    keys = query_string.split(' ')
-    keys = [key for key in keys if len(key)]
+    keys = []
+    def collect_keys(query_list: List[Union[str, list]]):
+      for q in query_list:
+        if isinstance(q, list):
+          collect_keys(q)
+        else:
+          keys.extend(word for word in Query.split_words(q) if (Query.parse_operator(word) is None) and (Query.parse_field(word) is None))
+    collect_keys(self._query_list if query_string is self._query_string else self.parse_query(query_string))
     return keys
 
   def parse_query(self, query_string: str) -> List[str]:
@@ -279,14 +412,15 @@ class Query(object):
     _, query_list, _ = self.__parse_nestedbrackets_to_list(query_string)
     return query_list
 
-  def excute_query(self, content: str, query_list: Union[List[str], None] = None) -> bool:
+  def excute_query(self, content: str, query_list: Union[List[str], None] = None, normalized: bool = False) -> bool:
     """
     对给定的内容，判断是否符合查询条件。
 
     :param content: 给定的内容字符串。
     :param query_list:
       查询语句列表。
-      缺省为空，默认为QueryObject对象初始化时的查询语句解码后的查询语句列表。
+      缺省为空，默认为QueryObject对象初始化时编译好的语法树。
+    :param normalized: content是否已经归一化（比如：ChapterSpan.search_text），为False时先归一化。
 
     :return:
       boolean，True符合查询条件；False，不符合查询条件。
@@ -298,8 +432,38 @@ class Query(object):
     """
     query_list = self._query_list if query_list is None else query_list
     if query_list is not None:
-      result, _, _, _ = self.__excute_query(query_list, content)
-      return result
+      if not normalized:
+        content = normalize_text(content)
+      query_tree = self._query_tree if query_list is self._query_list else Query.split_fields(self.compile_query(query_list))[1]
+      return None if query_tree is None else query_tree.evaluate(content)
     else:
       logger.warning(f"no query string...")
-      return False
\ No newline at end of file
+      return False
+
+  def match_query(self, content: str, normalized: bool = False) -> Union[List[Tuple[int, int]], None]:
+    """
+    对给定的内容，判断是否符合查询条件，符合时同时给出关键字的匹配结果，供高亮时使用，不用再次扫描。
+    归一化不改变文字的位置，匹配结果的位置也就是原文中的位置，可以直接在原文上高亮。
+
+    普通文本关键字较少时，先用语法树判断（'in'判断比扫描一遍的匹配器快），只对符合条件的内容执行匹配器；
+    关键字较多时，先执行匹配器，语法树直接使用匹配器找到的关键字集合来判断。
+
+    :param content: 给定的内容字符串。
+    :param normalized: content是否已经归一化（比如：ChapterSpan.search_text），为False时先归一化。
+    :return: 不符合查询条件时为None，否则为KeywordMatcher.search()的匹配结果。
+      只有字段条件时，所有的内容都符合查询条件（字段条件由调用者判断），匹配结果为空。
+    """
+    query_tree = self._query_tree
+    if query_tree is None:
+      return None if self._field_tree is None else []
+    if not normalized:
+      content = normalize_text(content)
+
+    matcher = self.matcher
+    if len(matcher.all_keys) >= Query.MATCHER_TERM_NUM:
+      matches = matcher.search(content)
+      return matches if query_tree.evaluate_found(matcher.found_keys(matches), content) else None
+    elif query_tree.evaluate(content):
+      return matcher.search(content)
+    else:
+      return None
@@ -0,0 +1,101 @@
+"""
+query_matcher.py
+
+多关键字匹配器。对一段文本只扫描一遍，就能找出所有关键字出现的位置，供查询条件判断和关键字高亮共同使用。
+
+实现上没有用纯Python来逐字遍历Aho–Corasick自动机（逐字的Python循环比re模块慢一个数量级），
+而是把所有关键字按长度从长到短编译为一个前瞻（lookahead）的正则表达式，由re模块在C代码中逐位置匹配，
+每个位置给出从该位置开始的最长关键字。再用预先计算好的关键字之间的包含关系（相当于自动机的输出链接），
+推导出所有出现的关键字以及高亮时每个位置应该使用的关键字。
+"""
+
+import re
+import logging
+
+from typing import Union, List, Dict, Tuple, Set
+
+logger = logging.getLogger('query.matcher')
+
+class KeywordMatcher(object):
+  """
+  多关键字匹配器。
+
+  匹配结果为[(位置, 关键字序号)]，按位置升序排列，关键字序号是从该位置开始的最长关键字在all_keys中的序号。
+  """
+
+  def __init__(self, keys: List[str], extra_keys: Union[List[str], None] = None):
+    """
+    :param keys: 需要高亮的关键字，关键字在keys中的序号决定高亮时的颜色。
+    :param extra_keys: 只用于查询条件判断，不需要高亮的关键字。
+    """
+    self._keys: List[str] = list(dict.fromkeys(key for key in keys if len(key) > 0))
+    self._all_keys: List[str] = list(self._keys)
+    if extra_keys is not None:
+      self._all_keys.extend(key for key in dict.fromkeys(extra_keys) if len(key) > 0 and key not in self._keys)
+
+    # 每一个关键字所包含的所有关键字
+    self._contains: List[Tuple[str, ...]] = [tuple(k for k in self._all_keys if k in key) for key in self._all_keys]
+
+    # 每一个关键字的前缀中，在keys中序号最小的关键字，高亮时在同一位置优先使用该关键字
+    self._highlight_keys: List[Union[int, None]] = []
+    for key in self._all_keys:
+      prefixes = [index for index, k in enumerate(self._keys) if key.startswith(k)]
+      self._highlight_keys.append(prefixes[0] if len(prefixes) else None)
+
+    if len(self._all_keys):
+      key_indexes = {key: index for index, key in enumerate(self._all_keys)}
+      pattern = '|'.join(re.escape(key) for key in sorted(self._all_keys, key = len, reverse = True))
+      self._pattern: Union[re.Pattern, None] = re.compile(f'(?=({pattern}))')
+      self._key_indexes: Dict[str, int] = key_indexes
+    else:
+      self._pattern = None
+      self._key_indexes = {}
+
+  @property
+  def keys(self) -> List[str]:
+    return self._keys
+
+  @property
+  def all_keys(self) -> List[str]:
+    return self._all_keys
+
+  def search(self, text: str) -> List[Tuple[int, int]]:
+    """
+    对text扫描一遍，输出所有关键字出现的位置。
+
+    示例:
+      >>> KeywordMatcher(['大人', '人']).search('大人之爱小人也')
+      [(0, 0), (1, 1), (5, 1)]
+    """
+    if self._pattern is None:
+      return []
+    key_indexes = self._key_indexes
+    return [(match.start(), key_indexes[match.group(1)]) for match in self._pattern.finditer(text)]
+
+  def found_keys(self, matches: List[Tuple[int, int]]) -> Set[str]:
+    """
+    输出匹配结果中出现过的所有关键字。
+    """
+    found = set()
+    for index in {index for _, index in matches}:
+      found.update(self._contains[index])
+    return found
+
+  def highlight_spans(self, matches: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    从匹配结果中选出需要高亮的文字，规则与依次尝试keys的正则表达式'(key1|key2|...)'一致：
+    从左到右选出互不重叠的关键字，同一位置优先使用在keys中序号最小的关键字。
+
+    :return: [(起始位置, 结束位置, 关键字在keys中的序号)]
+    """
+    spans = []
+    end = 0
+    for start, index in matches:
+      if start < end:
+        continue
+      key_index = self._highlight_keys[index]
+      if key_index is None:
+        continue
+      end = start + len(self._keys[key_index])
+      spans.append((start, end, key_index))
+    return spans
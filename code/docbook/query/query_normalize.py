@@ -0,0 +1,161 @@
+"""
+query_normalize.py
+
+文本归一化：把异体字、繁体字折叠为同一个字，把全角的字母、数字和标点折叠为半角，使搜索不区分这些写法，
+比如：'於'、'于'都折叠为'于'，查询语句中不再需要写'(於 or 于)'。
+
+归一化只做一个字到一个字的替换（str.translate），归一化后的文本与原文长度相同、位置一一对应，
+因此归一化文本上的匹配位置就是原文上的位置：索引中的位置、NEAR/BEFORE的距离和高亮都不需要另外的位置映射表。
+章节的span在建立时归一化一次（ChapterSpan.search_text），字符签名和n-gram索引都建立在归一化文本上；
+查询语句中的关键字在分词时以同样的方式归一化（Query.split_words），命中后在原文上高亮。
+
+折叠表只能在第一次建立章节的span表之前修改（add_variants），之后修改会抛出RuntimeError：
+已经建立的span表、字符签名都是用原来的折叠表建立的。n-gram索引和文献库的快照中保存了折叠表的hash（get_fold_table_hash），
+折叠表改变后它们被认为已经过期，重新建立。
+"""
+
+import re
+import json
+import hashlib
+import logging
+
+from typing import Union, List, Dict, Iterable
+
+logger = logging.getLogger('query.normalize')
+
+# 异体字、繁简字组：每一组的第一个字为归一化后的字，其余的字折叠为它
+# 简体字本身也是另一个常用古字的（比如：後/后、雲/云、乾/干、裏/里），不折叠，避免混淆不同的字
+VARIANTS = (
+  "于於 为為爲 与與 万萬 个個箇 么麼 义義 乌烏 乐樂 书書 买買 乱亂 争爭 亏虧 亚亞 产產 亲親 亿億 仅僅 从從 仑侖 仓倉 仪儀 们們 "
+  "众眾衆 优優 会會 伟偉 传傳 伤傷 伦倫 体體 侠俠 侣侶 侦偵 侧側 侨僑 俭儉 债債 倾傾 偿償 储儲 儿兒 兑兌 关關 兴興 兹茲 养養 "
+  "兽獸 内內 冈岡 册冊 写寫 军軍 农農 冯馮 决決 况況 冻凍 净淨 凉涼 减減 凤鳳 凭憑 击擊 凿鑿 刘劉 则則 刚剛 创創 删刪 别別 "
+  "剑劍劒 剧劇 劝勸 办辦 务務 动動 励勵 劳勞 势勢 勋勳 匀勻 区區 医醫 华華 协協 单單 卖賣 卢盧 卫衛衞 却卻 厅廳 历歷 压壓 "
+  "厌厭 县縣 参參 双雙 发發 变變 叙敘敍 号號 叹嘆歎 吕呂 吗嗎 启啟啓 吴吳呉 呜嗚 员員 听聽 咏詠 响響 哑啞 唤喚 啸嘯 喷噴 嘱囑 "
+  "团團 园園 围圍 国國 图圖 圆圓 圣聖 场場 坏壞 块塊 坚堅 坛壇 坟墳 坠墜 垒壘 垦墾 执執 扩擴 扫掃 扬揚 扰擾 抚撫 报報 护護 "
+  "拟擬 拥擁 拦攔 择擇 挂掛 挚摯 挡擋 挥揮 损損 换換 据據 掷擲 携攜 摄攝 摆擺 摇搖 敌敵 数數 斋齋 断斷 无無 时時 旷曠 昼晝 "
+  "显顯 晋晉 晓曉 暂暫 机機 杀殺 杂雜 权權 条條 来來 杨楊 极極 构構 枪槍 枣棗 标標 栏欄 树樹 样樣 桥橋 梦夢 检檢 楼樓 欢歡 "
+  "欧歐 残殘 殴毆 毁毀 毕畢 毙斃 气氣 汇匯彙 汉漢 汤湯 沟溝 没沒 泪淚 泽澤 洁潔 浅淺 测測 济濟 浑渾 浓濃 润潤 涛濤 涨漲 渊淵 "
+  "渐漸 渔漁 温溫 湾灣 湿濕溼 满滿 滚滾 滞滯 滥濫 潜潛 灭滅 灯燈 灵靈 灾災 炉爐 点點 炼煉鍊 烂爛 烛燭 烟煙 烦煩 烧燒 热熱 "
+  "焕煥 爱愛 爷爺 牵牽 犹猶 狱獄 独獨 狭狹 狮獅 猎獵 猪豬 猫貓 献獻 环環 现現 玺璽 琐瑣 电電 画畫 畅暢 畴疇 疗療 疮瘡 盖蓋 "
+  "盐鹽 监監 盘盤 尽盡儘 尝嘗嚐甞 层層 屡屢 属屬 岁歲嵗 岂豈 岛島 岭嶺 岳嶽 峡峽 峰峯 币幣 师師 帅帥 帐帳 带帶 帮幫 广廣 庄莊 "
+  "庆慶 应應 库庫 废廢 开開 异異 弃棄 张張 弥彌瀰 弯彎 归歸 录錄録 彻徹 忆憶 忧憂 怀懷 态態 怜憐 总總縂 恋戀 恒恆 恳懇 恶惡 "
+  "恼惱 悦悅 悬懸 惊驚 惧懼 惨慘 惩懲 惭慚慙 惯慣 愤憤 戏戲戯 战戰 户戶戸 扑撲 灶竈 礼禮 祷禱 祸禍 离離 种種 积積 称稱 秽穢 "
+  "稳穩 穷窮 窃竊 竞競 笔筆 笋筍 简簡 签簽 篮籃 类類 粮糧 紧緊 纠糾 红紅 约約 级級 纪紀 纯純 纲綱 纳納 纵縱 纷紛 纸紙 纹紋 "
+  "线線綫 练練 组組 细細 织織 终終 经經 结結 绕繞 绘繪 给給 络絡 绝絕 统統 继繼 绩績 续續 维維 绵綿 缘緣 编編 缓緩 缠纏 "
+  "罗羅 罚罰 罢罷 羡羨 习習 职職 联聯 聪聰 肃肅 肠腸 肤膚 肿腫 胁脅 胜勝 脉脈 脑腦 脚腳 脸臉 腾騰 舆輿 舰艦 艺藝 节節 "
+  "芜蕪 苍蒼 苏蘇 茎莖 荡蕩盪 荣榮 药藥 莱萊 获獲穫 营營 萧蕭 蓝藍 虏虜 虑慮 虚虛 虫蟲 虽雖 蚀蝕 蛮蠻 补補 袜襪 装裝 "
+  "见見 观觀 规規 视視 览覽 觉覺 誉譽 计計 订訂 认認 讨討 让讓 训訓 议議 讯訊 记記 讲講 许許 论論 讼訟 设設 访訪 证證 评評 "
+  "识識 诈詐 诉訴 词詞 译譯 试試 诗詩 诚誠 话話 询詢 该該 详詳 语語 误誤 说說説 请請 诸諸 诺諾 读讀 课課 谁誰 调調 谈談 谋謀 "
+  "谓謂 谢謝 谨謹 谱譜 贝貝 负負 贡貢 财財 责責 贤賢 败敗 货貨 质質 贫貧 购購 贯貫 贵貴 贷貸 费費 贺賀 资資 赏賞 赐賜 赋賦 "
+  "赖賴 赞贊讚 赠贈 赵趙 赶趕 趋趨 跃躍 践踐 踪蹤 车車 轨軌 转轉 轮輪 软軟 轻輕 载載 较較 辅輔 辈輩 辉輝 输輸 辞辭辤 边邊 "
+  "辽遼 达達 迁遷 过過 运運 还還 这這 进進 远遠 违違 连連 迟遲 选選 逊遜 递遞 遗遺 邓鄧 邮郵 邻鄰隣 郑鄭 酱醬 释釋 针針鍼 "
+  "钟鐘 钢鋼 钱錢 铁鐵 铃鈴 铜銅 铭銘 银銀 销銷 锁鎖 锋鋒 错錯 锦錦 镇鎮 长長 门門 闪閃 闭閉 问問 闲閒閑 间間 闷悶 闻聞 "
+  "阁閣 阅閱 阔闊 队隊 阳陽 阴陰 阵陣 阶階 际際 陆陸 陈陳 陕陝 险險 随隨 隐隱 隶隸 难難 雏雛 鸡雞鷄 雾霧 须須 顶頂 项項 "
+  "顺順 顾顧 顿頓 预預 领領 频頻 题題 颜顏 额額 风風 飞飛 饥飢饑 饭飯 饮飲 饰飾 饱飽 饿餓 馆館舘 马馬 驰馳 驱驅 驳駁 驶駛 "
+  "驾駕 骂罵 骄驕 骑騎 验驗騐 骚騷 鱼魚 鲁魯 鲜鮮 鸟鳥 鸣鳴 鸿鴻 鹅鵝 鹤鶴 麦麥 黄黃 齐齊 齿齒 龙龍 龟龜 东東 丝絲 丢丟 两兩 "
+  "严嚴 丧喪 临臨 举舉擧 乔喬 乡鄉 亩畝 价價 伞傘 俩倆 兰蘭 冢塚 凯凱 刍芻 剂劑 厉厲 厢廂 厨廚 吨噸 吓嚇 哗嘩譁 嘘噓 坝壩 "
+  "垄壟 够夠 奋奮 奖獎 妆妝粧 妇婦 妈媽 娄婁 娱娛 婴嬰 孙孫 学學 宁寧 宝寶寳 实實 宠寵 审審 宪憲 宽寬 宾賓 对對 寻尋 导導 "
+  "寿壽 将將 尔爾 尘塵 尧堯 屿嶼 岗崗 帜幟 并並竝 庙廟 庐廬 弹彈 强強彊 当當 径徑 忏懺 怅悵 恻惻 悯憫 托託 拣揀 拨撥 挟挾 "
+  "挠撓 挤擠 捞撈 捡撿 掳擄 搀攙 撑撐 敛斂 斩斬 旧舊 晒曬 晕暈 杰傑 枢樞 栋棟 栈棧 梁樑 椭橢 欤歟 歼殲 殇殤 汹洶 沦淪 泻瀉 "
+  "泼潑 洒灑 浇澆 浊濁 涡渦 涣渙 涩澀 渗滲 溃潰 滨濱 滩灘 潇瀟 灿燦 炀煬 烁爍 牍牘 牺犧 犊犢 状狀 狈狽 琼瓊 瑶瑤 疟瘧 疡瘍 "
+  "痒癢 瘫癱 瘾癮 皱皺 盏盞 矫矯 矿礦 码碼 砖磚 础礎 硕碩 确確 碍礙 禀稟 秃禿 税稅 窑窯 窜竄 窝窩 竖豎 笺箋 笼籠 筛篩 筹籌 "
+  "粤粵 纤纖 纬緯 绅紳 绍紹 绎繹 绑綁 绒絨 绢絹 绣繡 绥綏 绪緒 绳繩 绸綢 绿綠 缀綴 缅緬 缆纜 缉緝 缔締 缕縷 缚縛 缝縫 缩縮 "
+  "缮繕 缴繳 羁羈 耸聳 聂聶 肾腎 胶膠 脓膿 脐臍 脱脫 胆膽 舱艙 艰艱 艳艷豔 芦蘆 苇葦 茧繭 荆荊 荫蔭 莹瑩 莺鶯 萤螢 萨薩 蒋蔣 "
+  "蔷薔 蕴蘊 虾蝦 蚁蟻 蝇蠅 蝉蟬 衅釁 衔銜 袄襖 袭襲 裤褲 觅覓 触觸 "
+  # 异体字
+  "真眞 教敎 既旣 即卽 兔兎 群羣 清淸 青靑 吃喫 回迴廻囘 冰氷 床牀 略畧 凶兇 鉴鑒鑑 劫刧 迹跡蹟 秘祕 鼓皷 疏疎 效効 亘亙 "
+  "吞呑 污汙汚 德悳 睹覩 蚕蠶 杯盃 碗盌椀 棋碁 考攷 "
+  # 中文标点的繁简写法
+  "“「｢ ”」｣ ‘『 ’』 。｡ 、､"
+)
+
+def build_fold_table(variants: str = VARIANTS) -> Dict[int, str]:
+  """
+  建立归一化的折叠表（str.translate的映射表）：{字的码位: 归一化后的字}。
+  全角的字母、数字和标点折叠为半角，但在正则表达式中有特殊含义的半角字符（比如：'('、'?'、'.'）不折叠，
+  这样普通文本的关键字归一化后仍然是普通文本，正则表达式中的特殊字符也不会被改变。
+  """
+  table = {}
+  for code in range(0xFF01, 0xFF5F):
+    half = chr(code - 0xFEE0)
+    if re.escape(half) == half:
+      table[code] = half
+  for group in variants.split():
+    for char in group[1:]:
+      if (ord(char) in table) and (table[ord(char)] != group[0]):
+        raise ValueError(f"Variant '{char}' is folded to both '{table[ord(char)]}' and '{group[0]}'.")
+      table[ord(char)] = group[0]
+  # 归一化后的字不能再被折叠，保证归一化可以重复执行（归一化过的文本再归一化不变）
+  for code, char in table.items():
+    if ord(char) in table:
+      raise ValueError(f"'{chr(code)}' is folded to '{char}', which is folded again.")
+  return table
+
+def get_table_hash(table: Dict[int, str]) -> str:
+  return hashlib.sha1(json.dumps(sorted(table.items()), ensure_ascii = False).encode('utf-8')).hexdigest()[:16]
+
+# 普通文本的折叠表
+FOLD_TABLE: Dict[int, str] = build_fold_table()
+# 正则表达式的折叠表：只折叠非ASCII的字，正则表达式的语法不变
+PATTERN_FOLD_TABLE: Dict[int, str] = {code: char for code, char in FOLD_TABLE.items() if code >= 0x80}
+# 折叠表的hash
+FOLD_TABLE_HASH: str = get_table_hash(FOLD_TABLE)
+# add_variants增加的异体字组
+EXTRA_VARIANTS: List[str] = []
+# 折叠表是否已经用于建立章节的span表，之后不能再修改
+_frozen: bool = False
+
+def add_variants(groups: Iterable[str]):
+  """
+  增加异体字组，每一组的第一个字为归一化后的字，比如：add_variants(['峰峯', '群羣'])。
+  只能在载入文献库、建立章节的span表之前调用（比如：程序启动时），否则抛出RuntimeError。
+  """
+  global FOLD_TABLE, PATTERN_FOLD_TABLE, FOLD_TABLE_HASH
+  groups = list(groups)
+  if _frozen:
+    raise RuntimeError("The fold table is already used by the chapter spans, add the variants before loading the archive.")
+  table = build_fold_table(' '.join([VARIANTS, *EXTRA_VARIANTS, *groups]))
+  EXTRA_VARIANTS.extend(groups)
+  FOLD_TABLE = table
+  PATTERN_FOLD_TABLE = {code: char for code, char in table.items() if code >= 0x80}
+  FOLD_TABLE_HASH = get_table_hash(table)
+
+def freeze_fold_table():
+  """
+  标记折叠表已经被使用（章节的span表、字符签名、n-gram索引），之后不能再修改。
+  """
+  global _frozen
+  _frozen = True
+
+def sync_fold_table(extra_variants: List[str], fold_hash: str):
+  """
+  在子进程（载入进程、搜索进程）中使用与主进程相同的折叠表：spawn启动的子进程只有默认的折叠表，需要重新增加异体字组。
+  """
+  if FOLD_TABLE_HASH != fold_hash:
+    add_variants(extra_variants)
+    if FOLD_TABLE_HASH != fold_hash:
+      raise RuntimeError("The fold table of the subprocess is different from the main process.")
+
+def get_fold_table_hash() -> str:
+  """
+  当前折叠表的hash，保存在n-gram索引和文献库的快照中，折叠表改变后它们失效。
+  """
+  return FOLD_TABLE_HASH
+
+def normalize_text(text: Union[str, None]) -> Union[str, None]:
+  """
+  归一化文本，输出与text长度相同、位置一一对应的文本。
+
+  示例:
+    >>> normalize_text('子曰：「學而時習之，不亦說乎？」')
+    '子曰:“学而时习之,不亦说乎？”'
+  """
+  if text is None:
+    return None
+  return text.translate(FOLD_TABLE)
+
+def normalize_pattern(pattern: str) -> str:
+  """
+  归一化正则表达式中的字，ASCII字符（正则表达式的语法）保持不变。
+  """
+  return pattern.translate(PATTERN_FOLD_TABLE)
@@ -18,7 +18,7 @@ logger = logging.getLogger('docbook.query')
 class QueryResultPiece(object):
 #  QueryResultPiece
 #  - directory: []
-#  - hits: [(content, relevance)]
+#  - hits: [(content, relevance, matches, span)], matches为KeywordMatcher.search()的匹配结果，span为命中的span在章节中的序号，都用于高亮
 
   DIRECTORY_TO_DICT_FUNC = None
 
@@ -0,0 +1,372 @@
+"""
+query_tree.py
+
+定义查询语句编译后的语法树。
+查询语句只在创建Query对象时解码、编译一次，之后对每一段内容的判断都直接在语法树上求值，
+关键字的正则表达式预先编译好，普通文本的关键字直接用'in'判断，AND/OR在结果确定后就不再继续求值。
+NEAR/n、BEFORE/n通过合并两个关键字出现位置的有序列表来判断，不需要用正则表达式扫描文本。
+字段条件（比如：'title:周易'）不在内容上求值，由调用者按照书籍、段落的元数据通过evaluate_fields判断。
+语法树中的关键字已经归一化（见query_normalize），evaluate等方法的content也应该是归一化的文本。
+"""
+
+import re
+import bisect
+import logging
+
+from typing import Union, List, Dict, Tuple, Set, Iterator, Callable
+
+from .query_normalize import normalize_text
+
+logger = logging.getLogger('query.tree')
+
+class QueryPhrase(str):
+  """
+  查询语句中用引号括起来的短语，作为普通文本匹配：其中的空格、操作符和正则表达式的特殊字符都不再解释。
+  """
+  __slots__ = ()
+
+
+class QueryNode(object):
+  """
+  语法树节点。
+  """
+  __slots__ = ()
+
+  def evaluate(self, content: str) -> bool:
+    raise NotImplementedError
+
+  def is_positional(self) -> bool:
+    """
+    本节点是否可以输出命中的位置，可以作为NEAR/BEFORE的操作数。
+    """
+    return False
+
+  def get_positions(self, content: str) -> List[Tuple[int, int]]:
+    """
+    输出本节点在content中命中的位置：[(起始位置, 结束位置)]，按照起始位置升序排列。
+    """
+    raise NotImplementedError
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    """
+    用KeywordMatcher已经找出的关键字集合求值，普通文本的关键字不再扫描content。
+    """
+    raise NotImplementedError
+
+  def get_terms(self) -> List['QueryTerm']:
+    """
+    输出本节点下所有的关键字节点。
+    """
+    return []
+
+  def get_fields(self) -> List['QueryField']:
+    """
+    输出本节点下所有的字段节点。
+    """
+    return []
+
+  def evaluate_fields(self, match_field: Callable[['QueryField'], bool]) -> bool:
+    """
+    对只包含字段条件的语法树求值，match_field判断每一个字段条件是否成立。
+    """
+    raise NotImplementedError
+
+
+class QueryTerm(QueryNode):
+  """
+  关键字节点。关键字为普通文本时用'in'判断，否则作为正则表达式预先编译。
+  """
+  __slots__ = ('_word', '_pattern')
+
+  def __init__(self, word: str):
+    self._word: str = word
+    self._pattern: Union[re.Pattern, None] = None if QueryTerm.is_literal(word) else re.compile(word)
+
+  @staticmethod
+  def is_literal(word: str) -> bool:
+    """
+    判断关键字是否为普通文本（不包含正则表达式的特殊字符，或者是引号中的短语）。
+    """
+    return isinstance(word, QueryPhrase) or (re.escape(word) == word)
+
+  @property
+  def word(self) -> str:
+    return self._word
+
+  @property
+  def pattern(self) -> Union[re.Pattern, None]:
+    return self._pattern
+
+  def evaluate(self, content: str) -> bool:
+    if self._pattern is None:
+      return self._word in content
+    return self._pattern.search(content) is not None
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    if self._pattern is None:
+      return self._word in found
+    return self._pattern.search(content) is not None
+
+  def get_terms(self) -> List['QueryTerm']:
+    return [self]
+
+  def is_positional(self) -> bool:
+    return True
+
+  def get_positions(self, content: str) -> List[Tuple[int, int]]:
+    if self._pattern is not None:
+      return [match.span() for match in self._pattern.finditer(content)]
+    # 包括互相重叠的出现位置
+    positions = []
+    word = self._word
+    length = len(word)
+    start = content.find(word)
+    while start >= 0:
+      positions.append((start, start + length))
+      start = content.find(word, start + 1)
+    return positions
+
+  def __repr__(self) -> str:
+    return f"QueryTerm({repr(self._word)})"
+
+
+class QueryNot(QueryNode):
+  __slots__ = ('_node',)
+
+  def __init__(self, node: QueryNode):
+    self._node: QueryNode = node
+
+  @property
+  def node(self) -> QueryNode:
+    return self._node
+
+  def evaluate(self, content: str) -> bool:
+    return not self._node.evaluate(content)
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    return not self._node.evaluate_found(found, content)
+
+  def get_terms(self) -> List['QueryTerm']:
+    return self._node.get_terms()
+
+  def get_fields(self) -> List['QueryField']:
+    return self._node.get_fields()
+
+  def evaluate_fields(self, match_field: Callable[['QueryField'], bool]) -> bool:
+    return not self._node.evaluate_fields(match_field)
+
+  def __repr__(self) -> str:
+    return f"QueryNot({repr(self._node)})"
+
+
+class QueryAnd(QueryNode):
+  __slots__ = ('_nodes',)
+
+  def __init__(self, a: QueryNode, b: QueryNode):
+    # 合并连续的AND为一个节点，减少求值时的递归层数
+    self._nodes: List[QueryNode] = (a._nodes if isinstance(a, QueryAnd) else [a]) + (b._nodes if isinstance(b, QueryAnd) else [b])
+
+  @property
+  def nodes(self) -> List[QueryNode]:
+    return self._nodes
+
+  def evaluate(self, content: str) -> bool:
+    for node in self._nodes:
+      if not node.evaluate(content):
+        return False
+    return True
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    for node in self._nodes:
+      if not node.evaluate_found(found, content):
+        return False
+    return True
+
+  def evaluate_fields(self, match_field: Callable[['QueryField'], bool]) -> bool:
+    for node in self._nodes:
+      if not node.evaluate_fields(match_field):
+        return False
+    return True
+
+  def get_terms(self) -> List['QueryTerm']:
+    return [term for node in self._nodes for term in node.get_terms()]
+
+  def get_fields(self) -> List['QueryField']:
+    return [field for node in self._nodes for field in node.get_fields()]
+
+  def __repr__(self) -> str:
+    return f"QueryAnd({', '.join(repr(node) for node in self._nodes)})"
+
+
+class QueryOr(QueryNode):
+  __slots__ = ('_nodes',)
+
+  def __init__(self, a: QueryNode, b: QueryNode):
+    # 合并连续的OR为一个节点，减少求值时的递归层数
+    self._nodes: List[QueryNode] = (a._nodes if isinstance(a, QueryOr) else [a]) + (b._nodes if isinstance(b, QueryOr) else [b])
+
+  @property
+  def nodes(self) -> List[QueryNode]:
+    return self._nodes
+
+  def evaluate(self, content: str) -> bool:
+    for node in self._nodes:
+      if node.evaluate(content):
+        return True
+    return False
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    for node in self._nodes:
+      if node.evaluate_found(found, content):
+        return True
+    return False
+
+  def evaluate_fields(self, match_field: Callable[['QueryField'], bool]) -> bool:
+    for node in self._nodes:
+      if node.evaluate_fields(match_field):
+        return True
+    return False
+
+  def get_terms(self) -> List['QueryTerm']:
+    return [term for node in self._nodes for term in node.get_terms()]
+
+  def get_fields(self) -> List['QueryField']:
+    return [field for node in self._nodes for field in node.get_fields()]
+
+  def is_positional(self) -> bool:
+    return all(node.is_positional() for node in self._nodes)
+
+  def get_positions(self, content: str) -> List[Tuple[int, int]]:
+    return sorted(set(position for node in self._nodes for position in node.get_positions(content)))
+
+  def __repr__(self) -> str:
+    return f"QueryOr({', '.join(repr(node) for node in self._nodes)})"
+
+
+class QueryNear(QueryNode):
+  """
+  邻近节点。两个操作数之间相隔的字数不超过distance：
+  - NEAR/n：不区分先后，互相重叠也算作邻近；
+  - BEFORE/n：第一个操作数在前，第二个操作数在第一个操作数结束之后n个字之内开始。
+  操作数必须能够输出命中的位置（关键字、短语、它们的OR，以及NEAR/BEFORE）。
+  NEAR/BEFORE命中的位置为两个操作数合并后的范围，因此可以连续使用：'a NEAR/5 b BEFORE/3 c'。
+  """
+  __slots__ = ('_a', '_b', '_distance', '_ordered')
+
+  def __init__(self, a: QueryNode, b: QueryNode, distance: int, ordered: bool = False):
+    if (not a.is_positional()) or (not b.is_positional()):
+      raise ValueError("The operands of NEAR/BEFORE must be keywords, phrases or their OR.")
+    self._a: QueryNode = a
+    self._b: QueryNode = b
+    self._distance: int = distance
+    self._ordered: bool = ordered
+
+  @property
+  def distance(self) -> int:
+    return self._distance
+
+  @property
+  def ordered(self) -> bool:
+    return self._ordered
+
+  def __iter_matches(self, content: str) -> Iterator[Tuple[int, int]]:
+    """
+    合并两个操作数的位置列表，输出所有符合距离条件的组合的范围。
+    """
+    a_positions = self._a.get_positions(content)
+    if len(a_positions) == 0:
+      return
+    b_positions = self._b.get_positions(content)
+    if len(b_positions) == 0:
+      return
+
+    distance = self._distance
+    b_starts = [start for start, _ in b_positions]
+    # 第二个操作数可以从第一个操作数之前开始（NEAR），最多提前它自己的长度加上distance
+    b_max_length = 0 if self._ordered else max(end - start for start, end in b_positions)
+    for a_start, a_end in a_positions:
+      if self._ordered:
+        low = bisect.bisect_left(b_starts, a_end)
+      else:
+        low = bisect.bisect_left(b_starts, a_start - distance - b_max_length)
+      high = bisect.bisect_right(b_starts, a_end + distance)
+      for b_start, b_end in b_positions[low : high]:
+        if self._ordered or (b_end >= a_start - distance):
+          yield min(a_start, b_start), max(a_end, b_end)
+
+  def evaluate(self, content: str) -> bool:
+    for _ in self.__iter_matches(content):
+      return True
+    return False
+
+  def evaluate_found(self, found: Set[str], content: str) -> bool:
+    # 两个操作数都出现时才需要合并位置
+    if (not self._a.evaluate_found(found, content)) or (not self._b.evaluate_found(found, content)):
+      return False
+    return self.evaluate(content)
+
+  def get_terms(self) -> List['QueryTerm']:
+    return self._a.get_terms() + self._b.get_terms()
+
+  def is_positional(self) -> bool:
+    return True
+
+  def get_positions(self, content: str) -> List[Tuple[int, int]]:
+    return sorted(set(self.__iter_matches(content)))
+
+  def __repr__(self) -> str:
+    return f"QueryNear({repr(self._a)}, {repr(self._b)}, {self._distance}, {self._ordered})"
+
+
+class QueryField(QueryNode):
+  """
+  字段节点，比如：'title:周易'。字段的值和关键字一样，可以是普通文本或者正则表达式，判断元数据中是否包含它。
+  """
+  __slots__ = ('_field', '_term')
+
+  def __init__(self, field: str, value: str):
+    self._field: str = field
+    self._term: QueryTerm = QueryTerm(value)
+
+  @property
+  def field(self) -> str:
+    return self._field
+
+  @property
+  def value(self) -> str:
+    return self._term.word
+
+  def match(self, text: Union[str, None]) -> bool:
+    """
+    判断元数据text是否符合字段的值，text先归一化，比如：'title:论语'可以匹配'論語'。
+    """
+    return (text is not None) and self._term.evaluate(normalize_text(text))
+
+  def get_fields(self) -> List['QueryField']:
+    return [self]
+
+  def evaluate_fields(self, match_field: Callable[['QueryField'], bool]) -> bool:
+    return match_field(self)
+
+  def __repr__(self) -> str:
+    return f"QueryField({repr(self._field)}, {repr(self.value)})"
+
+
+def split_query_tree(tree: Union[QueryNode, None], predicate: Callable[[QueryNode], bool]) -> Tuple[Union[QueryNode, None], Union[QueryNode, None]]:
+  """
+  把语法树最上层AND的子节点分为符合predicate的和其他的两部分，两部分再以AND组合即为原来的语法树。
+  语法树最上层不是AND时，作为一个子节点判断。
+
+  :return: (符合predicate的子节点组成的语法树, 其他子节点组成的语法树)，没有子节点的部分为None。
+  """
+  if tree is None:
+    return None, None
+
+  selected = None
+  others = None
+  for node in (tree.nodes if isinstance(tree, QueryAnd) else [tree]):
+    if predicate(node):
+      selected = node if selected is None else QueryAnd(selected, node)
+    else:
+      others = node if others is None else QueryAnd(others, node)
+  return selected, others
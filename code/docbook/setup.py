@@ -9,6 +9,9 @@ setup(
     ],
     extras_require={
         'dev': [
+        ],
+        'fast': [
+            "orjson"
         ]
     },
 
@@ -0,0 +1,112 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import CONTENTS, get_hits
+
+logger = logging.getLogger("test.docbook.cache")
+
+def create_parts_archive(path: pathlib.Path, chapter_cache: docbook.ChapterCache = None) -> docbook.BookArchive:
+  for book_index, title in enumerate(['周易', '論語']):
+    book = docbook.Book(title = title)
+    for chapter_index in range(3):
+      chapter = docbook.Division(title = f"{title}{chapter_index}", type = docbook.DivisionType.CHAPTER)
+      for content in CONTENTS[(chapter_index + book_index) % len(CONTENTS):]:
+        chapter.add_content_piece(docbook.ContentPiece(content = content))
+      book.add_division(chapter)
+    docbook.BookFile.save_to_docbook((path / title).as_posix(), book, docbook.BookFileType.PARTS_FILE)
+  return docbook.BookArchive(path.as_posix(), True, chapter_cache)
+
+def test_chapter_cache():
+  with tempfile.TemporaryDirectory() as path:
+    chapter_cache = docbook.ChapterCache(max_count = 2)
+    dbarchive = create_parts_archive(pathlib.Path(path), chapter_cache)
+    chapters = dbarchive.chapters
+    assert not any(chapter.is_load() for chapter in chapters)
+
+    dbfile = dbarchive.dbfiles[0]
+    assert dbfile.load_chapter(chapters[0]) and chapters[0].is_load()
+    assert dbfile.load_chapter(chapters[1])
+    assert dbfile.load_chapter(chapters[0])
+    assert (chapter_cache.hits, chapter_cache.misses, chapter_cache.evictions) == (1, 2, 0)
+
+    # 超出上限时卸载最久没有使用的章节
+    assert dbfile.load_chapter(chapters[2])
+    assert chapter_cache.evictions == 1
+    assert chapter_cache.count == 2
+    assert chapters[0].is_load() and (not chapters[1].is_load()) and chapters[2].is_load()
+
+    # 卸载后再次载入为未命中
+    assert dbfile.load_chapter(chapters[1]) and chapters[1].is_load()
+    assert chapter_cache.misses == 4
+    assert chapter_cache.get_stats()['evictions'] == 2
+
+def test_chapter_cache_bytes():
+  with tempfile.TemporaryDirectory() as path:
+    chapter_cache = docbook.ChapterCache(max_bytes = 1)
+    dbarchive = create_parts_archive(pathlib.Path(path), chapter_cache)
+    # 字节数上限很小时，只保留最近载入的一个章节
+    for directory in dbarchive.get_chapters_directorys():
+      assert dbarchive.load_chapter_directory(directory)
+      assert directory[-1].is_load()
+      assert chapter_cache.count == 1
+      assert chapter_cache.bytes > 0
+
+def test_chapter_cache_pin():
+  with tempfile.TemporaryDirectory() as path:
+    chapter_cache = docbook.ChapterCache(max_count = 1)
+    dbarchive = create_parts_archive(pathlib.Path(path), chapter_cache)
+    chapters = dbarchive.chapters
+    dbfile = dbarchive.dbfiles[0]
+
+    # 固定的章节在unpin之前不被卸载，缓存暂时超出上限
+    assert dbfile.load_chapter(chapters[0], pin = True)
+    assert dbfile.load_chapter(chapters[1])
+    assert dbfile.load_chapter(chapters[2])
+    assert chapters[0].is_load() and (not chapters[1].is_load()) and chapters[2].is_load()
+    assert chapter_cache.get_stats()['pinned'] == 1
+    content = chapters[0].to_dict()
+
+    # 固定的次数：每一次固定都需要取消
+    assert dbfile.load_chapter_byid(chapters[0].id, pin = True) == (True, chapters[0])
+    dbfile.unpin_chapter(chapters[0])
+    assert chapters[0].is_load() and (chapters[0].to_dict() == content)
+    # 取消固定后卸载超出上限的章节（最久没有使用的章节）
+    dbfile.unpin_chapter(chapters[0])
+    assert chapters[0].is_load() and (not chapters[2].is_load())
+    assert chapter_cache.count == 1
+    assert chapter_cache.get_stats()['pinned'] == 0
+
+def test_search_with_cache():
+  with tempfile.TemporaryDirectory() as path:
+    chapter_cache = docbook.ChapterCache(max_count = 1)
+    dbarchive = create_parts_archive(pathlib.Path(path), chapter_cache)
+    directorys = dbarchive.get_chapters_directorys()
+
+    # 搜索时动态载入章节，结果与全部载入时一致
+    # 缓存只能保存一个章节，多个线程同时搜索时，章节在搜索的过程中会被其他线程挤出缓存，搜索使用自己取得的span表
+    docbook.BookQuery.CHAPTER_LOAD_FUNC = dbarchive.load_chapter_directory
+    try:
+      query_results = [docbook.BookQuery.search_in_chapters("君子", directorys, limit = None) for _ in range(5)]
+      counts = [docbook.BookQuery.count_in_chapters("小人", directorys) for _ in range(5)]
+    finally:
+      docbook.BookQuery.CHAPTER_LOAD_FUNC = None
+    assert chapter_cache.misses >= len(directorys)
+    assert chapter_cache.count == 1
+
+    dbarchive = docbook.BookArchive(path, False)
+    directorys = dbarchive.get_chapters_directorys()
+    expected = get_hits(docbook.BookQuery.search_in_chapters("君子", directorys, limit = None))
+    assert all(get_hits(item) == expected for item in query_results)
+    assert counts == [docbook.BookQuery.count_in_chapters("小人", directorys)] * 5
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_chapter_cache()
+  test_chapter_cache_bytes()
+  test_chapter_cache_pin()
+  test_search_with_cache()
@@ -0,0 +1,47 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import create_archive
+
+logger = logging.getLogger("test.docbook.chapters_cache")
+
+def test_chapters_cache():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbook = dbarchive.dbooks[0]
+
+    # 没有变化时，返回同一个缓存的列表
+    assert dbook.chapters is dbook.chapters
+    assert dbook.get_chapters_directorys() is dbook.get_chapters_directorys()
+    assert dbarchive.chapters is dbarchive.chapters
+    directorys = dbarchive.get_chapters_directorys()
+    assert directorys is dbarchive.get_chapters_directorys()
+    assert len(directorys) == 4
+
+    # 加入卷章后，书籍和文献库的缓存都失效
+    volume = docbook.Division(title = "卷一", type = docbook.DivisionType.VOLUME)
+    dbook.add_division(volume)
+    chapter = docbook.Division(title = "新章", type = docbook.DivisionType.CHAPTER)
+    volume.add_division(chapter)
+    assert dbook.chapters[-1] is chapter
+    assert volume.chapters == [chapter]
+    assert dbook.get_chapters_directorys()[-1] == [dbook, volume, chapter]
+    assert volume.get_chapters_directorys() == [[volume, chapter]]
+    assert dbook.get_chapters_directorys(use_object = False)[-1][:2] == [(dbook.id, dbook.title.title), (volume.id, "卷一")]
+    assert dbarchive.get_chapters_directorys() is not directorys
+    assert len(dbarchive.get_chapters_directorys()) == 5
+    assert dbarchive.chapters[len(dbook.chapters) - 1] is chapter
+
+    # 章节内容的载入、卸载不影响缓存
+    directorys = dbook.get_chapters_directorys()
+    dbook.chapters[0].divisions = []
+    assert dbook.get_chapters_directorys() is directorys
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_chapters_cache()
@@ -0,0 +1,60 @@
+import json
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import create_archive
+
+logger = logging.getLogger("test.docbook.collation")
+
+calls = []
+
+def collation_key_func(title: str):
+  calls.append(title)
+  return [str(ord(c)) for c in title]
+
+def test_collation_keys():
+  with tempfile.TemporaryDirectory() as path:
+    create_archive(pathlib.Path(path))
+
+    docbook.BookArchive.COLLATION_KEY_FUNC = collation_key_func
+    try:
+      dbarchive = docbook.BookArchive(path)
+      # 所有书籍、章节标题的排序键在载入时计算，并保存在archive.json中
+      assert len(calls) == 6
+      with open(pathlib.Path(path) / docbook.BookArchive.ROOT_FILE_NAME, "rb") as file:
+        archive = json.loads(file.read().decode('utf-8'))
+      assert len(archive['collation']['keys']) == 6
+
+      directorys = sorted(dbarchive.get_chapters_directorys(), key = lambda directory: (dbarchive.get_collation_key(directory[-1]), directory[-1].order))
+      assert [directory[-1].title.title for directory in directorys] == sorted(directory[-1].title.title for directory in directorys)
+
+      # 再次载入时直接使用保存的排序键
+      calls.clear()
+      dbarchive = docbook.BookArchive(path)
+      assert len(calls) == 0
+      assert dbarchive.get_collation_key(dbarchive.dbooks[0]) == collation_key_func(dbarchive.dbooks[0].title.title)
+
+      # 排序键没有变化时不重写archive.json
+      archive_path = pathlib.Path(path) / docbook.BookArchive.ROOT_FILE_NAME
+      stat = archive_path.stat()
+      dbarchive = docbook.BookArchive(path)
+      assert archive_path.stat().st_mtime_ns == stat.st_mtime_ns
+      assert archive_path.stat().st_ino == stat.st_ino
+
+      # 删除书籍后，去掉它的标题的排序键
+      (pathlib.Path(path) / "論語.dbook").unlink()
+      dbarchive = dbarchive.refresh()
+      with open(archive_path, "rb") as file:
+        archive = json.loads(file.read().decode('utf-8'))
+      assert sorted(archive['collation']['keys']) == ['周易', '周易0', '周易1']
+    finally:
+      docbook.BookArchive.COLLATION_KEY_FUNC = None
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_collation_keys()
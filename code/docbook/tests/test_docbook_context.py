@@ -0,0 +1,66 @@
+import time
+import logging
+import pathlib
+import tempfile
+import threading
+
+import utils
+import docbook
+
+from test_docbook_index import create_archive, get_hits
+
+logger = logging.getLogger("test.docbook.context")
+
+def test_context_take():
+  context = docbook.SearchContext(limit = 5)
+  assert context.take(3) == 3
+  assert not context.is_stopped()
+  assert context.take(3) == 2
+  assert context.is_full and context.is_stopped()
+  assert context.take(1) == 0
+  assert context.count == 5
+
+  context = docbook.SearchContext()
+  context.cancel()
+  assert context.is_stopped()
+  assert context.take(1) == 0
+
+  context = docbook.SearchContext(timeout = 0.01)
+  time.sleep(0.02)
+  assert context.is_timeout and context.is_stopped()
+
+def test_concurrent_search():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    directorys = dbarchive.get_chapters_directorys()
+
+    expected = {query_string: get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = True)) for query_string in ["君子", "小人", "大人"]}
+
+    # 并发的搜索使用各自的上下文，limit和中止互不影响
+    errors = []
+    def search(query_string: str, limit: int):
+      for _ in range(20):
+        query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = limit, annotation = True)
+        if limit is None:
+          if get_hits(query_results) != expected[query_string]:
+            errors.append(query_string)
+        elif query_results.query_result_count != limit:
+          errors.append(query_string)
+
+    threads = [threading.Thread(target = search, args = args) for args in [("君子", None), ("小人", 2), ("大人", None), ("君子", 1)]]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assert len(errors) == 0
+
+    # 被中止的context不再搜索
+    context = docbook.SearchContext()
+    context.cancel()
+    assert docbook.BookQuery.search_in_chapters("君子", directorys, limit = None, context = context).query_result_count == 0
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_context_take()
+  test_concurrent_search()
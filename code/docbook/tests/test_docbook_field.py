@@ -0,0 +1,126 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+import query
+
+from test_docbook_index import create_archive, get_hits
+
+logger = logging.getLogger("test.docbook.field")
+
+def create_books():
+  books = []
+  for title, author, dynasty, category, annotators in [("周易", "王弼", "魏", "經部", ["王弼", "韓康伯"]), ("論語", "何晏", "魏", "經部", ["何晏"]), ("荀子", "荀況", "周", "子部", ["楊倞"])]:
+    book = docbook.Book(title = title, authors = [docbook.Author(author, dynasty = dynasty)], categories = [category])
+    for chapter_index in range(2):
+      chapter = docbook.Division(title = f"{title}{chapter_index}", type = docbook.DivisionType.CHAPTER)
+      if chapter_index == 1:
+        chapter.authors = [docbook.Author("孔穎達", dynasty = "唐")]
+      for annotator in annotators:
+        content_piece = docbook.ContentPiece(content = "君子終日乾乾，夕惕若厲。\n小人樂得其事。")
+        content_piece.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "君子謂大人也", annotator = annotator, position = 0))
+        chapter.add_content_piece(content_piece)
+      book.add_division(chapter)
+    books.append(book)
+  return books
+
+def test_field_query():
+  q = query.Query('title:周易 and (君子 or 小人) author:"王 弼"')
+  assert [(field.field, field.value) for field in q.field_tree.get_fields()] == [('title', '周易'), ('author', '王 弼')]
+  assert [term.word for term in q.query_tree.get_terms()] == ['君子', '小人']
+  assert q.get_query_keys() == ['君子', '小人']
+  # 不是字段名的'xxx:'仍然是关键字
+  assert query.Query("http://x").field_tree is None
+
+  # 字段条件只能以AND与其他关键字组合，书籍的字段条件也只能以AND与段落的字段条件组合，在解码时就报告错误
+  for query_string in ["title:周易 or 君子", "title:周易 NEAR/3 君子", "title:周易 or annotator:王弼", "not (title:周易 and type:annotation)"]:
+    try:
+      query.Query(query_string)
+      assert False, query_string
+    except ValueError:
+      pass
+
+  # 只有字段条件时，所有的内容都符合
+  q = query.Query("not title:周易")
+  assert q.query_tree is None
+  assert q.match_query("君子") == []
+
+def test_field_index():
+  books = create_books()
+  fields = docbook.BookFieldIndex.build(books)
+  directorys = [directory for book in books for directory in book.get_chapters_directorys()]
+
+  def get_titles(query_string):
+    q = query.Query(query_string)
+    return [directory[-1].title.title for directory in fields.filter_directorys(q.field_tree, directorys)]
+
+  assert get_titles("title:周") == ["周易0", "周易1"]
+  assert get_titles("dynasty:魏 and not author:王弼") == ["論語0", "論語1"]
+  assert get_titles("category:子部 or author:何晏") == ["論語0", "論語1", "荀子0", "荀子1"]
+  # 卷章的著作者只对它下面的章节有效
+  assert get_titles("author:孔穎達 and category:經部") == ["周易1", "論語1"]
+  assert get_titles("dynasty:唐") == ["周易1", "論語1", "荀子1"]
+
+  # 只判断书籍本身的字段
+  assert [book.title.title for book in fields.filter_books(query.Query("dynasty:魏").field_tree, books)] == ["周易", "論語"]
+  assert fields.filter_books(query.Query("author:孔穎達").field_tree, books) == []
+
+def test_field_search():
+  books = create_books()
+  directorys = [directory for book in books for directory in book.get_chapters_directorys()]
+  fields = docbook.BookFieldIndex.build(books)
+
+  def search(query_string, annotation = False):
+    results = get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation, fields = fields))
+    assert results == get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation))
+    return results
+
+  hits = search("title:周易 and 君子")
+  assert [len(chapter_hits) for _, chapter_hits in hits] == [2, 2]
+  assert hits == get_hits(docbook.BookQuery.search_in_chapters("君子", directorys[:2], limit = None))
+
+  # 段落的字段条件决定搜索的范围，包括注释
+  hits = search("type:annotation and annotator:王弼 and 大人")
+  assert [(len(chapter_hits), chapter_hits[0][0]) for _, chapter_hits in hits] == [(1, "君子謂大人也"), (1, "君子謂大人也")]
+  # 只有字段条件时，符合条件的span都命中，没有需要高亮的关键字
+  assert search("type:annotation and annotator:王弼") == [(id, [(hit[0], hit[1], [], hit[3]) for hit in chapter_hits]) for id, chapter_hits in hits]
+  assert len(search("type:paragraph and 大人")) == 0
+  assert docbook.BookQuery.count_in_chapters("type:annotation and not annotator:王弼 and 君子", directorys) == 6
+  assert docbook.BookQuery.count_in_chapters("category:經部 and type:annotation", directorys, fields = fields) == 6
+
+  try:
+    docbook.BookQuery.count_in_chapters("title:周易 or annotator:王弼", directorys)
+    assert False
+  except ValueError:
+    pass
+
+def test_field_search_pool():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    directorys = dbarchive.get_chapters_directorys()
+    fields = dbarchive.get_field_index()
+    with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+      for query_string in ["title:論語 and 君子", "not title:周易 and 小人"]:
+        expected = get_hits(docbook.BookQuery.search_page_in_chapters(query_string, directorys, 0, None, fields = fields))
+        assert len(expected) > 0
+        assert get_hits(dbquery_pool.search_page_in_chapters(query_string, directorys, 0, None, fields = fields)) == expected
+
+def test_search_book_bytitle():
+  books = create_books()
+  fields = docbook.BookFieldIndex.build(books)
+  for index in [None, fields]:
+    assert [book.title.title for book in docbook.BookQuery.search_book_bytitle("周 or 論", books, fields = index)] == ["周易", "論語"]
+    assert [book.title.title for book in docbook.BookQuery.search_book_bytitle("周 and not author:王弼", books, fields = index)] == []
+    assert [book.title.title for book in docbook.BookQuery.search_book_bytitle("dynasty:魏 category:經部", books, fields = index)] == ["周易", "論語"]
+    assert [book.title.title for book in docbook.BookQuery.search_book_bytitle("子 and dynasty:周", books, fields = index)] == ["荀子"]
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_field_query()
+  test_field_index()
+  test_field_search()
+  test_field_search_pool()
+  test_search_book_bytitle()
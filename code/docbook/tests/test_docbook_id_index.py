@@ -0,0 +1,54 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import create_archive
+
+logger = logging.getLogger("test.docbook.id_index")
+
+def test_get_byid():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    for directory in dbarchive.get_chapters_directorys():
+      chapter = directory[-1]
+      assert dbarchive.get_chapter_directory_byid(str(chapter.id)) == directory
+      assert dbarchive.get_chapter_byid(chapter.id) is chapter
+      assert dbarchive.get_book_byid(directory[0].id) is directory[0]
+      assert dbarchive.get_bookfile_byid(directory[0].id).book is directory[0]
+      assert directory[0].get_chapter_byid(chapter.id) is chapter
+      assert directory[0].get_chapter_directory_byid(chapter.id, use_object = False) == [(division.id, division.title.title) for division in directory]
+
+    assert dbarchive.get_bookfile_byid("invalid id") is None
+    assert dbarchive.get_chapter_byid(dbarchive.dbooks[0].id) is None
+
+def test_index_update():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+
+    # 加入卷章后，索引自动更新
+    dbook = dbarchive.dbooks[0]
+    volume = docbook.Division(title = "卷一", type = docbook.DivisionType.VOLUME)
+    dbook.add_division(volume)
+    chapter = docbook.Division(title = "新章", type = docbook.DivisionType.CHAPTER)
+    volume.add_division(chapter)
+    assert dbarchive.get_chapter_directory_byid(chapter.id) == [dbook, volume, chapter]
+    assert dbarchive.get_division_byid(volume.id) is volume
+    assert dbarchive.get_chapter_directory_byid(volume.id) is None
+    assert volume.get_chapter_directory_byid(chapter.id) == [volume, chapter]
+
+    # 重新载入书籍后，索引指向新的书籍对象
+    dbfile = dbarchive.dbfiles[1]
+    dbook = dbfile.book
+    dbfile.load(dbfile.path, False)
+    assert dbfile.book is not dbook
+    assert dbarchive.get_book_byid(dbook.id) is dbfile.book
+    assert dbarchive.get_chapter_byid(dbfile.book.chapters[0].id) is dbfile.book.chapters[0]
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_get_byid()
+  test_index_update()
@@ -0,0 +1,131 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+logger = logging.getLogger("test.docbook.index")
+
+CONTENTS = [
+  "初六：童觀，小人無咎，君子吝。\n六二：闚觀，利女貞。",
+  "太公曰：臣聞君子樂得其志，小人樂得其事。",
+  "天之愛人也，薄於聖人之愛人也；大人之愛小人也。",
+  "密云不雨，自我西郊。<span class=\"name\">公</span>弋取彼在穴。",
+]
+
+def create_archive(path: pathlib.Path) -> docbook.BookArchive:
+  for book_index, title in enumerate(['周易', '論語']):
+    book = docbook.Book(title = title)
+    for chapter_index in range(2):
+      chapter = docbook.Division(title = f"{title}{chapter_index}", type = docbook.DivisionType.CHAPTER)
+      for content in CONTENTS[chapter_index + book_index:]:
+        content_piece = docbook.ContentPiece(content = content)
+        content_piece.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "注：君子謂大人也", position = 0))
+        chapter.add_content_piece(content_piece)
+      book.add_division(chapter)
+    docbook.BookFile.save_to_docbook((path / f"{title}.dbook").as_posix(), book)
+  return docbook.BookArchive(path.as_posix())
+
+def get_hits(query_results):
+  return [(query_result_piece.directory[-1].id, query_result_piece.hits) for query_result_piece in query_results.query_result_pieces]
+
+def test_index_search():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbindex = dbarchive.load_index()
+    assert (pathlib.Path(path) / docbook.BookArchive.INDEX_FILE_NAME).is_file()
+
+    directorys = dbarchive.get_chapters_directorys()
+    for query_string in ["君子 and 小人", "密云 or 樂得", "not 君子", "大人 and not (小人 or 聖人)", "君.", "xyz",
+                         "君子 NEAR/5 小人", "小人 BEFORE/5 君子", "\"樂得其\" BEFORE/2 小人", "愛人 NEAR/0 聖人", "(小人 or 大人) NEAR/1 愛"]:
+      for annotation in [False, True]:
+        query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation)
+        index_query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation, index = dbindex)
+        logger.info(f"query: {query_string}, annotation: {annotation}, hits: {query_results.query_result_count}.")
+        assert get_hits(query_results) == get_hits(index_query_results)
+
+    dbindex.close()
+
+def test_index_reload():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbindex = dbarchive.load_index()
+    dbindex.close()
+
+    dbindex = docbook.BookIndex.load((pathlib.Path(path) / docbook.BookArchive.INDEX_FILE_NAME).as_posix())
+    assert dbindex.is_up_to_date(dbarchive)
+    candidates = dbindex.candidates("童觀")
+    assert len(candidates) == 1
+    candidates = dbindex.candidates("君子 and 小人")
+    assert len(candidates) == 3
+    assert dbindex.candidates("not 君子") is None
+    dbindex.close()
+
+def test_index_positions():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbindex = dbarchive.load_index()
+    dbindex.close()
+    dbindex = docbook.BookIndex.load((pathlib.Path(path) / docbook.BookArchive.INDEX_FILE_NAME).as_posix())
+
+    # 多个字的关键字由双字的位置对齐得到，不包含只是双字都出现的span
+    positions = dbindex.get_word_positions("樂得其")
+    assert len(positions) == 3
+    assert all(starts == [8, 15] for starts in positions.values())
+    assert dbindex.get_word_positions("樂得其志其") == {}
+    # 布尔运算只读取去重的posting，每一个span一项
+    assert sorted(dbindex.get_posting("得其")) == sorted(positions)
+    assert len(dbindex.get_gram_positions("得其")[0]) == 2 * len(positions)
+
+    # NEAR/BEFORE通过位置直接得到精确的span
+    assert dbindex.candidates("君子 BEFORE/5 小人") == dbindex.candidates("樂得其志")
+    assert dbindex.candidates("君子 BEFORE/4 小人") == {}
+    assert dbindex.candidates("小人 BEFORE/5 君子") == dbindex.candidates("童觀")
+    assert dbindex.candidates("小人 NEAR/3 君子") == dbindex.candidates("童觀")
+    assert dbindex.candidates("小人 NEAR/5 君子") == dbindex.candidates("君子 and 小人")
+    dbindex.close()
+
+def test_index_update():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    dbarchive = create_archive(path)
+    dbarchive.load_index().close()
+
+    # 修改、删除和新增书籍后，没有变化的书籍沿用原来的posting，结果与重新建立的索引一致
+    book = docbook.Book(title = "孟子")
+    chapter = docbook.Division(title = "孟子0", type = docbook.DivisionType.CHAPTER)
+    for content in CONTENTS[1:]:
+      chapter.add_content_piece(docbook.ContentPiece(content = content))
+    book.add_division(chapter)
+    docbook.BookFile.save_to_docbook((path / "孟子.dbook").as_posix(), book)
+    book = docbook.BookFile((path / "論語.dbook").as_posix(), False).book
+    book.chapters[0].add_content_piece(docbook.ContentPiece(content = "君子坦蕩蕩，小人長戚戚。"))
+    docbook.BookFile.save_to_docbook((path / "論語.dbook").as_posix(), book)
+    dbarchive = dbarchive.refresh()
+
+    dbindex = dbarchive.load_index()
+    assert dbindex.is_up_to_date(dbarchive)
+    # 沿用的书籍在前，新建立索引的书籍在后
+    assert [book['id'] for book in dbindex._books] == [str(dbfile.book.id) for dbfile in sorted(dbarchive.dbfiles, key = lambda dbfile: dbfile.book.title.title != "周易")]
+    rebuilt_dbindex = docbook.BookIndex.build(dbarchive)
+    assert dbindex.span_count == rebuilt_dbindex.span_count
+    directorys = dbarchive.get_chapters_directorys()
+    for query_string in ["君子 and 小人", "密云 or 樂得", "坦蕩", "\"樂得其\" BEFORE/2 小人", "(小人 or 大人) NEAR/1 愛"]:
+      query_results = get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None))
+      assert get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, index = dbindex)) == query_results
+      assert get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, index = rebuilt_dbindex)) == query_results
+    dbindex.close()
+
+    # 书籍的顺序不影响索引
+    dbindex = dbarchive.load_index()
+    assert dbindex.is_up_to_date(dbarchive)
+    dbindex.close()
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_index_search()
+  test_index_reload()
+  test_index_positions()
+  test_index_update()
@@ -0,0 +1,84 @@
+import json
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+from utils import json_utils
+
+from test_docbook_index import create_archive
+
+logger = logging.getLogger("test.docbook.json")
+
+def test_json_backends():
+  data = {"title": "周易", "path": "a/b", "order": [1, 2.5, None, True], "attrs": {}}
+  for backend in ['json', 'orjson', 'ujson', 'msgspec']:
+    try:
+      loads = json_utils._get_loads(backend)
+    except ImportError:
+      continue
+    dumps = json_utils._get_dumps(backend)
+    assert loads(json.dumps(data, ensure_ascii = False, indent = 4).encode('utf-8')) == data
+    if dumps is not None:
+      # 输出的json可以被标准库读取
+      assert json.loads(dumps(data, None)) == data
+
+  assert utils.json_loads(utils.json_dumps_bytes(data)) == data
+  assert utils.json_loads(utils.json_dumps_bytes(data, indent = 4)) == data
+  assert b'\n' not in utils.json_dumps_bytes(data)
+  assert utils.json_dumps(data, ensure_ascii = True) == json.dumps(data, ensure_ascii = True)
+  # 编解码库不支持的值由标准库处理
+  assert utils.json_loads(utils.json_dumps_bytes({"n": 2 ** 70})) == {"n": 2 ** 70}
+  assert utils.json_loads('{"n": NaN}')['n'] != 0
+
+def test_backend_errors_fallback():
+  for backend in ['json', 'orjson', 'ujson', 'msgspec']:
+    try:
+      decode_errors, encode_errors = json_utils._get_errors(backend)
+      loads = json_utils._get_loads(backend)
+    except ImportError:
+      continue
+    # 编解码库拒绝的输入抛出的异常都在回退的范围内
+    try:
+      loads(b'{"n": NaN}')
+    except decode_errors:
+      pass
+
+  # 编解码库抛出自己的异常类型时，仍然回退到标准库json
+  class BackendError(Exception):
+    pass
+  def loads(data):
+    raise BackendError()
+  def dumps(obj, indent):
+    raise BackendError()
+  state = (json_utils._loads, json_utils._dumps, json_utils._decode_errors, json_utils._encode_errors)
+  json_utils._loads, json_utils._dumps = loads, dumps
+  json_utils._decode_errors, json_utils._encode_errors = (ValueError, BackendError), (TypeError, OverflowError, BackendError)
+  try:
+    assert utils.json_loads('{"n": NaN}')['n'] != 0
+    assert utils.json_loads(utils.json_dumps_bytes({"title": "周易"})) == {"title": "周易"}
+  finally:
+    json_utils._loads, json_utils._dumps, json_utils._decode_errors, json_utils._encode_errors = state
+
+def test_compact_book_file():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    dbarchive = create_archive(path / "indent")
+    try:
+      docbook.BookFile.JSON_INDENT = None
+      compact_dbarchive = create_archive(path / "compact")
+    finally:
+      docbook.BookFile.JSON_INDENT = 4
+
+    for dbfile, compact_dbfile in zip(dbarchive.dbfiles, compact_dbarchive.dbfiles):
+      assert pathlib.Path(compact_dbfile.path).stat().st_size < pathlib.Path(dbfile.path).stat().st_size
+      assert compact_dbfile.book.title.title == dbfile.book.title.title
+      assert [[content_piece.to_dict() for content_piece in chapter.divisions] for chapter in compact_dbfile.book.chapters] == [[content_piece.to_dict() for content_piece in chapter.divisions] for chapter in dbfile.book.chapters]
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_json_backends()
+  test_backend_errors_fallback()
+  test_compact_book_file()
@@ -0,0 +1,169 @@
+import os
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import get_hits
+from test_docbook_pack import create_book
+
+logger = logging.getLogger("test.docbook.load")
+
+def create_archive_files(path: pathlib.Path):
+  docbook.BookFile.save_to_docbook((path / "周易").as_posix(), create_book("周易"), docbook.BookFileType.PARTS_FILE)
+  docbook.BookFile.save_to_docbook((path / "論語.dbook").as_posix(), create_book("論語"), docbook.BookFileType.SINGLE_FILE)
+  docbook.BookFile.save_to_docbook((path / "孟子.dbpack").as_posix(), create_book("孟子"), docbook.BookFileType.PACKED_FILE)
+  docbook.BookFile.save_to_docbook((path / "大學.dbzip").as_posix(), create_book("大學"), docbook.BookFileType.SINGLE_PARTS_FILE)
+  # 损坏的书籍文件
+  (path / "中庸.dbook").write_bytes(b'{"title": ')
+
+def load_archive(path: pathlib.Path, dynamic_load: bool, process_num: int, use_snapshot: bool = False) -> docbook.BookArchive:
+  docbook.BookArchive.LOAD_PROCESS_NUM, load_process_num = process_num, docbook.BookArchive.LOAD_PROCESS_NUM
+  docbook.BookArchive.REBUILD_CHAPTERS_ORDER = True
+  docbook.BookArchive.USE_SNAPSHOT = use_snapshot
+  try:
+    return docbook.BookArchive(path.as_posix(), dynamic_load)
+  finally:
+    docbook.BookArchive.LOAD_PROCESS_NUM = load_process_num
+    docbook.BookArchive.REBUILD_CHAPTERS_ORDER = False
+    docbook.BookArchive.USE_SNAPSHOT = False
+
+def get_snapshot_refs(dbarchive: docbook.BookArchive):
+  return [pathlib.Path(item['ref']).name for item in dbarchive.load_report if item['reused']]
+
+def test_parallel_load():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    create_archive_files(path)
+
+    for dynamic_load in [False, True]:
+      dbarchive = load_archive(path, dynamic_load, 1)
+      parallel_dbarchive = load_archive(path, dynamic_load, 3)
+
+      # 损坏的书籍被跳过并记录原因，其他书籍正常载入
+      for archive in [dbarchive, parallel_dbarchive]:
+        assert archive.book_count == 4
+        assert len(archive.load_report) == 5
+        assert all(item['seconds'] >= 0 for item in archive.load_report)
+        assert [pathlib.Path(item['ref']).name for item in archive.load_errors] == ["中庸.dbook"]
+        assert all(chapter.order == index for book in archive.dbooks for index, chapter in enumerate(book.chapters))
+
+      assert [dbfile.path for dbfile in parallel_dbarchive.dbfiles] == [dbfile.path for dbfile in dbarchive.dbfiles]
+      assert [book.to_dict() for book in parallel_dbarchive.dbooks] == [book.to_dict() for book in dbarchive.dbooks]
+      assert [chapter.is_load() for chapter in parallel_dbarchive.chapters] == [chapter.is_load() for chapter in dbarchive.chapters]
+
+      # 从载入进程传回的书籍可以继续载入章节（包括重新打开zip文件）
+      book = parallel_dbarchive.get_book_byid(dbarchive.dbooks[0].id)
+      assert book is parallel_dbarchive.dbooks[0]
+      parallel_dbarchive.load_all_books()
+      dbarchive.load_all_books()
+      assert [chapter.to_dict() for chapter in parallel_dbarchive.chapters] == [chapter.to_dict() for chapter in dbarchive.chapters]
+
+      dbquery = docbook.BookQuery()
+      hits = get_hits(dbquery.search_in_chapters("君子", dbarchive.get_chapters_directorys()))
+      parallel_hits = get_hits(dbquery.search_in_chapters("君子", parallel_dbarchive.get_chapters_directorys()))
+      assert [hits for _, hits in parallel_hits] == [hits for _, hits in hits]
+
+def test_snapshot():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    create_archive_files(path)
+
+    dbarchive = load_archive(path, False, 1, True)
+    assert get_snapshot_refs(dbarchive) == []
+    assert (path / docbook.BookArchive.SNAPSHOT_FILE_NAME).is_dir()
+
+    # 没有变化的书籍从快照恢复，结果与从磁盘文件载入的一致
+    snapshot_dbarchive = load_archive(path, False, 2, True)
+    assert sorted(get_snapshot_refs(snapshot_dbarchive)) == sorted(["book.json", "論語.dbook", "孟子.dbpack", "大學.dbzip"])
+    assert [book.to_dict() for book in snapshot_dbarchive.dbooks] == [book.to_dict() for book in dbarchive.dbooks]
+    assert [chapter.to_dict() for chapter in snapshot_dbarchive.chapters] == [chapter.to_dict() for chapter in dbarchive.chapters]
+    assert len(snapshot_dbarchive.load_errors) == 1
+    assert snapshot_dbarchive.get_chapter_byid(dbarchive.chapters[0].id) is snapshot_dbarchive.chapters[0]
+
+    # 只有修改时间变化、内容没有变化的书籍仍然从快照恢复，内容变化的书籍重新载入
+    stat = (path / "論語.dbook").stat()
+    os.utime(path / "論語.dbook", ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    book = create_book("孟子")
+    book.title = "孟子注疏"
+    docbook.BookFile.save_to_docbook((path / "孟子.dbpack").as_posix(), book, docbook.BookFileType.PACKED_FILE)
+    snapshot_dbarchive = load_archive(path, False, 1, True)
+    assert sorted(get_snapshot_refs(snapshot_dbarchive)) == sorted(["book.json", "論語.dbook", "大學.dbzip"])
+    assert "孟子注疏" in [book.title.title for book in snapshot_dbarchive.dbooks]
+    assert sorted(get_snapshot_refs(load_archive(path, False, 1, True))) == sorted(["book.json", "論語.dbook", "孟子.dbpack", "大學.dbzip"])
+
+    # 载入选项不同时不使用快照（周易为PARTS_FILE，章节没有载入）
+    snapshot_dbarchive = load_archive(path, True, 1, True)
+    assert get_snapshot_refs(snapshot_dbarchive) == []
+    assert not any(chapter.is_load() for chapter in snapshot_dbarchive.get_book_byid(dbarchive.dbooks[0].id).chapters)
+
+    # 刷新时不再读取快照，只写入变化的书籍，并去掉已经删除的书籍
+    docbook.BookArchive.USE_SNAPSHOT = True
+    try:
+      dbarchive = docbook.BookArchive(path.as_posix(), False)
+      get_entries = lambda: {entry.name: (entry.stat().st_ino, entry.stat().st_mtime_ns) for entry in (path / docbook.BookArchive.SNAPSHOT_FILE_NAME).glob("*.pickle")}
+      entries = get_entries()
+      assert len(entries) == 4
+      docbook.BookFile.save_to_docbook((path / "大學.dbzip").as_posix(), create_book("大學章句"), docbook.BookFileType.SINGLE_PARTS_FILE)
+      (path / "論語.dbook").unlink()
+      dbarchive = dbarchive.refresh()
+      assert sorted(pathlib.Path(item['ref']).name for item in dbarchive.load_report if not item['reused']) == ["中庸.dbook", "大學.dbzip"]
+      new_entries = get_entries()
+      assert len(new_entries) == 3
+      assert len([name for name, entry in new_entries.items() if entries.get(name) != entry]) == 1
+      assert sorted(pathlib.Path(item['ref']).name for item in docbook.BookArchive(path.as_posix(), False).load_report if item['reused']) == sorted(["book.json", "孟子.dbpack", "大學.dbzip"])
+    finally:
+      docbook.BookArchive.USE_SNAPSHOT = False
+
+def test_refresh():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    docbook.BookFile.save_to_docbook((path / "周易").as_posix(), create_book("周易"), docbook.BookFileType.PARTS_FILE)
+    docbook.BookFile.save_to_docbook((path / "論語.dbpack").as_posix(), create_book("論語"), docbook.BookFileType.PACKED_FILE)
+    docbook.BookFile.save_to_docbook((path / "孟子.dbook").as_posix(), create_book("孟子"), docbook.BookFileType.SINGLE_FILE)
+    dbarchive = docbook.BookArchive(path.as_posix(), True)
+    titles = sorted(book.title.title for book in dbarchive.dbooks)
+
+    # 新增、修改和删除书籍
+    docbook.BookFile.save_to_docbook((path / "大學.dbzip").as_posix(), create_book("大學"), docbook.BookFileType.SINGLE_PARTS_FILE)
+    docbook.BookFile.save_to_docbook((path / "論語.dbpack").as_posix(), create_book("論語注疏"), docbook.BookFileType.PACKED_FILE)
+    (path / "孟子.dbook").unlink()
+
+    new_dbarchive = dbarchive.refresh()
+    assert sorted(book.title.title for book in new_dbarchive.dbooks) == ["周易", "大學", "論語注疏"]
+    assert sorted(pathlib.Path(item['ref']).name for item in new_dbarchive.load_report if not item['reused']) == ["大學.dbzip", "論語.dbpack"]
+    assert new_dbarchive.load_errors == []
+    # 没有变化的书籍直接沿用
+    zhouyi = [dbfile for dbfile in dbarchive.dbfiles if dbfile.book.title.title == "周易"][0]
+    assert new_dbarchive.get_bookfile_byid(zhouyi.book.id) is zhouyi
+    assert len(docbook.BookArchive(path.as_posix(), True).dbfiles) == 3
+
+    # 原来的文献库对象不变，已经被修改的书籍不再通过新的文献库对象载入章节
+    assert sorted(book.title.title for book in dbarchive.dbooks) == titles
+    lunyu = [dbfile for dbfile in dbarchive.dbfiles if dbfile.book.title.title == "論語"][0]
+    assert not new_dbarchive.load_chapter_directory(lunyu.book.get_chapters_directorys()[0])
+    assert new_dbarchive.load_chapter_directory(zhouyi.book.get_chapters_directorys()[0])
+
+    # 搜索通过上下文使用它所搜索的那一代文献库载入章节，不使用CHAPTER_LOAD_FUNC
+    docbook.BookQuery.CHAPTER_LOAD_FUNC = lambda directory: False
+    try:
+      for chapter in zhouyi.book.chapters:
+        chapter.unload()
+      context = docbook.SearchContext(chapter_load_func = new_dbarchive.load_chapter_directory)
+      assert docbook.BookQuery.count_in_chapters("君子", zhouyi.book.get_chapters_directorys(), context = context) > 0
+      context = docbook.SearchContext(chapter_load_func = new_dbarchive.load_chapter_directory)
+      assert docbook.BookQuery.count_in_chapters("君子", lunyu.book.get_chapters_directorys(), context = context) == 0
+    finally:
+      docbook.BookQuery.CHAPTER_LOAD_FUNC = None
+
+    # 没有变化时所有的书籍都沿用
+    assert all(item['reused'] for item in new_dbarchive.refresh().load_report)
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_parallel_load()
+  test_snapshot()
+  test_refresh()
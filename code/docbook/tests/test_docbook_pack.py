@@ -0,0 +1,122 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import CONTENTS, get_hits
+
+logger = logging.getLogger("test.docbook.pack")
+
+IMAGE = bytes(range(256))
+
+def create_book(title: str) -> docbook.Book:
+  book = docbook.Book(title = title, authors = ["王弼"])
+  volume = docbook.Division(title = "上經", type = docbook.DivisionType.VOLUME)
+  book.add_division(volume)
+  for chapter_index in range(3):
+    chapter = docbook.Division(title = f"{title}{chapter_index}", type = docbook.DivisionType.CHAPTER)
+    for content in CONTENTS[chapter_index:]:
+      content_piece = docbook.ContentPiece(content = content)
+      content_piece.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "注：君子謂大人也", position = 0))
+      chapter.add_content_piece(content_piece)
+    volume.add_division(chapter)
+  book.extras.append(docbook.Extra("img_001", docbook.ExtraContentType.ITEM_IMAGE, "images/img_001.gif", IMAGE))
+  return book
+
+def get_book_dict(dbfile: docbook.BookFile):
+  d = dbfile.book.to_dict()
+  d.pop('date')
+  return d, [chapter.to_dict() for chapter in dbfile.book.chapters], [extra.content for extra in dbfile.book.extras]
+
+def test_packed_file():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    for compress in [True, False]:
+      book = create_book("周易")
+      chapters = [chapter.to_dict() for chapter in book.chapters]
+      packed_path = path / f"周易{compress}{docbook.BookFile.PACKED_FILE_SUFFIX}"
+      assert docbook.BookFile.save_to_docbook(packed_path.as_posix(), book, docbook.BookFileType.PACKED_FILE, compress)
+
+      # 打开书籍时只解码目录，章节内容在需要时单独解码
+      dbfile = docbook.BookFile(packed_path.as_posix())
+      assert dbfile.type == docbook.BookFileType.PACKED_FILE
+      assert not any(chapter.is_load() for chapter in dbfile.book.chapters)
+      assert dbfile.load_chapter(dbfile.book.chapters[1])
+      assert [chapter.is_load() for chapter in dbfile.book.chapters] == [False, True, False]
+      assert dbfile.book.chapters[1].to_dict()['divisions'] == chapters[1]['divisions']
+      assert dbfile.get_chapter_size(dbfile.book.chapters[1]) > 0
+      assert dbfile.book.extras[0].content is None
+      assert dbfile.load_extra(dbfile.book.extras[0]) and (dbfile.book.extras[0].content == IMAGE)
+
+      dbfile = docbook.BookFile(packed_path.as_posix(), False)
+      assert [chapter.to_dict()['divisions'] for chapter in dbfile.book.chapters] == [chapter['divisions'] for chapter in chapters]
+
+def test_packed_file_convert():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    docbook.BookFile.save_to_docbook((path / "parts").as_posix(), create_book("周易"), docbook.BookFileType.PARTS_FILE)
+    parts_dbfile = docbook.BookFile((path / "parts").as_posix(), False)
+    assert parts_dbfile.load_all_extra()
+
+    # PARTS_FILE -> PACKED_FILE -> PARTS_FILE，内容不变
+    parts = get_book_dict(parts_dbfile)
+    docbook.BookFile.save_to_docbook((path / "周易.dbpack").as_posix(), parts_dbfile.book, docbook.BookFileType.PACKED_FILE)
+    packed_dbfile = docbook.BookFile((path / "周易.dbpack").as_posix(), False)
+    assert packed_dbfile.load_all_extra()
+    assert get_book_dict(packed_dbfile) == parts
+
+    docbook.BookFile.save_to_docbook((path / "parts2").as_posix(), packed_dbfile.book, docbook.BookFileType.PARTS_FILE)
+    parts_dbfile = docbook.BookFile((path / "parts2").as_posix(), False)
+    assert parts_dbfile.load_all_extra()
+    assert get_book_dict(parts_dbfile) == parts
+
+def test_packed_archive():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    docbook.BookFile.save_to_docbook((path / "packed" / "周易.dbpack").as_posix(), create_book("周易"), docbook.BookFileType.PACKED_FILE)
+    docbook.BookFile.save_to_docbook((path / "single" / "周易.dbook").as_posix(), create_book("周易"), docbook.BookFileType.SINGLE_FILE)
+
+    # 动态载入章节的搜索结果与全部载入的一致
+    dbquery = docbook.BookQuery()
+    packed_dbarchive = docbook.BookArchive((path / "packed").as_posix(), True, docbook.ChapterCache(max_count = 1))
+    single_dbarchive = docbook.BookArchive((path / "single").as_posix(), False)
+    docbook.BookQuery.CHAPTER_LOAD_FUNC = packed_dbarchive.load_chapter_directory
+    docbook.BookQuery.QUERY_THREAD_NUM, thread_num = 1, docbook.BookQuery.QUERY_THREAD_NUM
+    try:
+      packed_hits = get_hits(dbquery.search_in_chapters("君子", packed_dbarchive.get_chapters_directorys()))
+    finally:
+      docbook.BookQuery.CHAPTER_LOAD_FUNC = None
+      docbook.BookQuery.QUERY_THREAD_NUM = thread_num
+    single_hits = get_hits(dbquery.search_in_chapters("君子", single_dbarchive.get_chapters_directorys()))
+    assert [hits for _, hits in packed_hits] == [hits for _, hits in single_hits]
+    assert len(packed_hits) == 2
+
+def test_packed_file_truncated():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    packed_path = path / "周易.dbpack"
+    docbook.BookFile.save_to_docbook(packed_path.as_posix(), create_book("周易"), docbook.BookFileType.PACKED_FILE)
+    data = packed_path.read_bytes()
+    with open(packed_path, 'rb') as file:
+      _, _, blocks = docbook.docbook_pack.read_packed_header(file)
+    header_length = min(block.offset for block in blocks.values())
+
+    # 文件头、数据块偏移表、目录任意位置被截断都抛出DecoderError
+    truncated_path = path / "truncated.dbpack"
+    for length in range(0, header_length, 7):
+      truncated_path.write_bytes(data[:length])
+      try:
+        docbook.BookFile(truncated_path.as_posix())
+        assert False
+      except docbook.DecoderError:
+        pass
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_packed_file()
+  test_packed_file_convert()
+  test_packed_archive()
+  test_packed_file_truncated()
@@ -0,0 +1,86 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import create_archive, get_hits
+
+logger = logging.getLogger("test.docbook.query_page")
+
+def get_page_hits(query_results, start, count):
+  hits = [(chapter_id, hit) for chapter_id, chapter_hits in get_hits(query_results) for hit in chapter_hits]
+  return hits[start:] if count is None else hits[start : start + count]
+
+def test_search_page():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbindex = dbarchive.load_index()
+    # 按照最终的顺序排列章节
+    directorys = sorted(dbarchive.get_chapters_directorys(), key = lambda directory: (directory[-1].title.title, directory[-1].order), reverse = True)
+
+    with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+      for query_string in ["君子", "君子 and 小人", "xyz"]:
+        query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = True)
+        for start, count in [(0, 3), (2, 5), (5, 100), (0, None), (100, 10)]:
+          for searcher in [docbook.BookQuery, dbquery_pool]:
+            for index in [None, dbindex]:
+              page_query_results = searcher.search_page_in_chapters(query_string, directorys, start, count, annotation = True, index = index)
+              logger.info(f"query: {query_string}, start: {start}, count: {count}, hits: {page_query_results.query_result_count}, total: {page_query_results.query_target_count}.")
+              page_hits = [(chapter_id, hit) for chapter_id, hits in get_hits(page_query_results) for hit in hits]
+              assert page_hits == get_page_hits(query_results, start, count)
+              assert page_query_results.query_target_count == query_results.query_result_count
+
+      # 没有选中任何书籍时没有结果
+      for searcher in [docbook.BookQuery, dbquery_pool]:
+        assert searcher.count_in_chapters("君子", directorys, books = set()) == 0
+
+    dbindex.close()
+
+def test_search_page_books():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbooks = dbarchive.dbooks
+    directorys = dbarchive.get_chapters_directorys()
+    zhouyi, lunyu = [book.id for book in dbooks]
+
+    # 书籍id或者书名（可以使用通配符），URL中的'+'被解码为空格
+    assert docbook.BookQuery.parse_book_list(None, dbooks) is None
+    assert docbook.BookQuery.parse_book_list("", dbooks) is None
+    assert docbook.BookQuery.parse_book_list("+周易", dbooks) == {zhouyi}
+    assert docbook.BookQuery.parse_book_list(" 周易  論語", dbooks) == {zhouyi, lunyu}
+    assert docbook.BookQuery.parse_book_list(f"-{zhouyi}", dbooks) == {lunyu}
+    assert docbook.BookQuery.parse_book_list("*,-論?", dbooks) == {zhouyi}
+    assert docbook.BookQuery.parse_book_list("+荀子", dbooks) == set()
+
+    with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+      for book_list in ["+周易", "-周易", "+周易,+論語"]:
+        books = docbook.BookQuery.parse_book_list(book_list, dbooks)
+        for query_string in ["君子", "title:論語 and 小人"]:
+          query_results = docbook.BookQuery.search_in_chapters(query_string, [directory for directory in directorys if directory[0].id in books], limit = None)
+          for searcher in [docbook.BookQuery, dbquery_pool]:
+            assert get_hits(searcher.search_in_chapters(query_string, directorys, limit = None, books = books)) == get_hits(query_results)
+            page_query_results = searcher.search_page_in_chapters(query_string, directorys, 1, 2, fields = dbarchive.get_field_index(), books = books)
+            assert [(chapter_id, hit) for chapter_id, hits in get_hits(page_query_results) for hit in hits] == get_page_hits(query_results, 1, 2)
+            assert page_query_results.query_target_count == query_results.query_result_count
+
+      # 没有选中任何书籍时没有结果
+      for searcher in [docbook.BookQuery, dbquery_pool]:
+        assert searcher.count_in_chapters("君子", directorys, books = set()) == 0
+
+def test_count_in_chapters():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    directorys = dbarchive.get_chapters_directorys()
+    for query_string in ["君子", "not 君子", "大人 or 聖人"]:
+      for annotation in [False, True]:
+        query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation)
+        assert docbook.BookQuery.count_in_chapters(query_string, directorys, annotation) == query_results.query_result_count
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_search_page()
+  test_search_page_books()
+  test_count_in_chapters()
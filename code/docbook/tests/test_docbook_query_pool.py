@@ -0,0 +1,148 @@
+import logging
+import pathlib
+import tempfile
+import concurrent.futures
+
+import utils
+import query
+import docbook
+
+from test_docbook_index import create_archive, get_hits
+
+logger = logging.getLogger("test.docbook.query_pool")
+
+def test_query_pool_search():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    dbindex = dbarchive.load_index()
+    directorys = dbarchive.get_chapters_directorys()
+
+    with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+      assert dbquery_pool.process_num == 2
+      for query_string in ["君子 and 小人", "密云 or 樂得", "not 君子", "君.", "xyz"]:
+        for annotation in [False, True]:
+          query_results = docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, annotation = annotation)
+          for index in [None, dbindex]:
+            pool_query_results = dbquery_pool.search_in_chapters(query_string, directorys, limit = None, annotation = annotation, index = index)
+            logger.info(f"query: {query_string}, annotation: {annotation}, hits: {pool_query_results.query_result_count}.")
+            # 结果的顺序与directorys一致
+            assert get_hits(query_results) == get_hits(pool_query_results)
+
+      # 达到limit后中止搜索，输出的是按顺序的前limit个结果
+      query_results = docbook.BookQuery.search_in_chapters("君子", directorys, limit = None, annotation = True)
+      pool_query_results = dbquery_pool.search_in_chapters("君子", directorys, limit = 3, annotation = True)
+      assert pool_query_results.query_result_count == 3
+      assert [hit for _, hits in get_hits(pool_query_results) for hit in hits] == [hit for _, hits in get_hits(query_results) for hit in hits][:3]
+
+      # 中途放弃的搜索不影响之后的搜索
+      query_result_pieces = dbquery_pool.iter_search_in_chapters("君子", directorys, limit = None)
+      next(query_result_pieces)
+      query_result_pieces.close()
+      assert get_hits(dbquery_pool.search_in_chapters("小人", directorys, limit = None)) == get_hits(docbook.BookQuery.search_in_chapters("小人", directorys, limit = None))
+
+      # 交错进行的搜索：结果按照search_id转发给各自的调用者，未结束的生成器不阻塞其他搜索
+      query_result_pieces = dbquery_pool.iter_search_in_chapters("君子", directorys, limit = None)
+      first = next(query_result_pieces)
+      assert dbquery_pool.count_in_chapters("小人", directorys) == docbook.BookQuery.count_in_chapters("小人", directorys)
+      assert get_hits(dbquery_pool.search_in_chapters("愛", directorys, limit = None)) == get_hits(docbook.BookQuery.search_in_chapters("愛", directorys, limit = None))
+      pool_query_results = query.QueryResults(query.Query("君子"))
+      for query_result_piece in [first, *query_result_pieces]:
+        pool_query_results.add_query_result_piece(query_result_piece)
+      assert get_hits(pool_query_results) == get_hits(docbook.BookQuery.search_in_chapters("君子", directorys, limit = None))
+
+      # 多个线程同时搜索
+      query_strings = ["君子", "小人", "愛 or 聖人", "君子 and 小人"] * 4
+      with concurrent.futures.ThreadPoolExecutor(max_workers = 4) as executor:
+        results = list(executor.map(lambda query_string: get_hits(dbquery_pool.search_in_chapters(query_string, directorys, limit = None)), query_strings))
+      assert results == [get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None)) for query_string in query_strings]
+
+      # 被中止的context不再搜索
+      context = docbook.SearchContext()
+      context.cancel()
+      assert dbquery_pool.search_in_chapters("君子", directorys, limit = None, context = context).query_result_count == 0
+
+    dbindex.close()
+
+def test_query_pool_update():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    dbarchive = create_archive(path)
+    directorys = dbarchive.get_chapters_directorys()
+    query_strings = ["坦蕩", "君子 and 小人", "樂得"]
+    expected = [get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None)) for query_string in query_strings]
+
+    dbquery_pool = docbook.BookQueryPool(dbarchive, 2)
+    processes = dbquery_pool._search_processes.processes
+    pids = [process.pid for process in processes]
+    # 搜索进程启动时从磁盘文件载入书籍，等它们载入完成之后再修改磁盘文件
+    assert get_hits(dbquery_pool.search_in_chapters(query_strings[1], directorys, limit = None)) == expected[1]
+
+    # 修改、删除和新增书籍后，只更新变化的书籍，搜索进程不重新启动
+    book = docbook.BookFile((path / "論語.dbook").as_posix(), False).book
+    book.chapters[0].add_content_piece(docbook.ContentPiece(content = "君子坦蕩蕩，小人長戚戚。"))
+    docbook.BookFile.save_to_docbook((path / "論語.dbook").as_posix(), book)
+    (path / "周易.dbook").unlink()
+    docbook.BookFile.save_to_docbook((path / "孟子.dbook").as_posix(), docbook.BookFile((path / "論語.dbook").as_posix(), False).book)
+    new_dbarchive = dbarchive.refresh()
+    new_dbquery_pool = dbquery_pool.update(new_dbarchive)
+    assert new_dbquery_pool.generation != dbquery_pool.generation
+    assert [process.pid for process in new_dbquery_pool._search_processes.processes] == pids
+
+    # 在update之后开始的、使用原来一代的搜索，得到的仍然是原来的书籍的结果（包括已经删除、修改过的书籍）
+    for query_string, hits in zip(query_strings, expected):
+      assert get_hits(dbquery_pool.search_in_chapters(query_string, directorys, limit = None)) == hits
+    assert dbquery_pool.count_in_chapters("坦蕩", directorys) == 0
+
+    # 新的一代搜索刷新后的书籍
+    new_directorys = new_dbarchive.get_chapters_directorys()
+    for query_string in query_strings:
+      assert get_hits(new_dbquery_pool.search_in_chapters(query_string, new_directorys, limit = None)) == get_hits(docbook.BookQuery.search_in_chapters(query_string, new_directorys, limit = None))
+    assert new_dbquery_pool.count_in_chapters("坦蕩", new_directorys) == 2
+
+    # 关闭原来的一代不影响新的一代，所有的代都关闭后搜索进程退出
+    dbquery_pool.close()
+    assert all(process.is_alive() for process in processes)
+    assert new_dbquery_pool.count_in_chapters("坦蕩", new_directorys) == 2
+    new_dbquery_pool.close()
+    assert not any(process.is_alive() for process in processes)
+
+def test_query_pool_snapshot():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    create_archive(path)
+    docbook.BookArchive.USE_SNAPSHOT = True
+    try:
+      dbarchive = docbook.BookArchive(path.as_posix(), False)
+      directorys = dbarchive.get_chapters_directorys()
+      expected = get_hits(docbook.BookQuery.search_in_chapters("君子", directorys, limit = None))
+      # 书籍文件在文献库载入之后损坏，搜索进程从快照中恢复书籍，不再解析书籍文件
+      for dbfile in dbarchive.dbfiles:
+        pathlib.Path(dbfile.path).write_bytes(b"broken")
+      with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+        assert get_hits(dbquery_pool.search_in_chapters("君子", directorys, limit = None)) == expected
+    finally:
+      docbook.BookArchive.USE_SNAPSHOT = False
+
+def test_query_pool_error():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    dbarchive = create_archive(path)
+    directorys = dbarchive.get_chapters_directorys()
+    # 没有快照时搜索进程解析书籍文件，载入失败的书籍的章节作为搜索失败，调用者得到异常而不是不完整的结果
+    for dbfile in dbarchive.dbfiles:
+      pathlib.Path(dbfile.path).write_bytes(b"broken")
+    with docbook.BookQueryPool(dbarchive, 2) as dbquery_pool:
+      for search in [lambda: dbquery_pool.search_in_chapters("君子", directorys, limit = None), lambda: dbquery_pool.count_in_chapters("君子", directorys)]:
+        try:
+          search()
+          assert False
+        except RuntimeError as e:
+          logger.info(f"search failed: {e}")
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_query_pool_search()
+  test_query_pool_update()
+  test_query_pool_snapshot()
+  test_query_pool_error()
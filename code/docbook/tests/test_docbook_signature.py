@@ -0,0 +1,83 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+from docbook.docbook_signature import ChapterSignature
+from query import Query
+
+from test_docbook_index import get_hits
+from test_docbook_pack import create_book
+
+logger = logging.getLogger("test.docbook.signature")
+
+def test_signature():
+  signature = ChapterSignature.build(["君子不器", "小人長戚戚"])
+  assert ChapterSignature.compile_query(Query("君子 and 小人"))(signature)
+  assert ChapterSignature.compile_query(Query("君子 and (童觀 or 小人)"))(signature)
+  assert not ChapterSignature.compile_query(Query("君子 and 童觀"))(signature)
+  # 双字也在签名中，单字都出现但是不相邻时可以排除
+  assert not ChapterSignature.compile_query(Query("子小"))(signature)
+  assert ChapterSignature.compile_query(Query("君. and 不器"))(signature)
+  assert not ChapterSignature.compile_query(Query("君. and 童觀"))(signature)
+
+  # NOT和正则表达式无法通过签名判断
+  assert ChapterSignature.compile_query(Query("not 君子")) is None
+  assert ChapterSignature.compile_query(Query("君. or 童觀")) is None
+
+def test_signature_search():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    for title in ["周易", "論語"]:
+      docbook.BookFile.save_to_docbook((path / f"{title}.dbpack").as_posix(), create_book(title), docbook.BookFileType.PACKED_FILE)
+    dbarchive = docbook.BookArchive(path.as_posix(), True, docbook.ChapterCache(max_count = 1))
+    directorys = dbarchive.get_chapters_directorys()
+
+    loaded = []
+    def load_chapter_directory(directory):
+      loaded.append(directory[-1].id)
+      return dbarchive.load_chapter_directory(directory)
+
+    dbquery = docbook.BookQuery()
+    docbook.BookQuery.CHAPTER_LOAD_FUNC = load_chapter_directory
+    try:
+      # 没有载入过的章节没有签名，需要载入后搜索
+      assert not any(chapter._signature is not None for chapter in dbarchive.chapters)
+      hits = get_hits(dbquery.search_in_chapters("君子", directorys))
+      assert len(loaded) == len(directorys)
+
+      # 章节被挤出缓存后签名仍然保留，不可能命中的章节不再载入
+      assert all(chapter._signature is not None for chapter in dbarchive.chapters)
+      assert sum(chapter.is_load() for chapter in dbarchive.chapters) == 1
+      loaded.clear()
+      assert get_hits(dbquery.search_in_chapters("童觀", directorys)) != []
+      assert len(loaded) == 2
+      loaded.clear()
+      assert dbquery.count_in_chapters("潛龍", directorys) == 0
+      assert loaded == []
+
+      # 结果与不使用签名时一致
+      docbook.BookQuery.USE_SIGNATURE = False
+      try:
+        for query_string in ["君子", "童觀", "童觀 or 密云", "大人 and not 童觀"]:
+          expected = get_hits(dbquery.search_in_chapters(query_string, directorys))
+          docbook.BookQuery.USE_SIGNATURE = True
+          assert get_hits(dbquery.search_in_chapters(query_string, directorys)) == expected
+          docbook.BookQuery.USE_SIGNATURE = False
+      finally:
+        docbook.BookQuery.USE_SIGNATURE = True
+    finally:
+      docbook.BookQuery.CHAPTER_LOAD_FUNC = None
+
+    # 载入新的内容时签名失效
+    chapter = dbarchive.chapters[0]
+    chapter.divisions = [docbook.ContentPiece(content = "潛龍勿用")]
+    assert chapter._signature is None
+    assert ChapterSignature.compile_query(Query("潛龍"))(docbook.docbook_span.get_chapter_signature(chapter))
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_signature()
+  test_signature_search()
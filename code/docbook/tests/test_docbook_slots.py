@@ -0,0 +1,50 @@
+import logging
+
+import utils
+import docbook
+
+logger = logging.getLogger("test.docbook.slots")
+
+def test_slots():
+  title = docbook.Title("周易", "卷")
+  author = docbook.Author("王弼", "注", "魏")
+  chapter = docbook.Division(title = "觀卦", type = docbook.DivisionType.CHAPTER)
+  content_piece = docbook.ContentPiece(content = "初六：童觀，小人無咎。")
+  chapter.add_content_piece(content_piece)
+  book = docbook.Book(title = "周易", authors = [author])
+  book.add_division(chapter)
+
+  # 节点不分配__dict__，也不分配空的attrs
+  for obj in [title, author, author.dynasty, chapter, content_piece, book]:
+    assert not hasattr(obj, '__dict__')
+    assert obj._attributes is None
+
+  # attrs的读写与原来一致
+  assert content_piece.get('style') is None
+  assert content_piece.get('style', 'bold') == 'bold'
+  content_piece['style'] = 'bold'
+  assert content_piece['style'] == 'bold'
+  content_piece.clear_attrs()
+  assert content_piece._attributes is None
+  content_piece.attrs['style'] = 'italic'
+  assert content_piece.get('style') == 'italic'
+  del content_piece['style']
+  assert content_piece.attrs == {}
+
+  # 没有attrs时，输出与原来一致
+  assert chapter.to_dict()['attrs'] == {}
+  assert docbook.Book.from_json(book.dump_json()).dump_json() == book.dump_json()
+
+def test_intern_label():
+  annotator = "".join(["鄭", "玄"])
+  content_pieces = [docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "注", annotator = "".join(["鄭", "玄"]), authorship = "".join(["箋"])) for _ in range(2)]
+  assert content_pieces[0].annotator is content_pieces[1].annotator
+  assert content_pieces[0].authorship is content_pieces[1].authorship
+  content_pieces[0].annotator = annotator
+  assert content_pieces[0].annotator is content_pieces[1].annotator
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_slots()
+  test_intern_label()
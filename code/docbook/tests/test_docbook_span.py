@@ -0,0 +1,122 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import query
+import docbook
+from docbook.docbook_span import get_chapter_spans, get_loaded_chapter_spans, get_chapter_span, iter_chapter_spans, strip_html_tags
+
+from test_docbook_index import get_hits
+from test_docbook_cache import create_parts_archive
+
+logger = logging.getLogger("test.docbook.span")
+
+def create_chapter() -> docbook.Division:
+  chapter = docbook.Division(title = "觀卦", type = docbook.DivisionType.CHAPTER)
+  paragraph = docbook.ContentPiece(content = "初六：<b>童觀</b>，小人無咎。\n六二：<i>闚觀</i>，利女貞。")
+  paragraph.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "<a href='#'>注</a>：童，稚也。"))
+  chapter.add_content_piece(paragraph)
+  return chapter
+
+def test_strip_html_tags():
+  assert strip_html_tags("君子吝。") == ("君子吝。", None)
+
+  text = "初六：<b>童觀</b>，小人無咎。"
+  clean_text, segments = strip_html_tags(text, 10)
+  assert clean_text == utils.remove_html_tags(text)
+  assert segments == [(0, 10), (3, 16), (5, 22)]
+
+def test_chapter_spans():
+  chapter = create_chapter()
+  spans = get_chapter_spans(chapter)
+
+  assert [span.text for span in spans] == ["初六：童觀，小人無咎。", "六二：闚觀，利女貞。", "注：童，稚也。"]
+  assert [span.index for span in spans] == [0, 1, 2]
+  assert [span.in_annotation for span in spans] == [False, False, True]
+  assert spans[2].type == docbook.DivisionType.ANNOTATION
+  assert [(text, in_annotation) for text, _, in_annotation in iter_chapter_spans(chapter)] == [(span.text, span.in_annotation) for span in spans]
+
+  # 去掉标签后的位置可以映射回原始内容中的位置
+  for span in spans:
+    content = span.content_piece.content
+    for keyword in ["童觀", "闚觀", "小人", "貞", "注", "稚"]:
+      position = span.text.find(keyword)
+      if position >= 0:
+        offset = span.get_content_offset(position)
+        assert content[offset : offset + len(keyword)] == keyword
+
+  # span表缓存在章节上，章节内容变化时失效
+  assert get_chapter_spans(chapter) is spans
+  chapter.add_content_piece(docbook.ContentPiece(content = "九五：觀我生。"))
+  assert get_chapter_spans(chapter) is not spans
+  assert get_chapter_spans(chapter)[-1].text == "九五：觀我生。"
+
+def test_highlights_content():
+  chapter = create_chapter()
+  chapter.add_content_piece(docbook.ContentPiece(content = "九五：<b>觀</b>我生，<i>君子</i>無咎。"))
+  spans = get_chapter_spans(chapter)
+  assert spans[1].get_content() == "六二：<i>闚觀</i>，利女貞。"
+  # 被标签分开的文本各为一段
+  assert spans[3].get_content_ranges(3, 5) == [(6, 7), (11, 12)]
+
+  # 命中结果带有span的序号，在包含标签的原始内容上高亮
+  q = query.Query("觀我 or 君子 or 闚觀")
+  query_results = docbook.BookQuery.search_in_chapters(q, [[chapter]], limit = None)
+  hits = query_results.query_result_pieces[0].hits
+  assert [hit[3] for hit in hits] == [1, 3]
+  text, _, matches, index = hits[1]
+  span = get_chapter_span(chapter, index)
+  assert span is spans[3]
+  assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches, span = span) == "九五：<b><mark>觀</mark></b><mark>我</mark>生，<i><mark>君子</mark></i>無咎。"
+  assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches) == "九五：<mark>觀我</mark>生，<mark>君子</mark>無咎。"
+  text, _, matches, index = hits[0]
+  assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches, span = get_chapter_span(chapter, index)) == "六二：<i><mark>闚觀</mark></i>，利女貞。"
+  # surround按照去掉标签的文字计算
+  assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches, surround = 1, span = get_chapter_span(chapter, index)) == "...：<i><mark>闚觀</mark></i>，..."
+
+  # 没有缓存span表时只建立到需要的span为止
+  chapter = create_chapter()
+  assert get_chapter_span(chapter, 1).get_content() == "六二：<i>闚觀</i>，利女貞。"
+  assert chapter._spans is None
+  assert get_chapter_span(chapter, 10) is None
+
+def test_chapter_spans_unload():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_parts_archive(pathlib.Path(path))
+    directory = dbarchive.get_chapters_directorys()[0]
+    chapter = directory[-1]
+    assert dbarchive.load_chapter_directory(directory)
+    spans = get_chapter_spans(chapter)
+    assert get_chapter_spans(chapter) is spans
+
+    # 卸载后span表失效，重新载入后重新建立
+    chapter.unload()
+    assert chapter._spans is None
+    assert get_chapter_spans(chapter) == []
+    assert chapter._spans is None
+    assert get_loaded_chapter_spans(chapter) is None
+    assert dbarchive.load_chapter_directory(directory)
+    assert [span.text for span in get_chapter_spans(chapter)] == [span.text for span in spans]
+
+    # 已经取得的span表引用了章节的内容，章节被卸载后仍然可以搜索
+    spans = get_loaded_chapter_spans(chapter)
+    chapter.unload()
+    assert not chapter.is_load()
+    assert docbook.BookQuery.count_hits_in_chapter(query.Query("君子"), chapter, chapter_spans = spans) > 0
+    assert dbarchive.load_chapter_directory(directory)
+
+    # 使用span表的搜索结果与索引确认的结果一致
+    dbarchive.load_all_books()
+    dbquery = docbook.BookQuery()
+    directorys = dbarchive.get_chapters_directorys()
+    dbindex = dbarchive.load_index()
+    assert get_hits(dbquery.search_in_chapters("小人", directorys)) == get_hits(dbquery.search_in_chapters("小人", directorys, index = dbindex))
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_strip_html_tags()
+  test_chapter_spans()
+  test_highlights_content()
+  test_chapter_spans_unload()
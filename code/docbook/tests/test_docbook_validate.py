@@ -0,0 +1,83 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_pack import create_book
+from test_docbook_load import create_archive_files, load_archive
+
+logger = logging.getLogger("test.docbook.validate")
+
+def test_trusted_load():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    create_archive_files(path)
+    dbarchive = load_archive(path, False, 1)
+
+    # 快速载入的结果与完整校验载入的一致
+    for dbfile in dbarchive.dbfiles:
+      dbfile = docbook.BookFile(dbfile.path, False)
+      trusted_dbfile = docbook.BookFile(dbfile.path, False, trusted = True)
+      assert trusted_dbfile.book.to_dict() == dbfile.book.to_dict()
+      assert [chapter.to_dict() for chapter in trusted_dbfile.book.chapters] == [chapter.to_dict() for chapter in dbfile.book.chapters]
+      assert trusted_dbfile.book.get_chapter_byid(dbfile.book.chapters[1].id) is trusted_dbfile.book.chapters[1]
+
+    docbook.BookArchive.TRUSTED_LOAD = True
+    try:
+      trusted_dbarchive = load_archive(path, True, 2)
+    finally:
+      docbook.BookArchive.TRUSTED_LOAD = False
+    trusted_dbarchive.load_all_books()
+    assert [book.to_dict() for book in trusted_dbarchive.dbooks] == [book.to_dict() for book in dbarchive.dbooks]
+    assert [chapter.to_dict() for chapter in trusted_dbarchive.chapters] == [chapter.to_dict() for chapter in dbarchive.chapters]
+
+def test_validate_bookfile():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    book = create_book("周易")
+
+    for type, name in [(docbook.BookFileType.SINGLE_FILE, "周易.dbook"), (docbook.BookFileType.PARTS_FILE, "周易"),
+                       (docbook.BookFileType.PACKED_FILE, "周易.dbpack"), (docbook.BookFileType.SINGLE_PARTS_FILE, "周易.dbzip")]:
+      docbook.BookFile.save_to_docbook((path / name).as_posix(), book, type)
+      assert docbook.BookValidate.validate_bookfile((path / name).as_posix()) == []
+
+    # 记录所有不合法的地方，而不是只有第一个
+    params = create_book("周易").to_dict()
+    params['date'] = "2024-01-01"
+    params['divisions'][0]['id'] = "not-a-uuid"
+    params['divisions'][0]['divisions'][1]['type'] = "PARAGRAPH"
+    params['divisions'][0]['divisions'][2]['title'] = {'title': ""}
+    params['divisions'][0]['divisions'][2]['divisions'][0]['type'] = "CHAPTER"
+    params['extras'][0]['type'] = "VIDEO"
+    validator = docbook.BookValidate.BookValidator()
+    validator.check_book(params)
+    violations = validator.violations
+    assert len(violations) == 6
+    assert violations[0] == "book.date: invalid date '2024-01-01'"
+    assert violations[1].startswith("book.divisions[0].id: invalid UUID")
+    assert violations[-1].startswith("book.extras[0].type:")
+
+    # 缺少章节文件
+    chapter_ref = book.chapters[1].ref
+    (path / "周易" / chapter_ref).unlink()
+    violations = docbook.BookValidate.validate_bookfile((path / "周易").as_posix())
+    assert len(violations) == 1 and (chapter_ref in violations[0])
+
+def test_validate_archive():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    create_archive_files(path)
+    load_archive(path, True, 1)
+
+    for process_num in [1, 3]:
+      results = docbook.BookValidate.validate_archive(path.as_posix(), process_num)
+      assert [pathlib.Path(book_path).name for book_path in results] == ["中庸.dbook"]
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_trusted_load()
+  test_validate_bookfile()
+  test_validate_archive()
@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+
+import utils
+import docbook
+from utils import json_utils
+from docbook.docbook_writer import JsonWriter, dumps_json
+
+logger = logging.getLogger("test.docbook.writer")
+
+def create_book() -> docbook.Book:
+  book = docbook.Book(title = "周易", authors = [docbook.Author("王弼", "注", "魏"), docbook.Author("孔穎達", "疏")], categories = ["經部|易類", ""], description = "")
+  book.attrs.update({"empty": {"list": [], "dict": {}, "str": "", "none": None}, "tuple": (), "nested": [[], [1, {}], "\"引號\"\n"], 1: False, 2.5: 0.0})
+
+  volume = docbook.Division(title = docbook.Title("上經", "卷一"), type = docbook.DivisionType.VOLUME)
+  book.add_division(volume)
+  for index in range(3):
+    chapter = docbook.Division(title = f"第{index}章", type = docbook.DivisionType.CHAPTER)
+    paragraph = docbook.ContentPiece(content = "初六：<b>童觀</b>，小人無咎。" if index != 1 else "")
+    paragraph.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.ANNOTATION, content = "注：童，稚也。", annotator = "王弼", position = 0))
+    paragraph["style"] = {"indent": 2}
+    chapter.add_content_piece(paragraph)
+    chapter.add_content_piece(docbook.ContentPiece(type = docbook.DivisionType.SECTION))
+    volume.add_division(chapter)
+  # 亡佚的卷章
+  volume.add_division(docbook.Division(title = "第3章", type = docbook.DivisionType.VOLUME))
+  book.extras.append(docbook.Extra("img_001", docbook.ExtraContentType.ITEM_IMAGE, "images/img_001.gif"))
+  return book
+
+def test_writer():
+  book = create_book()
+  for obj in [book, book.chapters[0], book.chapters[0].divisions[0], book.authors[0]]:
+    d = utils.remove_useless_value(obj.to_dict())
+    for indent in [None, 2, 4]:
+      separators = (',', ':') if indent is None else None
+      for ensure_ascii in [False, True]:
+        assert dumps_json(obj, ensure_ascii = ensure_ascii, indent = indent) == json.dumps(d, ensure_ascii = ensure_ascii, indent = indent, separators = separators)
+    assert obj.dump_json(indent = 4, remove_useless = True) == json.dumps(d, ensure_ascii = False, indent = 4)
+    assert utils.json_loads(obj.dump_json_bytes(remove_useless = True)) == json.loads(json.dumps(d))
+
+  # 没有用的值输出为null
+  assert dumps_json(docbook.Title()) == json.dumps(utils.remove_useless_value(docbook.Title().to_dict()))
+  assert dumps_json({"a": [None, {}]}) == "null"
+
+def test_writer_stream():
+  book = create_book()
+  expected = json.dumps(utils.remove_useless_value(book.to_dict()), ensure_ascii = False, indent = 4).encode('utf-8')
+
+  # 写入文件的内容与一次输出的内容一致，缓存很小时分多次写入
+  writes = []
+  def write(data: bytes):
+    writes.append(data)
+  assert JsonWriter(write, indent = 4, buffer_size = 8).dump(book)
+  assert len(writes) > 1
+  assert b''.join(writes) == expected
+
+  file = io.BytesIO()
+  book.write_json(file, indent = 4)
+  assert file.getvalue() == expected
+
+def test_writer_compare_backends():
+  book = create_book()
+  book.attrs.update({"number": [1e16, 1e-7, 0.1], "text": "\u2028\x1f\x7f/\\"})
+  del book.attrs[1], book.attrs[2.5]
+  dumps = json_utils._dumps
+  try:
+    for backend in ['json', 'orjson', 'ujson', 'msgspec']:
+      try:
+        json_utils._dumps = json_utils._get_dumps(backend)
+      except ImportError:
+        continue
+      for obj in [book, book.chapters[0]]:
+        for indent in [None, 2, 4]:
+          # 之前的输出：to_dict、remove_useless_value之后经过json_utils编码
+          old = json_utils.json_dumps_bytes(utils.remove_useless_value(obj.to_dict()), indent = indent)
+          new = obj.dump_json_bytes(indent = indent, remove_useless = True)
+          assert json.loads(new) == json.loads(old)
+          if json_utils._dumps is None or json_utils._dumps(obj.to_dict(), indent) is None:
+            # 之前由标准库json编码时逐字节一致
+            assert new == old
+  finally:
+    json_utils._dumps = dumps
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_writer()
+  test_writer_stream()
+  test_writer_compare_backends()
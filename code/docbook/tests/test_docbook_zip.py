@@ -0,0 +1,101 @@
+import logging
+import pathlib
+import zipfile
+import tempfile
+
+import utils
+import docbook
+
+from test_docbook_index import get_hits
+from test_docbook_pack import IMAGE, create_book, get_book_dict
+
+logger = logging.getLogger("test.docbook.zip")
+
+def test_single_parts_file():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    book = create_book("周易")
+    chapters = [chapter.to_dict() for chapter in book.chapters]
+    zip_path = path / f"周易{docbook.BookFile.SINGLE_PARTS_FILE_SUFFIX}"
+    assert docbook.BookFile.save_to_docbook(zip_path.as_posix(), book, docbook.BookFileType.SINGLE_PARTS_FILE)
+
+    # 打开书籍时只读取book.json，章节在需要时从zip中读取
+    dbfile = docbook.BookFile(zip_path.as_posix())
+    assert dbfile.type == docbook.BookFileType.SINGLE_PARTS_FILE
+    assert not any(chapter.is_load() for chapter in dbfile.book.chapters)
+    assert dbfile.load_chapter(dbfile.book.chapters[2])
+    assert [chapter.is_load() for chapter in dbfile.book.chapters] == [False, False, True]
+    assert dbfile.book.chapters[2].to_dict()['divisions'] == chapters[2]['divisions']
+    assert dbfile.get_chapter_size(dbfile.book.chapters[2]) > 0
+    assert dbfile.get_source_files() == [zip_path]
+
+    # 附加内容直接从zip中读取
+    extra = dbfile.book.get_extra("img_001")
+    assert (dbfile.get_extra_content(extra) == IMAGE) and (extra.content is None)
+
+    dbfile.clear()
+
+def test_single_parts_file_zipped_directory():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    docbook.BookFile.save_to_docbook((path / "周易").as_posix(), create_book("周易"), docbook.BookFileType.PARTS_FILE)
+    parts_dbfile = docbook.BookFile((path / "周易").as_posix(), False)
+    assert parts_dbfile.load_all_extra()
+
+    # 直接压缩PARTS_FILE的目录，book.json在zip的一级目录中
+    zip_path = path / "zip" / "周易.dbzip"
+    zip_path.parent.mkdir()
+    with zipfile.ZipFile(zip_path, 'w') as file:
+      for file_path in sorted((path / "周易").rglob("*")):
+        if file_path.is_file():
+          file.write(file_path, file_path.relative_to(path).as_posix())
+
+    dbfile = docbook.BookFile(zip_path.as_posix(), False)
+    assert dbfile.load_all_extra()
+    assert get_book_dict(dbfile) == get_book_dict(parts_dbfile)
+
+    # 文献库可以直接使用zip书籍
+    dbquery = docbook.BookQuery()
+    dbarchive = docbook.BookArchive(zip_path.parent.as_posix(), True)
+    docbook.BookQuery.CHAPTER_LOAD_FUNC = dbarchive.load_chapter_directory
+    try:
+      hits = get_hits(dbquery.search_in_chapters("君子", dbarchive.get_chapters_directorys()))
+    finally:
+      docbook.BookQuery.CHAPTER_LOAD_FUNC = None
+    parts_hits = get_hits(dbquery.search_in_chapters("君子", parts_dbfile.book.get_chapters_directorys()))
+    assert [hits for _, hits in hits] == [hits for _, hits in parts_hits]
+
+def test_single_parts_file_extras_and_handles():
+  with tempfile.TemporaryDirectory() as path:
+    path = pathlib.Path(path)
+    # 没有ref的附加内容保存时生成ref
+    book = create_book("周易")
+    book.extras.append(docbook.Extra("img_002.gif", docbook.ExtraContentType.ITEM_IMAGE, None, IMAGE))
+    docbook.BookFile.save_to_docbook((path / "周易.dbzip").as_posix(), book, docbook.BookFileType.SINGLE_PARTS_FILE)
+    docbook.BookFile.save_to_docbook((path / "論語.dbzip").as_posix(), create_book("論語"), docbook.BookFileType.SINGLE_PARTS_FILE)
+
+    # 同时打开的zip文件数量有上限，被关闭的zip文件在需要时重新打开
+    zip_file_cache = docbook.BookFile.ZIP_FILE_CACHE
+    docbook.BookFile.ZIP_FILE_CACHE = docbook.ZipFileCache(1)
+    try:
+      dbfiles = [docbook.BookFile((path / name).as_posix()) for name in ["周易.dbzip", "論語.dbzip"]]
+      extra = dbfiles[0].book.get_extra("img_002.gif")
+      assert extra.ref == "extras/extra_001.gif"
+      for chapter_index in range(len(dbfiles[0].book.chapters)):
+        for dbfile in dbfiles:
+          assert dbfile.load_chapter(dbfile.book.chapters[chapter_index])
+          assert docbook.BookFile.ZIP_FILE_CACHE.count == 1
+      assert dbfiles[0].get_extra_content(extra) == IMAGE
+      assert [chapter.divisions[0].content for chapter in dbfiles[1].book.chapters] == [chapter.divisions[0].content for chapter in create_book("論語").chapters]
+      for dbfile in dbfiles:
+        dbfile.clear()
+      assert docbook.BookFile.ZIP_FILE_CACHE.count == 0
+    finally:
+      docbook.BookFile.ZIP_FILE_CACHE = zip_file_cache
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_single_parts_file()
+  test_single_parts_file_zipped_directory()
+  test_single_parts_file_extras_and_handles()
@@ -0,0 +1,45 @@
+import logging
+
+import utils
+import query
+import docbook
+
+logger = logging.getLogger("test.query.matcher")
+
+def test_search():
+  matcher = query.KeywordMatcher(['大人', '人', '小人'])
+  matches = matcher.search('大人之爱小人也')
+  logger.info(f"matches: {matches}.")
+  assert matches == [(0, 0), (1, 1), (4, 2), (5, 1)]
+  assert matcher.found_keys(matches) == {'大人', '人', '小人'}
+  assert matcher.found_keys(matcher.search('小人')) == {'人', '小人'}
+  assert matcher.search('君子') == []
+
+def test_highlight_spans():
+  # 同一位置优先使用在keys中序号最小的关键字，和正则表达式'(人|大人)'一致
+  matcher = query.KeywordMatcher(['人', '大人'])
+  assert matcher.highlight_spans(matcher.search('大人之爱人')) == [(0, 2, 1), (4, 5, 0)]
+  matcher = query.KeywordMatcher(['大', '大人'])
+  assert matcher.highlight_spans(matcher.search('大人之爱人')) == [(0, 1, 0)]
+
+  # 不需要高亮的关键字只用于查询条件判断
+  matcher = query.KeywordMatcher(['人'], ['大人之'])
+  assert matcher.highlight_spans(matcher.search('大人之爱人')) == [(1, 2, 0), (4, 5, 0)]
+
+def test_match_query():
+  q = query.Query("(大人 or 小人) and not 君子")
+  content = '大人之爱小人也'
+  matches = q.match_query(content)
+  assert matches is not None
+  assert q.match_query('君子之爱小人也') is None
+
+  highlighted = docbook.BookQuery.highlights(content, format = docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches)
+  assert highlighted == '<mark>大人</mark>之爱<mark>小人</mark>也'
+  assert highlighted == docbook.BookQuery.highlights(content, format = docbook.BookQuery.MARK_TEXT, keys = q.get_query_keys())
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_search()
+  test_highlight_spans()
+  test_match_query()
@@ -0,0 +1,109 @@
+import logging
+import pathlib
+import tempfile
+
+import utils
+import query
+import docbook
+from query import query_normalize
+from query.query_normalize import build_fold_table, normalize_pattern
+
+from test_docbook_index import create_archive, get_hits
+
+logger = logging.getLogger("test.query.normalize")
+
+def test_normalize_text():
+  text = "初六：童觀，小人無咎，君子吝。「學而時習之」"
+  normalized = query.normalize_text(text)
+  assert normalized == "初六:童观,小人无咎,君子吝。“学而时习之”"
+  # 长度不变、可以重复执行
+  assert len(normalized) == len(text)
+  assert query.normalize_text(normalized) == normalized
+  # 在正则表达式中有特殊含义的半角字符不折叠
+  assert query.normalize_text("（？）") == "（？）"
+  assert normalize_pattern("君.{1,2}觀，") == "君.{1,2}观,"
+
+  # 同一个字不能折叠为两个不同的字
+  try:
+    build_fold_table("于於 乎於")
+    assert False
+  except ValueError:
+    pass
+
+def test_normalize_query():
+  q = query.Query('(於 or 于) and "說 乎？" and 君. and title:論語')
+  assert q.get_query_keys() == ['于', '于', '说 乎？', '君.']
+  assert [term.pattern is None for term in q.query_tree.get_terms()] == [True, True, True, False]
+  assert [field.value for field in q.field_tree.get_fields()] == ['论语']
+  assert q.field_tree.get_fields()[0].match("論語注疏")
+
+  q = query.Query("於 and 童觀")
+  assert q.match_query("初六：童觀，生於谯") == [(3, 1), (7, 0)]
+  assert q.excute_query("初六：童觀，生於谯")
+  assert not q.excute_query("初六：童觀")
+
+def test_normalize_search():
+  with tempfile.TemporaryDirectory() as path:
+    dbarchive = create_archive(pathlib.Path(path))
+    directorys = dbarchive.get_chapters_directorys()
+    dbindex = dbarchive.load_index()
+
+    # 繁简、异体字的写法搜索到相同的结果，索引、签名的结果与直接搜索一致
+    for query_strings in [["童觀", "童观"], ["小人無咎", "小人无咎"], ["薄於 NEAR/2 聖人", "薄于 NEAR/2 圣人"], ["(君子 or 小人) and 愛", "(君子 or 小人) and 爱"]]:
+      expected = get_hits(docbook.BookQuery.search_in_chapters(query_strings[0], directorys, limit = None))
+      assert len(expected) > 0
+      for query_string in query_strings:
+        assert get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None)) == expected
+        assert get_hits(docbook.BookQuery.search_in_chapters(query_string, directorys, limit = None, index = dbindex)) == expected
+
+    # 命中的结果是原文，在原文上高亮
+    q = query.Query("童观 or 无咎")
+    query_results = docbook.BookQuery.search_in_chapters(q, directorys, limit = None)
+    text, _, matches, _ = query_results.query_result_pieces[0].hits[0]
+    assert text == "初六：童觀，小人無咎，君子吝。"
+    assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, matcher = q.matcher, matches = matches) == "初六：<mark>童觀</mark>，小人<mark>無咎</mark>，君子吝。"
+    assert docbook.BookQuery.highlights(text, docbook.BookQuery.MARK_TEXT, keys = ["無咎"]) == "初六：童觀，小人<mark>無咎</mark>，君子吝。"
+    dbindex.close()
+
+def test_fold_table_changed():
+  use_snapshot = docbook.BookArchive.USE_SNAPSHOT
+  state = (query_normalize.FOLD_TABLE, query_normalize.PATTERN_FOLD_TABLE, query_normalize.FOLD_TABLE_HASH, list(query_normalize.EXTRA_VARIANTS), query_normalize._frozen)
+  docbook.BookArchive.USE_SNAPSHOT = True
+  try:
+    with tempfile.TemporaryDirectory() as path:
+      dbarchive = create_archive(pathlib.Path(path))
+      dbarchive.load_index().close()
+      assert (pathlib.Path(path) / docbook.BookArchive.SNAPSHOT_FILE_NAME).is_dir()
+
+      # 文献库载入之后不能再修改折叠表
+      try:
+        query.add_variants(['仁人'])
+        assert False
+      except RuntimeError:
+        pass
+
+      # 模拟下一次启动时增加了异体字组：快照和索引都失效，重新建立
+      query_normalize._frozen = False
+      query.add_variants(['仁人'])
+      dbarchive = docbook.BookArchive(path)
+      assert not any(item['reused'] for item in dbarchive.load_report)
+      dbindex = dbarchive.load_index()
+      assert dbindex.is_up_to_date(dbarchive)
+
+      directorys = dbarchive.get_chapters_directorys()
+      expected = get_hits(docbook.BookQuery.search_in_chapters("小人", directorys, limit = None))
+      assert len(expected) > 0
+      assert get_hits(docbook.BookQuery.search_in_chapters("小仁", directorys, limit = None, index = dbindex)) == expected
+      dbindex.close()
+  finally:
+    docbook.BookArchive.USE_SNAPSHOT = use_snapshot
+    query_normalize.FOLD_TABLE, query_normalize.PATTERN_FOLD_TABLE, query_normalize.FOLD_TABLE_HASH, extra_variants, query_normalize._frozen = state
+    query_normalize.EXTRA_VARIANTS[:] = extra_variants
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_normalize_text()
+  test_normalize_query()
+  test_normalize_search()
+  test_fold_table_changed()
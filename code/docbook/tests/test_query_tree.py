@@ -0,0 +1,90 @@
+import logging
+
+import utils
+import query
+
+logger = logging.getLogger("test.query.tree")
+
+def test_compile_query():
+  q = query.Query("(大人 or 小人) and not 君子")
+  tree = q.query_tree
+  logger.info(f"query: {q.query_string}, tree: {tree}.")
+  assert isinstance(tree, query.QueryAnd)
+  assert isinstance(tree.nodes[0], query.QueryOr)
+  assert isinstance(tree.nodes[1], query.QueryNot)
+  assert [term.word for term in tree.get_terms()] == ['大人', '小人', '君子']
+
+  # 连续的AND/OR合并为一个节点，普通文本不编译为正则表达式
+  tree = query.Query("a and b and c.").query_tree
+  assert len(tree.nodes) == 3
+  assert tree.nodes[0].pattern is None
+  assert tree.nodes[2].pattern is not None
+
+  assert query.Query("and or").query_tree is None
+
+def test_near_query():
+  # 引号中的短语作为普通文本，其中的空格和正则表达式的特殊字符不再解释
+  assert query.Query.split_words('"君子 小人" and 大.') == [query.QueryPhrase("君子 小人"), "and", "大."]
+  assert query.Query.parse_operator("near/5") == ('NEAR', 5)
+  assert query.Query.parse_operator("BEFORE/0") == ('BEFORE', 0)
+  assert query.Query.parse_operator("NEAR") is None
+
+  tree = query.Query('君子 NEAR/5 "小人."').query_tree
+  assert isinstance(tree, query.QueryNear)
+  assert (tree.distance, tree.ordered) == (5, False)
+  assert [term.word for term in tree.get_terms()] == ['君子', '小人.']
+  assert tree.get_terms()[1].pattern is None
+
+  # NEAR/BEFORE的操作数必须是关键字、短语或者它们的OR
+  try:
+    query.Query("(君子 and 小人) NEAR/5 大人")
+    assert False
+  except ValueError:
+    pass
+
+  content = "太公曰：臣聞君子樂得其志，小人樂得其事。"
+  expected = {
+    "君子 NEAR/5 小人": True,
+    "君子 NEAR/4 小人": False,
+    "小人 NEAR/5 君子": True,
+    "君子 BEFORE/5 小人": True,
+    "小人 BEFORE/5 君子": False,
+    "君子 BEFORE/0 樂得": True,
+    "君子 NEAR/0 聞": True,
+    "(大人 or 小人) BEFORE/2 樂得": True,
+    "君子 NEAR/1 樂 BEFORE/4 小人": True,
+    "君子 NEAR/1 樂 BEFORE/3 小人": False,
+    '"樂得其志" and 小人': True,
+    '"樂得其 志"': False,
+  }
+  for query_string, result in expected.items():
+    assert query.Query(query_string).excute_query(content) == result, query_string
+
+def test_excute_query():
+  contents = [
+    "天之爱人也，薄于圣人之爱人也；其利人也，厚于圣人之利人也。大人之爱小人也，薄于小人之爱大人也。",
+    "密云不雨，君子",
+    "太公曰：“臣闻君子乐得其志，小人乐得其事。今吾渔甚有似也，殆非乐之也。”",
+    ""]
+
+  expected = {
+    "((大人 or 小人) and (not 君子)) or 密云不雨": [True, True, False, False],
+    "(not 君子)": [True, False, False, True],
+    "大人": [True, False, False, False],
+    "not (大人 or 小人) and (君子)": [False, True, False, False],
+    "君子 and not (大人 or 小人)": [False, True, False, False],
+    "大人 or 小人 or 君子 or 圣人": [True, True, True, False],
+    "君子 小人": [False, False, True, False],
+    "君. and 乐得": [False, False, True, False],
+  }
+
+  for query_string, results in expected.items():
+    q = query.Query(query_string)
+    assert [q.excute_query(content) for content in contents] == results, query_string
+
+if __name__ == "__main__":
+  utils.setup_logging(log_file = utils.convert_relativepath_to_abspath('../../../logs/test.log', __file__), level = logging.INFO)
+
+  test_compile_query()
+  test_near_query()
+  test_excute_query()
@@ -0,0 +1,57 @@
+"""
+validate_archive.py
+离线检查文献库或者书籍文件，输出所有不合法的地方。全部通过检查的文献库可以使用BookArchive.TRUSTED_LOAD快速载入。
+
+usage: validate_archive.py path [-h] [--process_num PROCESS_NUM]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  path
+                        Archive directory, archive.json or a docbook file.
+  --process_num PROCESS_NUM
+                        Number of validate processes. Defaults to the number
+                        of CPUs.
+"""
+
+import sys
+import pathlib
+import argparse
+
+import docbook
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument(
+    "path",
+    type=str,
+    help="Archive directory, archive.json or a docbook file.",
+  )
+
+  parser.add_argument(
+    "--process_num",
+    type=int,
+    default=None,
+    help=(
+      "Number of validate processes. "
+      "Defaults to the number of CPUs."
+    )
+  )
+
+  args = parser.parse_args()
+
+  path = pathlib.Path(args.path)
+  if (path.is_dir() and (path / "archive.json").is_file()) or (path.name == "archive.json"):
+    results = docbook.BookValidate.validate_archive(args.path, args.process_num)
+  else:
+    violations = docbook.BookValidate.validate_bookfile(args.path)
+    results = {args.path: violations} if len(violations) > 0 else {}
+
+  for book_path, violations in results.items():
+    print(f"{book_path}: {len(violations)} violations.")
+    for violation in violations:
+      print(f"  -> {violation}")
+
+  if len(results) > 0:
+    sys.exit(1)
+  print(f"path: {args.path} is valid.")
@@ -2,13 +2,19 @@
 
 from .colormap_utils import COLOR_MAP
 from .logger_utils import setup_logging
-from .helper_utils import remove_html_tags, remove_useless_value, is_valid_url, convert_relativepath_to_abspath
+from .helper_utils import HTML_TAG_PATTERN, remove_html_tags, remove_useless_value, is_valid_url, convert_relativepath_to_abspath
+from .json_utils import JSON_BACKEND, json_loads, json_dumps, json_dumps_bytes
 
 __all__ = [
   'COLOR_MAP',
   'setup_logging'
   'remove_html_tags',
+  'HTML_TAG_PATTERN',
   'remove_useless_value',
   'is_valid_url',
   'convert_relativepath_to_abspath',
+  'JSON_BACKEND',
+  'json_loads',
+  'json_dumps',
+  'json_dumps_bytes',
 ]
@@ -69,6 +69,9 @@ def is_valid_url(url) -> bool:
 
   return False
 
+# HTML标签的正则表达式，预先编译，避免每次调用时查找re模块的缓存
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
 def remove_html_tags(text: str) -> str:
   """
   The function `remove_html_tags` removes HTML tags from a given text string using regular
@@ -79,7 +82,7 @@ def remove_html_tags(text: str) -> str:
   @returns The function `remove_html_tags` returns the input text with all HTML tags removed.
   """
   # 使用正则表达式匹配并替换 HTML 标签
-  clean_text = re.sub(r'<[^>]+>', '', text)
+  clean_text = HTML_TAG_PATTERN.sub('', text)
   return clean_text
 
 def convert_relativepath_to_abspath(relative_path: str, abspath: str = None) -> str:
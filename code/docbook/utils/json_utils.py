@@ -0,0 +1,115 @@
+"""
+json_utils.py
+
+json编解码。安装了orjson、ujson或者msgspec时使用更快的编解码库，否则使用标准库json。
+所有的编解码库输出的都是标准的UTF-8 json，互相之间可以读取。
+"""
+import json
+import logging
+
+from typing import Union, Callable, Tuple
+
+logger = logging.getLogger('utils.json')
+
+def _load_backend() -> str:
+  """
+  按照orjson、ujson、msgspec的顺序，选择第一个已经安装的编解码库。
+  """
+  for name in ('orjson', 'ujson', 'msgspec'):
+    try:
+      __import__(name)
+      return name
+    except ImportError:
+      continue
+  return 'json'
+
+# 使用的json编解码库名称：orjson、ujson、msgspec或者json
+JSON_BACKEND: str = _load_backend()
+
+def _get_loads(backend: str) -> Callable[[Union[str, bytes]], any]:
+  if backend == 'orjson':
+    import orjson
+    return orjson.loads
+  elif backend == 'ujson':
+    import ujson
+    return ujson.loads
+  elif backend == 'msgspec':
+    import msgspec
+    decoder = msgspec.json.Decoder()
+    return decoder.decode
+  return json.loads
+
+def _get_dumps(backend: str) -> Union[Callable[[any, Union[int, None]], Union[bytes, None]], None]:
+  """
+  输出bytes的编码函数：func(obj, indent)，不支持该indent时返回None，由标准库json编码。
+  """
+  if backend == 'orjson':
+    import orjson
+    def dumps(obj, indent):
+      if indent is None:
+        return orjson.dumps(obj)
+      elif indent == 2:
+        return orjson.dumps(obj, option = orjson.OPT_INDENT_2)
+      return None
+    return dumps
+  elif backend == 'ujson':
+    import ujson
+    def dumps(obj, indent):
+      return ujson.dumps(obj, ensure_ascii = False, escape_forward_slashes = False, indent = 0 if indent is None else indent).encode('utf-8')
+    return dumps
+  elif backend == 'msgspec':
+    import msgspec
+    encoder = msgspec.json.Encoder()
+    def dumps(obj, indent):
+      return encoder.encode(obj) if indent is None else None
+    return dumps
+  return None
+
+def _get_errors(backend: str) -> Tuple[Tuple[type, ...], Tuple[type, ...]]:
+  """
+  编解码库拒绝输入时抛出的异常：(解码异常, 编码异常)。msgspec的异常不是ValueError、TypeError的子类，需要单独列出。
+  """
+  if backend == 'msgspec':
+    import msgspec
+    return (ValueError, msgspec.MsgspecError), (TypeError, OverflowError, msgspec.MsgspecError)
+  return (ValueError, ), (TypeError, OverflowError)
+
+_loads = _get_loads(JSON_BACKEND)
+_dumps = _get_dumps(JSON_BACKEND)
+_decode_errors, _encode_errors = _get_errors(JSON_BACKEND)
+
+def json_loads(data: Union[str, bytes]) -> any:
+  """
+  解码json，data可以是str，也可以是UTF-8编码的bytes（直接传入文件内容，不需要先解码成str）。
+  """
+  try:
+    return _loads(data)
+  except _decode_errors:
+    if _loads is json.loads:
+      raise
+    # 更快的编解码库对输入的要求更严格（比如NaN），用标准库再解码一次
+    return json.loads(data)
+
+def json_dumps_bytes(obj: any, indent: Union[int, None] = None) -> bytes:
+  """
+  把obj编码为UTF-8 json，不转义非ASCII字符。indent为None时输出紧凑的json。
+  """
+  if _dumps is not None:
+    try:
+      data = _dumps(obj, indent)
+      if data is not None:
+        return data
+    except _encode_errors:
+      # 编解码库不支持的类型（比如超过64位的整数），由标准库json编码
+      pass
+  if indent is None:
+    return json.dumps(obj, ensure_ascii = False, separators = (',', ':')).encode('utf-8')
+  return json.dumps(obj, ensure_ascii = False, indent = indent).encode('utf-8')
+
+def json_dumps(obj: any, ensure_ascii: bool = False, indent: Union[int, None] = None) -> str:
+  """
+  把obj编码为json字符串，参数与json.dumps一致。需要转义非ASCII字符时使用标准库json。
+  """
+  if ensure_ascii:
+    return json.dumps(obj, ensure_ascii = True, indent = indent)
+  return json_dumps_bytes(obj, indent).decode('utf-8')
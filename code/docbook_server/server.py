@@ -1,6 +1,8 @@
 import os
 import uuid
 import logging
+import threading
+import mimetypes
 
 from flask import Flask, jsonify, request
 from pypinyin import pinyin, Style
@@ -8,23 +10,33 @@ from pypinyin import pinyin, Style
 from typing import Union, List, Dict, Tuple
 from enum import Enum
 
-from utils import setup_logging, remove_useless_value, convert_relativepath_to_abspath
-from docbook import Division, Book, BookFile, BookArchive, BookQuery
-from query import QueryResults, QueryResultPiece
+from utils import setup_logging, remove_useless_value, convert_relativepath_to_abspath, JSON_BACKEND
+from docbook import Division, Book, BookFile, BookArchive, BookQuery, BookQueryPool, SearchContext, ChapterCache
+from docbook.docbook_writer import dumps_json
+from docbook.docbook_span import get_chapter_span
+from query import Query, QueryResults, QueryResultPiece
 
 # 实例化并命名为 app 实例
 app = Flask(__name__)
 
-def sort_func(query_result_piece: QueryResultPiece):
+# 一次搜索的最长时间（秒）
+SEARCH_TIMEOUT = 30
+
+# 章节内容缓存的字节数上限。为None时启动时载入所有章节；否则动态载入章节，超出上限时卸载最久没有使用的章节
+CHAPTER_CACHE_MAX_BYTES = None
+
+def collation_key_func(title: str) -> List[str]:
   """
-  用chapter的book title为第一排序，中文拼音排序。
+  标题的中文拼音排序键，由BookArchive在载入时预先计算，并保存在archive.json中。
   """
-  directory = query_result_piece.directory
-  if (directory is None):
-    assert 0
-    return (pinyin("", style = Style.TONE3), query_result_piece.order)
-  else:
-    return (pinyin(directory[-1].title.title, style = Style.TONE3), query_result_piece.order)
+  return [syllables[0] for syllables in pinyin(title, style = Style.TONE3)]
+
+def directory_sort_func(dbarchive: BookArchive, directory: List[Union[Division, Book]]):
+  """
+  章节的排序：先按照章节标题的排序键（中文拼音），再按照章节的order。
+  搜索按照该顺序的章节进行，搜索结果就是该顺序，不需要再排序。
+  """
+  return (dbarchive.get_collation_key(directory[-1]), directory[-1].order)
 
 def directory_to_dict_func(directory):
   """
@@ -32,13 +44,86 @@ def directory_to_dict_func(directory):
   """
   return [{'id': dir.id, 'title': dir.title.title} for dir in directory]
 
+class Library(object):
+  """
+  一代文献库：文献库对象、全文索引、按照搜索结果的顺序排好的章节，以及搜索进程。
+  刷新文献库时建立新的一代，再整体替换app.library。正在处理的搜索继续使用旧的一代，全部结束后再关闭旧的一代。
+  """
+
+  def __init__(self, dbarchive: BookArchive, previous: Union['Library', None] = None):
+    self.dbarchive: BookArchive = dbarchive
+    # load the full-text index of the library, only the new and modified books are indexed after a refresh
+    self.dbindex = dbarchive.load_index()
+    # all chapters of the library, in the order of search results
+    self.dbdirectorys = sorted(dbarchive.get_chapters_directorys(), key = lambda directory: directory_sort_func(dbarchive, directory))
+    # the field index of the books, for the fielded queries (title:, author:, dynasty:, category:)
+    self.dbfields = dbarchive.get_field_index()
+    # load the chapters on demand from the books of this generation, the books removed or modified by a refresh aren't loaded any more
+    self.chapter_load_func = dbarchive.load_chapter_directory if CHAPTER_CACHE_MAX_BYTES is not None else None
+    # start the search processes, which load the books by themselves
+    # the search processes keep all of their books in memory, so they aren't used with a memory budget
+    # after a refresh, the search processes of the previous generation add a new generation, they only load the new and modified books,
+    # the previous generation keeps its books in the search processes until it is closed
+    if (previous is not None) and (previous.dbquery_pool is not None):
+      self.dbquery_pool = previous.dbquery_pool.update(dbarchive)
+    else:
+      self.dbquery_pool = BookQueryPool(dbarchive) if ((os.cpu_count() or 1) > 1) and (CHAPTER_CACHE_MAX_BYTES is None) else None
+    # 正在使用该代的请求数量，以及是否已经被新的一代替换
+    self.users = 0
+    self.retired = False
+
+  def close(self):
+    # 搜索进程释放只属于该代的书籍，所有的代都关闭后退出
+    if self.dbquery_pool is not None:
+      self.dbquery_pool.close()
+    self.dbindex.close()
+
+# 保护app.library的替换和使用计数
+library_lock = threading.Lock()
+# 同一时间只进行一次刷新
+refresh_lock = threading.Lock()
+
+def acquire_library() -> Library:
+  with library_lock:
+    library: Library = app.library
+    library.users += 1
+    return library
+
+def release_library(library: Library):
+  with library_lock:
+    library.users -= 1
+    close = library.retired and (library.users == 0)
+  if close:
+    library.close()
+
+def swap_library(library: Library):
+  """
+  用新的一代替换app.library，旧的一代没有正在处理的请求时立即关闭，否则由最后一个请求关闭。
+  """
+  with library_lock:
+    previous: Library = app.library
+    app.library = library
+    previous.retired = True
+    close = (previous.users == 0)
+  if close:
+    previous.close()
+
+def json_response(obj):
+  """
+  输出去掉没有用的值的json，与jsonify(remove_useless_value(obj.to_dict()))一致，但一次遍历直接输出，不生成中间的dict。
+  """
+  return app.response_class(dumps_json(obj, default = app.json.default), mimetype = app.json.mimetype)
+
 # http://127.0.0.1:6060/book/search?q=大人%20and%20小人
 @app.route("/book/search", methods=["GET"])
 def search_in_dbarchive():
   """
   基于关键字搜索文献库中书中的内容，给出以正文段落搜索范围的搜索结果集。
-  @param {str} q - 搜索关键字组合，可以用and，or，not来组合关键字。
-  @param {List[str]} books - 搜索文献库中书籍的范围。+表示只搜索指定的书籍，-表示排除掉文献库中的书籍。
+  @param {str} q - 搜索关键字组合，可以用and，or，not来组合关键字，用引号表示短语，用NEAR/n、BEFORE/n表示两个关键字相隔不超过n个字。
+                   可以用title:、author:、dynasty:、category:、annotator:、type:annotation限定范围，以and与其他关键字组合。
+                   搜索不区分繁简字、异体字和全角半角标点，比如：於与于相同，高亮原文中的文字。
+  @param {str} book_list - 搜索文献库中书籍的范围，以逗号或者空格分隔的书籍id或者书名（可以使用通配符*?[]）。
+                           +表示只搜索指定的书籍，-表示排除掉文献库中的书籍，比如：+周易,+論語 或者 -*注疏。
   @param {surround} surround - 搜索结果中，关键字附近的文字最大数量，超出的用...来省略掉。
   @param {start} start - 选出搜索结果集中的起始结果。
   @param {count} count - 从`start`开始，提供count个搜索结果。
@@ -46,30 +131,52 @@ def search_in_dbarchive():
   if request.method == 'GET':
     q = request.args.get('q')
     book_list = request.args.get("book_list")
-    start = request.args.get("start")
-    count = request.args.get("count")
+    start = request.args.get("start", type=int)
+    count = request.args.get("count", type=int)
     surround = request.args.get("surround", type=int)
 
     logging.info(f"/book/search, q: {q}, book_list: {book_list}, start: {start}, count: {count}, surround: {surround}.")
 
     if start is None:
       start = 0
+    if count is None:
+      count = BookQuery.QUERY_MAX_RESULT_NUM
     
     if (q is not None):
+      # 查询语句不合法（比如：NEAR/BEFORE的操作数不是关键字或者短语）时，返回错误请求
+      try:
+        q = Query(q)
+      except ValueError as e:
+        return jsonify(error = f"invalid q: {e}"), 400
       dbquery = BookQuery()
-      dbarchive: BookArchive = app.dbarchive
-
-      directorys = dbarchive.get_chapters_directorys()
-      query_results: QueryResults = dbquery.search_in_chapters(q, directorys, limit = None)
-      query_results.sort_query_result_piece(sort_func)
-      query_results.query_range = int(dbarchive.book_count)
+      # 整个搜索使用同一代文献库，搜索过程中文献库被刷新也不受影响
+      library = acquire_library()
+      try:
+        dbarchive: BookArchive = library.dbarchive
+
+        # 章节已经按照结果的顺序排好，只生成[start, start + count)的结果，其余的章节只统计命中数量
+        directorys = library.dbdirectorys
+        # 有多个搜索进程时，在搜索进程中搜索，否则在本进程中用多线程搜索
+        searcher = library.dbquery_pool if library.dbquery_pool is not None else dbquery
+        # 每个请求使用自己的搜索上下文，并发的请求互不影响
+        context = SearchContext(timeout = SEARCH_TIMEOUT, chapter_load_func = library.chapter_load_func)
+        # 书籍范围在分配搜索之前缩小章节，只搜索选中的书籍
+        books = BookQuery.parse_book_list(book_list, dbarchive.dbooks)
+        query_results: QueryResults = searcher.search_page_in_chapters(q, directorys, start, count, index = library.dbindex, context = context, fields = library.dbfields, books = books)
+      finally:
+        release_library(library)
+      if context.is_timeout:
+        logging.warning(f"/book/search, q: {q.query_string} timeout, hits: {context.count}.")
+      query_results.query_range = int(dbarchive.book_count) if books is None else len(books)
 
       for query_result_piece in query_results.query_result_pieces:
         for index, hit in enumerate(query_result_piece.hits):
           #logger.info(f"query: {query_results.query.query_string}, {'' if query_result_piece.directory is None else '|'.join([dir.title.title for dir in query_result_piece.directory])}, content: {hit[0]}.")
-          query_result_piece.hits[index] = (dbquery.highlights(hit[0], format = BookQuery.MARK_TEXT, keys = query_results.query.get_query_keys(), strong = True, surround = surround), hit[1])
+          # 使用搜索时得到的关键字匹配结果进行高亮，不用再次扫描；章节已经载入时在包含标签的原始内容上高亮
+          span = get_chapter_span(query_result_piece.directory[-1], hit[3])
+          query_result_piece.hits[index] = (dbquery.highlights(hit[0], format = BookQuery.MARK_TEXT, strong = True, surround = surround, matcher = query_results.query.matcher, matches = hit[2], span = span), hit[1])
 
-      return jsonify(remove_useless_value(query_results.to_dict()))
+      return json_response(query_results.to_dict())
     else:
       return jsonify(error = "q parameter is missing."), 400  # 使用HTTP状态码400表示错误请求
 
@@ -77,21 +184,27 @@ def search_in_dbarchive():
 def get_book_list():
   """
   基于关键字搜索文献库中书籍，给出命中的书籍对象（只包含目录）。
+  @param {str} q - 书籍标题中的关键字组合，可以用author:、dynasty:、category:限定范围。
   """
   if request.method == 'GET':
     q = request.args.get('q')
 
     logging.info(f"/book/list, q: {q}.")
 
-    dbarchive: BookArchive = app.dbarchive
+    library: Library = app.library
+    dbarchive: BookArchive = library.dbarchive
     if (q is not None) and (len(q) > 0):
+      try:
+        q = Query(q)
+      except ValueError as e:
+        return jsonify(error = f"invalid q: {e}"), 400
       dbquery = BookQuery()
-    
-      dbooks = dbquery.search_book_bytitle(q, dbarchive.dbooks, limit = None)
+
+      dbooks = dbquery.search_book_bytitle(q, dbarchive.dbooks, limit = None, fields = library.dbfields)
     else:
       dbooks = dbarchive.dbooks
 
-    dbooks.sort(key = lambda dbook: pinyin(dbook.title.title, style = Style.TONE3))
+    dbooks.sort(key = dbarchive.get_collation_key)
     return jsonify({
       "query_range": dbarchive.book_count,
       "query_target_count": len(dbooks),
@@ -107,11 +220,11 @@ def get_book_catalogue():
     logging.info(f"/book/catalogue, bid: {bid}.")
 
     if (bid is not None):
-      dbarchive: BookArchive = app.dbarchive
+      dbarchive: BookArchive = app.library.dbarchive
       dbook: Book = dbarchive.get_book_byid(bid)
 
       if dbook is not None:
-        return jsonify(remove_useless_value(dbook.get_catalogue()))
+        return json_response(dbook.get_catalogue())
       else:
         return jsonify(error = f"can't find book: {bid}."), 400  # 使用HTTP状态码400表示错误请求
     else:
@@ -126,23 +239,33 @@ def get_book_chapter():
     logging.info(f"/book/chapter, bid: {bid}, cid: {cid}.")
 
     if (bid is not None):
-      dbarchive: BookArchive = app.dbarchive
-      dbfile: BookFile = dbarchive.get_bookfile_byid(bid)
-
-      if (dbfile is not None):
-        chapter = None
-        isloaded = False 
-        if (cid is not None):
-          isloaded, chapter = dbfile.load_chapter_byid(cid)
+      # 整个请求使用同一代文献库
+      library = acquire_library()
+      try:
+        dbarchive: BookArchive = library.dbarchive
+        dbfile: BookFile = dbarchive.get_bookfile_byid(bid)
+
+        if (dbfile is not None):
+          chapter = None
+          isloaded = False 
+          # 固定载入的章节，输出之前不被章节缓存卸载
+          if (cid is not None):
+            isloaded, chapter = dbfile.load_chapter_byid(cid, pin = True)
+          else:
+            isloaded, chapter = dbfile.load_chapter_byid(dbfile.book.chapters[0].id, pin = True) if dbfile.book.chapters is not None else (False, None)
+
+          if chapter is not None:
+            try:
+              return json_response(chapter)
+            finally:
+              if isloaded:
+                dbfile.unpin_chapter(chapter)
+          else:
+            return jsonify(error = f"can't find book chapter: {bid, cid}."), 400  # 使用HTTP状态码400表示错误请求
         else:
-          isloaded, chapter = dbfile.load_chapter_byid(dbfile.book.chapters[0].id) if dbfile.book.chapters is not None else (False, None)
-
-        if chapter is not None:
-          return jsonify(remove_useless_value(chapter.to_dict()))
-        else:
-          return jsonify(error = f"can't find book chapter: {bid, cid}."), 400  # 使用HTTP状态码400表示错误请求
-      else:
-        return jsonify(error = f"can't find book: {bid}."), 400  # 使用HTTP状态码400表示错误请求
+          return jsonify(error = f"can't find book: {bid}."), 400  # 使用HTTP状态码400表示错误请求
+      finally:
+        release_library(library)
     else:
       return jsonify(error = "bid parameter is missing."), 400  # 使用HTTP状态码400表示错误请求
 
@@ -155,33 +278,101 @@ def get_book_chapters():
     logging.info(f"/book/chapters, bid: {bid}, cid: {cid}.")
 
     if (bid is not None):
-      dbarchive: BookArchive = app.dbarchive
+      # 整个请求使用同一代文献库
+      library = acquire_library()
+      try:
+        dbarchive: BookArchive = library.dbarchive
+        dbfile: BookFile = dbarchive.get_bookfile_byid(bid)
+
+        if (dbfile is not None):
+          chapter = None
+          isloaded = False 
+          # 固定载入的章节，输出之前不被章节缓存卸载
+          if (cid is not None):
+            isloaded, chapter = dbfile.load_chapter_byid(cid, pin = True)
+            cid = uuid.UUID(cid)
+          else:
+            isloaded, chapter = dbfile.load_chapter_byid(dbfile.book.chapters[0].id, pin = True) if dbfile.book.chapters is not None else (False, None)
+            cid = chapter.id
+
+          try:
+            directorys: List[Union['Division', 'Book']] = dbfile.book.get_chapters_directorys(True)
+            chapters = []
+            for (index, directory) in enumerate(directorys):
+              chapters.append({
+                  'directory': [{'id': dir.id, 'title': dir.title.title} for dir in directory],
+                  'content': None if (chapter is None) or (directory[-1].id != cid) else chapter
+                }
+              )
+            return json_response(chapters)
+          finally:
+            if isloaded:
+              dbfile.unpin_chapter(chapter)
+        else:
+          return jsonify(error = f"can't find book: {bid}."), 400  # 使用HTTP状态码400表示错误请求
+      finally:
+        release_library(library)
+    else:
+      return jsonify(error = "bid parameter is missing."), 400  # 使用HTTP状态码400表示错误请求
+ 
+@app.route("/book/extra", methods=["GET"])
+def get_book_extra():
+  """
+  书籍的附加内容（图片等），直接从书籍文件中读取，不保存在内存中。
+  """
+  if request.method == 'GET':
+    bid = request.args.get('bid')
+    name = request.args.get('name')
+
+    logging.info(f"/book/extra, bid: {bid}, name: {name}.")
+
+    if (bid is not None) and (name is not None):
+      dbarchive: BookArchive = app.library.dbarchive
       dbfile: BookFile = dbarchive.get_bookfile_byid(bid)
 
       if (dbfile is not None):
-        chapter = None
-        isloaded = False 
-        if (cid is not None):
-          isloaded, chapter = dbfile.load_chapter_byid(cid)
-          cid = uuid.UUID(cid)
+        extra = dbfile.book.get_extra(name)
+        content = None if extra is None else dbfile.get_extra_content(extra)
+        if content is not None:
+          mimetype, _ = mimetypes.guess_type(extra.ref)
+          return app.response_class(content, mimetype = mimetype if mimetype is not None else 'application/octet-stream')
         else:
-          isloaded, chapter = dbfile.load_chapter_byid(dbfile.book.chapters[0].id) if dbfile.book.chapters is not None else (False, None)
-          cid = chapter.id
-
-        directorys: List[Union['Division', 'Book']] = dbfile.book.get_chapters_directorys(True)
-        chapters = []
-        for (index, directory) in enumerate(directorys):
-          chapters.append({
-              'directory': [{'id': dir.id, 'title': dir.title.title} for dir in directory],
-              'content': None if (chapter is None) or (directory[-1].id != cid) else chapter.to_dict()
-            }
-          )
-        return jsonify(remove_useless_value(chapters))
+          return jsonify(error = f"can't find book extra: {bid, name}."), 400  # 使用HTTP状态码400表示错误请求
       else:
         return jsonify(error = f"can't find book: {bid}."), 400  # 使用HTTP状态码400表示错误请求
     else:
-      return jsonify(error = "bid parameter is missing."), 400  # 使用HTTP状态码400表示错误请求
- 
+      return jsonify(error = "bid or name parameter is missing."), 400  # 使用HTTP状态码400表示错误请求
+
+@app.route("/book/cache", methods=["GET"])
+def get_chapter_cache_stats():
+  """
+  章节缓存的统计：章节数量、字节数、命中、未命中和卸载次数。
+  """
+  chapter_cache: ChapterCache = app.library.dbarchive.chapter_cache
+  if chapter_cache is None:
+    return jsonify(error = "chapter cache is disabled."), 400
+  return jsonify(chapter_cache.get_stats())
+
+@app.route("/book/refresh", methods=["POST"])
+def refresh_library():
+  """
+  重新扫描文献库目录，只载入新增和修改过的书籍，去掉已经删除的书籍，再替换正在使用的文献库，不需要重启服务。
+  """
+  if not refresh_lock.acquire(blocking = False):
+    return jsonify(error = "the library is refreshing."), 409
+
+  try:
+    logging.info(f"/book/refresh.")
+    dbarchive: BookArchive = app.library.dbarchive.refresh()
+    swap_library(Library(dbarchive, app.library))
+    return jsonify({
+      "book_count": dbarchive.book_count,
+      "loaded": [item['ref'] for item in dbarchive.load_report if (not item['reused']) and (item['error'] is None)],
+      "failed": [{'ref': item['ref'], 'error': item['error']} for item in dbarchive.load_errors]
+    })
+  finally:
+    refresh_lock.release()
+
 def initialize():
   setup_logging(log_file = convert_relativepath_to_abspath('../../logs/server.log', __file__), level = logging.INFO)
   logger = logging.getLogger("server")
@@ -193,10 +384,30 @@ def initialize():
   app.json.sort_keys = False
   #app.config['JSON_AS_ASCII'] = False  
 
-  # load all books from library path
-  app.dbarchive = BookArchive(convert_relativepath_to_abspath('../../library/publish', __file__), False)
-  for book in app.dbarchive.dbooks:
-    book.rebuild_chapters_order()
+  # load all books from library path, with the pinyin collation keys of titles
+  BookArchive.COLLATION_KEY_FUNC = collation_key_func
+  # write compact json files, they are read by the json backend only
+  BookArchive.JSON_INDENT = None
+  logger.info(f"json backend: {JSON_BACKEND}.")
+  # parse the book files in a process pool, and number the chapters in the order of the books
+  BookArchive.LOAD_PROCESS_NUM = os.cpu_count()
+  BookArchive.REBUILD_CHAPTERS_ORDER = True
+  # restore the unchanged books from the snapshot of the last start
+  BookArchive.USE_SNAPSHOT = True
+  # the published library is checked by tools/validate_archive.py before publishing, skip the field validations
+  BookArchive.TRUSTED_LOAD = True
+  # build the character signatures of the chapters while loading, they are kept in the snapshot
+  BookArchive.BUILD_SIGNATURES = True
+  if CHAPTER_CACHE_MAX_BYTES is None:
+    dbarchive = BookArchive(convert_relativepath_to_abspath('../../library/publish', __file__), False)
+  else:
+    # load chapters on demand, in a fixed memory budget
+    # the chapters are loaded by the generation of the library used by each search, see Library.chapter_load_func
+    dbarchive = BookArchive(convert_relativepath_to_abspath('../../library/publish', __file__), True, ChapterCache(max_bytes = CHAPTER_CACHE_MAX_BYTES))
+  # the slowest books, the failed books are logged by the archive and skipped
+  for item in sorted(dbarchive.load_report, key = lambda item: item['seconds'], reverse = True)[:10]:
+    logger.info(f"load '{item['ref']}' in {item['seconds']:.2f}s.")
+  app.library = Library(dbarchive)
 
   QueryResultPiece.DIRECTORY_TO_DICT_FUNC = directory_to_dict_func
 